@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+'''
+compress_wrfout.py
+
+Convert wrfout files to compressed, rechunked netCDF4, in parallel.
+
+wrf.exe writes its history files as uncompressed netCDF (io_form_history = 2), which makes them slow to archive and
+transfer. For every input file this script writes a netCDF4 copy in which:
+  - every numeric variable is compressed (zlib, or zstd where the netCDF library supports it) with byte shuffle,
+  - 3-D and 4-D fields are chunked as all times x all levels x a horizontal tile of about CHUNK_BYTES, so reading a
+    time series or profile at a point decompresses one small chunk instead of whole fields,
+  - dimensions, attributes and values are otherwise unchanged (lossless).
+The copy is written next to its destination under a temporary name, read back and compared with the source
+variable by variable, and only then renamed into place; the source is then either kept, replaced (in place), or
+removed (moved into out_dir). A file that fails verification is left untouched. Files that are already compressed
+netCDF4 are only copied/moved.
+
+Files are processed concurrently in a process pool. compress_files() is also used by the archive step of
+setup_wps_wrf.py and by wildfireTS_wrapper/move_wrf.py.
+
+Examples:
+  python compress_wrfout.py /path/to/run/wrfout_d01_* -j 8
+  python compress_wrfout.py /path/to/run/wrfout_d0* -o /path/to/archive/wrfout -c zstd -l 3 --remove_source
+'''
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import pathlib
+import datetime as dt
+import concurrent.futures
+import logging
+
+import numpy as np
+import netCDF4
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+COMPRESSORS = ['zlib', 'zstd']
+DEFAULT_LEVEL = {'zlib': 4, 'zstd': 3}
+# Target uncompressed size of one chunk of a 3-D/4-D field, and the smallest horizontal tile edge
+CHUNK_BYTES = 1024 * 1024
+MIN_TILE = 16
+# Variables smaller than this (bytes) are stored uncompressed
+MIN_COMPRESS_BYTES = 4096
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Convert wrfout files to compressed, rechunked netCDF4.')
+    parser.add_argument('files', nargs='+', help='wrfout files to convert')
+    parser.add_argument('-o', '--out_dir', default=None,
+                        help='directory for the converted files (default: None, replace the files in place)')
+    parser.add_argument('-c', '--compression', default='zlib', choices=COMPRESSORS,
+                        help='compression filter (default: zlib)')
+    parser.add_argument('-l', '--level', default=None, type=int,
+                        help='compression level (default: 4 for zlib, 3 for zstd)')
+    parser.add_argument('-j', '--workers', default=4, type=int,
+                        help='files converted at once (default: 4)')
+    parser.add_argument('-R', '--remove_source', action='store_true',
+                        help='with --out_dir, remove each source file once its converted copy is verified')
+
+    args = parser.parse_args()
+    out_dir = pathlib.Path(args.out_dir) if args.out_dir is not None else None
+    if args.remove_source and out_dir is None:
+        log.error('ERROR! --remove_source only makes sense with --out_dir. Exiting!')
+        sys.exit(1)
+
+    return args.files, out_dir, args.compression, args.level, args.workers, args.remove_source
+
+
+def available_compression(compression):
+    '''The requested filter, or zlib if zstd cannot be written here (library built without it, or no HDF5 plugin).'''
+    if compression != 'zstd':
+        return compression
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with netCDF4.Dataset(os.path.join(tmp_dir, 'probe.nc'), 'w', format='NETCDF4') as nc:
+                nc.createDimension('x', 1024)
+                nc.createVariable('probe', 'f4', ('x',), compression='zstd')[:] = np.zeros(1024, 'f4')
+        return compression
+    except Exception as e:
+        log.warning(f'WARNING: zstd compression is not available ({e}), using zlib instead')
+        return 'zlib'
+
+
+def chunk_shape(var):
+    '''All leading (time, level) points with a square horizontal tile of about CHUNK_BYTES, or None for <3-D.'''
+    shape = var.shape
+    if len(shape) < 3 or 0 in shape:
+        return None
+    lead = shape[:-2]
+    n_lead = int(np.prod(lead))
+    side = int(np.sqrt(max(CHUNK_BYTES / (var.dtype.itemsize * n_lead), 1)))
+    side = max(side, MIN_TILE)
+    return tuple(lead) + (min(side, shape[-2]), min(side, shape[-1]))
+
+
+def is_compressed(nc):
+    if nc.data_model != 'NETCDF4':
+        return False
+    for var in nc.variables.values():
+        filters = var.filters() or {}
+        if filters.get('zlib') or filters.get('zstd'):
+            return True
+    return False
+
+
+def _same(a, b):
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    if a.dtype.kind == 'f':
+        return np.array_equal(a, b, equal_nan=True)
+    return np.array_equal(a, b)
+
+
+def _raw(var):
+    var.set_auto_maskandscale(False)
+    var.set_auto_chartostring(False)
+    return var
+
+
+def convert(src, tmp, compression, level):
+    with netCDF4.Dataset(src) as nc_in, netCDF4.Dataset(tmp, 'w', format='NETCDF4') as nc_out:
+        nc_out.setncatts({att: nc_in.getncattr(att) for att in nc_in.ncattrs()})
+        for name, dim in nc_in.dimensions.items():
+            nc_out.createDimension(name, None if dim.isunlimited() else len(dim))
+        for name, var in nc_in.variables.items():
+            _raw(var)
+            kwargs = {}
+            if var.dtype.kind in 'fiu' and var.size * var.dtype.itemsize >= MIN_COMPRESS_BYTES:
+                kwargs = {'compression': compression, 'complevel': level, 'shuffle': True,
+                          'chunksizes': chunk_shape(var)}
+            attrs = {att: var.getncattr(att) for att in var.ncattrs()}
+            fill_value = attrs.pop('_FillValue', None)
+            out = nc_out.createVariable(name, var.dtype, var.dimensions, fill_value=fill_value, **kwargs)
+            _raw(out)
+            out.setncatts(attrs)
+            if var.size > 0:
+                out[...] = var[...]
+
+
+def verify(src, dst):
+    '''Reason the converted file differs from its source, or None if dimensions, attributes and data all match.'''
+    with netCDF4.Dataset(src) as nc_a, netCDF4.Dataset(dst) as nc_b:
+        if {k: len(v) for k, v in nc_a.dimensions.items()} != {k: len(v) for k, v in nc_b.dimensions.items()}:
+            return 'dimensions differ'
+        if set(nc_a.ncattrs()) != set(nc_b.ncattrs()) or \
+                not all(_same(nc_a.getncattr(att), nc_b.getncattr(att)) for att in nc_a.ncattrs()):
+            return 'global attributes differ'
+        if set(nc_a.variables) != set(nc_b.variables):
+            return 'variable lists differ'
+        for name, var_a in nc_a.variables.items():
+            var_b = nc_b.variables[name]
+            if set(var_a.ncattrs()) != set(var_b.ncattrs()) or \
+                    not all(_same(var_a.getncattr(att), var_b.getncattr(att)) for att in var_a.ncattrs()):
+                return f'attributes of {name} differ'
+            if var_a.size > 0 and not _same(_raw(var_a)[...], _raw(var_b)[...]):
+                return f'values of {name} differ'
+    return None
+
+
+def compress_file(src, dst, compression='zlib', level=None, remove_source=False):
+    '''
+    Convert one file (see the module docstring) and return a summary dict with src, dst, status (compressed,
+    skipped or failed), bytes_in, bytes_out, seconds and, on failure, error. Runs in a worker process.
+    '''
+    src = pathlib.Path(src)
+    dst = pathlib.Path(dst)
+    level = DEFAULT_LEVEL[compression] if level is None else level
+    # bytes_in stays 0 if src vanished between listing and compression; that is reported as a failed file
+    result = {'src': str(src), 'dst': str(dst), 'bytes_in': 0}
+    time_beg = time.time()
+    tmp = dst.parent.joinpath('.' + dst.name + '.tmp')
+    try:
+        result['bytes_in'] = src.stat().st_size
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        with netCDF4.Dataset(src) as nc:
+            done = is_compressed(nc)
+        if done:
+            result['status'] = 'skipped'
+            if dst != src:
+                if remove_source:
+                    shutil.move(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+        else:
+            convert(src, tmp, compression, level)
+            error = verify(src, tmp)
+            if error is not None:
+                raise ValueError('verification failed: ' + error)
+            shutil.copystat(src, tmp)
+            os.replace(tmp, dst)
+            if remove_source and dst != src:
+                src.unlink()
+            result['status'] = 'compressed'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+        if tmp.exists():
+            tmp.unlink()
+    result['bytes_out'] = dst.stat().st_size if result['status'] != 'failed' else result['bytes_in']
+    result['seconds'] = round(time.time() - time_beg, 2)
+    return result
+
+
+def compress_files(files, out_dir=None, compression='zlib', level=None, workers=4, remove_source=False):
+    '''
+    Convert files concurrently, each to out_dir/<same name> (or in place if out_dir is None).
+
+    Returns
+    -------
+    list of dict
+        One compress_file() summary per file, in the order given.
+    '''
+    compression = available_compression(compression)
+    jobs = []
+    for file in files:
+        src = pathlib.Path(file)
+        dst = src if out_dir is None else pathlib.Path(out_dir).joinpath(src.name)
+        jobs.append((src, dst))
+    if not jobs:
+        return []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as pool:
+        futures = [pool.submit(compress_file, src, dst, compression, level, remove_source) for src, dst in jobs]
+        return [future.result() for future in futures]
+
+
+def summarize(results):
+    '''One-line summary of compress_files() results.'''
+    done = [r for r in results if r['status'] != 'failed']
+    bytes_in = sum(r['bytes_in'] for r in done)
+    bytes_out = sum(r['bytes_out'] for r in done)
+    ratio = bytes_in / bytes_out if bytes_out else 0.0
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ['compressed', 'skipped', 'failed']}
+    return (f"{counts['compressed']} compressed, {counts['skipped']} already compressed, {counts['failed']} failed; "
+            f"{bytes_in / 1e9:.2f} GB -> {bytes_out / 1e9:.2f} GB ({ratio:.1f}x)")
+
+
+def main(files, out_dir, compression, level, workers, remove_source):
+    results = compress_files(files, out_dir, compression, level, workers, remove_source)
+    for result in results:
+        if result['status'] == 'failed':
+            log.error(f"ERROR: {result['src']} was left unchanged: {result['error']}")
+        else:
+            log.info(f"{result['status']}: {result['src']} -> {result['dst']} "
+                     f"({result['bytes_in'] / 1e6:.1f} MB -> {result['bytes_out'] / 1e6:.1f} MB, {result['seconds']} s)")
+    log.info(summarize(results))
+    if any(result['status'] == 'failed' for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    now_time_beg = dt.datetime.now(dt.UTC)
+    main(*parse_args())
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
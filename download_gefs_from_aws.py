@@ -7,6 +7,7 @@ Created by: Jared A. Lee (jaredlee@ucar.edu)
 Created on: 3 Mar 2023
 
 This script downloads GEFS output files for the requested cycle(s), member(s), and lead times.
+The pgrb2a and pgrb2b files of all members and lead times are downloaded concurrently through one pool (-j).
 '''
 
 import os
@@ -14,12 +15,14 @@ import sys
 import argparse
 import pathlib
 import datetime as dt
+import concurrent.futures
 import numpy as np
 import pandas as pd
 import wget
 import logging
 
 from proc_util import exec_command
+from grib_store import register_files
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -40,6 +43,7 @@ def parse_args():
     parser.add_argument('-o', '--out_dir_parent', default=None, help='string or pathlib.Path object of the parent local directory where all downloaded GEFS data should be stored')
     parser.add_argument('-f', '--icbc_fc_dt', default=0, type=int, help='integer number of hours prior to WRF cycle time for IC/LBC model cycle (default: 0)')
     parser.add_argument('-i', '--int_h', default=3, type=int, help='integer number of hours between GEFS files to download (default: 3)')
+    parser.add_argument('-j', '--workers', default=16, type=int, help='number of files to download concurrently, across all members and lead times (default: 16)')
 
     args = parser.parse_args()
     cycle_dt = args.cycle_dt
@@ -48,6 +52,7 @@ def parse_args():
     out_dir_parent = args.out_dir_parent
     icbc_fc_dt = args.icbc_fc_dt
     int_h = args.int_h
+    workers = args.workers
 
     members = members_inp.split(',')
 
@@ -67,7 +72,7 @@ def parse_args():
         out_dir_parent = pathlib.Path('/','glade','derecho','scratch','jaredlee','data','gefs',cycle_dt)
         log.info('Using the default assumption for out_dir_parent: '+str(out_dir_parent))
 
-    return cycle_dt, sim_hrs, members, out_dir_parent, icbc_fc_dt, int_h
+    return cycle_dt, sim_hrs, members, out_dir_parent, icbc_fc_dt, int_h, workers
 
 def wget_error(error_msg, now_time_beg):
     log.error('ERROR: '+error_msg)
@@ -82,7 +87,7 @@ def wget_error(error_msg, now_time_beg):
     log.error('   Run time: '+str(run_time_tot)+'\n')
     sys.exit(1)
 
-def main(cycle_dt_str, sim_hrs, members, out_dir_parent, icbc_fc_dt, now_time_beg, int_h):
+def main(cycle_dt_str, sim_hrs, members, out_dir_parent, icbc_fc_dt, now_time_beg, int_h, workers=16):
 
     fmt_yyyy = '%Y'
     fmt_hh = '%H'
@@ -124,89 +129,69 @@ def main(cycle_dt_str, sim_hrs, members, out_dir_parent, icbc_fc_dt, now_time_be
 
     out_dir_parent.mkdir(parents=True, exist_ok=True)
 
-    n_members = len(members)
-    ## Loop over GEFS members
-    for mm in range(n_members):
-#       out_dir = out_dir_parent.joinpath('mem'+members[mm])
-#       out_dir.mkdir(parents=True, exist_ok=True)
-        ## Create folders for each type of file, as there is on AWS
-#       out_dir.joinpath('pgrb2ap5').mkdir(parents=True, exist_ok=True)
-#       out_dir.joinpath('pgrb2bp5').mkdir(parents=True, exist_ok=True)
-#       os.chdir(out_dir)
-        if is_gefsv12:
-            out_dir_parent.joinpath('pgrb2ap5').mkdir(parents=True, exist_ok=True)
-            out_dir_parent.joinpath('pgrb2bp5').mkdir(parents=True, exist_ok=True)
-        elif is_gefsv11:
-            out_dir_parent.joinpath('pgrb2a').mkdir(parents=True, exist_ok=True)
-            out_dir_parent.joinpath('pgrb2b').mkdir(parents=True, exist_ok=True)
-        os.chdir(out_dir_parent)
-        if members[mm] == '00':
+    if is_gefsv12:
+        dir_a, dir_b = 'pgrb2ap5', 'pgrb2bp5'
+    elif is_gefsv11:
+        dir_a, dir_b = 'pgrb2a', 'pgrb2b'
+    out_dir_parent.joinpath(dir_a).mkdir(parents=True, exist_ok=True)
+    out_dir_parent.joinpath(dir_b).mkdir(parents=True, exist_ok=True)
+    # wget writes its temporary files to the working directory, so keep them on the same file system
+    os.chdir(out_dir_parent)
+
+    ## Build the list of "a" and "b" files for every member and lead time, then fetch them all through one pool
+    downloads = []
+    for member in members:
+        if member == '00':
             gefs_prefix = 'gec'
         else:
             gefs_prefix = 'gep'
-
-        ## Loop over lead times
-        for ll in range(n_leads):
-            if is_gefsv12:
-                this_lead = str(leads[ll]).zfill(3)
-            elif is_gefsv11:
-                if leads[ll] < 100:
-                    this_lead = str(leads[ll]).zfill(2)
-                elif leads[ll] >= 100 and leads[ll] < 1000:
-                    this_lead = str(leads[ll]).zfill(3)
-
-            ## Download 0.5-deg "a" file
-#           os.chdir(out_dir.joinpath('pgrb2ap5'))
-            if is_gefsv12:
-                os.chdir(out_dir_parent.joinpath('pgrb2ap5'))
-                fname = gefs_prefix+members[mm]+'.t'+cycle_hour+'z.pgrb2a.0p50.f'+this_lead
-                url = aws_dir+'/pgrb2ap5/'+fname
-                local_fname = out_dir_parent.joinpath('pgrb2ap5', fname)
-            elif is_gefsv11:
-                os.chdir(out_dir_parent.joinpath('pgrb2a'))
-                fname = gefs_prefix+members[mm]+'.t'+cycle_hour+'z.pgrb2af'+this_lead
-                url = aws_dir+'/pgrb2a/'+fname
-                local_fname = out_dir_parent.joinpath('pgrb2a', fname)
-#            if not out_dir.joinpath('pgrb2ap5',fname).is_file():
-            if not local_fname.is_file():
-                log.info('Downloading '+url)
-                try:
-                    wget.download(url)
-                    log.info('')
-                except:
-                    wget_error(str(e), now_time_beg)
-            else:
-                log.info('   File '+fname+' already exists locally. Not downloading again from server.')
-
-            ## Download 0.5-deg "b" file
-#            os.chdir(out_dir.joinpath('pgrb2bp5'))
+        for lead in leads:
             if is_gefsv12:
-                os.chdir(out_dir_parent.joinpath('pgrb2bp5'))
-                fname = gefs_prefix+members[mm]+'.t'+cycle_hour+'z.pgrb2b.0p50.f'+this_lead
-                url = aws_dir+'/pgrb2bp5/'+fname
-                local_fname = out_dir_parent.joinpath('pgrb2bp5', fname)
+                this_lead = str(lead).zfill(3)
+                fnames = [dir_a + '/' + gefs_prefix + member + '.t' + cycle_hour + 'z.pgrb2a.0p50.f' + this_lead,
+                          dir_b + '/' + gefs_prefix + member + '.t' + cycle_hour + 'z.pgrb2b.0p50.f' + this_lead]
             elif is_gefsv11:
-                os.chdir(out_dir_parent.joinpath('pgrb2b'))
-                fname = gefs_prefix+members[mm]+'.t'+cycle_hour+'z.pgrb2bf'+this_lead
-                url = aws_dir+'/pgrb2b/'+fname
-                local_fname = out_dir_parent.joinpath('pgrb2b', fname)
-#            if not out_dir.joinpath('pgrb2bp5',fname).is_file():
-            if not local_fname.is_file():
-                log.info('Downloading '+url)
-                try:
-                    wget.download(url)
-                    log.info('')
-                except:
-                    wget_error(str(e), now_time_beg)
-            else:
-                log.info('   File '+fname+' already exists locally. Not downloading again from server.')
-            
+                this_lead = str(lead).zfill(2)
+                fnames = [dir_a + '/' + gefs_prefix + member + '.t' + cycle_hour + 'z.pgrb2af' + this_lead,
+                          dir_b + '/' + gefs_prefix + member + '.t' + cycle_hour + 'z.pgrb2bf' + this_lead]
+            for fname in fnames:
+                downloads.append((aws_dir + '/' + fname, out_dir_parent.joinpath(fname)))
+
+    log.info(f'{len(downloads)} file(s) for {len(members)} member(s) and {n_leads} lead time(s), {workers} at a time')
+    errors = []
+    # Each download is network-bound, so threads are enough to keep many of them in flight at once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(download_file, url, local_fname): url for url, local_fname in downloads}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(futures[future] + ': ' + str(e))
+    register_files([local_fname for url, local_fname in downloads if local_fname.is_file()])
+    if errors:
+        wget_error('; '.join(sorted(errors)), now_time_beg)
+
+def download_file(url, local_fname):
+    '''Download one file unless it already exists, through a temporary name so a partial file is never left behind.'''
+    if local_fname.is_file():
+        log.info('   File '+local_fname.name+' already exists locally. Not downloading again from server.')
+        return
+    log.info('Downloading '+url)
+    tmp_fname = local_fname.with_name(local_fname.name + '.part')
+    # wget picks a new name rather than overwrite an existing file, so clear any leftover from an interrupted run
+    tmp_fname.unlink(missing_ok=True)
+    try:
+        fname = wget.download(url, out=str(tmp_fname), bar=None)
+        os.replace(fname, local_fname)
+    finally:
+        if tmp_fname.exists():
+            tmp_fname.unlink()
 
 
 if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
-    cycle_dt, sim_hrs, members, out_dir_parent, icbc_fc_dt, int_h = parse_args()
-    main(cycle_dt, sim_hrs, members, out_dir_parent, icbc_fc_dt, now_time_beg, int_h)
+    cycle_dt, sim_hrs, members, out_dir_parent, icbc_fc_dt, int_h, workers = parse_args()
+    main(cycle_dt, sim_hrs, members, out_dir_parent, icbc_fc_dt, now_time_beg, int_h, workers)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
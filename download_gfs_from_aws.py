@@ -20,6 +20,7 @@ import pandas as pd
 import wget
 import logging
 from proc_util import exec_command
+from grib_store import register_files
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -127,6 +128,7 @@ def main(cycle_dt_str, sim_hrs, out_dir, icbc_fc_dt, resolution, now_time_beg, i
                 wget_error(str(err_msg), now_time_beg)
         else:
             log.info('   File '+fname+' already exists locally. Not downloading again from server.')
+        register_files([out_dir.joinpath(fname)])
 
 
 
@@ -20,6 +20,7 @@ import pandas as pd
 import wget
 import logging
 from proc_util import exec_command
+from grib_store import register_files
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -166,6 +167,7 @@ def main(cycle_dt_str, sim_hrs, out_dir_parent, icbc_fc_dt, now_time_beg, interv
                         wget_error(str(err_msg), now_time_beg)
                 else:
                     log.info('   File '+fname+' already exists locally. Not downloading again from server.')
+                register_files([out_dir.joinpath(fname)])
 
             # Download HRRR pressure-level files no matter what (atmosphere + soil)
             fname = 'hrrr.t' + cycle_hour + 'z.wrfprsf' + this_lead + '.grib2'
@@ -181,6 +183,7 @@ def main(cycle_dt_str, sim_hrs, out_dir_parent, icbc_fc_dt, now_time_beg, interv
                     wget_error(str(err_msg), now_time_beg)
             else:
                 log.info('   File '+fname+' already exists locally. Not downloading again from server.')
+            register_files([out_dir.joinpath(fname)])
     else:
         # icbc_analysis = True, so loop through valid times of the simulation for f00 files
         for vv in range(n_valid):
@@ -213,6 +216,7 @@ def main(cycle_dt_str, sim_hrs, out_dir_parent, icbc_fc_dt, now_time_beg, interv
                         wget_error(str(err_msg), now_time_beg)
                 else:
                     log.info('   File ' + fname + ' already exists locally. Not downloading again from server.')
+                register_files([out_dir.joinpath(fname)])
 
             # Download HRRR pressure-level files no matter what (atmosphere + soil)
             fname = 'hrrr.t' + valid_hour + 'z.wrfprsf00.grib2'
@@ -228,6 +232,7 @@ def main(cycle_dt_str, sim_hrs, out_dir_parent, icbc_fc_dt, now_time_beg, interv
                     wget_error(str(err_msg), now_time_beg)
             else:
                 log.info('   File ' + fname + ' already exists locally. Not downloading again from server.')
+            register_files([out_dir.joinpath(fname)])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+
+'''
+grib2_to_wps.py
+
+In-process GRIB2 -> WPS intermediate converter, an alternative to running ungrib.exe as batch jobs.
+
+ungrib.exe only decodes the GRIB2 messages a Vtable lists and writes them out as WPS intermediate files, yet
+run_ungrib.py spends most of its wall time waiting in the queue for one 1-core job per valid time. This module reads
+the same Vtables (custom_vtables/ and WPS ungrib/Variable_Tables/), scans each grib2 file's section headers, decodes
+only the matching messages with NumPy and writes PREFIX:YYYY-MM-DD_HH with wps_intermediate.py, so all valid times
+can be converted in a process pool on the workflow node (run_ungrib.py -P).
+
+Supported GRIB2 features:
+  - grid templates 3.0 (lat-lon), 3.10 (Mercator), 3.20 (polar stereographic), 3.30 (Lambert conformal)
+  - product templates 4.0, 4.1, 4.2, 4.8, 4.11, 4.12 (only the parameter, surfaces and forecast time are used)
+  - data templates 5.0 (simple packing), 5.2 (complex packing) and 5.3 (complex packing with spatial differencing),
+    which cover the NCEP HRRR and GFS files the workflow uses; anything else (e.g. 5.40 JPEG2000) raises
+    UnsupportedGrib, and run_ungrib.py without -P (ungrib.exe) should be used for that data
+  - bit maps (section 6), written out as ungrib's missing value -1.E30
+
+Fields are written as ungrib.exe writes them: levels are Pa for isobaric surfaces and 200100 (surface, height above
+ground, soil layers), 201300 (mean sea level) or the level number (hybrid levels) otherwise, and the projection is
+taken from the GRIB2 grid. The derived fields ungrib.exe's rrpr step adds when a Vtable field is absent from the data
+(e.g. RH computed from specific humidity) are not reproduced; a missing Vtable field is reported instead. Records are
+ordered by level and then Vtable row; metgrid.exe does not depend on the order.
+
+Because of rrpr, and because a new model or Vtable may use GRIB2 features not covered here, the converter is only
+used for (prefix, Vtable) pairs that have been validated against ungrib.exe output: run_ungrib.py -P refuses any
+other. A validation is recorded in VALIDATION_FILE by --compare with --record, and only when every field and level
+ungrib.exe wrote is present with bit-identical values and nothing extra is written. It is keyed by the Vtable's
+contents, so an edited Vtable needs validating again:
+
+    python grib2_to_wps.py gfs.t00z.pgrb2.0p25.f000 -t Vtable.GFS -p GFS -o /tmp/py -c ungrib_run/GFS:2024-08-01_00 -r
+'''
+
+import os
+import sys
+import json
+import mmap
+import time
+import hashlib
+import pathlib
+import argparse
+import datetime as dt
+import concurrent.futures
+from collections import namedtuple
+import logging
+
+import numpy as np
+
+import wps_intermediate as wpsi
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+UNGRIB_WORKERS = 8
+# (prefix, Vtable) pairs whose output has been checked against ungrib.exe with --compare --record
+VALIDATION_FILE = pathlib.Path(__file__).resolve().parent.joinpath('grib2_to_wps_validated.json')
+fmt_wrf_dt = '%Y-%m-%d_%H:%M:%S'
+fmt_wrf_date_hh = '%Y-%m-%d_%H'
+
+# Earth radius [km] for the GRIB2 shape-of-the-earth codes ungrib.exe handles
+EARTH_RADIUS_KM = {0: 6367.47, 6: 6371.229, 8: 6371.2}
+CENTERS = {7: 'NCEP', 54: 'CMC', 58: 'FNMOC', 98: 'ECMWF'}
+# Forecast time units (code table 4.4) in hours
+TIME_UNIT_H = {0: 1.0 / 60.0, 1: 1.0, 2: 24.0, 10: 3.0, 11: 6.0, 12: 12.0, 13: 1.0 / 3600.0}
+
+VtableEntry = namedtuple('VtableEntry', 'name units desc level1 level2 discipline category number level_type')
+
+
+class UnsupportedGrib(Exception):
+    pass
+
+
+## Vtables
+
+def read_vtable(vtable):
+    '''Entries of a Vtable that have a metgrid name and GRIB2 codes, in table order.'''
+    entries = []
+    n_rules = 0
+    with open(vtable) as f:
+        for line in f:
+            if line.startswith('-----'):
+                n_rules += 1
+                continue
+            if n_rules != 1:
+                continue
+            cols = [c.strip() for c in line.split('|')]
+            if len(cols) < 11 or not cols[4] or not all(c.lstrip('-').isdigit() for c in cols[7:11]):
+                continue
+            entries.append(VtableEntry(cols[4], cols[5], cols[6], cols[2], cols[3],
+                                       int(cols[7]), int(cols[8]), int(cols[9]), int(cols[10])))
+    return entries
+
+
+def level_xlvl(level_type, value):
+    '''XLVL ungrib.exe writes for a GRIB2 first fixed surface.'''
+    if level_type == 100:
+        return value
+    if level_type in (1, 103, 106):
+        return wpsi.LEVEL_SURFACE
+    if level_type == 101:
+        return wpsi.LEVEL_SEA
+    if level_type == 7:
+        return wpsi.LEVEL_TROPOPAUSE
+    if level_type == 6:
+        return wpsi.LEVEL_MAX_WIND
+    return value if value is not None else 0.0
+
+
+def level_matches(entry, value1, value2):
+    '''Whether the surfaces of a message match a Vtable row's Level1/Level2 (hPa, m or cm as in ungrib).'''
+    if entry.level1 in ('', '*'):
+        return True
+    if value1 is None:
+        return False
+    level1 = float(entry.level1)
+    if entry.level_type == 100:
+        return abs(value1 / 100.0 - level1) < 1.e-3
+    if entry.level_type == 106:
+        # Soil depths are in cm in the Vtable and m in GRIB2
+        if abs(value1 * 100.0 - level1) > 1.e-3:
+            return False
+        return entry.level2 == '' or (value2 is not None and abs(value2 * 100.0 - float(entry.level2)) < 1.e-3)
+    return abs(value1 - level1) < 1.e-3
+
+
+## GRIB2 parsing
+
+def _uint(b):
+    return int.from_bytes(b, 'big')
+
+
+def _sint(b):
+    # GRIB2 signed integers are sign-and-magnitude
+    v = int.from_bytes(b, 'big')
+    top = 1 << (8 * len(b) - 1)
+    return -(v - top) if v & top else v
+
+
+def _float(b):
+    return float(np.frombuffer(b, dtype='>f4')[0])
+
+
+def _surface(s, type_at):
+    level_type = s[type_at]
+    scale = s[type_at + 1]
+    raw = s[type_at + 2:type_at + 6]
+    if level_type == 255 or scale == 255 or raw == b'\xff\xff\xff\xff':
+        return level_type, None
+    return level_type, _sint(raw) / 10.0 ** _sint(bytes([scale]))
+
+
+def messages(mm):
+    '''(offset, length) of each GRIB2 message in a buffer.'''
+    pos = mm.find(b'GRIB', 0)
+    while pos >= 0:
+        if mm[pos + 7] != 2:
+            raise UnsupportedGrib(f'GRIB edition {mm[pos + 7]} at byte {pos}; only GRIB2 is supported')
+        length = _uint(mm[pos + 8:pos + 16])
+        yield pos, length
+        pos = mm.find(b'GRIB', pos + length)
+
+
+def fields(mm, offset, length):
+    '''
+    Fields of one GRIB2 message, as dicts of the parsed section 0/1/3/4 values plus the raw section 5 and 6 bytes
+    and the location of section 7 (decoded by decode_field only when needed).
+    '''
+    discipline = mm[offset + 6]
+    pos = offset + 16
+    end = offset + length
+    sec = {}
+    while pos < end - 4:
+        if mm[pos:pos + 4] == b'7777':
+            break
+        sec_len = _uint(mm[pos:pos + 4])
+        number = mm[pos + 4]
+        if number == 7:
+            yield dict(sec, discipline=discipline, sec7=(pos + 5, sec_len - 5))
+        elif number == 6:
+            indicator = mm[pos + 5]
+            if indicator == 0:
+                sec['bitmap'] = mm[pos + 6:pos + sec_len]
+            elif indicator == 255:
+                sec['bitmap'] = None
+            # 254: the bit map defined earlier in this message applies again
+        else:
+            s = mm[pos:pos + sec_len]
+            if number == 1:
+                sec['center'] = _uint(s[5:7])
+                sec['ref_time'] = dt.datetime(_uint(s[12:14]), s[14], s[15], s[16], s[17], s[18])
+            elif number == 3:
+                sec['grid'] = parse_grid(s)
+            elif number == 4:
+                sec.update(parse_product(s))
+            elif number == 5:
+                sec['sec5'] = s
+        pos += sec_len
+
+
+def parse_product(s):
+    template = _uint(s[7:9])
+    if template not in (0, 1, 2, 8, 11, 12):
+        raise UnsupportedGrib(f'product definition template 4.{template}')
+    type1, value1 = _surface(s, 22)
+    type2, value2 = _surface(s, 28)
+    unit = s[17]
+    if unit not in TIME_UNIT_H:
+        raise UnsupportedGrib(f'forecast time unit {unit}')
+    return {'category': s[9], 'number': s[10], 'fcst_h': _sint(s[18:22]) * TIME_UNIT_H[unit],
+            'level_type': type1, 'level1': value1, 'level2': value2 if type2 != 255 else None}
+
+
+def parse_grid(s):
+    '''Grid size, scanning mode and the WPS projection entries of a section 3.'''
+    template = _uint(s[12:14])
+    shape = s[14]
+    if shape == 1:
+        radius = _uint(s[16:20]) / 10.0 ** s[15] / 1000.0
+    else:
+        radius = EARTH_RADIUS_KM.get(shape, 6371.229)
+
+    def lon(b):
+        value = _uint(b) * 1.e-6
+        return value - 360.0 if value > 180.0 else value
+
+    nx, ny = _uint(s[30:34]), _uint(s[34:38])
+    if template == 0:
+        if _uint(s[38:42]) not in (0, 0xffffffff):
+            raise UnsupportedGrib('lat-lon grid with a non-default basic angle')
+        flags, scan = s[54], s[71]
+        dlat = _uint(s[67:71]) * 1.e-6
+        dlon = _uint(s[63:67]) * 1.e-6
+        proj = {'iproj': 0, 'startlat': _sint(s[46:50]) * 1.e-6, 'startlon': lon(s[50:54]),
+                'deltalat': dlat if scan & 64 else -dlat, 'deltalon': -dlon if scan & 128 else dlon}
+    elif template == 10:
+        flags, scan = s[46], s[59]
+        proj = {'iproj': 1, 'startlat': _sint(s[38:42]) * 1.e-6, 'startlon': lon(s[42:46]),
+                'dx': _uint(s[64:68]) * 1.e-6, 'dy': _uint(s[68:72]) * 1.e-6, 'truelat1': _sint(s[47:51]) * 1.e-6}
+    elif template in (20, 30):
+        flags, scan = s[46], s[64]
+        proj = {'iproj': 5 if template == 20 else 3, 'startlat': _sint(s[38:42]) * 1.e-6, 'startlon': lon(s[42:46]),
+                'dx': _uint(s[55:59]) * 1.e-6, 'dy': _uint(s[59:63]) * 1.e-6, 'xlonc': lon(s[51:55])}
+        if template == 20:
+            proj['truelat1'] = _sint(s[47:51]) * 1.e-6
+        else:
+            proj['truelat1'] = _sint(s[65:69]) * 1.e-6
+            proj['truelat2'] = _sint(s[69:73]) * 1.e-6
+    else:
+        raise UnsupportedGrib(f'grid definition template 3.{template}')
+    if scan & 16:
+        raise UnsupportedGrib('boustrophedonic scanning')
+    proj['earth_radius'] = radius
+    # Flag bit 5 set: u/v are relative to the grid rather than east/north
+    return {'nx': nx, 'ny': ny, 'scan': scan, 'is_wind_earth_rel': not flags & 8, 'proj': proj}
+
+
+## GRIB2 decoding
+
+def unpack_bits(data, bit_pos, widths):
+    '''
+    Unsigned integers of the given bit widths (<= 32) starting at the given bit positions of a uint8 array that is
+    padded with at least 5 trailing zero bytes. Vectorized over all values.
+    '''
+    bit_pos = np.asarray(bit_pos, dtype=np.int64)
+    widths = np.asarray(widths, dtype=np.uint64)
+    first = bit_pos >> 3
+    word = np.zeros(first.shape, dtype=np.uint64)
+    for k in range(5):
+        word = (word << np.uint64(8)) | data[first + k].astype(np.uint64)
+    shift = np.uint64(40) - (bit_pos & 7).astype(np.uint64) - widths
+    return ((word >> shift) & ((np.uint64(1) << widths) - np.uint64(1))).astype(np.int64)
+
+
+def _fixed(data, start_bit, n, width):
+    if width == 0 or n == 0:
+        return np.zeros(n, dtype=np.int64)
+    return unpack_bits(data, start_bit + np.arange(n, dtype=np.int64) * width, width)
+
+
+def _octets(bits):
+    return (bits + 7) // 8 * 8
+
+
+def decode_complex(s5, data, n_values, spatial):
+    '''Integer values and missing mask of data templates 5.2/5.3.'''
+    nbits = s5[19]
+    missing_mgmt = s5[22]
+    n_groups = _uint(s5[31:35])
+    ref_width, width_bits = s5[35], s5[36]
+    ref_len, len_incr, last_len, len_bits = _uint(s5[37:41]), s5[41], _uint(s5[42:46]), s5[46]
+
+    pos = 0
+    if spatial:
+        order, ov = s5[47], s5[48]
+        raw = data[:ov * (order + 1)].tobytes()
+        firsts = [_sint(raw[k * ov:(k + 1) * ov]) for k in range(order)]
+        overall_min = _sint(raw[order * ov:(order + 1) * ov])
+        pos = 8 * ov * (order + 1)
+
+    refs = _fixed(data, pos, n_groups, nbits)
+    pos = _octets(pos + n_groups * nbits)
+    widths = _fixed(data, pos, n_groups, width_bits) + ref_width
+    pos = _octets(pos + n_groups * width_bits)
+    lengths = _fixed(data, pos, n_groups, len_bits) * len_incr + ref_len
+    lengths[-1] = last_len
+    pos = _octets(pos + n_groups * len_bits)
+    if lengths.sum() != n_values:
+        raise ValueError(f'complex packing groups hold {lengths.sum()} values, expected {n_values}')
+
+    group_start = pos + np.concatenate([[0], np.cumsum(lengths * widths)[:-1]])
+    group = np.repeat(np.arange(n_groups), lengths)
+    index_in_group = np.arange(n_values) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    width = widths[group]
+    packed = unpack_bits(data, group_start[group] + index_in_group * width, width)
+    values = refs[group] + packed
+
+    missing = np.zeros(n_values, dtype=bool)
+    if missing_mgmt in (1, 2):
+        all_ones = (np.int64(1) << width) - 1
+        group_all_ones = (1 << nbits) - 1
+        missing = np.where(width > 0, packed == all_ones, refs[group] == group_all_ones)
+        if missing_mgmt == 2:
+            missing |= np.where(width > 0, packed == all_ones - 1, refs[group] == group_all_ones - 1)
+
+    if spatial:
+        valid = values[~missing]
+        if valid.size:
+            d = valid + overall_min
+            d[:order] = firsts[:min(order, valid.size)]
+            if order == 1:
+                valid = np.cumsum(d)
+            elif order == 2:
+                if valid.size > 1:
+                    d[1] = firsts[1] - firsts[0]
+                valid = np.concatenate([d[:1], d[0] + np.cumsum(np.cumsum(d[1:]))])
+            else:
+                raise UnsupportedGrib(f'spatial differencing of order {order}')
+        values[~missing] = valid
+    return values, missing
+
+
+def decode_field(mm, fld):
+    '''(ny, nx) float32 array of one field, with -1.E30 where the bit map or missing-value management says so.'''
+    s5 = fld['sec5']
+    template = _uint(s5[9:11])
+    n_values = _uint(s5[5:9])
+    ref = _float(s5[11:15])
+    binary_scale = _sint(s5[15:17])
+    decimal_scale = _sint(s5[17:19])
+    grid = fld['grid']
+    n_points = grid['nx'] * grid['ny']
+
+    pos7, len7 = fld['sec7']
+    data = np.frombuffer(mm[pos7:pos7 + len7] + bytes(8), dtype=np.uint8)
+    if template == 0:
+        values = _fixed(data, 0, n_values, s5[19])
+        missing = np.zeros(n_values, dtype=bool)
+    elif template in (2, 3):
+        values, missing = decode_complex(s5, data, n_values, spatial=template == 3)
+    else:
+        raise UnsupportedGrib(f'data representation template 5.{template}')
+
+    scaled = ((ref + values * 2.0 ** binary_scale) / 10.0 ** decimal_scale).astype(np.float32)
+    scaled[missing] = wpsi.MISSING_VALUE
+
+    bitmap = fld.get('bitmap')
+    if bitmap is not None:
+        present = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))[:n_points].astype(bool)
+        slab = np.full(n_points, wpsi.MISSING_VALUE, dtype=np.float32)
+        slab[present] = scaled
+    else:
+        slab = scaled
+    if slab.size != n_points:
+        raise ValueError(f'decoded {slab.size} values for a {grid["nx"]} x {grid["ny"]} grid')
+
+    if grid['scan'] & 32:
+        # Adjacent points are consecutive in j
+        return slab.reshape(grid['nx'], grid['ny']).T.copy()
+    return slab.reshape(grid['ny'], grid['nx'])
+
+
+## Conversion
+
+def convert(grib_files, vtable, prefix, out_dir='.', map_source=None):
+    '''
+    Convert the Vtable fields of one valid time to out_dir/PREFIX:YYYY-MM-DD_HH.
+
+    Returns a dict with the output path, the number of fields written, the Vtable entries not found in the data
+    and the run time.
+    '''
+    t0 = time.time()
+    entries = read_vtable(vtable)
+    keys = {}
+    for n, entry in enumerate(entries):
+        keys.setdefault((entry.discipline, entry.category, entry.number, entry.level_type), []).append((n, entry))
+
+    found = {}
+    found_rows = set()
+    valid_times = set()
+    for grib_file in grib_files:
+        with open(grib_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset, length in messages(mm):
+                for fld in fields(mm, offset, length):
+                    candidates = keys.get((fld['discipline'], fld['category'], fld['number'], fld['level_type']), [])
+                    for n, entry in candidates:
+                        if not level_matches(entry, fld['level1'], fld['level2']):
+                            continue
+                        xlvl = level_xlvl(fld['level_type'], fld['level1'])
+                        if (entry.name, xlvl) in found:
+                            break
+                        valid = fld['ref_time'] + dt.timedelta(hours=fld['fcst_h'])
+                        valid_times.add(valid)
+                        found[(entry.name, xlvl)] = (n, dict(
+                            fld['grid']['proj'], hdate=valid.strftime(fmt_wrf_dt), xfcst=fld['fcst_h'],
+                            map_source=map_source or CENTERS.get(fld['center'], 'GRIB2'), field=entry.name,
+                            units=entry.units, desc=entry.desc, xlvl=xlvl,
+                            is_wind_earth_rel=fld['grid']['is_wind_earth_rel'], slab=decode_field(mm, fld)))
+                        found_rows.add(n)
+                        break
+
+    if not found:
+        raise ValueError('none of the fields in ' + str(vtable) + ' were found in ' + ', '.join(map(str, grib_files)))
+    if len(valid_times) > 1:
+        raise ValueError('grib files hold more than one valid time: ' + ', '.join(sorted(map(str, valid_times))))
+    valid = valid_times.pop()
+
+    # Level-major (surface codes first, then pressure from the bottom up), then Vtable order
+    ordered = sorted(found.items(), key=lambda item: (-item[0][1], item[1][0]))
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_file = out_dir.joinpath(prefix + ':' + valid.strftime(fmt_wrf_date_hh))
+    tmp = out_file.with_name('.' + out_file.name + '.tmp')
+    wpsi.write_fields(tmp, [field for _, (_, field) in ordered])
+    os.replace(tmp, out_file)
+    return {'out_file': str(out_file), 'n_fields': len(found), 'seconds': time.time() - t0,
+            'absent': sorted({entry.name + ' ' + (entry.level1 or '*') for n, entry in enumerate(entries)
+                              if n not in found_rows})}
+
+
+def convert_all(jobs, workers=UNGRIB_WORKERS):
+    '''
+    Run convert for each job (a dict of its keyword arguments) in a process pool. Returns the results in job order;
+    the first failure is raised.
+    '''
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as pool:
+        futures = [pool.submit(convert, **job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def compare_files(ours, reference, atol=0.0):
+    '''
+    Differences between two intermediate files, field by field and level by level. Returns a list of messages,
+    empty if every field of the reference is present with the same grid, projection and values (within atol).
+    '''
+    def by_key(path):
+        return {(f['field'], round(f['xlvl'], 3)): f for f in wpsi.read_fields(path)}
+
+    ours, reference = by_key(ours), by_key(reference)
+    problems = []
+    for key in sorted(set(reference) - set(ours)):
+        problems.append(f'{key[0]} at {key[1]}: missing')
+    for key in sorted(set(ours) - set(reference)):
+        problems.append(f'{key[0]} at {key[1]}: not written by ungrib.exe')
+    for key in sorted(set(ours) & set(reference)):
+        a, b = ours[key], reference[key]
+        for name in ['iproj', 'hdate', 'is_wind_earth_rel'] + list(wpsi.PROJ_FIELDS[b['iproj']]):
+            if name not in a or (a[name] != b[name] and not np.isclose(a[name], b[name], rtol=1.e-6)):
+                problems.append(f'{key[0]} at {key[1]}: {name} {a.get(name)} != {b[name]}')
+        if a['slab'].shape != b['slab'].shape:
+            problems.append(f'{key[0]} at {key[1]}: shape {a["slab"].shape} != {b["slab"].shape}')
+            continue
+        diff = np.abs(a['slab'].astype(np.float64) - b['slab'].astype(np.float64))
+        if diff.max() > atol:
+            problems.append(f'{key[0]} at {key[1]}: max abs difference {diff.max():g}')
+    return problems
+
+
+def vtable_digest(vtable):
+    with open(vtable, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_validations(path=VALIDATION_FILE):
+    '''{prefix: [validation record, ...]} recorded by --record; empty if nothing has been validated.'''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def validation(prefix, vtable, path=VALIDATION_FILE):
+    '''The record validating prefix with this Vtable (same contents), or None.'''
+    digest = vtable_digest(vtable)
+    for record in read_validations(path).get(prefix, []):
+        if record['vtable_sha256'] == digest:
+            return record
+    return None
+
+
+def record_validation(prefix, vtable, grib_files, reference, n_fields, path=VALIDATION_FILE):
+    validations = read_validations(path)
+    digest = vtable_digest(vtable)
+    records = [r for r in validations.get(prefix, []) if r['vtable_sha256'] != digest]
+    records.append({'vtable': os.path.basename(vtable), 'vtable_sha256': digest,
+                    'grib_files': [os.path.basename(str(f)) for f in grib_files],
+                    'reference': str(reference), 'n_fields': n_fields,
+                    'validated': dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+    validations[prefix] = records
+    tmp = pathlib.Path(str(path) + '.tmp')
+    tmp.write_text(json.dumps(validations, indent=1, sort_keys=True) + '\n')
+    os.replace(tmp, path)
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('grib_files', nargs='+', help='grib2 file(s) holding one valid time')
+    parser.add_argument('-t', '--vtable', required=True, help='Vtable listing the fields to convert')
+    parser.add_argument('-p', '--prefix', default='FILE', help='prefix of the intermediate file (default: FILE)')
+    parser.add_argument('-o', '--out_dir', default='.', help='directory for the intermediate file (default: .)')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='ungrib.exe output file (or directory holding one with the same name) to validate against')
+    parser.add_argument('-e', '--atol', default=0.0, type=float,
+                        help='absolute tolerance for --compare (default: 0, bit-identical values)')
+    parser.add_argument('-r', '--record', action='store_true',
+                        help=f'If flag present and --compare finds no differences, record the prefix and Vtable as validated in {VALIDATION_FILE.name}')
+    args = parser.parse_args()
+    if args.record and (args.compare is None or args.atol != 0.0):
+        log.error('ERROR: --record needs --compare with the default atol of 0 (bit-identical output). Exiting!')
+        sys.exit(1)
+    return args.grib_files, args.vtable, args.prefix, args.out_dir, args.compare, args.atol, args.record
+
+
+def main(grib_files, vtable, prefix, out_dir, compare, atol, record):
+    try:
+        result = convert(grib_files, vtable, prefix, out_dir)
+    except (UnsupportedGrib, ValueError) as e:
+        log.error('ERROR: ' + str(e) + '. Exiting!')
+        sys.exit(1)
+    log.info('Wrote ' + str(result['n_fields']) + ' fields to ' + result['out_file'] +
+             f' in {result["seconds"]:.1f} s')
+    for absent in result['absent']:
+        log.info('   Vtable field not in the grib data: ' + absent)
+
+    if compare is not None:
+        reference = pathlib.Path(compare)
+        if reference.is_dir():
+            reference = reference.joinpath(pathlib.Path(result['out_file']).name)
+        if not reference.is_file():
+            log.error('ERROR: ungrib.exe output ' + str(reference) + ' not found. Exiting!')
+            sys.exit(1)
+        problems = compare_files(result['out_file'], reference, atol)
+        for problem in problems:
+            log.error('   ' + problem)
+        if problems:
+            log.error('ERROR: ' + str(len(problems)) + ' difference(s) from ' + str(reference) + '. Exiting!')
+            sys.exit(1)
+        log.info('Output matches ' + str(reference))
+        if record:
+            record_validation(prefix, vtable, grib_files, reference, result['n_fields'])
+            log.info('Recorded ' + prefix + ' with ' + os.path.basename(vtable) + ' as validated in ' + str(VALIDATION_FILE))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    main(*parse_args())
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+'''
+grib_store.py
+
+Quota-managed store for the grib/grib2 files under grib_dir_parent.
+
+Left alone, grib_dir_parent only grows: every cycle adds gfs.<date>, gefs.<date> or hrrr.<date>/conus trees until
+the scratch quota is hit and running jobs die. When the store is enabled, every file the download and link scripts
+fetch (or find already present) is registered in a small sqlite index in the store root, with its size and the
+time it was last used. Whenever a registration takes the store over its byte or file (inode) budget, the least
+recently used files are deleted until usage is back under LOW_WATER of the budget.
+
+Files are pinned by the cycle that registered them (owner, e.g. 20240801_00/mem01) until that cycle's ungrib has
+run, and pinned files are never evicted. Pins expire after PIN_TTL_S so a crashed cycle cannot hold files forever.
+Files placed in the store by other means are adopted (with their access/modification time) by scan().
+
+The store is configured through the environment, so the download/link scripts need no new arguments:
+  WPS_WRF_GRIB_STORE            store root (usually grib_dir_parent); the store is disabled if unset
+  WPS_WRF_GRIB_STORE_MAX_BYTES  byte budget (default: unlimited)
+  WPS_WRF_GRIB_STORE_MAX_FILES  file budget (default: unlimited)
+  WPS_WRF_GRIB_STORE_OWNER      owner pinning the files registered by this process (default: no pin)
+setup_wps_wrf.py sets these from the grib_store_max_gb and grib_store_max_files yaml entries.
+
+Examples:
+  python grib_store.py -d /glade/derecho/scratch/$USER/data status
+  python grib_store.py -d /glade/derecho/scratch/$USER/data -B 2000 evict --scan
+  python grib_store.py -d /glade/derecho/scratch/$USER/data unpin -p 20240801_00
+'''
+
+import os
+import sys
+import time
+import sqlite3
+import pathlib
+import argparse
+import datetime as dt
+import logging
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+STORE_ENV = 'WPS_WRF_GRIB_STORE'
+MAX_BYTES_ENV = 'WPS_WRF_GRIB_STORE_MAX_BYTES'
+MAX_FILES_ENV = 'WPS_WRF_GRIB_STORE_MAX_FILES'
+OWNER_ENV = 'WPS_WRF_GRIB_STORE_OWNER'
+
+INDEX_NAME = '.grib_store.sqlite'
+# Evict down to this fraction of the budget, so the next few registrations do not each trigger an eviction
+LOW_WATER = 0.9
+# Pins older than this are treated as left behind by a cycle that died
+PIN_TTL_S = 2 * 86400
+SQLITE_TIMEOUT_S = 120
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    bytes       INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_lru ON files (last_access);
+CREATE TABLE IF NOT EXISTS pins (
+    path      TEXT NOT NULL,
+    owner     TEXT NOT NULL,
+    pinned_at REAL NOT NULL,
+    PRIMARY KEY (path, owner)
+);
+CREATE INDEX IF NOT EXISTS pins_owner ON pins (owner);
+'''
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Inspect or maintain the quota-managed grib store.')
+    parser.add_argument('-d', '--store_dir', default=os.environ.get(STORE_ENV),
+                        help=f'store root, i.e. grib_dir_parent (default: ${STORE_ENV})')
+    parser.add_argument('-B', '--max_gb', default=None, type=float, help='byte budget in GB (default: from the environment)')
+    parser.add_argument('-N', '--max_files', default=None, type=int, help='file budget (default: from the environment)')
+    parser.add_argument('action', choices=['status', 'evict', 'register', 'unpin'], help='what to do')
+    parser.add_argument('files', nargs='*', help='files to register')
+    parser.add_argument('-p', '--owner', default=None, help='owner to pin registered files to, or to unpin')
+    parser.add_argument('--scan', action='store_true', help='adopt untracked files in the store before evicting')
+
+    args = parser.parse_args()
+    if args.store_dir is None:
+        log.error(f'ERROR! No store directory given with -d or ${STORE_ENV}. Exiting!')
+        sys.exit(1)
+    if args.action == 'unpin' and args.owner is None:
+        log.error('ERROR! unpin needs an owner (-p). Exiting!')
+        sys.exit(1)
+    max_bytes = int(args.max_gb * 1e9) if args.max_gb is not None else None
+    return pathlib.Path(args.store_dir), max_bytes, args.max_files, args.action, args.files, args.owner, args.scan
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(float(value)) if value else None
+
+
+class GribStore:
+    def __init__(self, root, max_bytes=None, max_files=None):
+        self.root = pathlib.Path(os.path.abspath(root))
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root.joinpath(INDEX_NAME)
+        con = self._connect()
+        try:
+            con.executescript(_SCHEMA)
+        finally:
+            con.close()
+
+    @classmethod
+    def from_env(cls):
+        '''The store configured in the environment, or None if WPS_WRF_GRIB_STORE is not set.'''
+        root = os.environ.get(STORE_ENV)
+        if not root:
+            return None
+        return cls(root, _env_int(MAX_BYTES_ENV), _env_int(MAX_FILES_ENV))
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=SQLITE_TIMEOUT_S, isolation_level=None)
+
+    def _key(self, path):
+        return str(pathlib.Path(os.path.abspath(path)))
+
+    def register(self, paths, owner=None, evict=True):
+        '''
+        Record files as used now (adding them if new), pin them to owner if given, then evict if over budget.
+        Paths that do not exist are ignored. Symlinks (e.g. to GLADE) count as one file of their own size.
+        '''
+        now = time.time()
+        rows = []
+        for path in paths:
+            try:
+                size = os.lstat(path).st_size
+            except FileNotFoundError:
+                continue
+            rows.append((self._key(path), size, now))
+        if not rows:
+            return
+        con = self._connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            con.executemany('INSERT INTO files (path, bytes, last_access) VALUES (?, ?, ?) '
+                            'ON CONFLICT(path) DO UPDATE SET bytes = excluded.bytes, last_access = excluded.last_access',
+                            rows)
+            if owner:
+                con.executemany('INSERT OR REPLACE INTO pins (path, owner, pinned_at) VALUES (?, ?, ?)',
+                                [(key, owner, now) for key, _, _ in rows])
+            con.execute('COMMIT')
+        finally:
+            con.close()
+        if evict:
+            self.evict()
+
+    def unpin(self, owner):
+        '''Release every file pinned by owner; returns how many pins were released.'''
+        con = self._connect()
+        try:
+            return con.execute('DELETE FROM pins WHERE owner = ?', (owner,)).rowcount
+        finally:
+            con.close()
+
+    def usage(self):
+        '''(bytes, files) currently registered.'''
+        con = self._connect()
+        try:
+            n_bytes, n_files = con.execute('SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM files').fetchone()
+            return int(n_bytes), int(n_files)
+        finally:
+            con.close()
+
+    def pinned(self):
+        '''(bytes, files) held by live pins.'''
+        con = self._connect()
+        try:
+            row = con.execute('SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM files WHERE path IN '
+                              '(SELECT path FROM pins WHERE pinned_at > ?)', (time.time() - PIN_TTL_S,)).fetchone()
+            return int(row[0]), int(row[1])
+        finally:
+            con.close()
+
+    def scan(self):
+        '''Adopt files under the root that are not in the index yet; returns how many were added.'''
+        con = self._connect()
+        try:
+            known = {row[0] for row in con.execute('SELECT path FROM files')}
+            rows = []
+            for dir_path, _, file_names in os.walk(self.root):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    key = self._key(path)
+                    if key in known or file_name.startswith(INDEX_NAME):
+                        continue
+                    stat = os.lstat(path)
+                    rows.append((key, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+            con.execute('BEGIN IMMEDIATE')
+            con.executemany('INSERT OR IGNORE INTO files (path, bytes, last_access) VALUES (?, ?, ?)', rows)
+            con.execute('COMMIT')
+            return len(rows)
+        finally:
+            con.close()
+
+    def over_budget(self, n_bytes, n_files, fraction=1.0):
+        return ((self.max_bytes is not None and n_bytes > fraction * self.max_bytes) or
+                (self.max_files is not None and n_files > fraction * self.max_files))
+
+    def evict(self):
+        '''
+        Delete least recently used, unpinned files until usage is under LOW_WATER of the budget, once it is over
+        the budget. Returns (files removed, bytes freed).
+        '''
+        if self.max_bytes is None and self.max_files is None:
+            return 0, 0
+        n_bytes, n_files = self.usage()
+        if not self.over_budget(n_bytes, n_files):
+            return 0, 0
+
+        removed = 0
+        freed = 0
+        con = self._connect()
+        try:
+            # One evicting process at a time; the others wait here and then find the store already trimmed
+            con.execute('BEGIN IMMEDIATE')
+            n_bytes, n_files = con.execute('SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM files').fetchone()
+            candidates = con.execute(
+                'SELECT path, bytes FROM files WHERE path NOT IN (SELECT path FROM pins WHERE pinned_at > ?) '
+                'ORDER BY last_access', (time.time() - PIN_TTL_S,)).fetchall()
+            gone = []
+            for path, size in candidates:
+                if not self.over_budget(n_bytes, n_files, LOW_WATER):
+                    break
+                try:
+                    os.unlink(path)
+                    removed += 1
+                    freed += size
+                except FileNotFoundError:
+                    pass
+                gone.append((path,))
+                n_bytes -= size
+                n_files -= 1
+                self._prune_dirs(pathlib.Path(path).parent)
+            con.executemany('DELETE FROM files WHERE path = ?', gone)
+            con.executemany('DELETE FROM pins WHERE path = ?', gone)
+            con.execute('DELETE FROM pins WHERE pinned_at <= ?', (time.time() - PIN_TTL_S,))
+            con.execute('COMMIT')
+        finally:
+            con.close()
+
+        if removed:
+            log.info(f'Grib store {self.root}: evicted {removed} least recently used file(s), {freed / 1e9:.2f} GB')
+        if self.over_budget(n_bytes, n_files):
+            log.warning(f'WARNING: grib store {self.root} is still over budget ({n_bytes / 1e9:.2f} GB, {n_files} files); '
+                        'everything left is pinned by running cycles')
+        return removed, freed
+
+    def _prune_dirs(self, dir_path):
+        '''Remove directories left empty by eviction, up to (not including) the store root.'''
+        while dir_path != self.root and self.root in dir_path.parents:
+            try:
+                dir_path.rmdir()
+            except OSError:
+                return
+            dir_path = dir_path.parent
+
+
+def register_files(paths):
+    '''Register files with the store configured in the environment, pinned to $WPS_WRF_GRIB_STORE_OWNER (no-op if
+    the store is not enabled). Used by the download and link scripts after each file they fetch or reuse.'''
+    store = GribStore.from_env()
+    if store is not None:
+        store.register(paths, owner=os.environ.get(OWNER_ENV))
+
+
+def main(store_dir, max_bytes, max_files, action, files, owner, scan):
+    store = GribStore(store_dir, max_bytes if max_bytes is not None else _env_int(MAX_BYTES_ENV),
+                      max_files if max_files is not None else _env_int(MAX_FILES_ENV))
+    if action == 'register':
+        store.register(files, owner=owner)
+    elif action == 'unpin':
+        log.info(f'Released {store.unpin(owner)} pin(s) held by {owner}')
+    elif action == 'evict':
+        if scan:
+            log.info(f'Adopted {store.scan()} untracked file(s)')
+        store.evict()
+    n_bytes, n_files = store.usage()
+    pin_bytes, pin_files = store.pinned()
+    budget = ', '.join([f'{store.max_bytes / 1e9:.2f} GB' if store.max_bytes is not None else 'unlimited GB',
+                        f'{store.max_files} files' if store.max_files is not None else 'unlimited files'])
+    log.info(f'Grib store {store.root}: {n_bytes / 1e9:.2f} GB in {n_files} files ({pin_bytes / 1e9:.2f} GB in '
+             f'{pin_files} pinned files); budget {budget}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    now_time_beg = dt.datetime.now(dt.UTC)
+    main(*parse_args())
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+'''
+icbc_check.py
+
+Pre-flight availability check for IC/LBC grib data.
+
+The download scripts (download_hrrr_from_aws_or_gc.py, download_gfs_from_aws.py, download_gefs_from_aws.py) only
+find out that a file is missing when wget hits a 404 partway through a cycle, possibly hours into a sweep, and the
+link_*_from_glade.py scripts just skip files that are not there. This module builds the full list of objects
+each cycle needs, with the same models, sources, lead times, analysis mode and file names as those scripts, and
+checks them all up front:
+  - remote objects with concurrent HEAD requests, or with one bucket listing per directory where many objects
+    share a prefix on an S3/GCS bucket (falling back to HEAD if listing is not possible),
+  - GLADE objects through the cached RDA catalog (rda_catalog.py), one directory listing per month.
+Results can be kept in a JSON cache file: objects seen to exist are trusted for AVAILABLE_TTL_S, missing ones are
+re-checked after MISSING_TTL_S since real-time data may still be on its way.
+
+plan_cycles() turns the check into a plan: each cycle keeps its icbc_fc_dt if everything is there, is
+rescheduled onto an older IC/LBC cycle (a larger icbc_fc_dt, up to max_fc_dt) if that one is complete, or is
+excluded. setup_wps_wrf.py runs it before the cycle loop when preflight is set in its yaml.
+
+For testing against a local HTTP stand-in, mirror rewrites every https://<host>/<path> URL to
+<mirror>/<host>/<path> (e.g. python -m http.server serving a directory tree laid out that way), and glade_root
+replaces /glade.
+
+Examples:
+  python icbc_check.py -b 20240801_00 -e 20240810_00 -m HRRR -c AWS -s 24 -i 1 -x 6
+  python icbc_check.py -b 20240801_00 -m GEFS -c AWS -M 01 -s 48 -i 3 --cache ~/.icbc_check.json
+'''
+
+import os
+import sys
+import json
+import time
+import pathlib
+import argparse
+import threading
+import datetime as dt
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+import concurrent.futures
+import logging
+
+from rda_catalog import RdaCatalog
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+fmt_yyyymmdd_hh = '%Y%m%d_%H'
+
+variants_aws = ['AWS', 'aws']
+variants_glade = ['GLADE', 'glade']
+variants_gc = ['GoogleCloud', 'googlecloud', 'Google_Cloud', 'google_cloud', 'GC', 'gc', 'GCloud', 'gcloud']
+variants_nomads = ['NOMADS', 'nomads']
+
+variants_gfs = ['GFS', 'gfs']
+variants_gfs_fnl = ['GFS_FNL', 'gfs_fnl']
+variants_gefs = ['GEFS', 'gefs']
+variants_hrrr = ['HRRR', 'hrrr']
+
+HRRR_AWS = 'https://noaa-hrrr-bdp-pds.s3.amazonaws.com'
+HRRR_GC = 'https://storage.googleapis.com/high-resolution-rapid-refresh'
+GFS_AWS = 'https://noaa-gfs-bdp-pds.s3.amazonaws.com'
+GEFS_AWS = 'https://noaa-gefs-pds.s3.amazonaws.com'
+GEFS_NOMADS = 'https://nomads.ncep.noaa.gov/pub/data/nccf/com/gens/prod'
+GLADE_GFS = pathlib.Path('/', 'glade', 'campaign', 'collections', 'rda', 'data', 'd084001')
+GLADE_GFS_FNL = pathlib.Path('/', 'glade', 'campaign', 'collections', 'rda', 'data', 'd083003')
+GEFSV12_DT = dt.datetime(2020, 9, 23, 12)
+
+# How often each model is cycled, i.e. the step when rescheduling onto an older IC/LBC cycle
+CYCLE_STEP_H = {'HRRR': 1, 'GFS': 6, 'GEFS': 6}
+
+# Cache lifetimes: an object seen once stays, a missing one may still be uploaded
+AVAILABLE_TTL_S = 7 * 86400
+MISSING_TTL_S = 600
+HTTP_TIMEOUT_S = 20
+# Use one bucket listing instead of HEAD requests once a directory holds at least this many required objects
+LIST_MIN_OBJECTS = 8
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Check that the IC/LBC files for a set of cycles are available.')
+    parser.add_argument('-b', '--cycle_dt_beg', required=True, help='first WRF cycle [YYYYMMDD_HH]')
+    parser.add_argument('-e', '--cycle_dt_end', default=None, help='last WRF cycle [YYYYMMDD_HH] (default: cycle_dt_beg)')
+    parser.add_argument('-C', '--cycle_int_h', default=24, type=int, help='hours between WRF cycles (default: 24)')
+    parser.add_argument('-m', '--icbc_model', default='GFS', help='IC/LBC model: GFS|GFS_FNL|GEFS|HRRR (default: GFS)')
+    parser.add_argument('-c', '--icbc_source', default='AWS', help='GLADE|AWS|GoogleCloud|NOMADS (default: AWS)')
+    parser.add_argument('-s', '--sim_hrs', default=24, type=int, help='WRF simulation length in hours (default: 24)')
+    parser.add_argument('-i', '--int_h', default=3, type=int, help='hours between IC/LBC files (default: 3)')
+    parser.add_argument('-f', '--icbc_fc_dt', default=0, type=int,
+                        help='hours prior to WRF cycle time for IC/LBC model cycle (default: 0)')
+    parser.add_argument('-x', '--max_fc_dt', default=None, type=int,
+                        help='largest icbc_fc_dt a cycle may be rescheduled to if its files are missing (default: no rescheduling)')
+    parser.add_argument('-a', '--icbc_analysis', action='store_true', help='check analysis [f00] files (HRRR)')
+    parser.add_argument('-n', '--native_grid', action='store_true', help='also check HRRR native-grid files')
+    parser.add_argument('-M', '--member', default=None, help='GEFS member, e.g. 01 (default: None)')
+    parser.add_argument('-j', '--workers', default=16, type=int, help='concurrent requests (default: 16)')
+    parser.add_argument('--cache', default=None, help='JSON file caching availability between runs (default: None)')
+    parser.add_argument('--mirror', default=None, help='base URL of a local stand-in for the remote repositories')
+    parser.add_argument('--glade_root', default=None, help='directory standing in for /glade')
+    parser.add_argument('-o', '--out_file', default=None, help='write the plan to this JSON file')
+
+    args = parser.parse_args()
+    cycle_dt_end = args.cycle_dt_end if args.cycle_dt_end is not None else args.cycle_dt_beg
+    for cycle_dt in [args.cycle_dt_beg, cycle_dt_end]:
+        if len(cycle_dt) != 11 or cycle_dt[8] != '_':
+            log.error('ERROR! Incorrect format for cycle date/time ' + cycle_dt + '. Exiting!')
+            parser.print_help()
+            sys.exit(1)
+
+    cycles = date_range(dt.datetime.strptime(args.cycle_dt_beg, fmt_yyyymmdd_hh),
+                        dt.datetime.strptime(cycle_dt_end, fmt_yyyymmdd_hh), args.cycle_int_h)
+    cycle_strs = [cycle.strftime(fmt_yyyymmdd_hh) for cycle in cycles]
+    return (cycle_strs, args.icbc_model, args.icbc_source, args.sim_hrs, args.int_h, args.icbc_fc_dt, args.max_fc_dt,
+            args.icbc_analysis, args.native_grid, args.member, args.workers, args.cache, args.mirror, args.glade_root,
+            args.out_file)
+
+
+## Required objects
+
+def date_range(beg_dt, end_dt, int_h):
+    return [beg_dt + dt.timedelta(hours=hours) for hours in range(0, int((end_dt - beg_dt).total_seconds()) // 3600 + 1, int_h)]
+
+
+def model_key(icbc_model):
+    for key, variants in [('HRRR', variants_hrrr), ('GFS', variants_gfs), ('GFS_FNL', variants_gfs_fnl),
+                          ('GEFS', variants_gefs)]:
+        if icbc_model in variants:
+            return key
+    raise ValueError(f'Unknown icbc_model {icbc_model}; expected GEFS|GFS|GFS_FNL|HRRR')
+
+
+def required_objects(cycle_str, icbc_model, icbc_source, sim_hrs, int_hrs, icbc_fc_dt=0, icbc_analysis=False,
+                     hrrr_native=False, mem_id=None, glade_root=None):
+    '''
+    URLs (remote sources) or paths (GLADE) of every file the download/link script for this model and source
+    fetches for one WRF cycle. Raises ValueError for combinations setup_wps_wrf.py does not support.
+    '''
+    model = model_key(icbc_model)
+    cycle_dt = dt.datetime.strptime(cycle_str, fmt_yyyymmdd_hh)
+    icbc_cycle = cycle_dt - dt.timedelta(hours=icbc_fc_dt)
+    leads = range(icbc_fc_dt, sim_hrs + icbc_fc_dt + 1, int_hrs)
+    valid_all = date_range(cycle_dt, cycle_dt + dt.timedelta(hours=sim_hrs), int_hrs)
+    glade = (lambda path: pathlib.Path(glade_root).joinpath(*path.parts[2:])) if glade_root else (lambda path: path)
+
+    if model == 'HRRR':
+        if icbc_source in variants_aws:
+            base = HRRR_AWS
+        elif icbc_source in variants_gc:
+            base = HRRR_GC
+        else:
+            raise ValueError('HRRR data can only be checked on AWS or GoogleCloud, not ' + icbc_source)
+        products = ['wrfnat', 'wrfprs'] if hrrr_native else ['wrfprs']
+        if icbc_analysis:
+            times = [(valid, 0) for valid in valid_all]
+        else:
+            times = [(icbc_cycle, lead) for lead in leads]
+        return [f'{base}/hrrr.{cycle:%Y%m%d}/conus/hrrr.t{cycle:%H}z.{product}f{lead:02d}.grib2'
+                for cycle, lead in times for product in products]
+
+    if model == 'GFS':
+        if icbc_analysis:
+            raise ValueError('icbc_analysis with GFS is not supported; use GFS_FNL')
+        if icbc_source in variants_glade:
+            glade_dir = glade(GLADE_GFS).joinpath(f'{icbc_cycle:%Y}', f'{icbc_cycle:%Y%m%d}')
+            return [str(glade_dir.joinpath(f'gfs.0p25.{icbc_cycle:%Y%m%d%H}.f{lead:03d}.grib2')) for lead in leads]
+        if icbc_source in variants_aws:
+            return [f'{GFS_AWS}/gfs.{icbc_cycle:%Y%m%d}/{icbc_cycle:%H}/atmos/gfs.t{icbc_cycle:%H}z.pgrb2.0p25.f{lead:03d}'
+                    for lead in leads]
+        raise ValueError('GFS data can only be checked on GLADE or AWS, not ' + icbc_source)
+
+    if model == 'GFS_FNL':
+        if icbc_source not in variants_glade:
+            raise ValueError('GFS_FNL data can only be checked on GLADE, not ' + icbc_source)
+        paths = []
+        for valid in valid_all:
+            # FNL files are f00 at 00/06/12/18 UTC and f03 from the previous cycle in between
+            lead = valid.hour % 6
+            cycle = valid - dt.timedelta(hours=lead)
+            glade_dir = glade(GLADE_GFS_FNL).joinpath(f'{cycle:%Y}', f'{cycle:%Y%m}')
+            paths.append(str(glade_dir.joinpath(f'gdas1.fnl0p25.{cycle:%Y%m%d%H}.f{lead:02d}.grib2')))
+        return paths
+
+    # GEFS
+    if icbc_analysis:
+        raise ValueError('icbc_analysis with GEFS is not supported')
+    if mem_id is None:
+        raise ValueError('A GEFS member is needed to check GEFS data')
+    prefix = 'gec' if mem_id == '00' else 'gep'
+    if icbc_source in variants_aws:
+        if icbc_cycle >= GEFSV12_DT:
+            base = f'{GEFS_AWS}/gefs.{icbc_cycle:%Y%m%d}/{icbc_cycle:%H}/atmos'
+            files = [(f'pgrb2ap5/{prefix}{mem_id}.t{icbc_cycle:%H}z.pgrb2a.0p50.f{lead:03d}',
+                      f'pgrb2bp5/{prefix}{mem_id}.t{icbc_cycle:%H}z.pgrb2b.0p50.f{lead:03d}') for lead in leads]
+        else:
+            base = f'{GEFS_AWS}/gefs.{icbc_cycle:%Y%m%d}/{icbc_cycle:%H}'
+            files = [(f'pgrb2a/{prefix}{mem_id}.t{icbc_cycle:%H}z.pgrb2af{lead:02d}',
+                      f'pgrb2b/{prefix}{mem_id}.t{icbc_cycle:%H}z.pgrb2bf{lead:02d}') for lead in leads]
+    elif icbc_source in variants_nomads:
+        base = f'{GEFS_NOMADS}/gefs.{icbc_cycle:%Y%m%d}/{icbc_cycle:%H}/atmos'
+        files = [(f'pgrb2ap5/{prefix}{mem_id}.t{icbc_cycle:%H}z.pgrb2a.0p50.f{lead:03d}',
+                  f'pgrb2bp5/{prefix}{mem_id}.t{icbc_cycle:%H}z.pgrb2b.0p50.f{lead:03d}') for lead in leads]
+    else:
+        raise ValueError('GEFS data can only be checked on AWS or NOMADS, not ' + icbc_source)
+    return [f'{base}/{name}' for pair in files for name in pair]
+
+
+## Checking
+
+def mirror_url(url, mirror):
+    '''https://<host>/<path> as served by a local stand-in at mirror: <mirror>/<host>/<path>.'''
+    if mirror is None:
+        return url
+    parts = urllib.parse.urlsplit(url)
+    return mirror.rstrip('/') + '/' + parts.netloc + parts.path
+
+
+def bucket_split(url):
+    '''(bucket URL, key) for objects on an S3 or GCS bucket, or None for other hosts.'''
+    parts = urllib.parse.urlsplit(url)
+    if parts.netloc.endswith('.s3.amazonaws.com'):
+        return f'{parts.scheme}://{parts.netloc}', parts.path.lstrip('/')
+    if parts.netloc == 'storage.googleapis.com':
+        bucket, _, key = parts.path.lstrip('/').partition('/')
+        return f'{parts.scheme}://{parts.netloc}/{bucket}', key
+    return None
+
+
+def head(url, mirror=None):
+    '''True if the object exists, False on 404/403; other errors are raised.'''
+    request = urllib.request.Request(mirror_url(url, mirror), method='HEAD')
+    try:
+        with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT_S):
+            return True
+    except urllib.error.HTTPError as e:
+        if e.code in (403, 404):
+            return False
+        raise
+
+
+def list_keys(bucket_url, prefix, mirror=None):
+    '''All keys under prefix in an S3/GCS bucket (ListObjectsV2), or None if the bucket cannot be listed.'''
+    keys = set()
+    token = None
+    try:
+        while True:
+            query = {'list-type': '2', 'prefix': prefix}
+            if token is not None:
+                query['continuation-token'] = token
+            url = mirror_url(bucket_url, mirror) + '?' + urllib.parse.urlencode(query)
+            with urllib.request.urlopen(url, timeout=HTTP_TIMEOUT_S) as response:
+                root = ET.fromstring(response.read())
+            if not root.tag.endswith('ListBucketResult'):
+                return None
+            ns = root.tag[:-len('ListBucketResult')]
+            keys.update(elem.text for elem in root.iter(ns + 'Key'))
+            token = root.findtext(ns + 'NextContinuationToken')
+            if root.findtext(ns + 'IsTruncated') != 'true' or not token:
+                return keys
+    except Exception:
+        return None
+
+
+class AvailabilityCache:
+    '''JSON file of {object: [available, checked_epoch]} with separate lifetimes for available and missing.'''
+
+    def __init__(self, cache_file=None):
+        self.cache_file = pathlib.Path(cache_file) if cache_file is not None else None
+        self.entries = {}
+        self.lock = threading.Lock()
+        if self.cache_file is not None and self.cache_file.is_file():
+            try:
+                self.entries = json.loads(self.cache_file.read_text())
+            except ValueError:
+                log.warning(f'WARNING: ignoring unreadable availability cache {self.cache_file}')
+
+    def get(self, obj, now=None):
+        entry = self.entries.get(obj)
+        if entry is None:
+            return None
+        available, checked = entry
+        ttl = AVAILABLE_TTL_S if available else MISSING_TTL_S
+        return available if (now or time.time()) - checked < ttl else None
+
+    def set(self, obj, available, now=None):
+        with self.lock:
+            self.entries[obj] = [bool(available), now or time.time()]
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_name('.' + self.cache_file.name + '.tmp')
+        tmp.write_text(json.dumps(self.entries))
+        os.replace(tmp, self.cache_file)
+
+
+def check_objects(objects, workers=16, cache=None, mirror=None):
+    '''
+    Availability of every object (URL or local path), checked concurrently.
+
+    Returns
+    -------
+    dict
+        {object: True | False | None}, None where the check itself failed (network error, timeout).
+    '''
+    cache = cache if cache is not None else AvailabilityCache()
+    result = {}
+    pending = []
+    local = []
+    for obj in dict.fromkeys(objects):
+        cached = cache.get(obj)
+        if cached is not None:
+            result[obj] = cached
+        elif '://' not in obj:
+            local.append(obj)
+        else:
+            pending.append(obj)
+    # GLADE files come from the RDA catalog: one listing per month instead of a metadata call per file
+    if local:
+        result.update(RdaCatalog().available(local))
+
+    # Directories with many required objects on a bucket are listed once instead of probed one by one
+    by_dir = {}
+    for obj in pending:
+        split = bucket_split(obj)
+        if split is not None:
+            by_dir.setdefault((split[0], split[1].rpartition('/')[0] + '/'), []).append((obj, split[1]))
+    listings = [(bucket_url, prefix, members) for (bucket_url, prefix), members in by_dir.items()
+                if len(members) >= LIST_MIN_OBJECTS]
+
+    def probe(obj):
+        try:
+            return obj, head(obj, mirror)
+        except Exception as e:
+            log.warning(f'WARNING: could not check {obj}: {e}')
+            return obj, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        listed = {}
+        futures = {pool.submit(list_keys, bucket_url, prefix, mirror): members for bucket_url, prefix, members in listings}
+        for future in concurrent.futures.as_completed(futures):
+            keys = future.result()
+            if keys is not None:
+                for obj, key in futures[future]:
+                    listed[obj] = key in keys
+        for obj, available in pool.map(probe, [obj for obj in pending if obj not in listed]):
+            result[obj] = available
+        result.update(listed)
+
+    for obj in pending:
+        if result[obj] is not None:
+            cache.set(obj, result[obj])
+    cache.save()
+    return result
+
+
+## Planning
+
+def plan_cycles(cycle_strs, icbc_model, icbc_source, sim_hrs, int_hrs, icbc_fc_dt=0, icbc_analysis=False,
+                hrrr_native=False, mem_id=None, max_fc_dt=None, workers=16, cache_file=None, mirror=None,
+                glade_root=None):
+    '''
+    Decide for each WRF cycle which IC/LBC cycle to use, checking every candidate object concurrently.
+
+    A cycle keeps icbc_fc_dt if all of its files are available. Otherwise, in forecast mode, older IC/LBC cycles
+    are tried one model cycle step at a time up to max_fc_dt, and the first complete one is used. A cycle with
+    no complete candidate is excluded. mem_id may be a list of GEFS members (an ensemble), in which case a cycle
+    needs the files of every member.
+
+    Returns
+    -------
+    dict
+        {cycle_str: {'icbc_fc_dt': int or None (excluded), 'missing': [objects missing for the requested
+        icbc_fc_dt], 'unknown': [objects that could not be checked]}}
+    '''
+    model = model_key(icbc_model)
+    step = CYCLE_STEP_H.get(model)
+    if max_fc_dt is None or icbc_analysis or step is None:
+        max_fc_dt = icbc_fc_dt
+    candidates = list(range(icbc_fc_dt, max_fc_dt + 1, step or 1))
+    cache = AvailabilityCache(cache_file)
+    mem_ids = mem_id if isinstance(mem_id, (list, tuple)) else [mem_id]
+
+    plan = {cycle_str: {'icbc_fc_dt': None, 'missing': [], 'unknown': []} for cycle_str in cycle_strs}
+    todo = list(cycle_strs)
+    for fc_dt in candidates:
+        if not todo:
+            break
+        needed = {cycle_str: [obj for member in mem_ids
+                              for obj in required_objects(cycle_str, icbc_model, icbc_source, sim_hrs, int_hrs, fc_dt,
+                                                          icbc_analysis, hrrr_native, member, glade_root)]
+                  for cycle_str in todo}
+        available = check_objects([obj for objs in needed.values() for obj in objs], workers, cache, mirror)
+        still_todo = []
+        for cycle_str, objs in needed.items():
+            missing = [obj for obj in objs if available[obj] is False]
+            unknown = [obj for obj in objs if available[obj] is None]
+            if fc_dt == icbc_fc_dt:
+                plan[cycle_str]['missing'] = missing
+                plan[cycle_str]['unknown'] = unknown
+            # A failed check is not proof the file is missing, so it does not hold a cycle back
+            if missing:
+                still_todo.append(cycle_str)
+            else:
+                plan[cycle_str]['icbc_fc_dt'] = fc_dt
+        todo = still_todo
+    return plan
+
+
+def summarize_plan(plan, icbc_fc_dt, log):
+    '''Log the plan and return the number of excluded cycles.'''
+    excluded = 0
+    for cycle_str, entry in plan.items():
+        if entry['icbc_fc_dt'] is None:
+            excluded += 1
+            log.warning(f'WARNING: cycle {cycle_str} excluded: {len(entry["missing"])} IC/LBC file(s) missing, '
+                        f'e.g. {entry["missing"][0]}')
+        elif entry['icbc_fc_dt'] != icbc_fc_dt:
+            log.warning(f'WARNING: cycle {cycle_str} rescheduled to icbc_fc_dt = {entry["icbc_fc_dt"]} '
+                        f'({len(entry["missing"])} file(s) missing with icbc_fc_dt = {icbc_fc_dt})')
+        if entry['unknown']:
+            log.warning(f'WARNING: cycle {cycle_str}: {len(entry["unknown"])} IC/LBC file(s) could not be checked')
+    log.info(f'IC/LBC pre-flight: {len(plan) - excluded} of {len(plan)} cycle(s) have their IC/LBC data')
+    return excluded
+
+
+def main(cycle_strs, icbc_model, icbc_source, sim_hrs, int_hrs, icbc_fc_dt, max_fc_dt, icbc_analysis, native_grid,
+         member, workers, cache_file, mirror, glade_root, out_file):
+    try:
+        plan = plan_cycles(cycle_strs, icbc_model, icbc_source, sim_hrs, int_hrs, icbc_fc_dt, icbc_analysis,
+                           native_grid, member, max_fc_dt, workers, cache_file, mirror, glade_root)
+    except ValueError as e:
+        log.error('ERROR: ' + str(e) + '. Exiting!')
+        sys.exit(1)
+    excluded = summarize_plan(plan, icbc_fc_dt, log)
+    if out_file is not None:
+        with open(out_file, 'w') as out:
+            json.dump(plan, out, indent=1)
+    if excluded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    now_time_beg = dt.datetime.now(dt.UTC)
+    main(*parse_args())
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
@@ -0,0 +1,289 @@
+'''
+iofields_util.py
+
+Generate a WRF iofields file that trims the history stream to what downstream consumers read.
+
+By default wrf.exe writes every Registry variable flagged for history (stream 0), a few hundred of them, to every
+wrfout file. Given a list of consumers, this module works out the variables they need, reads the default history
+list from the Registry of the WRF install, and writes the smallest set of edits
+  -:h:0:<default history variables nobody needs>
+  +:h:0:<needed variables that are not in the default history>
+to an iofields file, then points iofields_filename in namelist.input at it for every domain.
+
+Consumers are given as strings:
+  upp:<postxconfig file>  UPP: the fields its WRF reader always needs plus those behind every product requested
+                          in the postxconfig file (e.g. <upp_dir>/parm/postxconfig-NT-ipc.txt)
+  wildfire                the near-surface meteorology, fluxes and land-surface state used for wildfire features
+  vars:<file>             any variables listed in a text file (comma, space or newline separated)
+
+If a consumer asks for a UPP product this module does not know how to map to WRF variables, nothing is removed from
+the history stream (only additions are written), so a trimmed run can never starve UPP.
+'''
+
+import re
+import shlex
+import pathlib
+
+# Coordinates, map factors and vertical-grid constants every reader of wrfout relies on; never removed
+ALWAYS_KEEP = {
+    'XTIME', 'XLAT', 'XLONG', 'XLAT_U', 'XLONG_U', 'XLAT_V', 'XLONG_V', 'ZNU', 'ZNW', 'ZS', 'DZS', 'P_TOP',
+    'MAPFAC_M', 'MAPFAC_U', 'MAPFAC_V', 'MAPFAC_MX', 'MAPFAC_MY', 'MAPFAC_UX', 'MAPFAC_UY', 'MAPFAC_VX',
+    'MF_VX_INV', 'MAPFAC_VY', 'F', 'E', 'SINALPHA', 'COSALPHA', 'HGT', 'LU_INDEX', 'LANDMASK', 'XLAND',
+    'C1H', 'C2H', 'C3H', 'C4H', 'C1F', 'C2F', 'C3F', 'C4F', 'FNM', 'FNP', 'RDNW', 'RDN', 'DNW', 'DN',
+    'CFN', 'CFN1', 'RDX', 'RDY', 'CF1', 'CF2', 'CF3', 'ITIMESTEP', 'P00', 'T00', 'TLP', 'TISO', 'TLP_STRAT',
+    'P_STRAT', 'MAX_MSTFX', 'MAX_MSTFY', 'SAVE_TOPO_FROM_REAL',
+}
+
+# WRF variables UPP's WRF reader needs whatever products are asked for
+UPP_BASE = {
+    'U', 'V', 'W', 'T', 'P', 'PB', 'PH', 'PHB', 'QVAPOR', 'PSFC', 'HGT', 'XLAT', 'XLONG', 'MAPFAC_M',
+    'LANDMASK', 'XLAND', 'SST', 'TSK', 'IVGTYP', 'ISLTYP', 'VEGFRA', 'SEAICE', 'SNOW', 'SNOWH',
+}
+
+# WRF variables behind each UPP product (the part of the postxconfig shortname before _ON_)
+UPP_FIELD_VARS = {
+    'TMP': {'T', 'P', 'PB'}, 'POT': {'T'}, 'VIRTUAL_TMP': {'T', 'QVAPOR'},
+    'SPFH': {'QVAPOR', 'T', 'P', 'PB'}, 'RH': {'QVAPOR', 'T', 'P', 'PB'}, 'DPT': {'QVAPOR', 'T', 'P', 'PB'},
+    'UGRD': {'U', 'V'}, 'VGRD': {'U', 'V'}, 'VVEL': {'W', 'T', 'P', 'PB'}, 'DZDT': {'W'}, 'ABSV': {'U', 'V'},
+    'HGT': {'PH', 'PHB', 'HGT'}, 'PRES': {'P', 'PB', 'PSFC'},
+    'PRMSL': {'P', 'PB', 'PSFC', 'T', 'QVAPOR', 'PH', 'PHB'}, 'MSLET': {'P', 'PB', 'PSFC', 'T', 'QVAPOR', 'PH', 'PHB'},
+    'APCP': {'RAINC', 'RAINNC', 'RAINSH'}, 'ACPCP': {'RAINC', 'RAINSH'}, 'NCPCP': {'RAINNC'},
+    'PRATE': {'RAINC', 'RAINNC', 'RAINSH'}, 'WEASD': {'SNOW'}, 'SNOD': {'SNOWH'}, 'ASNOW': {'SNOWNC'},
+    'FROZR': {'SNOWNC', 'GRAUPELNC'}, 'CSNOW': {'SNOWNC'}, 'CRAIN': {'RAINNC'},
+    'REFD': {'REFL_10CM'}, 'REFC': {'REFL_10CM'}, 'MAXREF': {'REFL_10CM'}, 'RETOP': {'REFL_10CM', 'PH', 'PHB'},
+    'CLMR': {'QCLOUD'}, 'ICMR': {'QICE'}, 'RWMR': {'QRAIN'}, 'SNMR': {'QSNOW'}, 'GRLE': {'QGRAUP'},
+    'TCDC': {'CLDFRA', 'QCLOUD', 'QICE'}, 'LCDC': {'CLDFRA'}, 'MCDC': {'CLDFRA'}, 'HCDC': {'CLDFRA'},
+    'TCOLW': {'QCLOUD'}, 'TCOLI': {'QICE'}, 'TCOLR': {'QRAIN'}, 'TCOLS': {'QSNOW'},
+    'DSWRF': {'SWDOWN'}, 'USWRF': {'SWDOWN', 'ALBEDO'}, 'DLWRF': {'GLW'}, 'ULWRF': {'OLR', 'TSK', 'EMISS'},
+    'SHTFL': {'HFX'}, 'LHTFL': {'LH'}, 'GFLUX': {'GRDFLX'}, 'HPBL': {'PBLH'}, 'FRICV': {'UST'}, 'SFCR': {'ZNT'},
+    'CAPE': {'T', 'P', 'PB', 'QVAPOR', 'PH', 'PHB'}, 'CIN': {'T', 'P', 'PB', 'QVAPOR', 'PH', 'PHB'},
+    'PLI': {'T', 'P', 'PB', 'QVAPOR'}, 'LFTX': {'T', 'P', 'PB', 'QVAPOR'}, '4LFTX': {'T', 'P', 'PB', 'QVAPOR'},
+    'PWAT': {'QVAPOR', 'P', 'PB', 'PSFC'}, 'HLCY': {'U', 'V', 'PH', 'PHB'}, 'USTM': {'U', 'V', 'PH', 'PHB'},
+    'VSTM': {'U', 'V', 'PH', 'PHB'}, 'VUCSH': {'U', 'V', 'PH', 'PHB'}, 'VVCSH': {'U', 'V', 'PH', 'PHB'},
+    'VIS': {'QCLOUD', 'QRAIN', 'QICE', 'QSNOW', 'QVAPOR', 'T', 'P', 'PB'}, 'GUST': {'U', 'V', 'PBLH'},
+    'SOILW': {'SMOIS'}, 'SOILL': {'SH2O'}, 'TSOIL': {'TSLB'}, 'SOILM': {'SMOIS'}, 'LAND': {'LANDMASK'},
+    'ICEC': {'SEAICE'}, 'VEG': {'VEGFRA'}, 'ALBDO': {'ALBEDO'}, 'SSRUN': {'SFROFF'}, 'BGRUN': {'UDROFF'},
+    'CNWAT': {'CANWAT'}, 'LAI': {'LAI'}, 'EMIS': {'EMISS'}, 'MXUPHL': {'W', 'U', 'V', 'PH', 'PHB'},
+    'UPHL': {'W', 'U', 'V', 'PH', 'PHB'}, 'CPOFP': {'RAINNC', 'SNOWNC', 'GRAUPELNC'},
+}
+
+# Level-specific products that come from WRF's diagnosed 2-m/10-m fields or its surface fields
+UPP_LEVEL_VARS = {
+    ('TMP', 'SPEC_HGT_LVL_ABOVE_GRND_2m'): {'T2', 'TH2', 'PSFC'},
+    ('SPFH', 'SPEC_HGT_LVL_ABOVE_GRND_2m'): {'Q2', 'PSFC'},
+    ('RH', 'SPEC_HGT_LVL_ABOVE_GRND_2m'): {'T2', 'Q2', 'PSFC'},
+    ('DPT', 'SPEC_HGT_LVL_ABOVE_GRND_2m'): {'T2', 'Q2', 'PSFC'},
+    ('POT', 'SPEC_HGT_LVL_ABOVE_GRND_2m'): {'TH2', 'T2', 'PSFC'},
+    ('UGRD', 'SPEC_HGT_LVL_ABOVE_GRND_10m'): {'U10', 'V10'},
+    ('VGRD', 'SPEC_HGT_LVL_ABOVE_GRND_10m'): {'U10', 'V10'},
+    ('TMP', 'SURFACE'): {'TSK'},
+    ('PRES', 'SURFACE'): {'PSFC'},
+    ('HGT', 'SURFACE'): {'HGT'},
+}
+
+# Near-surface weather, fluxes and fuel/land-surface state for the wildfire feature set
+WILDFIRE_VARS = {
+    'T2', 'Q2', 'TH2', 'PSFC', 'U10', 'V10', 'RAINC', 'RAINNC', 'RAINSH', 'SWDOWN', 'GLW', 'HFX', 'LH', 'PBLH',
+    'TSK', 'SMOIS', 'SH2O', 'TSLB', 'VEGFRA', 'LAI', 'ZNT', 'UST', 'CANWAT', 'HGT', 'XLAT', 'XLONG', 'LANDMASK',
+    'XLAND', 'IVGTYP', 'ISLTYP',
+}
+
+# Longest line written to the iofields file; longer edits are split over several lines
+MAX_LINE = 200
+
+
+def _io_streams(io, letter):
+    '''Stream numbers a Registry I/O spec (e.g. "i01rhd=(interp)u" or "h{23}") assigns to input or history.'''
+    io = io.split('=')[0]
+    streams = set()
+    for match in re.finditer(letter + r'((?:\d|\{\d+\})*)', io):
+        digits = match.group(1)
+        if not digits:
+            streams.add(0)
+        for group in re.findall(r'\{(\d+)\}|(\d)', digits):
+            streams.add(int(group[0] or group[1]))
+    return streams
+
+
+def registry_history(wrf_dir, stream=0):
+    '''
+    Names of every variable the Registry of a WRF install writes to history stream `stream` by default,
+    following "include" lines. Returns None if the install has no Registry.
+    '''
+    registry_dir = pathlib.Path(wrf_dir).joinpath('Registry')
+    top = registry_dir.joinpath('Registry')
+    if not top.is_file():
+        top = registry_dir.joinpath('Registry.EM')
+    if not top.is_file():
+        return None
+
+    names = set()
+    seen = set()
+
+    def read(registry_file):
+        if registry_file in seen or not registry_file.is_file():
+            return
+        seen.add(registry_file)
+        text = registry_file.read_text(errors='replace').replace('\\\n', ' ')
+        for line in text.splitlines():
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if line.startswith('include'):
+                read(registry_dir.joinpath(line.split()[1]))
+                continue
+            if not line.startswith('state'):
+                continue
+            try:
+                fields = shlex.split(line)
+            except ValueError:
+                continue
+            if len(fields) < 9:
+                continue
+            if stream in _io_streams(fields[7], 'h'):
+                dname = fields[8].strip('"')
+                names.add((fields[2] if dname in ['', '-'] else dname).upper())
+
+    read(top)
+    return names
+
+
+def upp_vars(postxconfig_file):
+    '''
+    WRF variables UPP needs for the products in a postxconfig file, and the product names it could not map.
+    '''
+    needed = set(UPP_BASE)
+    unknown = set()
+    with open(postxconfig_file, errors='replace') as f:
+        for line in f:
+            match = re.fullmatch(r'([A-Z0-9]+(?:_[A-Z0-9]+)*?)_ON_(\w+)', line.strip())
+            if not match:
+                continue
+            field, level = match.group(1), match.group(2)
+            if (field, level) in UPP_LEVEL_VARS:
+                needed |= UPP_LEVEL_VARS[(field, level)]
+            elif field in UPP_FIELD_VARS:
+                needed |= UPP_FIELD_VARS[field]
+            else:
+                unknown.add(match.group(0))
+    return needed, unknown
+
+
+def consumer_vars(consumers):
+    '''
+    Union of the WRF variables needed by a list of consumer strings (see the module docstring), and the UPP
+    products that could not be mapped.
+    '''
+    needed = set()
+    unknown = set()
+    for consumer in consumers:
+        kind, _, arg = consumer.strip().partition(':')
+        if kind == 'upp':
+            if not arg:
+                raise ValueError('The upp consumer needs a postxconfig file, e.g. upp:/path/to/postxconfig-NT.txt')
+            upp_needed, upp_unknown = upp_vars(arg)
+            needed |= upp_needed
+            unknown |= upp_unknown
+        elif kind == 'wildfire':
+            needed |= WILDFIRE_VARS
+        elif kind == 'vars':
+            needed |= {var.upper() for var in re.split(r'[\s,]+', pathlib.Path(arg).read_text()) if var}
+        else:
+            raise ValueError(f'Unknown iofields consumer {consumer}; use upp:<postxconfig>, wildfire or vars:<file>')
+    return needed, unknown
+
+
+def iofields_edits(needed, default, stream=0, trim=True):
+    '''
+    The iofields lines that turn the default history list into `needed` (plus ALWAYS_KEEP), split to MAX_LINE.
+    With trim=False only the additions are written.
+    '''
+    remove = sorted(default - needed - ALWAYS_KEEP) if trim else []
+    add = sorted(needed - default)
+    lines = []
+    for op, names in [('-', remove), ('+', add)]:
+        prefix = f'{op}:h:{stream}:'
+        line = ''
+        for name in names:
+            if line and len(prefix) + len(line) + len(name) + 1 > MAX_LINE:
+                lines.append(prefix + line)
+                line = ''
+            line = line + ',' + name if line else name
+        if line:
+            lines.append(prefix + line)
+    return lines, remove, add
+
+
+def write_iofields(nml_file, iofields_file, consumers, wrf_dir, log):
+    '''
+    Generate iofields_file for a list of consumers and point every domain's iofields_filename at it. Lines of an
+    iofields file the namelist already names (e.g. edits to auxiliary streams) are kept after the generated ones.
+    Call from the run directory once namelist.input and any template iofields file are in place.
+    '''
+    needed, unknown = consumer_vars(consumers)
+    default = registry_history(wrf_dir)
+    trim = True
+    if default is None:
+        log.warning(f'WARNING: no Registry found under {wrf_dir}; history variables can be added but not removed')
+        default = set()
+        trim = False
+    if unknown:
+        log.warning('WARNING: no WRF variables known for UPP product(s) ' + ', '.join(sorted(unknown)) +
+                    '; keeping the full history stream')
+        trim = False
+    lines, remove, add = iofields_edits(needed, default, trim=trim)
+
+    with open(nml_file) as in_file:
+        nml_lines = in_file.readlines()
+    max_dom = 1
+    kept = []
+    for line in nml_lines:
+        key = line.split('=')[0].strip()
+        if key == 'max_dom':
+            max_dom = int(line.split('=')[1].strip().split(',')[0])
+        elif key == 'iofields_filename':
+            for name in line.split('=')[1].strip().split(','):
+                name = name.strip().strip('"\'')
+                if name and name != iofields_file and pathlib.Path(name).is_file():
+                    with open(name) as io_file:
+                        kept += [l.rstrip('\n') for l in io_file if l.strip() and l.rstrip('\n') not in kept]
+
+    with open(iofields_file, 'w') as out_file:
+        for line in lines + kept:
+            out_file.write(line + '\n')
+
+    entries = {'iofields_filename': ', '.join([f'"{iofields_file}"'] * max_dom) + ',',
+               'ignore_iofields_warning': '.true.,'}
+    with open(nml_file, 'w') as out_file:
+        for line in nml_lines:
+            key = line.split('=')[0].strip()
+            if key in entries:
+                out_file.write(f' {key:<35} = {entries.pop(key)}\n')
+            else:
+                out_file.write(line)
+                if line.strip().lower() == '&time_control':
+                    # Placed at the top of &time_control if the template has neither entry
+                    for new_key in [k for k in ['iofields_filename', 'ignore_iofields_warning']
+                                    if not any(l.split('=')[0].strip() == k for l in nml_lines)]:
+                        out_file.write(f' {new_key:<35} = {entries.pop(new_key)}\n')
+
+    log.info(f'iofields for {", ".join(consumers)}: removing {len(remove)} and adding {len(add)} history '
+             f'variables ({len(needed | ALWAYS_KEEP)} needed) in {iofields_file}')
+    return remove, add
+
+
+if __name__ == '__main__':
+    # Print the iofields edits for a set of consumers without touching any namelist
+    import argparse
+    parser = argparse.ArgumentParser(description='Print the WRF iofields edits that trim history output to what consumers need.')
+    parser.add_argument('wrf_dir', help='WRF install directory (its Registry gives the default history variables)')
+    parser.add_argument('consumers', nargs='+', help='upp:<postxconfig file>, wildfire, or vars:<file>')
+    args = parser.parse_args()
+
+    needed, unknown = consumer_vars(args.consumers)
+    default = registry_history(args.wrf_dir) or set()
+    lines, remove, add = iofields_edits(needed, default, trim=not unknown and bool(default))
+    for line in lines:
+        print(line)
+    if unknown:
+        print('# unmapped UPP products (nothing removed): ' + ', '.join(sorted(unknown)))
@@ -8,6 +8,7 @@ Created on: 4 Feb 2025
 
 This script links to GFS FNL 0.25-deg output files stored on GLADE at NSF NCAR for the requested times for ICs/LBCs.
 For every 6-hourly GFS cycle, GFS FNL files are stored every 3 hours for 0–9 hour lead times.
+Availability comes from the cached RDA catalog (rda_catalog.py) in one lookup, and the links are made in-process.
 """
 
 import os
@@ -18,7 +19,8 @@ import datetime as dt
 import numpy as np
 import pandas as pd
 import logging
-from proc_util import exec_command
+from grib_store import register_files
+from rda_catalog import RdaCatalog, link_files
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s', level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
@@ -105,16 +107,15 @@ def main(cycle_dt_str, sim_hrs, out_dir_parent, now_time_beg, interval):
     glade_dir_parent = pathlib.Path('/', 'glade', 'campaign', 'collections', 'rda', 'data', 'd083003')
     # glade_dir = glade_dir_parent.joinpath(cycle_year, cycle_date)
 
-    # Loop over valid times
+    # Build the list of GFS FNL files for all valid times
+    links = []
     for vv in range(n_valid):
         this_valid = valid_dt[vv]
         this_date = this_valid.strftime(fmt_yyyymmdd)
         this_hh = this_valid.strftime(fmt_hh)
 
-        # Download GFS FNL files into date-specific directories
+        # Link GFS FNL files into date-specific directories
         out_dir = out_dir_parent.joinpath('gfs_fnl.' + this_date)
-        out_dir.mkdir(parents=True, exist_ok=True)
-        os.chdir(out_dir)
 
         # Always grab either the f00 or f03 files for GFS FNL
         if this_hh in ['00', '06', '12', '18']:
@@ -137,19 +138,23 @@ def main(cycle_dt_str, sim_hrs, out_dir_parent, now_time_beg, interval):
 
         # Set the GFS FNL filename on GLADE (likely different in other data repos)
         glade_fname = 'gdas1.fnl0p25.' + this_cycle_datehh + '.f' + this_lead + '.grib2'
-        glade_file = glade_dir.joinpath(glade_fname)
-
-        # First, check for the file's existence on GLADE
-        if not glade_file.is_file():
-            log.info('WARNING: File ' + str(glade_file) + ' does not exist. Looping to the next expected IC/LBC time.')
-            continue
+        links.append((glade_dir.joinpath(glade_fname), out_dir.joinpath(glade_fname)))
+
+    # First, check for the files' existence on GLADE, all valid times at once
+    available = RdaCatalog().available([glade_file for glade_file, link in links])
+    missing = [str(glade_file) for glade_file, link in links if not available[str(glade_file)]]
+    if missing:
+        for glade_file in missing:
+            log.error('ERROR: File ' + glade_file + ' does not exist.')
+        log.error('ERROR: ' + str(len(missing)) + ' of ' + str(n_valid) + ' GFS FNL file(s) missing from ' +
+                  str(glade_dir_parent) + '. Exiting!')
+        sys.exit(1)
 
-        # Second, check for the existence of the link/file where ungrib will expect to find it
-        if not out_dir.joinpath(glade_fname).is_file():
-            log.info('Linking to ' + str(glade_file) + ' in ' + str(out_dir))
-            ret,output = exec_command(['ln', '-sf', str(glade_dir.joinpath(glade_fname)), '.'], log)
-        else:
-            log.info('   File ' + glade_fname + ' already exists locally. No need to re-link to it on GLADE.')
+    # Second, link to every file not already where ungrib will expect to find it
+    created = link_files(links)
+    log.info('Linked ' + str(len(created)) + ' GFS FNL file(s) in ' + str(out_dir_parent) + ', ' +
+             str(len(links) - len(created)) + ' already present locally')
+    register_files([link for glade_file, link in links])
 
 
 
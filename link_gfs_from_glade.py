@@ -8,6 +8,7 @@ Created on: 13 Dec 2024
 
 This script links to GFS 0.25-deg forecast output files stored on GLADE at NSF NCAR for the requested
 cycle(s) and lead times. Note that these files are stored every 3 h on GLADE, unlike AWS (1-hourly files).
+Availability comes from the cached RDA catalog (rda_catalog.py) in one lookup, and the links are made in-process.
 """
 
 import os
@@ -18,7 +19,8 @@ import datetime as dt
 import numpy as np
 import pandas as pd
 import logging
-from proc_util import exec_command
+from grib_store import register_files
+from rda_catalog import RdaCatalog, link_files
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s', level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
@@ -96,26 +98,25 @@ def main(cycle_dt_str, sim_hrs, out_dir, icbc_fc_dt, resolution, now_time_beg, i
     out_dir.mkdir(parents=True, exist_ok=True)
     os.chdir(out_dir)
 
-    # Loop over lead times
-    for ll in range(n_leads):
-        this_lead = str(leads[ll]).zfill(3)
-
-        # Note that the filenames for 0.25-deg GFS files on GLADE and AWS differ...
-        fname_glade = 'gfs.0p25.' + cycle_datehh + '.f' + this_lead + '.grib2'
-        fname_aws = 'gfs.t' + cycle_hour + 'z.pgrb2.0p25.f' + this_lead
-        glade_file = glade_dir.joinpath(fname_glade)
-
-        # First, check for the file's existence on GLADE
-        if not glade_file.is_file():
-            log.info('WARNING: File ' + str(glade_file) + ' does not exist. Looping to the next expected IC/LBC time.')
-            continue
-
-        # Second, check for the existence of the link/file where ungrib will expect to find it
-        if not out_dir.joinpath(fname_glade).is_file():
-            log.info('Linking to ' + str(glade_file) + ' in ' + str(out_dir))
-            ret,output = exec_command(['ln', '-sf', str(glade_dir.joinpath(fname_glade)), '.'], log)
-        else:
-            log.info('   File ' + fname_glade + ' already exists locally. No need to re-link to it on GLADE.')
+    # Note that the filenames for 0.25-deg GFS files on GLADE and AWS differ...
+    fnames_glade = ['gfs.0p25.' + cycle_datehh + '.f' + str(lead).zfill(3) + '.grib2' for lead in leads]
+
+    # First, check for the files' existence on GLADE, all lead times at once
+    available = RdaCatalog().available([glade_dir.joinpath(fname) for fname in fnames_glade])
+    links = [(glade_dir.joinpath(fname), out_dir.joinpath(fname)) for fname in fnames_glade]
+    missing = [str(glade_file) for glade_file, link in links if not available[str(glade_file)]]
+    if missing:
+        for glade_file in missing:
+            log.error('ERROR: File ' + glade_file + ' does not exist.')
+        log.error('ERROR: ' + str(len(missing)) + ' of ' + str(n_leads) + ' GFS file(s) missing from ' + str(glade_dir) +
+                  '. Exiting!')
+        sys.exit(1)
+
+    # Second, link to every file not already where ungrib will expect to find it
+    created = link_files(links)
+    log.info('Linked ' + str(len(created)) + ' file(s) from ' + str(glade_dir) + ' in ' + str(out_dir) + ', ' +
+             str(len(links) - len(created)) + ' already present locally')
+    register_files([link for target, link in links])
 
 
 
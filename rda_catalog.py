@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+'''
+rda_catalog.py
+
+Cached index of the NSF NCAR RDA collections on GLADE that the workflow links to:
+  d084001  GFS 0.25-deg forecasts  <year>/<yyyymmdd>/gfs.0p25.<yyyymmddhh>.f<lll>.grib2
+  d083003  GFS FNL 0.25-deg        <year>/<yyyymm>/gdas1.fnl0p25.<yyyymmddhh>.f<ll>.grib2
+
+Every metadata round-trip to campaign storage is slow, and a sweep of cycles probes thousands of files one
+is_file() at a time. Here the listing of a <year> directory and of its <yyyymm*> subdirectories (one month) is read
+once and kept in a JSON index file; a file's availability is then a set lookup. Each listing is stored with the
+directory's modification time and re-read only when that changes (adding or removing an entry updates it), so
+checking a month again costs one stat per directory instead of one per file. available() groups any number of
+paths by month and answers them together; link_files() creates the symlinks in-process.
+
+The index file is $WPS_WRF_RDA_CATALOG (setup_wps_wrf.py sets it from rda_catalog in its yaml), or
+~/.cache/wps_wrf/rda_catalog.json.
+
+    python rda_catalog.py /glade/campaign/collections/rda/data/d084001/2024/20240801/gfs.0p25.2024080100.f0*.grib2
+'''
+
+import os
+import json
+import pathlib
+import argparse
+import logging
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+RDA_ROOT = pathlib.Path('/', 'glade', 'campaign', 'collections', 'rda', 'data')
+CATALOG_ENV = 'WPS_WRF_RDA_CATALOG'
+DEFAULT_INDEX = pathlib.Path('~', '.cache', 'wps_wrf', 'rda_catalog.json')
+
+
+def index_file():
+    return pathlib.Path(os.environ.get(CATALOG_ENV) or DEFAULT_INDEX).expanduser()
+
+
+class RdaCatalog:
+    '''
+    Directory listings of <year>/<yyyymm*> months, validated against directory modification times.
+
+    The index maps a year directory to {'mtime', 'subdirs', 'leaves': {subdir: {'mtime', 'files'}}}. Within one
+    process a month is validated only once.
+    '''
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path) if path is not None else index_file()
+        self.index = {}
+        self.dirty = False
+        self._months = {}
+        try:
+            with open(self.path) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log.warning(f'WARNING: ignoring unreadable RDA catalog {self.path}: {e}')
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            st = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return st.st_mtime_ns
+
+    def month(self, year_dir, yyyymm):
+        '''{subdir name: set of file names} for the subdirectories of year_dir whose names start with yyyymm.'''
+        year_dir = pathlib.Path(year_dir)
+        memo_key = (str(year_dir), yyyymm)
+        if memo_key in self._months:
+            return self._months[memo_key]
+
+        entry = self.index.setdefault(str(year_dir), {'mtime': None, 'subdirs': [], 'leaves': {}})
+        mtime = self._mtime(year_dir)
+        if mtime is None:
+            self._months[memo_key] = {}
+            return {}
+        if entry['mtime'] != mtime:
+            entry['subdirs'] = sorted(os.listdir(year_dir))
+            entry['mtime'] = mtime
+            self.dirty = True
+
+        listing = {}
+        for sub in entry['subdirs']:
+            if not sub.startswith(yyyymm):
+                continue
+            leaf_mtime = self._mtime(year_dir.joinpath(sub))
+            if leaf_mtime is None:
+                continue
+            leaf = entry['leaves'].get(sub)
+            if leaf is None or leaf['mtime'] != leaf_mtime:
+                leaf = {'mtime': leaf_mtime, 'files': sorted(os.listdir(year_dir.joinpath(sub)))}
+                entry['leaves'][sub] = leaf
+                self.dirty = True
+            listing[sub] = set(leaf['files'])
+        self._months[memo_key] = listing
+        return listing
+
+    def available(self, paths):
+        '''
+        {path: bool} for files laid out as <year dir>/<yyyymm...>/<file>. Paths are grouped by month, so each
+        month is listed (or validated) once however many of its files are asked about.
+        '''
+        result = {}
+        for path in dict.fromkeys(str(p) for p in paths):
+            p = pathlib.Path(path)
+            leaf = p.parent
+            listing = self.month(leaf.parent, leaf.name[:6])
+            result[path] = p.name in listing.get(leaf.name, ())
+        self.save()
+        return result
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path.with_name(self.path.name + f'.{os.getpid()}.tmp')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(self.index))
+            # Atomic, so concurrent runs never read a partial index; the last writer wins
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # An unwritable catalog only costs re-listing the directories next time
+            log.info(f'Not saving RDA catalog {self.path}: {e}')
+            return
+        self.dirty = False
+
+
+def link_files(links):
+    '''
+    Create symlinks in-process for (target, link path) pairs, like ln -sf but leaving existing files and links
+    that already resolve alone. Returns the link paths created.
+    '''
+    created = []
+    for target, link in links:
+        link = pathlib.Path(link)
+        if link.is_file():
+            continue
+        link.parent.mkdir(parents=True, exist_ok=True)
+        tmp = link.with_name(link.name + f'.{os.getpid()}.lnk')
+        if tmp.is_symlink():
+            tmp.unlink()
+        os.symlink(target, tmp)
+        os.replace(tmp, link)
+        created.append(link)
+    return created
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Check RDA files on GLADE against the cached catalog.')
+    parser.add_argument('files', nargs='+', help='RDA file paths')
+    parser.add_argument('-C', '--catalog', default=None, help=f'index file (default: ${CATALOG_ENV} or {DEFAULT_INDEX})')
+    args = parser.parse_args()
+    return args.files, args.catalog
+
+
+def main(files, catalog):
+    available = RdaCatalog(catalog).available(files)
+    for path, ok in available.items():
+        if not ok:
+            log.info('missing: ' + path)
+    log.info(f'{sum(available.values())} of {len(available)} file(s) available')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    main(*parse_args())
@@ -0,0 +1,171 @@
+'''
+rsl_util.py
+
+Streaming parser for the rsl.out.0000 file of a running wrf.exe.
+
+Every model step on every domain wrf.exe writes a line such as
+  Timing for main: time 2024-08-01_00:00:06 on domain   1:    0.41234 elapsed seconds
+and every output or input operation one such as
+  Timing for Writing wrfout_d01_2024-08-01_01:00:00 for domain        1:    1.23456 elapsed seconds
+  Timing for processing lateral boundary for domain        1:    0.54321 elapsed seconds
+
+RslMonitor tails the file (reading only what was appended since the last call) and keeps:
+  - the model time reached on domain 1,
+  - speed: simulated seconds per wall-clock second since the run started,
+  - io_fraction: share of the timed work spent writing/reading files rather than integrating,
+  - eta: estimated wall-clock time to reach the end of the simulation at the speed so far,
+  - stall detection: wall-clock time since the domain 1 model time last advanced.
+'''
+
+import os
+import re
+import json
+import time
+import datetime as dt
+
+fmt_wrf_dt = '%Y-%m-%d_%H:%M:%S'
+
+MAIN_PATTERN = re.compile(r'Timing for main: time (\S+) on domain\s+(\d+):\s+([0-9.]+) elapsed seconds')
+IO_PATTERN = re.compile(r'Timing for (?:Writing|processing)\b.*?for domain\s+(\d+):\s+([0-9.]+) elapsed seconds')
+SUCCESS_PATTERN = 'SUCCESS COMPLETE WRF'
+
+
+class RslMonitor:
+    def __init__(self, rsl_file, beg_dt, end_dt, run_beg=None):
+        self.rsl_file = rsl_file
+        self.beg_dt = beg_dt
+        self.end_dt = end_dt
+        self.run_beg = time.time() if run_beg is None else run_beg
+        self.offset = 0
+        self.partial = ''
+        self.model_dt = None
+        self.main_s = 0.0
+        self.io_s = 0.0
+        self.steps = 0
+        self.success = False
+        self.last_advance = self.run_beg
+        self.wall_end = None
+
+    def update(self):
+        '''Parse whatever has been appended to the rsl file since the last call.'''
+        try:
+            with open(self.rsl_file, 'r', errors='replace') as f:
+                # Start over if the file was replaced by a new, shorter one (e.g. a resubmitted job)
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    self.offset = 0
+                    self.partial = ''
+                f.seek(self.offset)
+                chunk = f.read()
+                self.offset = f.tell()
+        except FileNotFoundError:
+            return self
+        lines = (self.partial + chunk).split('\n')
+        # Keep an unterminated last line for the next call
+        self.partial = lines.pop()
+        for line in lines:
+            self._parse(line)
+        return self
+
+    def _parse(self, line):
+        match = MAIN_PATTERN.search(line)
+        if match:
+            self.main_s += float(match.group(3))
+            self.steps += 1
+            if int(match.group(2)) == 1:
+                try:
+                    model_dt = dt.datetime.strptime(match.group(1), fmt_wrf_dt)
+                except ValueError:
+                    return
+                if self.model_dt is None or model_dt > self.model_dt:
+                    self.model_dt = model_dt
+                    self.last_advance = time.time()
+            return
+        match = IO_PATTERN.search(line)
+        if match:
+            self.io_s += float(match.group(2))
+            return
+        if SUCCESS_PATTERN in line:
+            self.success = True
+            self.wall_end = time.time()
+
+    @property
+    def simulated_s(self):
+        if self.model_dt is None:
+            return 0.0
+        return (self.model_dt - self.beg_dt).total_seconds()
+
+    @property
+    def speed(self):
+        '''Simulated seconds per wall-clock second since the run started.'''
+        wall_s = (self.wall_end or time.time()) - self.run_beg
+        return self.simulated_s / wall_s if wall_s > 0 else 0.0
+
+    @property
+    def io_fraction(self):
+        timed_s = self.main_s + self.io_s
+        return self.io_s / timed_s if timed_s > 0 else 0.0
+
+    @property
+    def eta_s(self):
+        speed = self.speed
+        if speed <= 0:
+            return None
+        remaining_s = (self.end_dt - self.beg_dt).total_seconds() - self.simulated_s
+        return max(remaining_s, 0.0) / speed
+
+    @property
+    def stalled_s(self):
+        '''Wall-clock seconds since the domain 1 model time last advanced.'''
+        return time.time() - self.last_advance
+
+    def status(self):
+        eta_s = self.eta_s
+        return {
+            'model_time': self.model_dt.strftime(fmt_wrf_dt) if self.model_dt is not None else None,
+            'end_time': self.end_dt.strftime(fmt_wrf_dt),
+            'percent_complete': round(100.0 * self.simulated_s / max((self.end_dt - self.beg_dt).total_seconds(), 1), 1),
+            'speed': round(self.speed, 2),
+            'io_fraction': round(self.io_fraction, 3),
+            'eta': (dt.datetime.now() + dt.timedelta(seconds=eta_s)).strftime(fmt_wrf_dt) if eta_s is not None else None,
+            'eta_s': round(eta_s) if eta_s is not None else None,
+            'stalled_s': round(self.stalled_s),
+            'steps': self.steps,
+            'success': self.success,
+            'updated': dt.datetime.now().strftime(fmt_wrf_dt),
+        }
+
+    def summary(self):
+        status = self.status()
+        eta = 'unknown' if status['eta_s'] is None else str(dt.timedelta(seconds=status['eta_s']))
+        return (f"model time {status['model_time']} ({status['percent_complete']}%), "
+                f"speed {status['speed']}x real time, I/O {100 * status['io_fraction']:.1f}% of timed work, ETA {eta}")
+
+    def write_status(self, status_file, **extra):
+        '''Write the current status as JSON, atomically so a reader never sees a partial file.'''
+        tmp_file = str(status_file) + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({**self.status(), **extra}, f, indent=2)
+        os.replace(tmp_file, status_file)
+
+
+if __name__ == '__main__':
+    # Report progress of a (running or finished) WRF run from its rsl.out.0000 and namelist.input
+    import argparse
+    import f90nml
+    parser = argparse.ArgumentParser(description='Report speed, I/O fraction and ETA of a WRF run from rsl.out.0000.')
+    parser.add_argument('run_dir', nargs='?', default='.', help='WRF run directory (default: .)')
+    args = parser.parse_args()
+
+    time_control = f90nml.read(os.path.join(args.run_dir, 'namelist.input'))['time_control']
+
+    def nml_dt(prefix):
+        values = [time_control[prefix + key] for key in ['year', 'month', 'day', 'hour', 'minute']]
+        return dt.datetime(*[v[0] if isinstance(v, list) else v for v in values])
+
+    rsl_file = os.path.join(args.run_dir, 'rsl.out.0000')
+    beg_file = os.path.join(args.run_dir, 'WRF_BEG')
+    run_beg = os.stat(beg_file).st_mtime if os.path.isfile(beg_file) else os.stat(rsl_file).st_ctime
+    monitor = RslMonitor(rsl_file, nml_dt('start_'), nml_dt('end_'), run_beg).update()
+    if monitor.success:
+        monitor.wall_end = os.stat(rsl_file).st_mtime
+    print(json.dumps(monitor.status(), indent=2))
@@ -7,6 +7,7 @@ Created by: Jared A. Lee (jaredlee@ucar.edu)
 Created on: 21 Feb 2025
 
 This script is designed to run avg_tsfc.exe and wait for its completion.
+With -p, TAVGSFC is instead computed in-process from the ungrib output by tavgsfc.py (no namelist or executable).
 '''
 
 import os
@@ -22,6 +23,7 @@ import logging
 
 from proc_util import exec_command
 from wps_wrf_util import search_file
+from trace_util import span
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -53,6 +55,8 @@ def parse_args():
                         help='string for filename of namelist template (default: namelist.wps.[icbc_model])')
     parser.add_argument('-v', '--hrrr_native', action='store_true',
                         help='If flag present, then use HRRR native-grid data for atmospheric variables')
+    parser.add_argument('-p', '--python', action='store_true',
+                        help='If flag present, compute TAVGSFC with tavgsfc.py instead of avg_tsfc.exe')
 
     args = parser.parse_args()
     cycle_dt_beg = args.cycle_dt_beg
@@ -64,23 +68,26 @@ def parse_args():
     icbc_model = args.icbc_model
     nml_tmp = args.nml_tmp
     hrrr_native = args.hrrr_native
+    python = args.python
 
     if len(cycle_dt_beg) != 11 or cycle_dt_beg[8] != '_':
         log.error('ERROR! Incorrect format for argument cycle_dt_beg in call to run_metgrid.py. Exiting!')
         parser.print_help()
         sys.exit(1)
 
-    if sim_hrs < 24:
+    if sim_hrs < 24 and not python:
         log.error('ERROR! sim_hrs = ' + str(sim_hrs) + ', but must be at least 24 to run avg_tsfc.exe.')
         log.error('Exiting!')
         sys.exit(1)
 
-    if sim_hrs % 24 != 0:
+    if sim_hrs % 24 != 0 and not python:
         log.info('WARNING: sim_hrs = ' + str(sim_hrs) + ', but avg_tsfc.exe will only process full 24-h periods.')
         log.info('         The last ' + str(sim_hrs % 24) + ' of this simulation will be ignored by avg_tsfc.exe.')
 
     if wps_dir is not None:
         wps_dir = pathlib.Path(wps_dir)
+    elif python:
+        wps_dir = None
     else:
         log.error('ERROR! wps_dir not specified as an argument in call to run_avg_tsfc.py. Exiting!')
         sys.exit(1)
@@ -99,6 +106,8 @@ def parse_args():
 
     if tmp_dir is not None:
         tmp_dir = pathlib.Path(tmp_dir)
+    elif python:
+        tmp_dir = None
     else:
         log.error('ERROR! tmp_dir is not specified as an argument in call to run_avg_tsfc.py. Exiting!')
         sys.exit(1)
@@ -107,9 +116,28 @@ def parse_args():
         ## Make a default assumption about what namelist template we want to use
         nml_tmp = 'namelist.wps.'+icbc_model.lower()
 
-    return (cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native)
+    return (cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native, python)
 
-def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native):
+def main_python(cycle_dt, end_dt, run_dir, ungrib_dir, prefixes):
+    '''Compute TAVGSFC from the intermediate files of the simulation period with tavgsfc.py.'''
+    import tavgsfc
+
+    fmt_wrf_date_hh = '%Y-%m-%d_%H'
+    times = sorted({path.name.split(':', 1)[1] for prefix in prefixes for path in ungrib_dir.glob(prefix + ':*')})
+    times = [t for t in times if cycle_dt.strftime(fmt_wrf_date_hh) <= t <= end_dt.strftime(fmt_wrf_date_hh)]
+    if not times:
+        log.error('ERROR: No ungrib output for ' + ', '.join(prefixes) + ' found in ' + str(ungrib_dir) + '. Exiting!')
+        sys.exit(1)
+    paths = [[ungrib_dir.joinpath(prefix + ':' + t) for prefix in prefixes if ungrib_dir.joinpath(prefix + ':' + t).is_file()]
+             for t in times]
+    with span('run', exe='tavgsfc.py'):
+        try:
+            tavgsfc.compute_tavgsfc(paths, run_dir.joinpath('TAVGSFC'))
+        except (OSError, ValueError) as e:
+            log.error('ERROR: TAVGSFC computation failed: ' + str(e) + '. Exiting!')
+            sys.exit(1)
+
+def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native, python=False):
 
     log.info(f'Running run_avg_tsfc.py from directory: {curr_dir}')
 
@@ -130,6 +158,21 @@ def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_mode
     beg_dt_wrf = beg_dt.strftime(fmt_wrf_dt)
     end_dt_wrf = end_dt.strftime(fmt_wrf_dt)
 
+    if python:
+        if icbc_model in variants_gfs:
+            prefixes = ['GFS']
+        elif icbc_model in variants_gfs_fnl:
+            prefixes = ['GFS_FNL']
+        elif icbc_model in variants_gefs:
+            prefixes = ['GEFS_B', 'GEFS_A']
+        elif icbc_model in variants_hrrr:
+            prefixes = ['HRRR_hybr', 'HRRR_soil'] if hrrr_native else ['HRRR_pres']
+        else:
+            prefixes = ['FILE']
+        run_dir.mkdir(parents=True, exist_ok=True)
+        main_python(beg_dt, end_dt, run_dir, ungrib_dir, prefixes)
+        return
+
     # Go to the run directory
     os.chdir(run_dir)
 
@@ -193,7 +236,8 @@ def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_mode
                 out_file.write(line)
 
     # Run avg_tsfc.exe utility
-    ret, output = exec_command('./avg_tsfc.exe', log, wait=True)
+    with span('run', exe='avg_tsfc.exe'):
+        ret, output = exec_command('./avg_tsfc.exe', log, wait=True)
     # avg_tsfc.exe won't return an error code of 1 or anything to stderr even if it fails, so manually search stdout
     if 'ERROR' in output:
         log.error('ERROR: avg_tsfc.exe failed. Exiting!')
@@ -202,8 +246,9 @@ def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, ungrib_dir, tmp_dir, icbc_mode
 
 if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
-    cycle_dt_beg, sim_hrs, wps_dir, run_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native = parse_args()
-    main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native)
+    cycle_dt_beg, sim_hrs, wps_dir, run_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native, python = parse_args()
+    with span(this_file, cycle=cycle_dt_beg):
+        main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, hrrr_native, python)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+'''
+run_ensemble_wps.py
+
+Runs ungrib and/or metgrid for every member of a GEFS ensemble cycle as batch job arrays and waits for them.
+
+run_ungrib.py and run_metgrid.py handle one member per call, so an N-member ensemble pays N times their queue waits.
+Here the work directories of all members are prepared exactly as those scripts prepare them (run_dir/memNN is the
+WPS run directory of member NN, as with exp_name memNN in setup_wps_wrf.py), and the usual submit_ungrib.bash /
+submit_metgrid.bash templates are submitted once as job arrays (qsub -J / sbatch --array), each task changing into
+its own directory before running the template's commands:
+    ungrib   one task per member, valid time and GEFS file (a, b), in run_dir/memNN/ungrib_YYYYMMDD_HH_[ab]
+    metgrid  one task per member, in run_dir/memNN
+All members share the one geogrid output that the namelist template points to.
+'''
+
+import os
+import sys
+import shutil
+import argparse
+import pathlib
+import glob
+import time
+import datetime as dt
+import pandas as pd
+import logging
+
+from proc_util import exec_command
+from wps_wrf_util import search_file
+from trace_util import span, record_span
+from walltime_util import plan_job
+
+this_file = os.path.basename(__file__)
+logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                    level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+log = logging.getLogger(__name__)
+
+long_time = 5
+short_time = 3
+# First GEFS v12 cycle; gefs_file builds v12 names only
+gefsv12_dt = dt.datetime(2020, 9, 23, 12, 0, 0)
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Largest array to submit at once (slurm's default MaxArraySize is 1001); more tasks are split over several arrays
+MAX_ARRAY_TASKS = 1000
+ERROR_PATTERNS = ['FATAL', 'Fatal', 'ERROR', 'Error', 'BAD TERMINATION', 'forrtl:', 'unrecognized option']
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--cycle_dt_beg', default='20220801_00', help='beginning date/time of the WRF model cycle [YYYYMMDD_HH] (default: 20220801_00)')
+    parser.add_argument('-s', '--sim_hrs', default=192, type=int, help='integer number of hours for the WRF simulation (default: 192)')
+    parser.add_argument('-w', '--wps_dir', default=None, help='string or pathlib.Path object of the WPS install directory')
+    parser.add_argument('-r', '--run_dir', default=None, help='string or pathlib.Path object of the cycle run directory; each member runs in run_dir/memNN')
+    parser.add_argument('-g', '--grib_dir', default=None, help='string or pathlib.Path object that hosts the GEFS pgrb2a/pgrb2b directories (needed for ungrib)')
+    parser.add_argument('-t', '--temp_dir', default=None, help='string or pathlib.Path object that hosts namelist & queue submission script templates')
+    parser.add_argument('-e', '--members', default='01', help='GEFS ensemble members, separated by commas only (e.g., 01,02) (default: 01)')
+    parser.add_argument('-i', '--int_hrs', default=3, type=int, help='integer number of hours between IC/LBC files (default: 3)')
+    parser.add_argument('-f', '--icbc_fc_dt', default=0, type=int, help='integer number of hours prior to WRF cycle time for IC/LBC model cycle (default: 0)')
+    parser.add_argument('-q', '--scheduler', default='pbs', help='string specifying the cluster job scheduler (default: pbs)')
+    parser.add_argument('-a', '--hostname', default='derecho', help='string specifying the hostname (default: derecho')
+    parser.add_argument('-u', '--ungrib', action='store_true', help='If flag present, run ungrib for all members')
+    parser.add_argument('-m', '--metgrid', action='store_true', help='If flag present, run metgrid for all members')
+    parser.add_argument('-T', '--tavgsfc', action='store_true',
+                        help='If flag present, also write each member\'s TAVGSFC from its ungrib output (replaces avg_tsfc.exe)')
+    parser.add_argument('-P', '--python_ungrib', action='store_true',
+                        help='If flag present, convert the grib2 files in-process with grib2_to_wps.py instead of submitting ungrib.exe jobs')
+    parser.add_argument('-G', '--use_tavgsfc', action='store_true',
+                        help='If flag present, then ensure metgrid uses each member\'s TAVGSFC file')
+
+    args = parser.parse_args()
+    cycle_dt_beg = args.cycle_dt_beg
+    members = args.members.split(',')
+
+    if len(cycle_dt_beg) != 11 or cycle_dt_beg[8] != '_':
+        log.error('ERROR! Incorrect format for argument cycle_dt_beg in call to run_ensemble_wps.py. Exiting!')
+        parser.print_help()
+        sys.exit(1)
+
+    for name in ['wps_dir', 'run_dir', 'temp_dir']:
+        if getattr(args, name) is None:
+            log.error('ERROR! ' + name + ' not specified as an argument in call to run_ensemble_wps.py. Exiting!')
+            sys.exit(1)
+    if args.ungrib and args.grib_dir is None:
+        log.error('ERROR! grib_dir not specified as an argument in call to run_ensemble_wps.py. Exiting!')
+        sys.exit(1)
+
+    grib_dir = None if args.grib_dir is None else pathlib.Path(args.grib_dir)
+
+    return (cycle_dt_beg, args.sim_hrs, pathlib.Path(args.wps_dir), pathlib.Path(args.run_dir), grib_dir,
+            pathlib.Path(args.temp_dir), members, args.int_hrs, args.icbc_fc_dt, args.scheduler, args.hostname,
+            args.ungrib, args.metgrid, args.tavgsfc, args.python_ungrib, args.use_tavgsfc)
+
+def member_dir(run_dir, member):
+    return run_dir.joinpath('mem' + member)
+
+def gefs_file(member, part, icbc_cycle_hr, lead_h):
+    '''Path of a GEFS v12 a/b file relative to the grib directory, as download_gefs_from_aws.py stores it.'''
+    gefs_prefix = 'gec' if member == '00' else 'gep'
+    return ('pgrb2' + part + 'p5/' + gefs_prefix + member + '.t' + icbc_cycle_hr + 'z.pgrb2' + part + '.0p50.f' +
+            str(lead_h).zfill(3))
+
+def template_script(temp_dir, stage, hostname):
+    # Add special handling for derecho & casper, since peer scheduling is possible
+    if hostname in ['derecho', 'casper']:
+        return temp_dir.joinpath('submit_' + stage + '.bash.' + hostname)
+    return temp_dir.joinpath('submit_' + stage + '.bash')
+
+def array_script(template, task_dirs, script_file):
+    '''
+    Write a job-array version of a submit_*.bash template: task i runs the template's commands in task_dirs[i].
+    The directories are listed one per line in script_file.dirs.
+    '''
+    dirs_file = script_file.with_suffix('.dirs')
+    dirs_file.write_text(''.join(str(task_dir) + '\n' for task_dir in task_dirs))
+    lines = template.read_text().splitlines(keepends=True)
+    # Scheduler directives must stay ahead of the first command
+    last = max([ii for ii, line in enumerate(lines) if line.startswith(('#PBS', '#SBATCH'))], default=0)
+    cd_line = ('\n# Job array task: run in the directory on line (task index + 1) of ' + dirs_file.name + '\n'
+               'cd "$(sed -n "$(( ${PBS_ARRAY_INDEX:-${SLURM_ARRAY_TASK_ID:-0}} + 1 ))p" ' + str(dirs_file) +
+               ')" || exit 1\n')
+    script_file.write_text(''.join(lines[:last + 1]) + cd_line + ''.join(lines[last + 1:]))
+    return script_file
+
+def submit_array(script_file, n_tasks, scheduler):
+    '''Submit a job-array script with n_tasks tasks from its own directory; returns the job id.'''
+    os.chdir(script_file.parent)
+    submit_time = time.time()
+    # PBS and slurm both reject arrays of a single task; the cd line falls back to index 0 without one
+    if scheduler == 'slurm':
+        cmd_list = ['sbatch'] + (['--array=0-' + str(n_tasks - 1)] if n_tasks > 1 else []) + [script_file.name]
+        ret, output = exec_command(cmd_list, log, wait=True)
+        jobid = output.split('job ')[1].split('\\n')[0].strip()
+        log.info('Submitted batch job array '+jobid+' with '+str(n_tasks)+' task(s)')
+    elif scheduler == 'pbs':
+        cmd_list = ['qsub'] + (['-J', '0-' + str(n_tasks - 1)] if n_tasks > 1 else []) + [script_file.name]
+        ret, output = exec_command(cmd_list, log, wait=True)
+        jobid = output.split('.')[0]
+        log.info('Submitted batch job array '+jobid+' with '+str(n_tasks)+' task(s)')
+    else:
+        log.error('ERROR: Unknown job scheduler. Exiting!')
+        sys.exit(1)
+    record_span('job_submit', submit_time, scheduler=scheduler, job_id=jobid, n_tasks=n_tasks)
+    return jobid
+
+def submit_tasks(array_dir, stage, template, task_dirs, scheduler, nml_file=None, sim_hrs=None):
+    '''Submit one array job per MAX_ARRAY_TASKS directories; returns the job ids.'''
+    array_dir.mkdir(parents=True, exist_ok=True)
+    jobids = []
+    for beg in range(0, len(task_dirs), MAX_ARRAY_TASKS):
+        chunk = task_dirs[beg:beg + MAX_ARRAY_TASKS]
+        script_file = array_script(template, chunk,
+                                   array_dir.joinpath('submit_' + stage + '_array' + str(len(jobids)) + '.bash'))
+        if nml_file is not None:
+            ## All members share the domain and simulation length, so one walltime fits every task
+            plan_job(stage, script_file, nml_file, sim_hrs, log)
+        jobids.append(submit_array(script_file, len(chunk), scheduler))
+        time.sleep(short_time)
+    return jobids
+
+def wait_for_tasks(stage, task_dirs, log_name, success, array_dir):
+    '''
+    Wait until every task directory's log_name reports success. Exits on the first error message in any of them.
+    '''
+    pending = list(task_dirs)
+    running = False
+    wait_beg = time.time()
+    while pending:
+        still_pending = []
+        for task_dir in pending:
+            log_file = task_dir.joinpath(log_name)
+            if not log_file.is_file():
+                still_pending.append(task_dir)
+                continue
+            if not running:
+                log.info(stage + ' is now running on the cluster . . .')
+                record_span('queue_wait', wait_beg, n_tasks=len(task_dirs))
+                running = True
+            if search_file(str(log_file), success):
+                continue
+            for pattern in ERROR_PATTERNS:
+                if search_file(str(log_file), pattern):
+                    log.error('ERROR: ' + stage + '.exe failed in ' + str(task_dir) + '.')
+                    log.error('Consult ' + str(log_file) + ' and the job array logs in ' + str(array_dir) +
+                              ' for potential error messages.')
+                    log.error('Exiting!')
+                    sys.exit(1)
+            still_pending.append(task_dir)
+        if still_pending and len(still_pending) != len(pending):
+            log.info(stage + ': ' + str(len(task_dirs) - len(still_pending)) + ' of ' + str(len(task_dirs)) +
+                     ' task(s) done')
+        pending = still_pending
+        if pending:
+            time.sleep(long_time)
+    log.info('SUCCESS! ' + stage + ' completed successfully for all ' + str(len(task_dirs)) + ' task(s).')
+
+def clean_logs(task_dir, patterns):
+    for pattern in patterns:
+        for file in glob.glob(str(task_dir.joinpath(pattern))):
+            os.remove(file)
+
+def prepare_ungrib_dir(ungrib_dir, wps_dir, temp_dir, grib_file, part, this_dt):
+    '''Set up one ungrib task directory as run_ungrib.py does for a single member, time and GEFS file.'''
+    ungrib_dir.mkdir(parents=True, exist_ok=True)
+    os.chdir(ungrib_dir)
+    for link, target in [('ungrib.exe', wps_dir.joinpath('ungrib.exe')),
+                         ('link_grib.csh', wps_dir.joinpath('link_grib.csh')),
+                         ('Vtable', wps_dir.joinpath('ungrib', 'Variable_Tables', 'Vtable.GFSENS'))]:
+        if pathlib.Path(link).is_symlink():
+            pathlib.Path(link).unlink()
+        pathlib.Path(link).symlink_to(target)
+
+    # Run link_grib
+    ret, output = exec_command(['./link_grib.csh', str(grib_file)], log, verbose=False)
+
+    this_dt_wrf_str = this_dt.strftime('%Y-%m-%d_%H:%M:%S')
+    prefix = 'GEFS_' + part.upper()
+    with open(temp_dir.joinpath('namelist.wps.gefs_' + part), 'r') as in_file, open('namelist.wps', 'w') as out_file:
+        for line in in_file:
+            if line.strip()[0:10] == 'start_date':
+                out_file.write(" start_date = '"+this_dt_wrf_str+"',\n")
+            elif line.strip()[0:8] == 'end_date':
+                out_file.write(" end_date   = '"+this_dt_wrf_str+"',\n")
+            elif line.strip()[0:6] == 'prefix':
+                # As in run_ungrib.py, each task writes into its own directory so that ungrib's clean-up of
+                # PFILE files cannot delete the files of other tasks still running
+                out_file.write(" prefix = '"+str(ungrib_dir)+"/"+prefix+"',\n")
+            else:
+                out_file.write(line)
+
+    ## Remove earlier output and logs, so a finished task can be recognized by its log and output file
+    ungribbed_file = ungrib_dir.joinpath(prefix + ':' + this_dt.strftime('%Y-%m-%d_%H'))
+    if ungribbed_file.is_file():
+        ungribbed_file.unlink()
+    clean_logs(ungrib_dir, ['ungrib.log', 'ungrib.o[0-9]*', 'ungrib.e[0-9]*', 'log_ungrib.o[0-9]*',
+                            'log_ungrib.e[0-9]*'])
+
+def run_ungrib(cycle_dt, all_dt, icbc_cycle_dt, icbc_fc_dt, members, wps_dir, run_dir, grib_dir, temp_dir,
+               scheduler, hostname, tavgsfc, python_ungrib):
+    from run_ungrib import ungrib_vtables, check_ungrib_output, ungrib_in_python
+
+    vtable_dir = pathlib.Path(curr_dir).joinpath('custom_vtables')
+    vtables = ungrib_vtables('GEFS', False, wps_dir, vtable_dir)
+    icbc_cycle_hr = icbc_cycle_dt.strftime('%H')
+
+    for member in members:
+        out_dir = member_dir(run_dir, member).joinpath('ungrib')
+        if out_dir.is_dir():
+            shutil.rmtree(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    if python_ungrib:
+        # In-process conversion has no queue wait to share, so members simply run one after another
+        for member in members:
+            with span('ungrib_member', member=member):
+                ungrib_in_python(all_dt, cycle_dt, icbc_cycle_dt, 'GEFS', 'AWS', icbc_fc_dt, False, False, member,
+                                 grib_dir, '', wps_dir, vtable_dir, member_dir(run_dir, member).joinpath('ungrib'),
+                                 member_dir(run_dir, member), tavgsfc)
+        return
+
+    tasks = []
+    for member in members:
+        for this_dt in all_dt:
+            lead_h = int((this_dt - cycle_dt).total_seconds() // 3600) + icbc_fc_dt
+            for part in ['b', 'a']:
+                grib_file = grib_dir.joinpath(gefs_file(member, part, icbc_cycle_hr, lead_h))
+                if not grib_file.is_file():
+                    log.error('ERROR: grib file ' + str(grib_file) + ' not found. Exiting!')
+                    sys.exit(1)
+                ungrib_dir = member_dir(run_dir, member).joinpath('ungrib_' + this_dt.strftime('%Y%m%d_%H') + '_' + part)
+                prepare_ungrib_dir(ungrib_dir, wps_dir, temp_dir, grib_file, part, this_dt)
+                tasks.append((member, this_dt, part, ungrib_dir))
+    log.info('Prepared ' + str(len(tasks)) + ' ungrib task(s) for ' + str(len(members)) + ' member(s)')
+
+    array_dir = run_dir.joinpath('ensemble_ungrib')
+    task_dirs = [task[3] for task in tasks]
+    submit_tasks(array_dir, 'ungrib', template_script(temp_dir, 'ungrib', hostname), task_dirs, scheduler)
+    with span('run', n_tasks=len(tasks)):
+        wait_for_tasks('ungrib', task_dirs, 'ungrib.log', 'Successful completion of program ungrib.exe', array_dir)
+
+    # Move each ungribbed file to its member's ungrib directory, where metgrid will expect to find them all
+    for member, this_dt, part, ungrib_dir in tasks:
+        fname = 'GEFS_' + part.upper() + ':' + this_dt.strftime('%Y-%m-%d_%H')
+        os.replace(ungrib_dir.joinpath(fname), member_dir(run_dir, member).joinpath('ungrib', fname))
+
+    for member in members:
+        log.info('Checking the ungrib output of member ' + member)
+        check_ungrib_output(member_dir(run_dir, member).joinpath('ungrib'), all_dt, vtables)
+        if tavgsfc:
+            write_member_tavgsfc(member_dir(run_dir, member), all_dt)
+
+def write_member_tavgsfc(mem_dir, all_dt):
+    import tavgsfc
+
+    # Surface TT may be in either the b or the a file; take the first that has it
+    paths = [[mem_dir.joinpath('ungrib', prefix + ':' + this_dt.strftime('%Y-%m-%d_%H'))
+              for prefix in ['GEFS_B', 'GEFS_A']] for this_dt in all_dt]
+    try:
+        tavg_file = tavgsfc.compute_tavgsfc(paths, mem_dir.joinpath('TAVGSFC'))
+    except (OSError, ValueError) as e:
+        log.error('ERROR: TAVGSFC not written for ' + str(mem_dir) + ': ' + str(e))
+        log.error('Exiting!')
+        sys.exit(1)
+    log.info('Wrote ' + str(tavg_file))
+
+def prepare_metgrid_dir(mem_dir, wps_dir, temp_dir, beg_dt, end_dt, use_tavgsfc):
+    '''Set up one member's metgrid run directory as run_metgrid.py does.'''
+    ungrib_dir = mem_dir.joinpath('ungrib')
+    out_dir = mem_dir.joinpath('metgrid')
+    out_dir.mkdir(parents=True, exist_ok=True)
+    os.chdir(mem_dir)
+
+    if pathlib.Path('metgrid.exe').is_symlink():
+        pathlib.Path('metgrid.exe').unlink()
+    pathlib.Path('metgrid.exe').symlink_to(wps_dir.joinpath('metgrid.exe'))
+
+    # Does TAVGSFC file exist? It needs to be there already if we intend to use it
+    if use_tavgsfc and not mem_dir.joinpath('TAVGSFC').exists():
+        log.error('ERROR! TAVGSFC file not found in ' + str(mem_dir) + '. Set do_avg_tsfc = True and rerun the workflow.')
+        log.error('Exiting!')
+        sys.exit(1)
+
+    beg_dt_wrf = beg_dt.strftime('%Y-%m-%d_%H:%M:%S')
+    end_dt_wrf = end_dt.strftime('%Y-%m-%d_%H:%M:%S')
+    with open(temp_dir.joinpath('namelist.wps.gefs'), 'r') as in_file:
+        template = in_file.readlines()
+    constants_name = any('constants_name' in line for line in template)
+    with open('namelist.wps', 'w') as out_file:
+        for line in template:
+            if line.strip()[0:10] == 'start_date':
+                out_file.write(" start_date = '"+beg_dt_wrf+"', '"+beg_dt_wrf+"', '"+beg_dt_wrf+"',\n")
+            elif line.strip()[0:8] == 'end_date':
+                out_file.write(" end_date   = '"+end_dt_wrf+"', '"+beg_dt_wrf+"', '"+beg_dt_wrf+"',\n")
+            elif line.strip()[0:7] == 'fg_name':
+                out_file.write(" fg_name = '"+str(ungrib_dir)+"/GEFS_B','"+str(ungrib_dir)+"/GEFS_A',\n")
+            elif line.strip()[0:28] == 'opt_output_from_metgrid_path':
+                out_file.write(" opt_output_from_metgrid_path = '"+str(out_dir)+"',\n")
+            elif use_tavgsfc and line.strip()[0:8] == '&metgrid' and not constants_name:
+                out_file.write(line + " constants_name = '" + str(mem_dir) + "/TAVGSFC',\n")
+            elif use_tavgsfc and line.strip()[0:14] == 'constants_name' and line.find('TAVGSFC') == -1:
+                out_file.write(line.split(sep='\n')[0] + "'TAVGSFC',\n")
+            else:
+                out_file.write(line)
+
+    clean_logs(mem_dir, ['metgrid.log*', 'METGRID_BEG', 'METGRID_END'])
+
+def run_metgrid(beg_dt, end_dt, sim_hrs, members, wps_dir, run_dir, temp_dir, scheduler, hostname, use_tavgsfc):
+    task_dirs = [member_dir(run_dir, member) for member in members]
+    for mem_dir in task_dirs:
+        prepare_metgrid_dir(mem_dir, wps_dir, temp_dir, beg_dt, end_dt, use_tavgsfc)
+
+    array_dir = run_dir.joinpath('ensemble_metgrid')
+    submit_tasks(array_dir, 'metgrid', template_script(temp_dir, 'metgrid', hostname), task_dirs, scheduler,
+                 nml_file=task_dirs[0].joinpath('namelist.wps'), sim_hrs=sim_hrs)
+    with span('run', n_tasks=len(task_dirs)):
+        wait_for_tasks('metgrid', task_dirs, 'metgrid.log.0000',
+                       '*** Successful completion of program metgrid.exe ***', array_dir)
+
+def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, grib_dir, temp_dir, members, int_hrs, icbc_fc_dt, scheduler,
+         hostname, ungrib, metgrid, tavgsfc=False, python_ungrib=False, use_tavgsfc=False):
+
+    log.info(f'Running run_ensemble_wps.py from directory: {curr_dir}')
+
+    cycle_dt = pd.to_datetime(cycle_dt_str, format='%Y%m%d_%H')
+    beg_dt = cycle_dt
+    end_dt = beg_dt + dt.timedelta(hours=sim_hrs)
+    all_dt = pd.date_range(start=beg_dt, end=end_dt, freq=str(int_hrs)+'h')
+    icbc_cycle_dt = cycle_dt - dt.timedelta(hours=icbc_fc_dt)
+    if ungrib and icbc_cycle_dt < gefsv12_dt:
+        log.error('ERROR: GEFS cycle ' + str(icbc_cycle_dt) + ' predates GEFS v12 (' + str(gefsv12_dt) + ').')
+        log.error('       Ensemble mode only reads v12 files (pgrb2ap5/pgrb2bp5). Exiting!')
+        sys.exit(1)
+
+    for member in members:
+        member_dir(run_dir, member).mkdir(parents=True, exist_ok=True)
+
+    if ungrib:
+        with span('ungrib', members=len(members)):
+            run_ungrib(cycle_dt, all_dt, icbc_cycle_dt, icbc_fc_dt, members, wps_dir, run_dir, grib_dir, temp_dir,
+                       scheduler, hostname, tavgsfc, python_ungrib)
+    if metgrid:
+        with span('metgrid', members=len(members)):
+            run_metgrid(beg_dt, end_dt, sim_hrs, members, wps_dir, run_dir, temp_dir, scheduler, hostname,
+                        use_tavgsfc)
+
+
+if __name__ == '__main__':
+    now_time_beg = dt.datetime.now(dt.UTC)
+    (cycle_dt, sim_hrs, wps_dir, run_dir, grib_dir, temp_dir, members, int_hrs, icbc_fc_dt, scheduler, hostname,
+     ungrib, metgrid, tavgsfc, python_ungrib, use_tavgsfc) = parse_args()
+    with span(this_file, cycle=cycle_dt, host=hostname, members=len(members)):
+        main(cycle_dt, sim_hrs, wps_dir, run_dir, grib_dir, temp_dir, members, int_hrs, icbc_fc_dt, scheduler,
+             hostname, ungrib, metgrid, tavgsfc, python_ungrib, use_tavgsfc)
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
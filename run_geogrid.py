@@ -20,6 +20,8 @@ import datetime as dt
 import logging
 from proc_util import exec_command
 from wps_wrf_util import search_file
+from trace_util import span, start_span, record_span
+from walltime_util import plan_job, record_job
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -123,9 +125,16 @@ def main(wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname):
 	files = glob.glob('log_geogrid.o[0-9]*')
 	for file in files:
 		ret, output = exec_command(['rm', file], log, False, False)
+	files = glob.glob('GEOGRID_BEG') + glob.glob('GEOGRID_END')
+	for file in files:
+		ret, output = exec_command(['rm', file], log, False, False)
+
+	## Request walltime for this domain from the runtime history of earlier geogrid jobs
+	job_plan = plan_job('geogrid', 'submit_geogrid.bash', 'namelist.wps', 0, log)
 
 	# Submit geogrid and get the job ID as a string
 	# Set wait=True to force subprocess.run to wait for stdout echoed from the job scheduler
+	submit_span = start_span('job_submit', scheduler=scheduler)
 	if scheduler == 'slurm':
 		ret,output = exec_command(['sbatch','submit_geogrid.bash'], log, False, wait=True)
 		jobid = output.split('job ')[1].split('\\n')[0].strip()
@@ -142,6 +151,8 @@ def main(wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname):
 	else:
 		log.error('ERROR: Unknown job scheduler. Exiting!')
 		sys.exit(1)
+	submit_span.set(job_id=jobid).end()
+	submit_end = time.time()
 	time.sleep(long_time)	# give the file system a moment
 
 	## Monitor the progress of geogrid
@@ -151,11 +162,16 @@ def main(wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname):
 			time.sleep(long_time)
 		else:
 			log.info('geogrid is now running on the cluster . . .')
+			record_span('queue_wait', submit_end, job_id=jobid)
+			run_span = start_span('run', job_id=jobid)
+			run_beg = time.time()
 			status = True
 	status = False
 	while not status:
 		if search_file(str(run_dir) + '/geogrid.log.0000', '*** Successful completion of program geogrid.exe ***'):
 			log.info('SUCCESS! geogrid completed successfully.')
+			run_span.end()
+			record_job(job_plan, 'GEOGRID_BEG', run_beg, jobid)
 			time.sleep(short_time)  # brief pause to let the file system gather itself
 			status = True
 		else:
@@ -177,7 +193,8 @@ def main(wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname):
 if __name__ == '__main__':
 	now_time_beg = dt.datetime.now(dt.UTC)
 	wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname = parse_args()
-	main(wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname)
+	with span(this_file, host=hostname):
+		main(wps_dir, run_dir, tmp_dir, nml_tmp, scheduler, hostname)
 	now_time_end = dt.datetime.now(dt.UTC)
 	run_time_tot = now_time_end - now_time_beg
 	now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
@@ -22,6 +22,8 @@ import logging
 
 from proc_util import exec_command
 from wps_wrf_util import search_file
+from trace_util import span, start_span, record_span
+from walltime_util import plan_job, record_job
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -228,9 +230,16 @@ def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, out_dir, ungrib_dir, tmp_dir,
     files = glob.glob('log_metgrid.o[0-9]*')
     for file in files:
         ret, output = exec_command(['rm', file], log, False, False)
+    files = glob.glob('METGRID_BEG') + glob.glob('METGRID_END')
+    for file in files:
+        ret, output = exec_command(['rm', file], log, False, False)
+
+    ## Request walltime for this domain and simulation length from the runtime history of earlier metgrid jobs
+    job_plan = plan_job('metgrid', 'submit_metgrid.bash', 'namelist.wps', sim_hrs, log)
 
     # Submit metgrid and get the job ID as a string
     # Set wait=True to force subprocess.run to wait for stdout echoed from the job scheduler
+    submit_span = start_span('job_submit', scheduler=scheduler)
     if scheduler == 'slurm':
         ret,output = exec_command(['sbatch','submit_metgrid.bash'], log, False, wait=True)
         jobid = output.split('job ')[1].split('\\n')[0].strip()
@@ -247,6 +256,8 @@ def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, out_dir, ungrib_dir, tmp_dir,
     else:
         log.error('ERROR: Unknown job scheduler. Exiting!')
         sys.exit(1)
+    submit_span.set(job_id=jobid).end()
+    submit_end = time.time()
     time.sleep(long_time)   # give the file system a moment
 
     if scheduler == 'slurm':
@@ -261,11 +272,16 @@ def main(cycle_dt_beg, sim_hrs, wps_dir, run_dir, out_dir, ungrib_dir, tmp_dir,
             time.sleep(long_time)
         else:
             log.info('metgrid is now running on the cluster . . .')
+            record_span('queue_wait', submit_end, job_id=jobid)
+            run_span = start_span('run', job_id=jobid)
+            run_beg = time.time()
             status = True
     status = False
     while not status:
         if search_file(str(run_dir) + '/metgrid.log.0000', '*** Successful completion of program metgrid.exe ***'):
             log.info('SUCCESS! metgrid completed successfully.')
+            run_span.end()
+            record_job(job_plan, 'METGRID_BEG', run_beg, jobid)
             time.sleep(short_time)  # brief pause to let the file system gather itself
             status = True
         else:
@@ -288,8 +304,9 @@ if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
     (cycle_dt, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, scheduler, hostname,
      hrrr_native, use_tavgsfc) = parse_args()
-    main(cycle_dt, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, scheduler, hostname,
-         hrrr_native, use_tavgsfc)
+    with span(this_file, cycle=cycle_dt, host=hostname):
+        main(cycle_dt, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, tmp_dir, icbc_model, nml_tmp, scheduler, hostname,
+             hrrr_native, use_tavgsfc)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
@@ -22,6 +22,8 @@ import logging
 
 from proc_util import exec_command
 from wps_wrf_util import search_file
+from trace_util import span, start_span, record_span
+from walltime_util import size_mpi_job, plan_job, record_job
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -189,9 +191,19 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_mod
     files = glob.glob('real.o*')
     for file in files:
         ret,output = exec_command(['rm',file], log, False, False)
+    files = glob.glob('REAL_BEG') + glob.glob('REAL_END')
+    for file in files:
+        ret,output = exec_command(['rm',file], log, False, False)
+
+    ## Choose the MPI decomposition for this domain and use it in namelist.input and submit_real.bash
+    size_mpi_job('submit_real.bash', 'namelist.input', log)
+
+    ## Request walltime for this domain from the runtime history of earlier real jobs
+    job_plan = plan_job('real', 'submit_real.bash', 'namelist.input', sim_hrs, log)
 
     # Submit real and get the job ID as a string
     # Set wait=True to force subprocess.run to wait for stdout echoed from the job scheduler
+    submit_span = start_span('job_submit', scheduler=scheduler)
     if scheduler == 'slurm':
         ret,output = exec_command(['sbatch','submit_real.bash'], log, wait=True)
         jobid = output.split('job ')[1].split('\\n')[0]
@@ -204,6 +216,8 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_mod
     else:
         log.error('ERROR: Unknown job scheduler. Exiting!')
         sys.exit(1)
+    submit_span.set(job_id=jobid).end()
+    submit_end = time.time()
     time.sleep(long_time)   # give the file system a moment
 
     ## Monitor the progress of real
@@ -218,11 +232,16 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_mod
             time.sleep(long_time)
         else:
             log.info('real is now running on the cluster . . .')
+            record_span('queue_wait', submit_end, job_id=jobid)
+            run_span = start_span('run', job_id=jobid)
+            run_beg = time.time()
             status = True
     status = False
     while not status:
         if search_file(str(run_dir) + '/rsl.out.0000', 'SUCCESS COMPLETE REAL_EM'):
             log.info('SUCCESS! real completed successfully.')
+            run_span.end()
+            record_job(job_plan, 'REAL_BEG', run_beg, jobid)
             time.sleep(short_time)  # brief pause to let the file system gather itself
             status = True
         else:
@@ -256,7 +275,8 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_mod
 if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
     cycle_dt, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_model, exp_name, nml_tmp, scheduler, hostname = parse_args()
-    main(cycle_dt, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_model, exp_name, nml_tmp, scheduler, hostname)
+    with span(this_file, cycle=cycle_dt, exp_name=exp_name, host=hostname):
+        main(cycle_dt, sim_hrs, wrf_dir, run_dir, metgrid_dir, tmp_dir, icbc_model, exp_name, nml_tmp, scheduler, hostname)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
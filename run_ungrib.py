@@ -23,6 +23,7 @@ import logging
 
 from proc_util import exec_command
 from wps_wrf_util import search_file
+from trace_util import span, record_span
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -55,6 +56,12 @@ def parse_args():
                         help='If flag present, then ungrib HRRR native-grid data for atmospheric variables and pressure-level data for soil variables, otherwise only ungrib HRRR pressure-level data for all variables')
     parser.add_argument('-l', '--icbc_analysis', action='store_true',
                         help='If flag present, use analysis [f00] files for ICs/LBCs')
+    parser.add_argument('-S', '--subset', action='store_true',
+                        help='If flag present, ungrib the geographically-subsetted files (subset_grib.py) in the .subset date directories of grib_dir (HRRR and GFS_FNL)')
+    parser.add_argument('-T', '--tavgsfc', action='store_true',
+                        help='If flag present, also write run_dir/TAVGSFC (replaces avg_tsfc.exe), accumulating each time as soon as it is ungribbed')
+    parser.add_argument('-P', '--python_ungrib', action='store_true',
+                        help='If flag present, convert the grib2 files in-process with grib2_to_wps.py instead of submitting ungrib.exe jobs')
 
     args = parser.parse_args()
     cycle_dt_beg = args.cycle_dt_beg
@@ -73,6 +80,9 @@ def parse_args():
     mem_id = args.mem_id
     hostname = args.hostname
     hrrr_native = args.hrrr_native
+    subset = args.subset
+    python_ungrib = args.python_ungrib
+    tavgsfc = args.tavgsfc
 
     if len(cycle_dt_beg) != 11 or cycle_dt_beg[8] != '_':
         log.error('ERROR! Incorrect format for argument cycle_dt_beg in call to run_metgrid.py. Exiting!')
@@ -110,10 +120,157 @@ def parse_args():
         sys.exit(1)
 
     return (cycle_dt_beg, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, icbc_source, icbc_model, int_hrs,
-            icbc_fc_dt, scheduler, mem_id, hostname, hrrr_native, icbc_analysis)
+            icbc_fc_dt, scheduler, mem_id, hostname, hrrr_native, icbc_analysis, subset, python_ungrib, tavgsfc)
+
+def ungrib_vtables(icbc_model, hrrr_native, wps_dir, vtable_dir):
+    '''Vtable behind each intermediate-file prefix ungrib writes for this IC/LBC model.'''
+    wps_vtables = wps_dir.joinpath('ungrib', 'Variable_Tables')
+    if icbc_model in ['GFS', 'gfs']:
+        return {'GFS': wps_vtables.joinpath('Vtable.GFS')}
+    elif icbc_model in ['GFS_FNL', 'gfs_fnl']:
+        return {'GFS_FNL': wps_vtables.joinpath('Vtable.GFS')}
+    elif icbc_model in ['GEFS', 'gefs']:
+        return {'GEFS_B': wps_vtables.joinpath('Vtable.GFSENS'), 'GEFS_A': wps_vtables.joinpath('Vtable.GFSENS')}
+    elif icbc_model in ['HRRR', 'hrrr'] and hrrr_native:
+        return {'HRRR_hybr': vtable_dir.joinpath('Vtable.raphrrr.hybr'),
+                'HRRR_soil': vtable_dir.joinpath('Vtable.raphrrr.soil_only')}
+    elif icbc_model in ['HRRR', 'hrrr']:
+        return {'HRRR_pres': vtable_dir.joinpath('Vtable.raphrrr.pres')}
+    return {}
+
+def check_ungrib_output(out_dir, all_dt, vtables):
+    '''
+    QA the intermediate files before metgrid is queued (wps_intermediate.check_fields): every prefix has a file
+    for every time, with the same fields, levels and grid throughout. Vtable fields absent everywhere are logged.
+    '''
+    import wps_intermediate
+
+    n_errors = 0
+    for prefix, vtable in vtables.items():
+        files = [out_dir.joinpath(prefix + ':' + this_dt.strftime('%Y-%m-%d_%H')) for this_dt in all_dt]
+        missing = [f for f in files if not f.is_file()]
+        for f in missing:
+            log.error('ERROR: Expected ungrib output file ' + str(f) + ' not found.')
+        errors, warnings = wps_intermediate.check_fields([f for f in files if f.is_file()],
+                                                         vtable if vtable.is_file() else None)
+        for warning in warnings:
+            log.info('WARNING: ' + prefix + ': ' + warning)
+        for error in errors:
+            log.error('ERROR: ' + error)
+        n_errors += len(missing) + len(errors)
+    if n_errors:
+        log.error('ERROR: ungrib output failed ' + str(n_errors) + ' check(s). Exiting!')
+        sys.exit(1)
+    log.info('Ungrib output passed the intermediate-file checks.')
+
+def add_tsfc(tavg, path):
+    '''Fold one intermediate file into the TAVGSFC accumulator; returns False if it has no surface temperature.'''
+    try:
+        return tavg.add(path)
+    except (OSError, ValueError) as e:
+        log.error('ERROR: Cannot add ' + str(path) + ' to TAVGSFC: ' + str(e))
+        log.error('Exiting!')
+        sys.exit(1)
+
+def write_tavgsfc(tavg, run_dir):
+    try:
+        tavg_file = tavg.write(run_dir.joinpath('TAVGSFC'))
+    except ValueError as e:
+        log.error('ERROR: TAVGSFC not written: ' + str(e))
+        log.error('Exiting!')
+        sys.exit(1)
+    log.info('Wrote ' + str(tavg_file))
+
+def ungrib_in_python(all_dt, cycle_dt, icbc_cycle_dt, icbc_model, icbc_source, icbc_fc_dt, icbc_analysis, hrrr_native,
+                     mem_id, grib_dir, date_dir_suffix, wps_dir, vtable_dir, out_dir, run_dir=None, tavgsfc=False):
+    '''
+    Convert every valid time with grib2_to_wps.py in a process pool, writing straight into out_dir.
+    Picks the same grib files, Vtables and prefixes as the ungrib.exe path in main.
+    '''
+    import grib2_to_wps
+
+    vtables = ungrib_vtables(icbc_model, hrrr_native, wps_dir, vtable_dir)
+    icbc_cycle_hr = icbc_cycle_dt.strftime('%H')
+    jobs = []
+    for this_dt in all_dt:
+        lead_h = int((this_dt - cycle_dt).total_seconds() // 3600) + icbc_fc_dt
+        hrrr_dir = grib_dir.joinpath('hrrr.' + (this_dt if icbc_analysis else icbc_cycle_dt).strftime('%Y%m%d')
+                                     + date_dir_suffix, 'conus')
+        hrrr_hh, hrrr_lead = (this_dt.strftime('%H'), '00') if icbc_analysis else (icbc_cycle_hr, str(lead_h).zfill(2))
+        if icbc_model in ['GFS', 'gfs']:
+            if icbc_source in ['GLADE', 'glade']:
+                fname = 'gfs.0p25.' + icbc_cycle_dt.strftime('%Y%m%d%H') + '.f' + str(lead_h).zfill(3) + '.grib2'
+            else:
+                fname = 'gfs.t' + icbc_cycle_hr + 'z.pgrb2.0p25.f' + str(lead_h).zfill(3)
+            jobs.append(dict(grib_files=[grib_dir.joinpath(fname)], prefix='GFS'))
+        elif icbc_model in ['GFS_FNL', 'gfs_fnl']:
+            this_lead = this_dt.hour % 6
+            this_cycle = this_dt - dt.timedelta(hours=this_lead)
+            fnl_dir = grib_dir.joinpath('gfs_fnl.' + this_dt.strftime('%Y%m%d') + date_dir_suffix)
+            fname = 'gdas1.fnl0p25.' + this_cycle.strftime('%Y%m%d%H') + '.f' + str(this_lead).zfill(2) + '.grib2'
+            jobs.append(dict(grib_files=[fnl_dir.joinpath(fname)], prefix='GFS_FNL'))
+        elif icbc_model in ['GEFS', 'gefs']:
+            for part, prefix in [('b', 'GEFS_B'), ('a', 'GEFS_A')]:
+                fname = 'pgrb2' + part + 'p5/gep' + mem_id + '.t' + icbc_cycle_hr + 'z.pgrb2' + part + '.0p50.f' + str(lead_h).zfill(3)
+                jobs.append(dict(grib_files=[grib_dir.joinpath(fname)], prefix=prefix))
+        elif icbc_model in ['HRRR', 'hrrr']:
+            prs_file = hrrr_dir.joinpath('hrrr.t' + hrrr_hh + 'z.wrfprsf' + hrrr_lead + '.grib2')
+            if hrrr_native:
+                nat_file = hrrr_dir.joinpath('hrrr.t' + hrrr_hh + 'z.wrfnatf' + hrrr_lead + '.grib2')
+                jobs.append(dict(grib_files=[nat_file], prefix='HRRR_hybr'))
+                jobs.append(dict(grib_files=[prs_file], prefix='HRRR_soil'))
+            else:
+                jobs.append(dict(grib_files=[prs_file], prefix='HRRR_pres'))
+        else:
+            log.error('ERROR: Unrecognized icbc_model in run_ungrib.py.')
+            log.error('Exiting!')
+            sys.exit(1)
+
+    # Only prefixes whose Vtable has been validated against ungrib.exe output (grib2_to_wps.py --compare --record)
+    unvalidated = [prefix + ' (' + str(vtable) + ')' for prefix, vtable in vtables.items()
+                   if not vtable.is_file() or grib2_to_wps.validation(prefix, vtable) is None]
+    if unvalidated:
+        log.error('ERROR: grib2_to_wps.py has not been validated against ungrib.exe for ' + ', '.join(unvalidated)
+                  + '. See ' + str(grib2_to_wps.VALIDATION_FILE) + ' and grib2_to_wps.py --compare --record.')
+        log.error('Run without -P (python_ungrib) to use ungrib.exe instead. Exiting!')
+        sys.exit(1)
+
+    for job in jobs:
+        job['out_dir'] = out_dir
+        job['vtable'] = vtables[job['prefix']]
+        for grib_file in job['grib_files']:
+            if not grib_file.is_file():
+                log.error('ERROR: grib file ' + str(grib_file) + ' not found. Exiting!')
+                sys.exit(1)
+
+    log.info('Converting ' + str(len(jobs)) + ' grib file(s) in-process with grib2_to_wps.py')
+    with span('grib2_to_wps', n_files=len(jobs)):
+        try:
+            results = grib2_to_wps.convert_all(jobs)
+        except (grib2_to_wps.UnsupportedGrib, ValueError) as e:
+            log.error('ERROR: grib2_to_wps.py failed: ' + str(e))
+            log.error('Run without -P (python_ungrib) to use ungrib.exe instead. Exiting!')
+            sys.exit(1)
+    for result in results:
+        log.info('   ' + result['out_file'] + ': ' + str(result['n_fields']) + f' fields in {result["seconds"]:.1f} s')
+        if result['absent']:
+            log.info('      Vtable fields not in the grib data: ' + ', '.join(result['absent']))
+    check_ungrib_output(out_dir, all_dt, vtables)
+    if tavgsfc:
+        import tavgsfc as tavgsfc_util
+        tavg = tavgsfc_util.TsfcAccumulator()
+        for this_dt in all_dt:
+            # Surface TT may be in either file of a pair (e.g. GEFS a/b); take the first that has it
+            if not any(add_tsfc(tavg, out_dir.joinpath(prefix + ':' + this_dt.strftime('%Y-%m-%d_%H')))
+                       for prefix in vtables):
+                log.error('ERROR: No surface temperature for TAVGSFC at ' + str(this_dt) + '. Exiting!')
+                sys.exit(1)
+        write_tavgsfc(tavg, run_dir)
+    log.info('SUCCESS! All grib files converted successfully.')
 
 def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, icbc_source, icbc_model, int_hrs,
-         icbc_fc_dt, scheduler, mem_id, hostname, hrrr_native, icbc_analysis):
+         icbc_fc_dt, scheduler, mem_id, hostname, hrrr_native, icbc_analysis, subset=False,
+         python_ungrib=False, tavgsfc=False):
 
     log.info(f'Running run_ungrib.py from directory: {curr_dir}')
 
@@ -133,6 +290,8 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
 
     if icbc_model in variants_hrrr or icbc_model in variants_gfs_fnl:
         grib_dir_parent = grib_dir
+    # Subsetted files live in <model>.<date>.subset instead of <model>.<date>
+    date_dir_suffix = '.subset' if subset else ''
 
     # Any custom grib Vtables (i.e., not part of the WPS distribution) should be stored as part of this repo
     vtable_dir = pathlib.Path(curr_dir).joinpath('custom_vtables')
@@ -160,8 +319,14 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
         shutil.rmtree(out_dir)
         out_dir.mkdir(parents=True, exist_ok=True)
 
+    if python_ungrib:
+        ungrib_in_python(all_dt, cycle_dt, icbc_cycle_dt, icbc_model, icbc_source, icbc_fc_dt, icbc_analysis,
+                         hrrr_native, mem_id, grib_dir, date_dir_suffix, wps_dir, vtable_dir, out_dir, run_dir, tavgsfc)
+        return
+
     # Create empty jobid list to be filled in later to allow tracking of each ungrib job
     jobid_list = [''] * n_times
+    submit_time_list = [0.0] * n_times
 
     ## Loop over times
     for tt in range(n_times):
@@ -177,15 +342,15 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
 
         # For some IC/LBC models, gribfiles are stored in directories by cycle date rather than cycle hour
         if icbc_model in variants_gfs_fnl:
-            grib_dir = grib_dir_parent.joinpath('gfs_fnl.' + this_dt_yyyymmdd)
+            grib_dir = grib_dir_parent.joinpath('gfs_fnl.' + this_dt_yyyymmdd + date_dir_suffix)
         elif icbc_model in variants_hrrr:
             # Assume conus for now, but maybe someday allow for selection of other HRRR domains if the need arises
             if icbc_analysis:
                 # All icbc files come from different HRRR model cycles (f00 each cycle) 
-                grib_dir = grib_dir_parent.joinpath('hrrr.' + this_dt_yyyymmdd, 'conus')
+                grib_dir = grib_dir_parent.joinpath('hrrr.' + this_dt_yyyymmdd + date_dir_suffix, 'conus')
             else:
                 # All icbc files come from a single HRRR model cycle
-                grib_dir = grib_dir_parent.joinpath('hrrr.' + icbc_cycle_date, 'conus')
+                grib_dir = grib_dir_parent.joinpath('hrrr.' + icbc_cycle_date + date_dir_suffix, 'conus')
 
         ## Calculate the lead hour for this cycle, accounting for the possible icbc_fc_dt offset
         lead_h = int((this_dt - cycle_dt).total_seconds() // 3600) + icbc_fc_dt
@@ -360,6 +525,7 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
 
         # Submit ungrib and get the job ID as a string in case it's useful
         # Set wait=True to force subprocess.run to wait for stdout echoed from the job scheduler
+        submit_time_list[tt] = time.time()
         if scheduler == 'slurm':
             ret,output = exec_command(['sbatch','submit_ungrib.bash'], log, wait=True)
             jobid = output.split('job ')[1].split('\\n')[0]
@@ -371,8 +537,17 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
             queue = output.split('.')[1]
             log.info('Submitted batch job '+jobid+' to queue '+queue)
             jobid_list[tt] = jobid
+        record_span('job_submit', submit_time_list[tt], scheduler=scheduler, job_id=jobid_list[tt],
+                    valid_time=this_dt_yyyymmdd_hh)
         time.sleep(short_time)
 
+    ## Daily-mean surface temperature for TAVGSFC, accumulated as each time comes out of the queue
+    tavg = None
+    vtables = ungrib_vtables(icbc_model, hrrr_native, wps_dir, vtable_dir)
+    if tavgsfc:
+        import tavgsfc as tavgsfc_util
+        tavg = tavgsfc_util.TsfcAccumulator()
+
     ## Loop back through the run directories, verifying that each ungrib job finished successfully
     for tt in range(n_times):
         this_dt = all_dt[tt]
@@ -408,6 +583,8 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
         status = False
         while not status:
             if search_file('ungrib.log', 'Successful completion of program ungrib.exe'):
+                # Jobs are checked one after another, so this covers queue wait + run of each ungrib job
+                record_span('job', submit_time_list[tt], job_id=jobid_list[tt], valid_time=this_dt_yyyymmdd_hh)
                 status = True
             else:
                 # May need to add more error message patterns to search for
@@ -439,6 +616,8 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
                 ret, output = exec_command(['mv', 'HRRR_pres:' + this_dt_wrf_date_hh, str(out_dir)], log)
         else:
             ret,output = exec_command(['mv', 'FILE:' + this_dt_wrf_date_hh, str(out_dir)], log)
+        if tavg is not None and vtables:
+            add_tsfc(tavg, out_dir.joinpath(list(vtables)[0] + ':' + this_dt_wrf_date_hh))
 
     ## If GEFS, run ungrib for the a files, too
     # Or if HRRR and using native-grid output for atmospheric vars, run ungrib on pressure-level output for soil vars
@@ -446,9 +625,12 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
     ## but keeping them as two separate code blocks is a little bit cleaner/easier to read. Maybe could do
     ## the same thing by making much of this code into a function.
     if icbc_model in variants_gefs or (icbc_model in variants_hrrr and hrrr_native):
+        # Surface TT comes from these files if the first set had none
+        tavg_second = tavg is not None and not tavg.times
 
         # Re-initialize empty jobid list to be filled in later to allow tracking of each ungrib job
         jobid_list = [''] * n_times
+        submit_time_list = [0.0] * n_times
 
         ## Loop over times
         for tt in range(n_times):
@@ -465,10 +647,10 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
             if icbc_model in variants_hrrr:
                 if icbc_analysis:
                     # All icbc files come from different HRRR model cycles (f00 each cycle)
-                    grib_dir = grib_dir_parent.joinpath('hrrr.' + this_dt_yyyymmdd, 'conus')
+                    grib_dir = grib_dir_parent.joinpath('hrrr.' + this_dt_yyyymmdd + date_dir_suffix, 'conus')
                 else:
                     # All icbc files come from a single HRRR model cycle
-                    grib_dir = grib_dir_parent.joinpath('hrrr.' + icbc_cycle_date, 'conus')
+                    grib_dir = grib_dir_parent.joinpath('hrrr.' + icbc_cycle_date + date_dir_suffix, 'conus')
 
             ## Calculate the lead hour for this cycle, accounting for the possible icbc_fc_dt offset
             lead_h = int((this_dt - cycle_dt).total_seconds() // 3600) + icbc_fc_dt
@@ -579,6 +761,7 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
 
             # Submit ungrib and get the job ID as a string in case it's useful
             # Set wait=True to force subprocess.run to wait for stdout echoed from the job scheduler
+            submit_time_list[tt] = time.time()
             if scheduler == 'slurm':
                 ret,output = exec_command(['sbatch', 'submit_ungrib.bash'], log, wait=True)
                 jobid = output.split('job ')[1].split('\\n')[0].strip()
@@ -590,6 +773,8 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
                 queue = output.split('.')[1]
                 log.info('Submitted batch job '+jobid+' to queue '+queue)
                 jobid_list[tt] = jobid
+            record_span('job_submit', submit_time_list[tt], scheduler=scheduler, job_id=jobid_list[tt],
+                        valid_time=this_dt_yyyymmdd_hh)
             time.sleep(short_time)
 
         ## Loop back through the run directories, verifying that each ungrib job finished successfully
@@ -626,6 +811,7 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
             status = False
             while not status:
                 if search_file('ungrib.log', '*** Successful completion of program ungrib.exe ***'):
+                    record_span('job', submit_time_list[tt], job_id=jobid_list[tt], valid_time=this_dt_yyyymmdd_hh)
                     status = True
                 else:
                     # Add other error message patterns to search for if needed
@@ -648,16 +834,22 @@ def main(cycle_dt_str, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, i
                 ret, output = exec_command(['mv', 'GEFS_A:' + this_dt_wrf_date_hh, str(out_dir)], log)
             elif icbc_model in variants_hrrr:
                 ret, output = exec_command(['mv', 'HRRR_soil:' + this_dt_wrf_date_hh, str(out_dir)], log)
+            if tavg_second:
+                add_tsfc(tavg, out_dir.joinpath(list(vtables)[1] + ':' + this_dt_wrf_date_hh))
 
+    check_ungrib_output(out_dir, all_dt, vtables)
+    if tavg is not None:
+        write_tavgsfc(tavg, run_dir)
     log.info('SUCCESS! All ungrib jobs completed successfully.')
 
 
 if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
     (cycle_dt, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, icbc_source, icbc_model, int_hrs, icbc_fc_dt,
-     scheduler, mem_id, hostname, hrrr_native, icbc_analysis) = parse_args()
-    main(cycle_dt, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, icbc_source, icbc_model, int_hrs, icbc_fc_dt,
-         scheduler, mem_id, hostname, hrrr_native, icbc_analysis)
+     scheduler, mem_id, hostname, hrrr_native, icbc_analysis, subset, python_ungrib, tavgsfc) = parse_args()
+    with span(this_file, cycle=cycle_dt, host=hostname):
+        main(cycle_dt, sim_hrs, wps_dir, run_dir, out_dir, grib_dir, temp_dir, icbc_source, icbc_model, int_hrs, icbc_fc_dt,
+             scheduler, mem_id, hostname, hrrr_native, icbc_analysis, subset, python_ungrib, tavgsfc)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
@@ -37,6 +37,7 @@ import logging
 import yaml
 
 from proc_util import exec_command
+from trace_util import span, record_span
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -170,10 +171,14 @@ def main(cycle_dt: str, exp_name: str, run_dir: Path, working_dir: Path, output_
 
     # Submit the jobs to sbatch
     submitted_jobids = []
+    submit_times = {}
     for upp_submitfile in submitfile_paths:
+        submit_beg = pytime.time()
         ret, output = exec_command(['sbatch', upp_submitfile], log)
         jobid = output.split('job ')[1].split('\\n')[0].strip()
         submitted_jobids.append(jobid)
+        submit_times[jobid] = submit_beg
+        record_span('job_submit', submit_beg, scheduler='slurm', job_id=jobid)
         log.info(f'Submitted UPP batch job via "sbatch {upp_submitfile}": ' + jobid)
 
     # Monitor for completion of all jobs
@@ -241,6 +246,7 @@ def main(cycle_dt: str, exp_name: str, run_dir: Path, working_dir: Path, output_
             
             if 'upp_batch.py completed successfully' in open(job_log_filename).read():
                 submitted_jobids.remove(jobid)
+                record_span('job', submit_times[jobid], job_id=jobid)
                 log.info(f'        SUCCESS! UPP job {jobid} completed successfully. {len(submitted_jobids)} UPP jobs still running...')
                 pytime.sleep(short_time)  # brief pause
             else:
@@ -318,7 +324,8 @@ if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
 
     params = parse_args()
-    main(**params)
+    with span(this_file, cycle=params['cycle_dt'], exp_name=params['exp_name']):
+        main(**params)
 
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
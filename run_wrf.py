@@ -22,6 +22,11 @@ import logging
 
 from proc_util import exec_command
 from wps_wrf_util import search_file
+from trace_util import span, start_span, record_span
+from walltime_util import plan_job, record_job
+from wrf_io_util import IO_FORMS, apply_io_profile
+from iofields_util import write_iofields
+from rsl_util import RslMonitor
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -31,6 +36,7 @@ log = logging.getLogger(__name__)
 long_time = 5
 long_long_time = 15
 short_time = 3
+progress_time = 300   # seconds between progress reports while wrf runs
 curr_dir=os.path.dirname(os.path.abspath(__file__))
 
 def parse_args():
@@ -47,6 +53,13 @@ def parse_args():
     parser.add_argument('-m', '--monitor_wrf', help='flag to keep the script active as long as wrf.exe is submitted/running on the cluster (True if flag present, False if not present)', action='store_true')
     parser.add_argument('-q', '--scheduler', default='pbs', help='string specifying the cluster job scheduler (default: pbs)')
     parser.add_argument('-a', '--hostname', default='derecho', help='string specifying the hostname (default: derecho')
+    parser.add_argument('-S', '--stall_minutes', default=30, type=int, help='with --monitor_wrf, cancel wrf if its model time has not advanced in this many minutes (0 to never cancel) (default: 30)')
+    parser.add_argument('-N', '--mpi_ranks', default=None, type=int, help='run wrf.exe on exactly this many MPI ranks instead of the planned decomposition (default: None)')
+    parser.add_argument('-M', '--run_minutes', default=None, type=int, help='integrate only this many model minutes from cycle_dt_beg, e.g. for scaling benchmarks; overrides sim_hrs in the namelist (default: None)')
+    parser.add_argument('-I', '--io_profile', default=None, choices=list(IO_FORMS), help='history output profile: serial (io_form 2), pnetcdf (io_form 11) or quilt (dedicated I/O ranks) (default: None, keep the namelist settings)')
+    parser.add_argument('-T', '--nio_tasks_per_group', default=None, type=int, help='with --io_profile quilt, I/O tasks per group; must divide nproc_y (default: None, one per ~32 compute ranks)')
+    parser.add_argument('-G', '--nio_groups', default=None, type=int, help='with --io_profile quilt, number of I/O groups (default: None, i.e. 1)')
+    parser.add_argument('-F', '--iofields', default=None, help='comma-separated downstream consumers of wrfout (upp:<postxconfig file>, wildfire, vars:<file>); history output is trimmed to the variables they need (default: None, full history)')
 
     args = parser.parse_args()
     cycle_dt_beg = args.cycle_dt_beg
@@ -59,6 +72,13 @@ def parse_args():
     nml_tmp = args.nml_tmp
     scheduler = args.scheduler
     hostname = args.hostname
+    stall_minutes = args.stall_minutes
+    mpi_ranks = args.mpi_ranks
+    run_minutes = args.run_minutes
+    io_profile = args.io_profile
+    nio_tasks_per_group = args.nio_tasks_per_group
+    nio_groups = args.nio_groups
+    iofields = args.iofields.split(',') if args.iofields else None
 
     if len(cycle_dt_beg) != 11 or cycle_dt_beg[8] != '_':
         log.error('ERROR! Incorrect format for argument cycle_dt_beg in call to run_real.py. Exiting!')
@@ -94,9 +114,11 @@ def parse_args():
     if args.monitor_wrf:
         monitor_wrf = True
 
-    return cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname
+    return cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname, stall_minutes, mpi_ranks, run_minutes, io_profile, nio_tasks_per_group, nio_groups, iofields
 
-def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname):
+def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname,
+         stall_minutes=30, mpi_ranks=None, run_minutes=None, io_profile=None, nio_tasks_per_group=None, nio_groups=None,
+         iofields=None):
 
     log.info(f'Running run_wrf.py from directory: {curr_dir}')
 
@@ -107,7 +129,10 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
 
     cycle_dt = pd.to_datetime(cycle_dt_beg, format=fmt_yyyymmdd_hh)
     beg_dt = cycle_dt
-    end_dt = beg_dt + dt.timedelta(hours=sim_hrs)
+    if run_minutes is None:
+        end_dt = beg_dt + dt.timedelta(hours=sim_hrs)
+    else:
+        end_dt = beg_dt + dt.timedelta(minutes=run_minutes)
 
     beg_dt_wrf = beg_dt.strftime(fmt_wrf_dt)
     end_dt_wrf = end_dt.strftime(fmt_wrf_dt)
@@ -150,10 +175,22 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
     shutil.copy(tmp_dir.joinpath(nml_tmp), 'namelist.input.template')
 
     ## Modify the namelist for this date and simulation length
+    with open('namelist.input.template', 'r') as in_file:
+        has_run_minutes = any(line.strip()[0:11] == 'run_minutes' for line in in_file)
     with open('namelist.input.template', 'r') as in_file, open('namelist.input', 'w') as out_file:
         for line in in_file:
             if line.strip()[0:9] == 'run_hours':
-                out_file.write(' run_hours                = '+str(sim_hrs)+',\n')
+                if run_minutes is None:
+                    out_file.write(' run_hours                = '+str(sim_hrs)+',\n')
+                else:
+                    # A short benchmark run: the run_* entries take precedence over the end_* dates in WRF
+                    out_file.write(' run_hours                = 0,\n')
+                    if not has_run_minutes:
+                        out_file.write(' run_minutes              = '+str(run_minutes)+',\n')
+            elif line.strip()[0:8] == 'run_days' and run_minutes is not None:
+                out_file.write(' run_days                 = 0,\n')
+            elif line.strip()[0:11] == 'run_minutes' and run_minutes is not None:
+                out_file.write(' run_minutes              = '+str(run_minutes)+',\n')
             elif line.strip()[0:10] == 'start_year':
                 out_file.write(' start_year               = '+str(beg_yr)+', '+str(beg_yr)+', '+str(beg_yr)+',\n')
             elif line.strip()[0:11] == 'start_month':
@@ -226,6 +263,14 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
                 log.warning(f'         That file was not found in {tmp_dir},')
                 log.warning('         so cannot be copied to the run directory.')
 
+    ## Trim the history stream to the variables the declared downstream consumers read
+    if iofields:
+        try:
+            write_iofields('namelist.input', 'wrf_iofields.txt', iofields, wrf_dir, log)
+        except (ValueError, OSError) as e:
+            log.error('ERROR: unable to generate the iofields file: ' + str(e) + '. Exiting!')
+            sys.exit(1)
+
     ## Clean up any rsl.out, rsl.error, and wrf log files
     files = glob.glob('rsl.*')
     for file in files:
@@ -234,11 +279,31 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
     for file in files:
         ret,output = exec_command(['rm',file], log, False, False)
     files = glob.glob('wrf.o*')
+    for file in files:
+        ret,output = exec_command(['rm',file], log, False, False)
+    files = glob.glob('WRF_BEG') + glob.glob('WRF_END')
     for file in files:
         ret,output = exec_command(['rm',file], log, False, False)
 
+    ## Choose the MPI decomposition for this domain and use it in namelist.input and submit_wrf.bash
+    ## and apply the history I/O profile, leaving room in the rank count for any quilting I/O tasks
+    try:
+        apply_io_profile(io_profile, 'submit_wrf.bash', 'namelist.input', wrf_dir, log, ranks=mpi_ranks,
+                         nio_tasks_per_group=nio_tasks_per_group, nio_groups=nio_groups)
+    except ValueError as e:
+        log.error('ERROR: ' + str(e) + '. Exiting!')
+        sys.exit(1)
+
+    ## Request walltime for this domain and simulation length from the runtime history of earlier wrf jobs
+    ## (short benchmark runs are not sized from, nor added to, that history)
+    if run_minutes is None:
+        job_plan = plan_job('wrf', 'submit_wrf.bash', 'namelist.input', sim_hrs, log)
+    else:
+        job_plan = None
+
     # Submit wrf and get the job ID as a string
     # Set wait=True to force subprocess.run to wait for stdout echoed from the job scheduler
+    submit_span = start_span('job_submit', scheduler=scheduler)
     if exp_name is None:
         jobname = 'wrf_' + str(beg_dy) + '_' + str(beg_hr)
     else:
@@ -255,6 +320,8 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
     else:
         log.error('ERROR: Unknown job scheduler. Exiting!')
         sys.exit(1)
+    submit_span.set(job_id=jobid).end()
+    submit_end = time.time()
 
     time.sleep(long_time)   # give the file system a moment
 
@@ -271,16 +338,45 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
                 time.sleep(long_time)
             else:
                 log.info('wrf is now running on the cluster . . .')
+                record_span('queue_wait', submit_end, job_id=jobid)
+                run_span = start_span('run', job_id=jobid)
+                run_beg = time.time()
                 status = True
+        ## Tail rsl.out.0000 for model speed, I/O fraction and ETA; publish them to wrf_status.json and the log
+        rsl = RslMonitor('rsl.out.0000', beg_dt, end_dt, run_beg)
+        last_report = time.time()
         status = False
         while not status:
-            if search_file(str(run_dir) + '/rsl.out.0000', 'SUCCESS COMPLETE WRF'):
+            rsl.update()
+            rsl.write_status('wrf_status.json', job_id=jobid)
+            if rsl.success:
                 log.info('SUCCESS! wrf completed successfully.')
+                log.info('wrf finished: ' + rsl.summary())
+                run_span.set(speed=round(rsl.speed, 2), io_fraction=round(rsl.io_fraction, 3)).end()
+                record_job(job_plan, 'WRF_BEG', run_beg, jobid)
                 time.sleep(short_time)  # brief pause to let the file system gather itself
                 status = True
             else:
+                if time.time() - last_report >= progress_time:
+                    log.info('wrf progress: ' + rsl.summary())
+                    last_report = time.time()
+
+                ## A run whose model time stops advancing is hung; cancel it rather than let it burn its walltime
+                if stall_minutes > 0 and rsl.stalled_s > stall_minutes * 60:
+                    log.error('ERROR: wrf model time has not advanced past ' + str(rsl.status()['model_time']) +
+                              ' in ' + str(stall_minutes) + ' minutes. Cancelling job ' + jobid + '.')
+                    if scheduler == 'slurm':
+                        ret,output = exec_command(['scancel', jobid], log, False)
+                    elif scheduler == 'pbs':
+                        ret,output = exec_command(['qdel', jobid], log, False)
+                    rsl.write_status('wrf_status.json', job_id=jobid, stalled=True)
+                    run_span.end(status='error')
+                    log.error('Consult ' + str(run_dir) + '/rsl.out.0000 for where it stopped.')
+                    log.error('Exiting!')
+                    sys.exit(1)
+
                 ## The rsl.error files might be empty for a time, which may cause an error if attempting to read it
-                if os.stat('rsl.error.0000') == 0:
+                if os.stat('rsl.error.0000').st_size == 0:
                     time.sleep(long_time)
                 else:
                     ## Loop through the rsl.error.* files to look for fatal errors
@@ -311,8 +407,10 @@ def main(cycle_dt_beg, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name,
 
 if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
-    cycle_dt, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname = parse_args()
-    main(cycle_dt, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname)
+    cycle_dt, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname, stall_minutes, mpi_ranks, run_minutes, io_profile, nio_tasks_per_group, nio_groups, iofields = parse_args()
+    with span(this_file, cycle=cycle_dt, exp_name=exp_name, host=hostname):
+        main(cycle_dt, sim_hrs, wrf_dir, run_dir, tmp_dir, icbc_model, exp_name, nml_tmp, monitor_wrf, scheduler, hostname,
+             stall_minutes, mpi_ranks, run_minutes, io_profile, nio_tasks_per_group, nio_groups, iofields)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
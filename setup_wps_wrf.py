@@ -23,9 +23,17 @@ import yaml
 import subprocess
 import glob
 import socket
+import atexit
 from argparse import RawTextHelpFormatter
 
 from proc_util import exec_command
+from trace_util import enable, span, start_span
+from walltime_util import RUNTIME_DB_ENV
+from compress_wrfout import compress_files, summarize
+from icbc_check import plan_cycles, summarize_plan
+from grib_store import GribStore, STORE_ENV, MAX_BYTES_ENV, MAX_FILES_ENV, OWNER_ENV
+from wps_cache import SharedWps, wps_key
+from rda_catalog import CATALOG_ENV
 
 this_file = os.path.basename(__file__)
 logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
@@ -64,6 +72,28 @@ def parse_args():
      'do_real':     'flag to run real for this case',
      'do_wrf':      'flag to submit wrf for this case',
      'do_upp':      'flag to perform UPP post-processing to grib2 for this case',
+     'trace_file':  'string or Path object of a JSON-lines file to append timing spans (cycle, stage, job submit, queue wait, run, post-move) to (default: None, or $WPS_WRF_TRACE_FILE)',
+     'runtime_db':  'string or Path object of a JSON-lines file recording the run time of each geogrid/metgrid/real/wrf job, used to request walltime and cores for later jobs (default: None, or $WPS_WRF_RUNTIME_DB)',
+     'wrf_io_profile': 'string specifying the WRF history output profile: serial (io_form 2), pnetcdf (io_form 11), or quilt (dedicated I/O ranks) (default: None, keep the namelist template settings)',
+     'nio_tasks_per_group': 'integer number of I/O tasks per quilting group with wrf_io_profile quilt; must divide nproc_y (default: None, about one per 32 compute ranks)',
+     'nio_groups': 'integer number of quilting I/O groups with wrf_io_profile quilt (default: None, i.e. 1)',
+     'compress_wrfout': 'flag to convert wrfout files to compressed, rechunked netCDF4 (verified against the originals) when archiving them (default: False)',
+     'compression': 'string specifying the compression filter for compress_wrfout: zlib or zstd (default: zlib)',
+     'compress_workers': 'integer number of wrfout files compressed at once (default: 4)',
+     'iofields_consumers': 'list of downstream consumers of wrfout (upp:<postxconfig file>, wildfire, vars:<file>) to trim the WRF history output to (default: None, full history)',
+     'preflight': 'flag to check that every cycle\'s IC/LBC files are available before anything is downloaded or submitted, and skip cycles whose files are missing (default: False)',
+     'preflight_max_fc_dt': 'integer largest icbc_fc_dt that preflight may move a cycle to, using an older IC/LBC cycle, when files are missing (default: None, no rescheduling)',
+     'preflight_cache': 'string or Path object of a JSON file caching IC/LBC availability between runs (default: None)',
+     'grib_store_max_gb': 'float size budget in GB for grib_dir; least recently used grib files not pinned by a running cycle are deleted to stay under it (default: None, unlimited)',
+     'grib_store_max_files': 'integer file (inode) budget for grib_dir, enforced the same way (default: None, unlimited)',
+     'subset_pad_deg': 'float padding in degrees added around the domain when cropping grib2 files for ungrib_domain = subset (default: 1.0)',
+     'subset_workers': 'integer number of grib2 files cropped concurrently for ungrib_domain = subset (default: 8)',
+     'ungrib_in_python': 'boolean flag to convert grib2 files in-process with grib2_to_wps.py instead of queuing ungrib.exe jobs; only for models whose Vtables have been validated against ungrib.exe with grib2_to_wps.py --compare --record (default: False)',
+     'avg_tsfc_in_python': 'boolean flag to compute TAVGSFC in-process with tavgsfc.py instead of avg_tsfc.exe; with do_ungrib it is accumulated as ungrib finishes each time (default: False)',
+     'gefs_members': 'list of GEFS members (e.g., [01, 02, 03]) to run as one ensemble: all members are downloaded through one concurrent pool and ungribbed/metgridded as job arrays in wps_run_dir/<cycle>/memNN, sharing geogrid (default: None, one member from exp_name)',
+     'download_workers': 'integer number of GEFS files downloaded concurrently across members and lead times (default: 16)',
+     'share_wps': 'boolean flag to run ungrib/avg_tsfc/metgrid once per distinct set of WPS inputs, in wps_run_dir/<cycle>/wps_<key>, and link each experiment to it; runs needing the same outputs wait for the first one (default: False)',
+     'rda_catalog': 'string or Path object of the JSON index of the GLADE RDA directories used to check and link GFS/GFS_FNL files (default: None, or $WPS_WRF_RDA_CATALOG, else ~/.cache/wps_wrf/rda_catalog.json)',
      #Add new parameters here
     }
 
@@ -135,6 +165,28 @@ def parse_args():
     params.setdefault('do_real', False)
     params.setdefault('do_wrf', False)
     params.setdefault('do_upp', False)
+    params.setdefault('trace_file', None)
+    params.setdefault('runtime_db', None)
+    params.setdefault('wrf_io_profile', None)
+    params.setdefault('nio_tasks_per_group', None)
+    params.setdefault('nio_groups', None)
+    params.setdefault('compress_wrfout', False)
+    params.setdefault('compression', 'zlib')
+    params.setdefault('compress_workers', 4)
+    params.setdefault('iofields_consumers', None)
+    params.setdefault('preflight', False)
+    params.setdefault('preflight_max_fc_dt', None)
+    params.setdefault('preflight_cache', None)
+    params.setdefault('grib_store_max_gb', None)
+    params.setdefault('grib_store_max_files', None)
+    params.setdefault('subset_pad_deg', 1.0)
+    params.setdefault('subset_workers', 8)
+    params.setdefault('ungrib_in_python', False)
+    params.setdefault('avg_tsfc_in_python', False)
+    params.setdefault('gefs_members', None)
+    params.setdefault('download_workers', 16)
+    params.setdefault('share_wps', False)
+    params.setdefault('rda_catalog', None)
 
     params['hostname'] = hostname
     params['grib_dir_parent'] = pathlib.Path(params['grib_dir'])
@@ -171,11 +223,40 @@ def parse_args():
 
     return params
 
+def template_int_hrs(nml_tmp):
+    ## Read interval_seconds from a template namelist.wps and convert it to int_hrs
+    with open(nml_tmp) as nml:
+        for line in nml:
+            if line.strip()[0:16] == 'interval_seconds':
+                return int(line.split('=')[1].strip().split(',')[0]) // 3600
+    log.error('ERROR: No interval_seconds entry in ' + str(nml_tmp) + '. Add one (e.g., interval_seconds = 10800,).')
+    log.error('Exiting!')
+    sys.exit(1)
+
+def gefs_member_id(exp_name):
+    ## Make an assumption about which GEFS member to download or linked to based on exp_name
+    ## Assume it starts with memNN or expNN, and set NN to the GEFS member to get or link to
+    if exp_name is None or exp_name[0:3] not in ['mem', 'exp']:
+        return None
+    mem_id = exp_name[3:5]
+    ## If this number exceeds the GEFS members, then base it only on the last number to get member 01-10
+    if int(mem_id) > 20:
+        mem_id = exp_name[4]
+        if mem_id == '0':
+            mem_id = '10'
+        else:
+            mem_id = '0'+mem_id
+    return mem_id
+
 def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, exp_name, realtime, archive, hostname,
          icbc_model, icbc_source, icbc_analysis, ungrib_domain, grib_dir_parent, wps_ins_dir, wrf_ins_dir, hrrr_native,
          wps_run_dir_parent, wrf_run_dir_parent, template_dir, arc_dir_parent,
          upp_working_dir, upp_yaml, upp_domains,
-         get_icbc, do_geogrid, do_ungrib, do_avg_tsfc, use_tavgsfc, do_metgrid, do_real, do_wrf, do_upp):
+         get_icbc, do_geogrid, do_ungrib, do_avg_tsfc, use_tavgsfc, do_metgrid, do_real, do_wrf, do_upp, trace_file, runtime_db,
+         wrf_io_profile, nio_tasks_per_group, nio_groups, compress_wrfout, compression, compress_workers,
+         iofields_consumers, preflight, preflight_max_fc_dt, preflight_cache, grib_store_max_gb, grib_store_max_files,
+         subset_pad_deg, subset_workers, ungrib_in_python, avg_tsfc_in_python, gefs_members, download_workers,
+         share_wps, rda_catalog):
 
     ## String format statements
     fmt_exp_dir        = '%Y-%m-%d_%H'
@@ -193,12 +274,62 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
     variants_gefs = ['GEFS', 'gefs']
     variants_hrrr = ['HRRR', 'hrrr']
 
+    ## Ensemble mode: WPS for all listed GEFS members of a cycle at once, each member in wps_run_dir/<cycle>/memNN
+    if gefs_members:
+        if isinstance(gefs_members, str):
+            gefs_members = gefs_members.split(',')
+        # yaml reads unquoted 01 as the integer 1
+        gefs_members = [str(member).strip().zfill(2) for member in gefs_members]
+        if icbc_model not in variants_gefs:
+            log.error('ERROR: gefs_members is only supported with icbc_model = GEFS. Exiting!')
+            sys.exit(1)
+        if exp_name is not None or do_real or do_wrf or do_upp or archive:
+            log.error('ERROR: gefs_members runs get_icbc, geogrid, ungrib, avg_tsfc and metgrid for the whole ensemble,')
+            log.error('       with exp_name unset. Run real/wrf/upp/archive per member with exp_name = memNN. Exiting!')
+            sys.exit(1)
+        log.info('Ensemble mode for GEFS members ' + ','.join(gefs_members))
+        if share_wps:
+            log.error('ERROR: share_wps is not supported together with gefs_members. Exiting!')
+            sys.exit(1)
+
+    ## Write timing spans for this run (and every run_*.py it launches) if requested
+    if trace_file is not None:
+        enable(trace_file)
+
+    ## Size batch job requests from (and add to) a history of job run times if requested
+    if runtime_db is not None:
+        os.environ[RUNTIME_DB_ENV] = str(runtime_db)
+
+    ## Index of the GLADE RDA directories shared by the pre-flight check and the link scripts
+    if rda_catalog is not None:
+        os.environ[CATALOG_ENV] = str(rda_catalog)
+
+    ## Keep grib_dir_parent within a size/file budget. The download and link scripts register every file they fetch
+    ## with the store through these environment variables; files stay pinned by their cycle until its ungrib is done.
+    grib_store = None
+    if grib_store_max_gb is not None or grib_store_max_files is not None:
+        os.environ[STORE_ENV] = str(grib_dir_parent)
+        if grib_store_max_gb is not None:
+            os.environ[MAX_BYTES_ENV] = str(int(float(grib_store_max_gb) * 1e9))
+        if grib_store_max_files is not None:
+            os.environ[MAX_FILES_ENV] = str(int(grib_store_max_files))
+        grib_store = GribStore.from_env()
+        log.info(f'Adopted {grib_store.scan()} untracked file(s) into the grib store {grib_dir_parent}')
+        grib_store.evict()
+
     ## Date/time manipulation
     cycle_dt_beg = pd.to_datetime(cycle_dt_str_beg, format=fmt_yyyymmdd_hh)
     cycle_dt_end = pd.to_datetime(cycle_dt_str_end, format=fmt_yyyymmdd_hh)
     cycle_dt_all = pd.date_range(start=cycle_dt_beg, end=cycle_dt_end, freq=str(cycle_int_h)+'h')
     n_cycles = len(cycle_dt_all)
 
+    # run_ensemble_wps.py reads GEFS v12 file names only; older (v11) cycles have other names and resolution
+    gefsv12_dt = dt.datetime(2020, 9, 23, 12, 0, 0)
+    if gefs_members and cycle_dt_beg - dt.timedelta(hours=icbc_fc_dt) < gefsv12_dt:
+        log.error('ERROR: gefs_members needs GEFS v12 cycles (' + str(gefsv12_dt) + ' or later), but the first')
+        log.error('       IC/LBC cycle is ' + str(cycle_dt_beg - dt.timedelta(hours=icbc_fc_dt)) + '. Exiting!')
+        sys.exit(1)
+
     if icbc_analysis and icbc_fc_dt != 0:
         log.error('ERROR: icbc_analysis = True and icbc_fc_dt = ' + str(icbc_fc_dt) + '. Incompatible options.')
         log.error('If icbc_analysis = True is desired, then set icbc_fc_dt = 0 and re-run the workflow.')
@@ -222,9 +353,36 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
             sys.exit(1)
     log.info('Using the '+scheduler+' scheduler for batch job submission')
 
+    ## Check every cycle's IC/LBC files before anything is downloaded or submitted. Cycles whose files are missing
+    ## are skipped, or moved to an older IC/LBC cycle (larger icbc_fc_dt) if preflight_max_fc_dt allows it.
+    icbc_fc_dt_req = icbc_fc_dt
+    icbc_plan = None
+    if preflight and get_icbc:
+        int_hrs = template_int_hrs(template_dir.joinpath('namelist.wps.'+icbc_model.lower()))
+        if icbc_model in variants_gefs:
+            mem_id = gefs_members or gefs_member_id(exp_name)
+        else:
+            mem_id = None
+        with span('preflight', cycles=n_cycles, icbc_model=icbc_model, icbc_source=icbc_source):
+            try:
+                icbc_plan = plan_cycles([cycle.strftime(fmt_yyyymmdd_hh) for cycle in cycle_dt_all], icbc_model,
+                                        icbc_source, sim_hrs, int_hrs, icbc_fc_dt, icbc_analysis, hrrr_native, mem_id,
+                                        preflight_max_fc_dt, cache_file=preflight_cache)
+            except ValueError as e:
+                log.error('ERROR: IC/LBC pre-flight check failed: ' + str(e))
+                log.error('Exiting!')
+                sys.exit(1)
+        summarize_plan(icbc_plan, icbc_fc_dt, log)
+
     ## Loop over forecast cycles
     for cc in range(n_cycles):
         cycle_dt = cycle_dt_all[cc]
+        icbc_fc_dt = icbc_fc_dt_req
+        if icbc_plan is not None:
+            icbc_fc_dt = icbc_plan[cycle_dt.strftime(fmt_yyyymmdd_hh)]['icbc_fc_dt']
+            if icbc_fc_dt is None:
+                log.warning('WARNING: Skipping cycle ' + cycle_dt.strftime(fmt_yyyymmdd_hh) + ', its IC/LBC files are not available')
+                continue
         cycle_yr = cycle_dt.strftime('%Y')
         cycle_mo = cycle_dt.strftime('%m')
         cycle_dy = cycle_dt.strftime('%d')
@@ -232,6 +390,7 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
         cycle_yyyymmdd    = cycle_dt.strftime(fmt_yyyymmdd)
         cycle_yyyymmdd_hh = cycle_dt.strftime(fmt_yyyymmdd_hh)
         cycle_str = cycle_yyyymmdd_hh
+        cycle_span = start_span('cycle', cycle=cycle_str, exp_name=exp_name, icbc_model=icbc_model, host=hostname)
 
         ## Directories for WPS & WRF where everything should be linked & run
         geo_run_dir = wps_run_dir_parent.joinpath('geogrid')
@@ -280,7 +439,7 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
                 template_dir.joinpath(wps_nml_tmp)) + ' does not exist.')
             log.error('Exiting!')
             sys.exit(1)
-        if not template_dir.joinpath(wrf_nml_tmp).exists():
+        if not gefs_members and not template_dir.joinpath(wrf_nml_tmp).exists():
             log.error('ERROR: Expected WRF namelist template file ' + str(
                 template_dir.joinpath(wrf_nml_tmp)) + ' does not exist.')
             log.error('Exiting!')
@@ -355,37 +514,28 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
         ## Read the template namelist.wps to get interval_seconds, and convert to int_hrs
         nml_tmp = template_dir.joinpath('namelist.wps.'+icbc_model.lower())
         log.info('Opening '+str(nml_tmp))
-        with open(nml_tmp) as nml:
-            for line in nml:
-                if line.strip()[0:16] == 'interval_seconds':
-                    int_sec = int(line.split('=')[1].strip().split(',')[0])
-                    int_hrs = int_sec // 3600
-                    break
+        int_hrs = template_int_hrs(nml_tmp)
 
         # Build the array of valid times for this simulation (most needed for icbc_analysis=True)
         valid_dt_all = pd.date_range(start=beg_dt, end=end_dt, freq=str(int_hrs) + 'h')
         n_valid = len(valid_dt_all)
 
-        if icbc_model in variants_gefs:
+        if icbc_model in variants_gefs and not gefs_members:
             if exp_name is None:
                 log.error('ERROR! exp_name is None, so a GEFS member number cannot be extracted. Exiting!')
-            ## Make an assumption about which GEFS member to download or linked to based on exp_name
-            ## Assume it starts with memNN or expNN, and set NN to the GEFS member to get or link to
-            if exp_name[0:3] in ['mem', 'exp']:
-                mem_id = exp_name[3:5]
-                ## If this number exceeds the GEFS members, then base it only on the last number to get member 01-10
-                if int(mem_id) > 20:
-                    mem_id = exp_name[4]
-                    if mem_id == '0':
-                        mem_id = '10'
-                    else:
-                        mem_id = '0'+mem_id
-            else:
+                sys.exit(1)
+            mem_id = gefs_member_id(exp_name)
+            if mem_id is None:
                 log.error('ERROR! Unable to obtain a GEFS member number from exp_name. Exiting!')
                 sys.exit(1)
         else:
             mem_id = None
 
+        ## Files this cycle fetches stay pinned in the grib store until its ungrib has run
+        grib_owner = cycle_str if exp_name is None else cycle_str + '/' + exp_name
+        if grib_store is not None:
+            os.environ[OWNER_ENV] = grib_owner
+
         if get_icbc:
             # If an ICBC dataset is locally available on GLADE, use that instead of downloading from an external repo
             if icbc_model in variants_gfs:
@@ -424,7 +574,8 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
                     sys.exit(1)
                 elif icbc_source in variants_aws:
                     cmd_list = ['python', 'download_gefs_from_aws.py', '-b', icbc_cycle_str, '-s', str(sim_hrs),
-                         '-i', str(int_hrs), '-m', mem_id, '-o', grib_dir_full, '-f', str(icbc_fc_dt)]
+                         '-i', str(int_hrs), '-m', ','.join(gefs_members) if gefs_members else mem_id,
+                         '-o', grib_dir_full, '-f', str(icbc_fc_dt), '-j', str(download_workers)]
                 else:
                     log.error('ERROR: No option yet to download or link to GEFS data from icbc_source=' + icbc_source + ' in setup_wps_wrf.py.')
                     log.error('Exiting!')
@@ -451,14 +602,95 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
                 sys.exit(1)
 
             # Execute the command to get ICs/LBCs
-            ret, output = exec_command(cmd_list, log)
+            with span('get_icbc'):
+                ret, output = exec_command(cmd_list, log)
 
         if do_geogrid:
             cmd_list = ['python', 'run_geogrid.py', '-w', wps_ins_dir, '-r', geo_run_dir, '-t', template_dir,
                  '-n', wps_nml_tmp, '-q', scheduler, '-a', hostname]
-            ret, output = exec_command(cmd_list, log)
-
-        if do_ungrib:
+            with span('geogrid'):
+                ret, output = exec_command(cmd_list, log)
+
+        ## With share_wps, ungrib/avg_tsfc/metgrid run once per distinct set of WPS inputs, in a directory named by a
+        ## hash of them. The first run to claim it produces the stages it needs; others wait for it, run only the
+        ## stages still missing, and link to it.
+        shared_wps = None
+        wps_stages = [stage for stage, do_stage in [('ungrib', do_ungrib), ('avg_tsfc', do_avg_tsfc),
+                                                    ('metgrid', do_metgrid)] if do_stage]
+        if do_avg_tsfc:
+            # Whether avg_tsfc runs here or ran before, metgrid uses its TAVGSFC
+            use_tavgsfc = True
+        exp_wps_run_dir = wps_run_dir
+        if share_wps and wps_stages:
+            from run_ungrib import ungrib_vtables
+            wps_files = [template_dir.joinpath(wps_nml_tmp), wps_ins_dir.joinpath('metgrid', 'METGRID.TBL')]
+            if icbc_model in variants_gefs:
+                wps_files += [template_dir.joinpath('namelist.wps.gefs_a'), template_dir.joinpath('namelist.wps.gefs_b')]
+            vtable_dir = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).joinpath('custom_vtables')
+            wps_files += list(ungrib_vtables(icbc_model, hrrr_native, wps_ins_dir, vtable_dir).values())
+            geo_dir = None
+            with open(template_dir.joinpath(wps_nml_tmp)) as nml:
+                for line in nml:
+                    if line.strip()[0:28] == 'opt_output_from_geogrid_path':
+                        geo_dir = line.split(sep='=')[1].split(sep='\'')[1]
+            wps_settings = {'icbc_model': icbc_model.upper(), 'icbc_source': icbc_source.upper(), 'cycle': cycle_str,
+                            'icbc_cycle': icbc_cycle_str, 'sim_hrs': sim_hrs, 'int_hrs': int_hrs,
+                            'icbc_analysis': icbc_analysis, 'hrrr_native': hrrr_native, 'mem_id': mem_id,
+                            'ungrib_domain': ungrib_domain,
+                            'subset_pad_deg': subset_pad_deg if ungrib_domain == 'subset' else None,
+                            'ungrib_in_python': ungrib_in_python, 'tavgsfc': do_avg_tsfc or use_tavgsfc,
+                            'avg_tsfc_in_python': avg_tsfc_in_python, 'wps_ins_dir': str(wps_ins_dir)}
+            shared_wps = SharedWps(wps_run_dir_parent.joinpath(cycle_yyyymmdd_hh),
+                                   wps_key(wps_settings, wps_files, geo_dir))
+            with span('wait_shared_wps', key=shared_wps.key):
+                needed = wps_stages
+                wps_stages = shared_wps.acquire(grib_owner, needed, use_tavgsfc)
+            if wps_stages:
+                log.info('Producing ' + ', '.join(wps_stages) + ' in the shared WPS directory ' + str(shared_wps.dir))
+                if set(wps_stages) - set(needed):
+                    log.info('Also running ' + ', '.join(sorted(set(wps_stages) - set(needed)))
+                             + ': their output is not yet in ' + str(shared_wps.dir) + ' and the requested stages read it')
+                # If a stage fails and exits, release the claim so that a waiting run can take over
+                atexit.register(shared_wps.release)
+            else:
+                log.info('Reusing the WPS output in ' + str(shared_wps.dir) + ' (same inputs as an earlier run)')
+                if grib_store is not None:
+                    grib_store.unpin(grib_owner)
+            wps_run_dir = shared_wps.dir
+            ungrib_dir = wps_run_dir.joinpath('ungrib')
+            metgrid_dir = wps_run_dir.joinpath('metgrid')
+
+        if 'ungrib' in wps_stages and ungrib_domain == 'subset':
+            # Crop the full-domain grib2 files to this domain (plus padding) into the .subset tree
+            for member in (gefs_members or [mem_id]):
+                cmd_list = ['python', 'subset_grib.py', '-b', cycle_str, '-s', str(sim_hrs), '-i', str(int_hrs),
+                            '-f', str(icbc_fc_dt), '-m', icbc_model, '-c', icbc_source, '-g', grib_dir_parent,
+                            '-t', template_dir.joinpath(wps_nml_tmp), '-p', str(subset_pad_deg), '-w', str(subset_workers)]
+                if icbc_analysis:
+                    cmd_list.append('-a')
+                if hrrr_native:
+                    cmd_list.append('-v')
+                if member is not None:
+                    cmd_list.append('-n')
+                    cmd_list.append(member)
+                with span('subset_grib'):
+                    ret, output = exec_command(cmd_list, log)
+
+        if 'ungrib' in wps_stages and gefs_members:
+            # All members' ungrib jobs go to the queue as job arrays
+            cmd_list = ['python', 'run_ensemble_wps.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wps_ins_dir,
+                        '-r', wps_run_dir, '-g', grib_dir, '-t', template_dir, '-e', ','.join(gefs_members),
+                        '-i', str(int_hrs), '-f', str(icbc_fc_dt), '-q', scheduler, '-a', hostname, '-u']
+            if ungrib_in_python:
+                cmd_list.append('-P')
+            if 'avg_tsfc' in wps_stages and avg_tsfc_in_python:
+                cmd_list.append('-T')
+            with span('ungrib', members=len(gefs_members)):
+                ret, output = exec_command(cmd_list, log)
+            if grib_store is not None:
+                grib_store.unpin(grib_owner)
+                grib_store.evict()
+        elif 'ungrib' in wps_stages:
             cmd_list = ['python', 'run_ungrib.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wps_ins_dir,
                         '-r', wps_run_dir, '-o', ungrib_dir, '-t', template_dir, '-m', icbc_model,
                         '-i', str(int_hrs), '-q', scheduler, '-f', str(icbc_fc_dt), '-a', hostname, '-c', icbc_source]
@@ -474,23 +706,58 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
 
             if icbc_model in variants_hrrr and icbc_analysis:
                 cmd_list.append('-l')
+            if ungrib_domain == 'subset' and (icbc_model in variants_gfs_fnl or icbc_model in variants_hrrr):
+                cmd_list.append('-S')
+            if ungrib_in_python:
+                cmd_list.append('-P')
+            if 'avg_tsfc' in wps_stages and avg_tsfc_in_python:
+                cmd_list.append('-T')
             if hrrr_native:
                 cmd_list.append('-v')
             if mem_id is not None:
                 cmd_list.append('-n')
                 cmd_list.append(mem_id)
-            ret, output = exec_command(cmd_list, log)
-
-        if do_avg_tsfc:
-            cmd_list = ['python', 'run_avg_tsfc.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wps_ins_dir,
-                        '-r', wps_run_dir, '-u', ungrib_dir, '-t', template_dir, '-m', icbc_model]
-            if hrrr_native:
-                cmd_list.append('-v')
-            ret, output = exec_command(cmd_list, log)
+            with span('ungrib'):
+                ret, output = exec_command(cmd_list, log)
+            if grib_store is not None:
+                grib_store.unpin(grib_owner)
+                grib_store.evict()
+        if 'ungrib' in wps_stages and shared_wps is not None:
+            shared_wps.mark(['ungrib'], dict(wps_settings, producer=grib_owner))
+
+        if 'avg_tsfc' in wps_stages:
+            # With avg_tsfc_in_python, run_ungrib.py -T has already written TAVGSFC
+            if not (avg_tsfc_in_python and 'ungrib' in wps_stages):
+                # In ensemble mode each member has its own ungrib output and TAVGSFC
+                if gefs_members:
+                    member_dirs = [wps_run_dir.joinpath('mem' + member) for member in gefs_members]
+                else:
+                    member_dirs = [wps_run_dir]
+                for member_dir in member_dirs:
+                    cmd_list = ['python', 'run_avg_tsfc.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wps_ins_dir,
+                                '-r', member_dir, '-u', member_dir.joinpath('ungrib'), '-t', template_dir,
+                                '-m', icbc_model]
+                    if hrrr_native:
+                        cmd_list.append('-v')
+                    if avg_tsfc_in_python:
+                        cmd_list.append('-p')
+                    with span('avg_tsfc'):
+                        ret, output = exec_command(cmd_list, log)
             # If we just ran avg_tsfc.exe, then we'll want to use TAVGSFC when running metgrid
             use_tavgsfc = True
-
-        if do_metgrid:
+            if shared_wps is not None:
+                shared_wps.mark(['avg_tsfc'], dict(wps_settings, producer=grib_owner))
+
+        if 'metgrid' in wps_stages and gefs_members:
+            # All members' metgrid jobs go to the queue as one job array
+            cmd_list = ['python', 'run_ensemble_wps.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wps_ins_dir,
+                        '-r', wps_run_dir, '-t', template_dir, '-e', ','.join(gefs_members), '-i', str(int_hrs),
+                        '-f', str(icbc_fc_dt), '-q', scheduler, '-a', hostname, '-m']
+            if use_tavgsfc:
+                cmd_list.append('-G')
+            with span('metgrid', members=len(gefs_members)):
+                ret, output = exec_command(cmd_list, log)
+        elif 'metgrid' in wps_stages:
             cmd_list = ['python', 'run_metgrid.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wps_ins_dir,
                         '-r', wps_run_dir, '-o', metgrid_dir, '-u', ungrib_dir, '-t', template_dir, '-m', icbc_model,
                         '-q', scheduler, '-a', hostname]
@@ -498,7 +765,16 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
                 cmd_list.append('-v')
             if use_tavgsfc:
                 cmd_list.append('-g')
-            ret, output = exec_command(cmd_list, log)
+            with span('metgrid'):
+                ret, output = exec_command(cmd_list, log)
+
+        if shared_wps is not None:
+            if wps_stages:
+                if 'metgrid' in wps_stages:
+                    shared_wps.mark(['metgrid'], dict(wps_settings, producer=grib_owner))
+                atexit.unregister(shared_wps.release)
+                shared_wps.release()
+            shared_wps.link(exp_wps_run_dir)
 
         if do_real:
             cmd_list = ['python', 'run_real.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wrf_ins_dir,
@@ -507,7 +783,8 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
             if exp_name is not None:
                 cmd_list.append('-x')
                 cmd_list.append(exp_name)
-            ret, output = exec_command(cmd_list, log)
+            with span('real'):
+                ret, output = exec_command(cmd_list, log)
 
         if do_wrf:
             cmd_list = ['python', 'run_wrf.py', '-b', cycle_str, '-s', str(sim_hrs), '-w', wrf_ins_dir,
@@ -518,7 +795,16 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
                 cmd_list.append(exp_name)
             if do_upp or archive:
                 cmd_list.append('-m')
-            ret, output = exec_command(cmd_list, log)
+            if wrf_io_profile is not None:
+                cmd_list.extend(['-I', wrf_io_profile])
+            if nio_tasks_per_group is not None:
+                cmd_list.extend(['-T', str(nio_tasks_per_group)])
+            if nio_groups is not None:
+                cmd_list.extend(['-G', str(nio_groups)])
+            if iofields_consumers:
+                cmd_list.extend(['-F', ','.join(iofields_consumers)])
+            with span('wrf'):
+                ret, output = exec_command(cmd_list, log)
 
         if do_upp:
             cmd_list = ['python', 'run_upp.py', '-b', cycle_str, '-r', wrf_run_dir, '-c', upp_yaml, '-N']
@@ -530,7 +816,8 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
                 log.info(f'Sending domains_str to run_upp: {domains_str}')
                 cmd_list.append('-d')
                 cmd_list.append(str(domains_str))
-            ret, output = exec_command(cmd_list, log)
+            with span('upp'):
+                ret, output = exec_command(cmd_list, log)
 
             # # TODO: Take this out after testing
             # if not upp_yaml.exists():
@@ -553,6 +840,7 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
             #     log.info(f'Submitted UPP batch job for "sbatch {upp_submitfile}": ' + jobid)
 
         if archive:
+            move_span = start_span('post_move', arc_dir=arc_dir)
             arc_dir.joinpath('config').mkdir(exist_ok=True, parents=True)
             arc_dir.joinpath('wrfout').mkdir(exist_ok=True, parents=True)
             os.chdir(wps_run_dir)
@@ -570,19 +858,35 @@ def main(cycle_dt_str_beg, cycle_dt_str_end, cycle_int_h, sim_hrs, icbc_fc_dt, e
             for file in files:
                 ret,output = exec_command(['mv',file,str(arc_dir.joinpath('config'))],log)
             log.info('Moving wrfout* and wrfxtrm* files to '+str(arc_dir.joinpath('wrfout')))
-            files = glob.glob('wrfout*')
+            files = sorted(glob.glob('wrfout*'))
+            if compress_wrfout:
+                # Each file is only removed here once its compressed copy in arc_dir has been verified;
+                # any file that could not be converted is moved over unchanged below
+                with span('compress_wrfout', files=len(files)):
+                    results = compress_files(files, arc_dir.joinpath('wrfout'), compression=compression,
+                                             workers=compress_workers, remove_source=True)
+                log.info('Compressed wrfout files: ' + summarize(results))
+                files = []
+                for result in results:
+                    if result['status'] == 'failed':
+                        log.warning('WARNING: could not compress ' + result['src'] + ': ' + result['error'])
+                        files.append(result['src'])
             for file in files:
                 ret,output = exec_command(['mv',file,str(arc_dir.joinpath('wrfout'))],log)
             files = glob.glob('wrfxtrm*')
             for file in files:
                 ret,output = exec_command(['mv', file, str(arc_dir.joinpath('wrfout'))], log)
+            move_span.end()
+
+        cycle_span.end()
 
 
 if __name__ == '__main__':
     now_time_beg = dt.datetime.now(dt.UTC)
     params = parse_args()
     # params['now_time_beg'] = now_time_beg
-    main(**params)
+    with span(this_file):
+        main(**params)
     now_time_end = dt.datetime.now(dt.UTC)
     run_time_tot = now_time_end - now_time_beg
     now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+'''
+subset_grib.py
+
+Crops the downloaded IC/LBC grib2 files of one cycle to the WRF domain, for ungrib_domain = subset.
+
+ungrib.exe decodes every grid point of every record it is given, so a 1-km fire domain ungribbed from full CONUS
+HRRR (or global GFS/GEFS) files spends nearly all of its time and memory on points metgrid will never use. This
+script derives a lat/lon bounding box from the d01 geogrid definition in namelist.wps (map_proj, ref_lat, ref_lon,
+truelat1/2, stand_lon, dx, dy, e_we, e_sn), pads it by pad_deg so metgrid's interpolation stencil stays inside the
+input grid, and crops each file with `wgrib2 -small_grib`, which keeps the native grid (Lambert conformal for HRRR,
+lat-lon for GFS/GEFS). Crops run concurrently, one wgrib2 process per file.
+
+The cropped files mirror the full-domain tree, with '.subset' appended to the date directory:
+    hrrr.YYYYMMDD/conus/...        -> hrrr.YYYYMMDD.subset/conus/...
+    gfs.YYYYMMDD/HH/atmos/...      -> gfs.YYYYMMDD.subset/HH/atmos/...
+    gefs.YYYYMMDD/HH/atmos/...     -> gefs.YYYYMMDD.subset/HH/atmos/...
+    gfs_fnl.YYYYMMDD/...           -> gfs_fnl.YYYYMMDD.subset/...
+which is where setup_wps_wrf.py (grib_dir_subset) and run_ungrib.py (-S) look for them.
+
+The grib directory can be shared by several domains (e.g. fires on the same day). The box each cropped file covers
+is kept next to it in <file>.bbox; a crop is reused when it covers the requested box and is newer than its source,
+otherwise the file is cropped again to the union of both boxes so it still serves every domain that asked for it.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import argparse
+import subprocess
+import datetime as dt
+import concurrent.futures
+import logging
+
+import numpy as np
+
+import icbc_check
+from grib_store import register_files
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+# Earth radius used by WPS/WRF map projections
+WRF_EARTH_RADIUS_M = 6370000.0
+# Padding around the domain [deg], and points sampled along each side of the domain when finding its extent
+PAD_DEG = 1.0
+EDGE_POINTS = 101
+SUBSET_WORKERS = 8
+WGRIB2 = 'wgrib2'
+SUBSET_SUFFIX = '.subset'
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--cycle_dt', default='20220801_00', help='WRF cycle date/time [YYYYMMDD_HH] (default: 20220801_00)')
+    parser.add_argument('-s', '--sim_hrs', default=24, type=int, help='integer number of simulation hours (default: 24)')
+    parser.add_argument('-i', '--int_h', default=3, type=int, help='integer number of hours between IC/LBC files (default: 3)')
+    parser.add_argument('-f', '--icbc_fc_dt', default=0, type=int,
+                        help='integer number of hours prior to WRF cycle time for IC/LBC model cycle (default: 0)')
+    parser.add_argument('-m', '--icbc_model', default='GFS', help='IC/LBC model (GEFS|GFS|GFS_FNL|HRRR) (default: GFS)')
+    parser.add_argument('-c', '--icbc_source', default='AWS', help='GLADE|AWS|GoogleCloud|NOMADS (default: AWS)')
+    parser.add_argument('-n', '--mem_id', default=None, help='two-digit GEFS member id')
+    parser.add_argument('-a', '--icbc_analysis', action='store_true', help='If flag present, IC/LBCs are analysis [f00] files')
+    parser.add_argument('-v', '--hrrr_native', action='store_true', help='If flag present, HRRR native-grid files are used too')
+    parser.add_argument('-g', '--grib_dir_parent', default=None, help='parent directory of the downloaded grib2 files')
+    parser.add_argument('-t', '--nml_file', default=None, help='namelist.wps whose d01 domain defines the crop box')
+    parser.add_argument('-p', '--pad_deg', default=PAD_DEG, type=float,
+                        help='padding around the domain [deg] (default: ' + str(PAD_DEG) + ')')
+    parser.add_argument('-w', '--workers', default=SUBSET_WORKERS, type=int,
+                        help='files cropped concurrently (default: ' + str(SUBSET_WORKERS) + ')')
+    parser.add_argument('-x', '--wgrib2', default=WGRIB2, help='wgrib2 executable (default: ' + WGRIB2 + ')')
+
+    args = parser.parse_args()
+    if len(args.cycle_dt) != 11 or args.cycle_dt[8] != '_':
+        log.error('ERROR! Incorrect format for argument cycle_dt. Exiting!')
+        parser.print_help()
+        sys.exit(1)
+    if args.grib_dir_parent is None:
+        log.error('ERROR! grib_dir_parent not specified. Exiting!')
+        sys.exit(1)
+    if args.nml_file is None or not pathlib.Path(args.nml_file).is_file():
+        log.error('ERROR! namelist.wps file ' + str(args.nml_file) + ' not found. Exiting!')
+        sys.exit(1)
+    if shutil.which(args.wgrib2) is None:
+        log.error('ERROR! wgrib2 executable ' + args.wgrib2 + ' not found. Exiting!')
+        sys.exit(1)
+
+    return (args.cycle_dt, args.sim_hrs, args.int_h, args.icbc_fc_dt, args.icbc_model, args.icbc_source, args.mem_id,
+            args.icbc_analysis, args.hrrr_native, pathlib.Path(args.grib_dir_parent), pathlib.Path(args.nml_file),
+            args.pad_deg, args.workers, args.wgrib2)
+
+
+## Domain extent
+
+def _first(value):
+    return value[0] if isinstance(value, list) else value
+
+
+def domain_bbox(nml_file, pad_deg=PAD_DEG):
+    '''
+    Padded (lon_min, lon_max, lat_min, lat_max) of the d01 domain in a namelist.wps, in degrees with longitudes
+    in [-180, 360). The domain perimeter (the staggered-grid edges) is sampled in projection coordinates and
+    inverse-projected, so the curved edges of Lambert and polar-stereographic domains are covered.
+    '''
+    import f90nml
+    from pyproj import Proj
+
+    geogrid = f90nml.read(nml_file)['geogrid']
+    map_proj = str(geogrid.get('map_proj', 'lambert')).lower()
+    e_we = int(_first(geogrid['e_we']))
+    e_sn = int(_first(geogrid['e_sn']))
+    dx = float(geogrid['dx'])
+    dy = float(geogrid['dy'])
+    ref_lat = float(geogrid['ref_lat'])
+    ref_lon = float(geogrid['ref_lon'])
+    # ref_x/ref_y are mass-grid indices of the reference point; WPS puts it at the domain centre by default
+    ref_x = float(geogrid.get('ref_x', e_we / 2.0))
+    ref_y = float(geogrid.get('ref_y', e_sn / 2.0))
+    x_edges = np.array([0.5 - ref_x, e_we - 0.5 - ref_x]) * dx
+    y_edges = np.array([0.5 - ref_y, e_sn - 0.5 - ref_y]) * dy
+
+    side = np.linspace(0.0, 1.0, EDGE_POINTS)
+    xs = x_edges[0] + side * (x_edges[1] - x_edges[0])
+    ys = y_edges[0] + side * (y_edges[1] - y_edges[0])
+    x = np.concatenate([xs, xs, np.full(EDGE_POINTS, x_edges[0]), np.full(EDGE_POINTS, x_edges[1])])
+    y = np.concatenate([np.full(EDGE_POINTS, y_edges[0]), np.full(EDGE_POINTS, y_edges[1]), ys, ys])
+
+    if map_proj == 'lat-lon':
+        # dx/dy are already in degrees
+        lons = ref_lon + x
+        lats = ref_lat + y
+    else:
+        truelat1 = float(geogrid.get('truelat1', ref_lat))
+        truelat2 = float(geogrid.get('truelat2', truelat1))
+        stand_lon = float(geogrid.get('stand_lon', ref_lon))
+        if map_proj == 'lambert':
+            proj = Proj(proj='lcc', lat_1=truelat1, lat_2=truelat2, lat_0=ref_lat, lon_0=stand_lon, R=WRF_EARTH_RADIUS_M)
+        elif map_proj == 'polar':
+            proj = Proj(proj='stere', lat_0=90.0 if truelat1 >= 0 else -90.0, lat_ts=truelat1, lon_0=stand_lon,
+                        R=WRF_EARTH_RADIUS_M)
+        elif map_proj == 'mercator':
+            proj = Proj(proj='merc', lat_ts=truelat1, lon_0=stand_lon, R=WRF_EARTH_RADIUS_M)
+        else:
+            raise ValueError('Unsupported map_proj for subsetting: ' + map_proj)
+        # Projection coordinates are relative to the reference point, which need not be the projection origin
+        x0, y0 = proj(ref_lon, ref_lat)
+        lons, lats = proj(x + x0, y + y0, inverse=True)
+        lons = np.asarray(lons)
+        lats = np.asarray(lats)
+
+    # Unwrap longitudes relative to ref_lon so a domain across the dateline is one interval
+    lons = ref_lon + (lons - ref_lon + 180.0) % 360.0 - 180.0
+    lon_min = float(np.min(lons)) - pad_deg
+    lon_max = float(np.max(lons)) + pad_deg
+    lat_min = max(float(np.min(lats)) - pad_deg, -90.0)
+    lat_max = min(float(np.max(lats)) + pad_deg, 90.0)
+    if lon_max - lon_min >= 360.0:
+        lon_min, lon_max = -180.0, 180.0
+    return lon_min, lon_max, lat_min, lat_max
+
+
+def bbox_union(a, b):
+    '''Smallest box covering both boxes (longitudes compared on the same 360-degree branch).'''
+    shift = 360.0 * round((a[0] - b[0]) / 360.0)
+    return (min(a[0], b[0] + shift), max(a[1], b[1] + shift), min(a[2], b[2]), max(a[3], b[3]))
+
+
+def bbox_covers(outer, inner):
+    shift = 360.0 * round((outer[0] - inner[0]) / 360.0)
+    return (outer[0] <= inner[0] + shift and inner[1] + shift <= outer[1]
+            and outer[2] <= inner[2] and inner[3] <= outer[3])
+
+
+## File lists
+
+def local_grib_files(cycle_str, icbc_model, icbc_source, sim_hrs, int_hrs, grib_dir_parent, icbc_fc_dt=0,
+                     icbc_analysis=False, hrrr_native=False, mem_id=None):
+    '''
+    Local paths of the full-domain grib2 files the download/link scripts put under grib_dir_parent for one cycle,
+    in the same layout setup_wps_wrf.py uses for grib_dir_full.
+    '''
+    model = icbc_check.model_key(icbc_model)
+    cycle_dt = dt.datetime.strptime(cycle_str, icbc_check.fmt_yyyymmdd_hh)
+    icbc_cycle = cycle_dt - dt.timedelta(hours=icbc_fc_dt)
+    objects = icbc_check.required_objects(cycle_str, icbc_model, icbc_source, sim_hrs, int_hrs, icbc_fc_dt,
+                                          icbc_analysis, hrrr_native, mem_id)
+    paths = []
+    for obj in objects:
+        parts = obj.split('/')
+        if model == 'HRRR':
+            # .../hrrr.YYYYMMDD/conus/<file>
+            paths.append(grib_dir_parent.joinpath(*parts[-3:]))
+        elif model == 'GFS_FNL':
+            # gdas1.fnl0p25.YYYYMMDDHH.fLL.grib2, linked into gfs_fnl.YYYYMMDD
+            paths.append(grib_dir_parent.joinpath('gfs_fnl.' + parts[-1].split('.')[2][:8], parts[-1]))
+        else:
+            grib_dir_full = grib_dir_parent.joinpath(model.lower() + '.' + icbc_cycle.strftime('%Y%m%d'),
+                                                     icbc_cycle.strftime('%H'), 'atmos')
+            # GEFS files sit in pgrb2a(p5)/pgrb2b(p5) subdirectories, GFS files directly in grib_dir_full
+            paths.append(grib_dir_full.joinpath(*parts[-2:]) if model == 'GEFS' else grib_dir_full.joinpath(parts[-1]))
+    return paths
+
+
+def subset_path(grib_file, grib_dir_parent):
+    '''Path of the cropped copy of grib_file: its date directory under grib_dir_parent gets the .subset suffix.'''
+    rel = pathlib.Path(grib_file).relative_to(grib_dir_parent)
+    return grib_dir_parent.joinpath(rel.parts[0] + SUBSET_SUFFIX, *rel.parts[1:])
+
+
+## Cropping
+
+def _read_bbox(bbox_file):
+    try:
+        return tuple(json.loads(bbox_file.read_text())['bbox'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def crop_file(src, dst, bbox, wgrib2=WGRIB2):
+    '''
+    Crop one grib2 file to bbox with wgrib2 -small_grib. Returns a dict with the status (cropped|reused|failed),
+    the input and output sizes and the run time.
+    '''
+    src = pathlib.Path(src)
+    dst = pathlib.Path(dst)
+    bbox_file = dst.with_name(dst.name + '.bbox')
+    result = {'src': str(src), 'dst': str(dst), 'status': 'reused', 'seconds': 0.0,
+              'bytes_in': src.stat().st_size, 'bytes_out': 0}
+
+    done = _read_bbox(bbox_file) if dst.is_file() else None
+    if done is not None and dst.stat().st_mtime >= src.stat().st_mtime:
+        if bbox_covers(done, bbox):
+            result['bytes_out'] = dst.stat().st_size
+            return result
+        bbox = bbox_union(done, bbox)
+
+    lon_min, lon_max, lat_min, lat_max = bbox
+    # wgrib2 wants the western edge in [0, 360) and allows the eastern one to run past 360
+    lon_w = lon_min % 360.0
+    lon_e = lon_w + (lon_max - lon_min)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name('.' + dst.name + '.' + str(os.getpid()) + '.tmp')
+    cmd = [wgrib2, str(src), '-set_grib_type', 'same',
+           '-small_grib', f'{lon_w:.4f}:{lon_e:.4f}', f'{lat_min:.4f}:{lat_max:.4f}', str(tmp)]
+    t0 = time.time()
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    result['seconds'] = time.time() - t0
+    if proc.returncode != 0 or not tmp.is_file() or tmp.stat().st_size == 0:
+        tmp.unlink(missing_ok=True)
+        result['status'] = 'failed'
+        result['output'] = proc.stdout[-2000:]
+        return result
+    os.replace(tmp, dst)
+    bbox_file.write_text(json.dumps({'bbox': list(bbox), 'src': str(src)}))
+    result['status'] = 'cropped'
+    result['bytes_out'] = dst.stat().st_size
+    return result
+
+
+def crop_files(grib_files, grib_dir_parent, bbox, workers=SUBSET_WORKERS, wgrib2=WGRIB2):
+    '''
+    Crop every file into the .subset tree, running up to workers wgrib2 processes at once.
+    Returns the list of crop_file results, in the order of grib_files.
+    '''
+    grib_dir_parent = pathlib.Path(grib_dir_parent)
+    # Each crop is its own wgrib2 process, so threads are enough to keep them all running concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(crop_file, f, subset_path(f, grib_dir_parent), bbox, wgrib2) for f in grib_files]
+        return [future.result() for future in futures]
+
+
+def main(cycle_str, sim_hrs, int_hrs, icbc_fc_dt, icbc_model, icbc_source, mem_id, icbc_analysis, hrrr_native,
+         grib_dir_parent, nml_file, pad_deg, workers, wgrib2):
+
+    grib_dir_parent = grib_dir_parent.resolve()
+    bbox = domain_bbox(nml_file, pad_deg)
+    log.info('Cropping to lon ' + f'{bbox[0]:.3f}:{bbox[1]:.3f}' + ', lat ' + f'{bbox[2]:.3f}:{bbox[3]:.3f}'
+             + ' (domain in ' + str(nml_file) + ' padded by ' + str(pad_deg) + ' deg)')
+
+    try:
+        grib_files = local_grib_files(cycle_str, icbc_model, icbc_source, sim_hrs, int_hrs, grib_dir_parent,
+                                      icbc_fc_dt, icbc_analysis, hrrr_native, mem_id)
+    except ValueError as e:
+        log.error('ERROR: ' + str(e) + '. Exiting!')
+        sys.exit(1)
+    missing = [f for f in grib_files if not f.is_file()]
+    if missing:
+        for f in missing:
+            log.error('ERROR: grib2 file ' + str(f) + ' not found. Run the get_icbc step first.')
+        log.error('Exiting!')
+        sys.exit(1)
+
+    results = crop_files(grib_files, grib_dir_parent, bbox, workers, wgrib2)
+    failed = [r for r in results if r['status'] == 'failed']
+    for r in failed:
+        log.error('ERROR: wgrib2 failed on ' + r['src'] + ':\n' + r.get('output', ''))
+    if failed:
+        log.error('Exiting!')
+        sys.exit(1)
+
+    register_files([r['dst'] for r in results])
+    n_cropped = sum(r['status'] == 'cropped' for r in results)
+    bytes_in = sum(r['bytes_in'] for r in results)
+    bytes_out = sum(r['bytes_out'] for r in results)
+    log.info('Cropped ' + str(n_cropped) + ' file(s), reused ' + str(len(results) - n_cropped) + '; '
+             + f'{bytes_in / 1e6:.1f} MB -> {bytes_out / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    now_time_beg = dt.datetime.now(dt.UTC)
+    (cycle_dt, sim_hrs, int_h, icbc_fc_dt, icbc_model, icbc_source, mem_id, icbc_analysis, hrrr_native,
+     grib_dir_parent, nml_file, pad_deg, workers, wgrib2) = parse_args()
+    main(cycle_dt, sim_hrs, int_h, icbc_fc_dt, icbc_model, icbc_source, mem_id, icbc_analysis, hrrr_native,
+         grib_dir_parent, nml_file, pad_deg, workers, wgrib2)
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
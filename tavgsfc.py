@@ -0,0 +1,110 @@
+'''
+tavgsfc.py
+
+Computes the TAVGSFC constants file (daily-mean surface air temperature, used by metgrid to set inland-lake SSTs)
+in-process, in place of WPS's util/avg_tsfc.exe.
+
+avg_tsfc.exe can only run once ungrib has finished every time and needs its own namelist. Here the surface
+temperature (TT at level 200100) is read out of each ungrib intermediate file as soon as that file is ready, through
+the memory-mapped reader in wps_intermediate.py, and added to a running float32 sum, so run_ungrib.py can have
+TAVGSFC written the moment the last time is ungribbed.
+
+As in avg_tsfc.exe, the mean covers whole days only: with files every interval hours, the first n * 24 / interval
+times for the largest n that fits, summed in time order in single precision and then divided, so the values match
+avg_tsfc.exe's. Unlike avg_tsfc.exe, a run shorter than one day is not an error: the mean over all its times is
+written, with a warning that it is not a full diurnal cycle.
+'''
+
+import datetime as dt
+import logging
+
+import numpy as np
+
+import wps_intermediate as wpsi
+
+log = logging.getLogger(__name__)
+
+TSFC_FIELD = 'TT'
+TAVGSFC_FIELD = 'TAVGSFC'
+TAVGSFC_DESC = 'Daily mean of surface air temperature'
+fmt_wrf_dt = '%Y-%m-%d_%H:%M:%S'
+
+
+class TsfcAccumulator:
+    '''
+    Running daily-mean surface temperature. Feed intermediate files in valid-time order with add(); write() picks the
+    whole-day mean (or the mean of everything for runs shorter than a day).
+    '''
+
+    def __init__(self):
+        self.total = None
+        self.header = None
+        self.times = []
+        self.interval = None
+        # Sum and count at the end of the last whole day
+        self.day_total = None
+        self.day_count = 0
+
+    def add(self, path):
+        '''Add the surface TT of one intermediate file. Returns False if the file has none (e.g. a soil-only file).'''
+        f = wpsi.IntermediateFile(path)
+        records = f.find(TSFC_FIELD, wpsi.LEVEL_SURFACE)
+        if not records:
+            return False
+        record = records[0]
+        valid = dt.datetime.strptime(record['hdate'][:19], fmt_wrf_dt)
+        if self.times:
+            step = valid - self.times[-1]
+            if step <= dt.timedelta(0):
+                raise ValueError(f'{path}: {valid} does not follow {self.times[-1]}; add files in time order')
+            if self.interval is None:
+                if dt.timedelta(days=1) % step:
+                    raise ValueError(f'interval {step} does not divide a day')
+                self.interval = step
+            elif step != self.interval:
+                raise ValueError(f'{path}: interval {step} differs from {self.interval}')
+        slab = f.data(record)
+        if self.total is None:
+            self.total = np.zeros(slab.shape, dtype=np.float32)
+            self.header = {k: v for k, v in record.items() if k not in ('offset', 'nx', 'ny')}
+        elif slab.shape != self.total.shape:
+            raise ValueError(f'{path}: grid {slab.shape} differs from {self.total.shape}')
+        # A day is complete once the time 24 h after its start arrives; that time starts the next day
+        if self.times and len(self.times) % (dt.timedelta(days=1) // self.interval) == 0:
+            self.day_total = self.total.copy()
+            self.day_count = len(self.times)
+        self.total += slab
+        self.times.append(valid)
+        return True
+
+    def mean(self):
+        '''(mean field, number of times averaged, whether it covers whole days).'''
+        if self.total is None:
+            raise ValueError('no surface temperature (' + TSFC_FIELD + ' at 200100) found')
+        if self.day_count:
+            return self.day_total / np.float32(self.day_count), self.day_count, True
+        return self.total / np.float32(len(self.times)), len(self.times), False
+
+    def write(self, out_file):
+        mean, count, whole_days = self.mean()
+        if whole_days:
+            log.info(f'TAVGSFC: mean of {count} time(s) from {self.times[0]} ({count * self.interval} of data)')
+        else:
+            log.info(f'WARNING: TAVGSFC: only {len(self.times)} time(s) ({self.times[0]} to {self.times[-1]}), less than'
+                     ' a full day; writing their mean, which does not cover a full diurnal cycle')
+        field = dict(self.header, field=TAVGSFC_FIELD, desc=TAVGSFC_DESC, xfcst=0.0, slab=mean)
+        wpsi.write_fields(out_file, [field])
+        return out_file
+
+
+def compute_tavgsfc(paths, out_file):
+    '''
+    Write TAVGSFC from the intermediate files of consecutive valid times. paths holds, per time, one file or a
+    list of candidate files (e.g. the GEFS a and b files); the first with surface TT is used.
+    '''
+    acc = TsfcAccumulator()
+    for entry in paths:
+        candidates = entry if isinstance(entry, (list, tuple)) else [entry]
+        if not any(acc.add(path) for path in candidates):
+            raise ValueError('no surface temperature in ' + ', '.join(map(str, candidates)))
+    return acc.write(out_file)
@@ -0,0 +1,209 @@
+'''
+trace_util.py
+
+Lightweight span tracing for the WPS/WRF workflow.
+
+A span is a named, timed piece of work (a cycle, a stage, a job submission, time spent waiting in the queue,
+time spent running, moving output). Finished spans are appended as one JSON object per line to the file named
+by the WPS_WRF_TRACE_FILE environment variable. If that variable is not set, spans cost almost nothing and
+nothing is written.
+
+Spans nest within a process, and the trace context (trace id, current span id, and inherited attributes such as
+cycle, exp_name, fire_id, host) is exported through environment variables while a span is open. That means
+run_*.py scripts launched with exec_command become children of the setup_wps_wrf.py stage span that started them.
+'''
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+
+TRACE_FILE_ENV = 'WPS_WRF_TRACE_FILE'
+TRACE_ID_ENV = 'WPS_WRF_TRACE_ID'
+PARENT_SPAN_ENV = 'WPS_WRF_PARENT_SPAN'
+TRACE_ATTRS_ENV = 'WPS_WRF_TRACE_ATTRS'
+
+_stack = []
+
+
+def enable(trace_file, **attrs):
+    '''
+    Turn on tracing for this process and every child process it launches.
+    Extra keyword arguments become attributes inherited by every span.
+    '''
+    os.environ[TRACE_FILE_ENV] = str(trace_file)
+    os.environ.setdefault(TRACE_ID_ENV, uuid.uuid4().hex)
+    if attrs:
+        os.environ[TRACE_ATTRS_ENV] = json.dumps({**_inherited_attrs(), **attrs}, default=str)
+
+
+def is_enabled():
+    return bool(os.environ.get(TRACE_FILE_ENV))
+
+
+def _inherited_attrs():
+    try:
+        return json.loads(os.environ.get(TRACE_ATTRS_ENV, '{}'))
+    except ValueError:
+        return {}
+
+
+def _write(record):
+    trace_file = os.environ.get(TRACE_FILE_ENV)
+    if not trace_file:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+        # One O_APPEND write per span keeps lines from concurrent processes from interleaving
+        fd = os.open(trace_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f'trace_util: unable to write span to {trace_file}: {e}', file=sys.stderr)
+
+
+class Span:
+    '''
+    One timed unit of work. Use as a context manager, or call start() and end() explicitly when the work
+    does not fit in a single block (e.g., the body of a long loop).
+    '''
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = None
+        self.parent_id = None
+        self.beg = None
+        self.status = 'ok'
+        self._saved_env = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def start(self):
+        if not os.environ.get(TRACE_ID_ENV):
+            os.environ[TRACE_ID_ENV] = uuid.uuid4().hex
+        self.trace_id = os.environ[TRACE_ID_ENV]
+        self.parent_id = os.environ.get(PARENT_SPAN_ENV)
+        self.attrs = {**_inherited_attrs(), **self.attrs}
+        self.beg = time.time()
+
+        # Export this span as the parent of anything launched while it is open
+        self._saved_env = (os.environ.get(PARENT_SPAN_ENV), os.environ.get(TRACE_ATTRS_ENV))
+        os.environ[PARENT_SPAN_ENV] = self.span_id
+        os.environ[TRACE_ATTRS_ENV] = json.dumps(self.attrs, default=str)
+        _stack.append(self)
+        return self
+
+    def end(self, status=None):
+        if self.beg is None:
+            return
+        end = time.time()
+        if status is not None:
+            self.status = status
+
+        # Spans still open inside this one were cut short (e.g., sys.exit from a failed stage)
+        while self in _stack and _stack[-1] is not self:
+            _stack[-1].end(status='error')
+        if self in _stack:
+            _stack.remove(self)
+        for key, value in zip((PARENT_SPAN_ENV, TRACE_ATTRS_ENV), self._saved_env):
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+        _write({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'beg': self.beg,
+            'end': end,
+            'duration_s': round(end - self.beg, 3),
+            'status': self.status,
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'attrs': self.attrs,
+        })
+        self.beg = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or (exc_type is SystemExit and exc.code in (None, 0)):
+            self.end()
+        else:
+            self.end(status='error')
+        return False
+
+
+def span(name, **attrs):
+    '''
+    Create a span. Typical use:
+        with span('wrf', job_id=jobid):
+            ...
+    '''
+    return Span(name, **attrs)
+
+
+def start_span(name, **attrs):
+    return Span(name, **attrs).start()
+
+
+def record_span(name, beg, end=None, status='ok', **attrs):
+    '''
+    Record a span that was measured after the fact (e.g., queue wait, from job submission until the job's first
+    log file appears). beg and end are epoch seconds as returned by time.time(). It becomes a child of the span
+    that is currently open.
+    '''
+    if not is_enabled():
+        return
+    end = time.time() if end is None else end
+    _write({
+        'trace_id': os.environ.get(TRACE_ID_ENV),
+        'span_id': uuid.uuid4().hex[:16],
+        'parent_id': os.environ.get(PARENT_SPAN_ENV),
+        'name': name,
+        'beg': beg,
+        'end': end,
+        'duration_s': round(end - beg, 3),
+        'status': status,
+        'pid': os.getpid(),
+        'host': socket.gethostname(),
+        'attrs': {**_inherited_attrs(), **attrs},
+    })
+
+
+if __name__ == '__main__':
+    # Summarize a trace file: total and mean wall time per span name, e.g. queue_wait vs run
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize WPS/WRF workflow spans by name.')
+    parser.add_argument('trace_file', nargs='?', default=os.environ.get(TRACE_FILE_ENV),
+                        help=f'JSON-lines trace file (default: ${TRACE_FILE_ENV})')
+    args = parser.parse_args()
+    if not args.trace_file:
+        parser.print_help()
+        sys.exit(1)
+
+    totals = {}
+    with open(args.trace_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            count, total, errors = totals.get(record['name'], (0, 0.0, 0))
+            totals[record['name']] = (count + 1, total + record['duration_s'], errors + (record['status'] != 'ok'))
+
+    print(f'{"span":<24}{"count":>8}{"total_s":>14}{"mean_s":>12}{"errors":>8}')
+    for name, (count, total, errors) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        print(f'{name:<24}{count:>8}{total:>14.1f}{total / count:>12.1f}{errors:>8}')
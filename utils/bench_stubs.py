@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+
+'''
+bench_stubs.py
+
+Fake job scheduler and stub WPS/WRF/UPP executables used by bench_workflow.py.
+
+Every tool is called through a small shim written by bench_workflow.py:
+    python bench_stubs.py <tool> [args...]
+
+Scheduler fakes: sbatch, qsub, sacct, qstat
+    Submitted scripts run in the background (bash) from the submission directory after an optional queue delay.
+    Job state is kept in $WPS_WRF_BENCH_DIR/jobs/<jobid>.json.
+Executable stubs: geogrid.exe, ungrib.exe, metgrid.exe, avg_tsfc.exe, real.exe, wrf.exe, upp.x
+    Each reads the namelist in the current directory, sleeps for its configured delay, and writes the log markers
+    and output files the run_*.py scripts look for.
+Environment no-ops: module, conda, mpiexec/mpirun/mpibind (the latter run their executable directly), link_grib.csh
+
+Delays come from the JSON file named by $WPS_WRF_BENCH_CONFIG, e.g. {"delays": {"wrf.exe": 2.0}, "queue_delay": 1.0}.
+Every invocation is appended to $WPS_WRF_BENCH_DIR/calls.jsonl so the harness can count scheduler calls.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import glob
+import struct
+import subprocess
+import datetime as dt
+
+BENCH_DIR = os.environ.get('WPS_WRF_BENCH_DIR', os.getcwd())
+JOBS_DIR = os.path.join(BENCH_DIR, 'jobs')
+CALLS_FILE = os.path.join(BENCH_DIR, 'calls.jsonl')
+
+DEFAULT_DELAYS = {
+    'geogrid.exe': 0.5,
+    'ungrib.exe': 0.2,
+    'metgrid.exe': 0.5,
+    'avg_tsfc.exe': 0.1,
+    'real.exe': 0.5,
+    'wrf.exe': 2.0,
+    'upp.x': 0.5,
+}
+
+fmt_wrf_dt = '%Y-%m-%d_%H:%M:%S'
+fmt_wrf_date_hh = '%Y-%m-%d_%H'
+
+
+def load_config():
+    config = {'delays': dict(DEFAULT_DELAYS), 'queue_delay': 0.0}
+    config_file = os.environ.get('WPS_WRF_BENCH_CONFIG')
+    if config_file and os.path.isfile(config_file):
+        with open(config_file) as f:
+            user_config = json.load(f)
+        config['delays'].update(user_config.get('delays', {}))
+        config['queue_delay'] = user_config.get('queue_delay', config['queue_delay'])
+    return config
+
+
+def append_line(path, record):
+    # One O_APPEND write per record so concurrent jobs never interleave lines
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + '\n').encode())
+    finally:
+        os.close(fd)
+
+
+def record_call(tool, beg, end=None, **extra):
+    append_line(CALLS_FILE, {'tool': tool, 'beg': beg, 'end': end if end is not None else time.time(),
+                             'cwd': os.getcwd(), 'parent_span': os.environ.get('WPS_WRF_PARENT_SPAN'), **extra})
+
+
+## ****************
+## Namelist reading
+## ****************
+
+def read_namelist(fname):
+    '''
+    Minimal Fortran namelist reader: returns {key: [values]} with quotes stripped. Good enough for the handful of
+    entries the stubs need, without depending on f90nml.
+    '''
+    values = {}
+    if not os.path.isfile(fname):
+        return values
+    with open(fname) as nml:
+        for line in nml:
+            line = line.split('!')[0].strip()
+            if '=' not in line or line.startswith('&'):
+                continue
+            # A line may hold several assignments: key1 = a, b, key2 = c,
+            parts = re.split(r'([A-Za-z_]\w*)\s*=', line)
+            for key, val in zip(parts[1::2], parts[2::2]):
+                items = [v.strip().strip('\'"') for v in val.split(',')]
+                values[key.lower()] = [v for v in items if v != '']
+    return values
+
+
+def first(values, key, default=None):
+    return values[key][0] if values.get(key) else default
+
+
+def namelist_input_dates(nml):
+    beg = dt.datetime(*[int(first(nml, 'start_' + k, 0)) for k in ('year', 'month', 'day', 'hour', 'minute')])
+    end = dt.datetime(*[int(first(nml, 'end_' + k, 0)) for k in ('year', 'month', 'day', 'hour', 'minute')])
+    return beg, end
+
+
+def time_steps(beg, end, step_seconds):
+    times = []
+    this_dt = beg
+    while this_dt <= end:
+        times.append(this_dt)
+        this_dt += dt.timedelta(seconds=step_seconds)
+    return times
+
+
+def touch(path, size=1024):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+
+def fortran_record(payload):
+    marker = struct.pack('>i', len(payload))
+    return marker + payload + marker
+
+
+def write_intermediate(path, hdate):
+    '''
+    A valid one-field WPS intermediate file (2 m temperature on a 2x2 lat-lon grid), so the ungrib output checks in
+    run_ungrib.py pass without pulling the repo's numpy-based writer into the stubs.
+    '''
+    header = struct.pack('>24sf32s9s25s46sf3i', hdate.ljust(24).encode(), 0.0, b'bench'.ljust(32), b'TT'.ljust(9),
+                         b'K'.ljust(25), b'Temperature'.ljust(46), 200100.0, 2, 2, 0)
+    proj = b'SWCORNER' + struct.pack('>5f', 40.0, -105.0, 1.0, 1.0, 6367.47)
+    with open(path, 'wb') as f:
+        f.write(fortran_record(struct.pack('>i', 5)) + fortran_record(header) + fortran_record(proj)
+                + fortran_record(struct.pack('>i', 1)) + fortran_record(struct.pack('>4f', 290.0, 291.0, 292.0, 293.0)))
+
+
+## ******************
+## Stub executables
+## ******************
+
+def stub_geogrid(delay):
+    nml = read_namelist('namelist.wps')
+    out_dir = first(nml, 'opt_output_from_geogrid_path', '.')
+    max_dom = int(first(nml, 'max_dom', 1))
+    with open('geogrid.log.0000', 'w') as log_file:
+        log_file.write('Parsed namelist options\n')
+    time.sleep(delay)
+    os.makedirs(out_dir, exist_ok=True)
+    for dd in range(1, max_dom + 1):
+        touch(os.path.join(out_dir, f'geo_em.d0{dd}.nc'))
+    with open('geogrid.log.0000', 'a') as log_file:
+        log_file.write('*** Successful completion of program geogrid.exe ***\n')
+
+
+def stub_ungrib(delay):
+    nml = read_namelist('namelist.wps')
+    beg = dt.datetime.strptime(first(nml, 'start_date'), fmt_wrf_dt)
+    end = dt.datetime.strptime(first(nml, 'end_date'), fmt_wrf_dt)
+    prefix = first(nml, 'prefix', 'FILE')
+    interval = int(first(nml, 'interval_seconds', 3600))
+    with open('ungrib.log', 'w') as log_file:
+        log_file.write('Begin ungrib\n')
+    time.sleep(delay)
+    for this_dt in time_steps(beg, end, interval):
+        write_intermediate(prefix + ':' + this_dt.strftime(fmt_wrf_date_hh), this_dt.strftime(fmt_wrf_dt))
+    with open('ungrib.log', 'a') as log_file:
+        log_file.write('*** Successful completion of program ungrib.exe ***\n')
+
+
+def stub_metgrid(delay):
+    nml = read_namelist('namelist.wps')
+    beg = dt.datetime.strptime(first(nml, 'start_date'), fmt_wrf_dt)
+    end = dt.datetime.strptime(first(nml, 'end_date'), fmt_wrf_dt)
+    interval = int(first(nml, 'interval_seconds', 3600))
+    out_dir = first(nml, 'opt_output_from_metgrid_path', '.')
+    with open('metgrid.log.0000', 'w') as log_file:
+        log_file.write('Processing domain 1 of 1\n')
+    time.sleep(delay)
+    os.makedirs(out_dir, exist_ok=True)
+    for this_dt in time_steps(beg, end, interval):
+        touch(os.path.join(out_dir, 'met_em.d01.' + this_dt.strftime(fmt_wrf_dt) + '.nc'))
+    with open('metgrid.log.0000', 'a') as log_file:
+        log_file.write('*** Successful completion of program metgrid.exe ***\n')
+
+
+def stub_avg_tsfc(delay):
+    time.sleep(delay)
+    touch('TAVGSFC')
+    print('Writing TAVGSFC')
+
+
+def start_rsl(header):
+    for fname in ('rsl.out.0000', 'rsl.error.0000'):
+        with open(fname, 'w') as rsl:
+            rsl.write(header + '\n')
+
+
+def finish_rsl(marker):
+    for fname in ('rsl.out.0000', 'rsl.error.0000'):
+        with open(fname, 'a') as rsl:
+            rsl.write(marker + '\n')
+
+
+def stub_real(delay):
+    nml = read_namelist('namelist.input')
+    max_dom = int(first(nml, 'max_dom', 1))
+    start_rsl('taskid: 0 hostname: bench')
+    time.sleep(delay)
+    for dd in range(1, max_dom + 1):
+        touch(f'wrfinput_d0{dd}')
+    touch('wrfbdy_d01')
+    finish_rsl('real_em: SUCCESS COMPLETE REAL_EM INIT')
+
+
+def stub_wrf(delay):
+    nml = read_namelist('namelist.input')
+    beg, end = namelist_input_dates(nml)
+    history_minutes = int(first(nml, 'history_interval', 60))
+    times = time_steps(beg, end, history_minutes * 60)
+    start_rsl('taskid: 0 hostname: bench')
+    # Spread the delay over the output times so wrfout files appear gradually, like a real run
+    for this_dt in times:
+        time.sleep(delay / max(len(times), 1))
+        touch('wrfout_d01_' + this_dt.strftime(fmt_wrf_dt))
+        with open('rsl.out.0000', 'a') as rsl:
+            rsl.write('Timing for Writing wrfout_d01_' + this_dt.strftime(fmt_wrf_dt) + ' for domain 1: 0.01000 elapsed seconds\n')
+    finish_rsl('wrf: SUCCESS COMPLETE WRF')
+
+
+def stub_upp(delay):
+    time.sleep(delay)
+    touch('WRFPRS.GrbF00')
+    print('UPP completed')
+
+
+STUBS = {
+    'geogrid.exe': stub_geogrid,
+    'ungrib.exe': stub_ungrib,
+    'metgrid.exe': stub_metgrid,
+    'avg_tsfc.exe': stub_avg_tsfc,
+    'real.exe': stub_real,
+    'wrf.exe': stub_wrf,
+    'upp.x': stub_upp,
+}
+
+
+## *****************
+## Fake schedulers
+## *****************
+
+def next_job_id():
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    counter = os.path.join(JOBS_DIR, 'next_id')
+    # O_EXCL lock file keeps concurrent submissions from handing out the same id
+    lock = counter + '.lock'
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL)
+            os.close(fd)
+            break
+        except FileExistsError:
+            time.sleep(0.01)
+    try:
+        job_id = int(open(counter).read()) if os.path.isfile(counter) else 1000
+        with open(counter, 'w') as f:
+            f.write(str(job_id + 1))
+    finally:
+        os.remove(lock)
+    return str(job_id)
+
+
+def write_job(job):
+    tmp = os.path.join(JOBS_DIR, f".{job['job_id']}.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp, os.path.join(JOBS_DIR, f"{job['job_id']}.json"))
+
+
+def read_job(job_id):
+    try:
+        with open(os.path.join(JOBS_DIR, f'{job_id}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def script_directive(script, prefix, flags):
+    '''Return the value of the first "#PBS -N name" / "#SBATCH -J name" style directive in a job script.'''
+    with open(script) as f:
+        for line in f:
+            if not line.startswith(prefix):
+                continue
+            parts = line[len(prefix):].split()
+            for ii, part in enumerate(parts):
+                for flag in flags:
+                    if part == flag and ii + 1 < len(parts):
+                        return parts[ii + 1]
+                    if flag.startswith('--') and part.startswith(flag + '='):
+                        return part.split('=', 1)[1]
+    return None
+
+
+def submit(scheduler, args):
+    job_name = None
+    join_output = False
+    script = None
+    ii = 0
+    while ii < len(args):
+        arg = args[ii]
+        if arg in ('-N', '-J', '--job-name'):
+            job_name = args[ii + 1]
+            ii += 2
+            continue
+        if arg == '-j':
+            join_output = args[ii + 1] == 'oe'
+            ii += 2
+            continue
+        if arg.startswith('-'):
+            # Other options (-q, -l, -A, ...) take a value
+            ii += 2 if '=' not in arg else 1
+            continue
+        script = arg
+        ii += 1
+
+    if script is None or not os.path.isfile(script):
+        print(f'{scheduler}: script file not found: {script}', file=sys.stderr)
+        sys.exit(1)
+
+    job_id = next_job_id()
+    stem = os.path.basename(script).replace('submit_', '').split('.')[0]
+    if scheduler == 'pbs':
+        job_name = job_name or script_directive(script, '#PBS', ['-N']) or stem
+        if not join_output:
+            with open(script) as f:
+                join_output = any(line.startswith('#PBS') and '-j oe' in line for line in f)
+        out_file = f'{job_name}.o{job_id}'
+        err_file = out_file if join_output else f'{job_name}.e{job_id}'
+    else:
+        job_name = job_name or script_directive(script, '#SBATCH', ['-J', '--job-name']) or stem
+        # The run_*.py scripts expect log_<stage>.o<jobid> whatever the job name (e.g. wrf_01_00)
+        out_file = script_directive(script, '#SBATCH', ['-o', '--output']) or f'log_{stem}.o%j'
+        err_file = script_directive(script, '#SBATCH', ['-e', '--error']) or f'log_{stem}.e%j'
+        out_file = out_file.replace('%j', job_id)
+        err_file = err_file.replace('%j', job_id)
+
+    job = {'job_id': job_id, 'name': job_name, 'scheduler': scheduler, 'script': os.path.abspath(script),
+           'cwd': os.getcwd(), 'out_file': out_file, 'err_file': err_file, 'state': 'QUEUED',
+           'submit': time.time(), 'start': None, 'end': None, 'returncode': None,
+           'parent_span': os.environ.get('WPS_WRF_PARENT_SPAN')}
+    write_job(job)
+
+    # Detach the job so the submitting process returns immediately, like the real scheduler
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '_runjob', job_id],
+                     start_new_session=True, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    if scheduler == 'pbs':
+        print(f'{job_id}.desched1')
+    else:
+        print(f'Submitted batch job {job_id}')
+
+
+def run_job(job_id):
+    job = read_job(job_id)
+    config = load_config()
+    time.sleep(config['queue_delay'])
+
+    job['state'] = 'RUNNING'
+    job['start'] = time.time()
+    write_job(job)
+
+    env = dict(os.environ, PBS_JOBID=job_id, SLURM_JOB_ID=job_id)
+    os.chdir(job['cwd'])
+    with open(job['out_file'], 'w') as out:
+        if job['err_file'] == job['out_file']:
+            ret = subprocess.run(['bash', job['script']], stdout=out, stderr=subprocess.STDOUT, env=env).returncode
+        else:
+            with open(job['err_file'], 'w') as err:
+                ret = subprocess.run(['bash', job['script']], stdout=out, stderr=err, env=env).returncode
+
+    job['state'] = 'COMPLETED' if ret == 0 else 'FAILED'
+    job['end'] = time.time()
+    job['returncode'] = ret
+    write_job(job)
+
+
+def sacct(args):
+    job_ids = [args[ii + 1] for ii, arg in enumerate(args) if arg == '-j' and ii + 1 < len(args)]
+    if not job_ids:
+        job_ids = [os.path.basename(f)[:-5] for f in glob.glob(os.path.join(JOBS_DIR, '*.json'))]
+    print(f"{'JobID':>12} {'JobName':>10} {'Partition':>10} {'Account':>10} {'AllocCPUS':>10} {'State':>10} {'ExitCode':>8}")
+    print(' '.join(['-' * 12, '-' * 10, '-' * 10, '-' * 10, '-' * 10, '-' * 10, '-' * 8]))
+    for job_id in sorted(job_ids):
+        job = read_job(job_id)
+        if job is None:
+            continue
+        state = {'QUEUED': 'PENDING'}.get(job['state'], job['state'])
+        print(f"{job_id:>12} {job['name'][:10]:>10} {'bench':>10} {'bench':>10} {1:>10} {state:>10} {job['returncode'] or 0:>6}:0")
+
+
+def qstat(args):
+    job_ids = [a.split('.')[0] for a in args if not a.startswith('-')]
+    if not job_ids:
+        job_ids = [os.path.basename(f)[:-5] for f in glob.glob(os.path.join(JOBS_DIR, '*.json'))]
+    print('Job id            Name             User              Time Use S Queue')
+    print('----------------  ---------------- ----------------  -------- - -----')
+    ret = 0
+    for job_id in sorted(job_ids):
+        job = read_job(job_id)
+        if job is None:
+            print(f'qstat: Unknown Job Id {job_id}', file=sys.stderr)
+            ret = 153
+            continue
+        state = {'QUEUED': 'Q', 'RUNNING': 'R'}.get(job['state'], 'F')
+        print(f"{job_id + '.desched1':<17} {job['name'][:16]:<16} {'bench':<16}  00:00:00 {state} main")
+    sys.exit(ret)
+
+
+## ************
+## Env no-ops
+## ************
+
+def mpi_launcher(args):
+    # Drop launcher options (-n 128, -np 4, --ppn 2, ...) and run the executable itself
+    ii = 0
+    while ii < len(args) and args[ii].startswith('-'):
+        ii += 2 if ii + 1 < len(args) and re.fullmatch(r'\d+', args[ii + 1]) else 1
+    if ii >= len(args):
+        return 0
+    return subprocess.run(args[ii:]).returncode
+
+
+def link_grib(args):
+    # Same naming as WPS link_grib.csh: GRIBFILE.AAA, GRIBFILE.AAB, ...
+    for old in glob.glob('GRIBFILE.???'):
+        os.remove(old)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    files = sorted(f for pattern in args for f in (glob.glob(pattern) or [pattern]))
+    for nn, fname in enumerate(files):
+        suffix = letters[nn // 676 % 26] + letters[nn // 26 % 26] + letters[nn % 26]
+        os.symlink(fname, 'GRIBFILE.' + suffix)
+
+
+def main(tool, args):
+    beg = time.time()
+    if tool == '_runjob':
+        run_job(args[0])
+        return 0
+
+    ret = 0
+    if tool in STUBS:
+        STUBS[tool](load_config()['delays'].get(tool, 0.0))
+    elif tool == 'sbatch':
+        submit('slurm', args)
+    elif tool == 'qsub':
+        submit('pbs', args)
+    elif tool == 'sacct':
+        try:
+            sacct(args)
+        except BrokenPipeError:
+            # check_job_status.sh pipes sacct into grep -q, which stops reading at the first match, as real sacct allows
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    elif tool == 'qstat':
+        record_call(tool, beg)
+        qstat(args)
+    elif tool in ('mpiexec', 'mpirun', 'mpibind', 'srun'):
+        ret = mpi_launcher(args)
+    elif tool == 'link_grib.csh':
+        link_grib(args)
+    elif tool in ('module', 'conda'):
+        pass
+    else:
+        print(f'bench_stubs.py: unknown tool {tool}', file=sys.stderr)
+        ret = 1
+    record_call(tool, beg)
+    return ret
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    sys.exit(main(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+
+'''
+bench_workflow.py
+
+Orchestration benchmark for the WPS/WRF workflow on a plain Linux box (no WPS/WRF install, no scheduler).
+
+This script builds a throwaway sandbox with:
+  - a fake scheduler (sbatch/sacct or qsub/qstat) and no-op module/conda/mpiexec commands on PATH,
+  - stub geogrid.exe, ungrib.exe, metgrid.exe, avg_tsfc.exe, real.exe, wrf.exe and upp.x that write the log
+    markers and output files the run_*.py scripts wait for, after configurable delays,
+  - copies of the master templates with every path pointing inside the sandbox, and fake HRRR grib2 files,
+then drives setup_wps_wrf.py and/or wildfireTS_wrapper/prepare_data.py end to end (see utils/bench_stubs.py).
+
+Because the stubs' own run time is known exactly, whatever else the workflow spends is orchestration overhead
+(polling sleeps, file-system churn, subprocess launches, scheduler round-trips). The report lists per stage:
+  - wall time (from the trace spans written by trace_util.py),
+  - time spent inside stub jobs, split into queue wait and run time,
+  - orchestration overhead = wall time - stub job time,
+and for the whole run: file-system operation counts, subprocess counts by program, and scheduler call counts.
+
+Examples:
+  python utils/bench_workflow.py --mode setup --cycles 2 --scheduler slurm
+  python utils/bench_workflow.py --mode prepare --fires 2 --days 2 --threads 2 -o bench_report.json
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import pathlib
+import tempfile
+import subprocess
+import datetime as dt
+import logging
+
+this_file = os.path.basename(__file__)
+logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                    level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+log = logging.getLogger(__name__)
+
+curr_dir = pathlib.Path(__file__).resolve().parent
+repo_dir = curr_dir.parent
+stubs_script = curr_dir.joinpath('bench_stubs.py')
+
+STAGES = ['get_icbc', 'geogrid', 'ungrib', 'avg_tsfc', 'metgrid', 'real', 'wrf', 'upp', 'post_move']
+WPS_EXES = ['geogrid.exe', 'ungrib.exe', 'metgrid.exe', 'link_grib.csh']
+WRF_EXES = ['real.exe', 'wrf.exe']
+ENV_TOOLS = ['module', 'conda', 'mpiexec', 'mpirun', 'mpibind', 'srun']
+SCHEDULER_TOOLS = {'slurm': ['sbatch', 'sacct'], 'pbs': ['qsub', 'qstat']}
+
+# Loaded through PYTHONPATH by every Python process in the sandbox: counts file-system operations and
+# subprocess launches under the sandbox via audit hooks and appends one summary line per process at exit
+SITECUSTOMIZE = '''
+import os, sys, json, atexit
+_bench_dir = os.environ.get('WPS_WRF_BENCH_DIR', '')
+_counts = {}
+_procs = {}
+_fs_events = {'os.remove', 'os.rename', 'os.symlink', 'os.mkdir', 'os.rmdir', 'os.listdir', 'os.scandir',
+              'os.chmod', 'shutil.copyfile', 'shutil.rmtree', 'shutil.move', 'glob.glob'}
+
+def _inside(path):
+    try:
+        return os.path.abspath(os.fsdecode(path)).startswith(_bench_dir)
+    except TypeError:
+        return False
+
+def _hook(event, args):
+    if event == 'open':
+        if args and isinstance(args[0], (str, bytes, os.PathLike)) and _inside(args[0]):
+            mode = args[1] or 'r'
+            kind = 'open_write' if any(c in str(mode) for c in 'wax+') else 'open_read'
+            _counts[kind] = _counts.get(kind, 0) + 1
+    elif event in _fs_events:
+        path = args[0] if args else None
+        if path is None or not isinstance(path, (str, bytes, os.PathLike)) or _inside(path) or event == 'glob.glob':
+            _counts[event] = _counts.get(event, 0) + 1
+    elif event == 'subprocess.Popen':
+        prog = args[1][0] if args[1] else args[0]
+        prog = os.path.basename(os.fsdecode(prog)) if isinstance(prog, (str, bytes, os.PathLike)) else str(prog)
+        _procs[prog] = _procs.get(prog, 0) + 1
+
+def _dump():
+    if not _bench_dir:
+        return
+    line = json.dumps({'script': os.path.basename(sys.argv[0]) if sys.argv else '', 'pid': os.getpid(),
+                       'fs': _counts, 'subprocess': _procs}) + '\\n'
+    fd = os.open(os.path.join(_bench_dir, 'audit.jsonl'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    os.write(fd, line.encode())
+    os.close(fd)
+
+if _bench_dir:
+    sys.addaudithook(_hook)
+    atexit.register(_dump)
+'''
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Benchmark WPS/WRF workflow orchestration with stub executables and a fake scheduler.')
+    parser.add_argument('-m', '--mode', default='setup', choices=['setup', 'prepare', 'both'],
+                        help='drive setup_wps_wrf.py directly (setup), the wildfireTS_wrapper sweep (prepare), or both (default: setup)')
+    parser.add_argument('-q', '--scheduler', default='slurm', choices=['slurm', 'pbs'],
+                        help='fake batch scheduler to put on PATH (default: slurm)')
+    parser.add_argument('-b', '--cycle_dt_beg', default='20240801_00',
+                        help='first cycle (setup mode) or first fire date (prepare mode) [YYYYMMDD_HH] (default: 20240801_00)')
+    parser.add_argument('-c', '--cycles', default=1, type=int,
+                        help='number of daily cycles to run in setup mode (default: 1)')
+    parser.add_argument('-s', '--sim_hrs', default=24, type=int,
+                        help='simulation length in hours; must be a multiple of 24 for avg_tsfc (default: 24)')
+    parser.add_argument('-f', '--fires', default=2, type=int,
+                        help='number of fires in prepare mode (default: 2)')
+    parser.add_argument('-d', '--days', default=1, type=int,
+                        help='number of days per fire in prepare mode (default: 1)')
+    parser.add_argument('-t', '--threads', default=2, type=int,
+                        help='prepare_data.py worker threads (default: 2)')
+    parser.add_argument('--queue_delay', default=0.0, type=float,
+                        help='seconds every fake job waits in the queue before it starts (default: 0)')
+    parser.add_argument('--delay', action='append', default=[], metavar='EXE=SECONDS',
+                        help='stub run time, e.g. --delay wrf.exe=5 (repeatable; defaults in bench_stubs.py)')
+    parser.add_argument('-w', '--work_dir', default=None,
+                        help='sandbox directory (default: a new temporary directory)')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='keep the sandbox afterwards (always kept when --work_dir is given)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the full report as JSON to this file')
+
+    args = parser.parse_args()
+    cycle_dt_beg = args.cycle_dt_beg
+    delays = {}
+
+    if len(cycle_dt_beg) != 11 or cycle_dt_beg[8] != '_':
+        log.error('ERROR! Incorrect format for argument cycle_dt_beg in call to bench_workflow.py. Exiting!')
+        parser.print_help()
+        sys.exit(1)
+
+    if args.sim_hrs < 24 or args.sim_hrs % 24 != 0:
+        log.error('ERROR! sim_hrs = ' + str(args.sim_hrs) + ', but must be a multiple of 24 so that avg_tsfc runs. Exiting!')
+        sys.exit(1)
+
+    for item in args.delay:
+        try:
+            exe, seconds = item.split('=')
+            delays[exe] = float(seconds)
+        except ValueError:
+            log.error('ERROR! --delay expects EXE=SECONDS, got ' + item + '. Exiting!')
+            sys.exit(1)
+
+    work_dir = pathlib.Path(args.work_dir).resolve() if args.work_dir is not None else None
+    keep = args.keep or work_dir is not None
+    output = pathlib.Path(args.output) if args.output is not None else None
+
+    return (args.mode, args.scheduler, cycle_dt_beg, args.cycles, args.sim_hrs, args.fires, args.days, args.threads,
+            args.queue_delay, delays, work_dir, keep, output)
+
+
+## *****************
+## Sandbox building
+## *****************
+
+def write_shim(path, tool):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/bash\nexec "{sys.executable}" "{stubs_script}" {tool} "$@"\n')
+    path.chmod(0o755)
+
+
+def build_sandbox(bench_dir, scheduler, queue_delay, delays):
+    '''
+    Lay out the sandbox: fake tools in bin/, fake WPS/WRF installs, a work dir that mirrors the repo, and the
+    audit hook that counts file-system operations.
+    '''
+    dirs = {name: bench_dir.joinpath(name) for name in ['bin', 'wps', 'wrf', 'home', 'scratch', 'data', 'wrfout', 'audit']}
+    for this_dir in dirs.values():
+        this_dir.mkdir(parents=True, exist_ok=True)
+
+    for tool in SCHEDULER_TOOLS[scheduler] + ENV_TOOLS:
+        write_shim(dirs['bin'].joinpath(tool), tool)
+    for python in ['python', 'python3']:
+        with open(dirs['bin'].joinpath(python), 'w') as f:
+            f.write(f'#!/bin/bash\nexec "{sys.executable}" "$@"\n')
+        dirs['bin'].joinpath(python).chmod(0o755)
+
+    for exe in WPS_EXES:
+        write_shim(dirs['wps'].joinpath(exe), exe)
+    write_shim(dirs['wps'].joinpath('util', 'avg_tsfc.exe'), 'avg_tsfc.exe')
+    for exe in WRF_EXES:
+        write_shim(dirs['wrf'].joinpath('run', exe), exe)
+    write_shim(dirs['wrf'].joinpath('run', 'upp.x'), 'upp.x')
+    # run_real.py links everything in run/ and then replaces namelist.input
+    dirs['wrf'].joinpath('run', 'namelist.input').touch()
+
+    with open(dirs['audit'].joinpath('sitecustomize.py'), 'w') as f:
+        f.write(SITECUSTOMIZE)
+    with open(bench_dir.joinpath('bench_config.json'), 'w') as f:
+        json.dump({'delays': delays, 'queue_delay': queue_delay}, f, indent=2)
+
+    # Work dir mirrors the repo (symlinks), except templates/, config/ and logs/, which the run writes into
+    for item in repo_dir.iterdir():
+        if item.name in ['.git', 'templates', 'config', 'logs']:
+            continue
+        dirs['home'].joinpath(item.name).symlink_to(item)
+    if repo_dir.joinpath('config').is_dir():
+        shutil.copytree(repo_dir.joinpath('config'), dirs['home'].joinpath('config'))
+    else:
+        dirs['home'].joinpath('config').mkdir()
+    shutil.copytree(repo_dir.joinpath('templates', 'master'), dirs['home'].joinpath('templates', 'master'))
+    dirs['home'].joinpath('logs').mkdir()
+
+    return dirs
+
+
+def sandbox_templates(dirs, sim_hrs):
+    '''
+    Point the master namelist and yaml configs at the sandbox. ICs/LBCs are seeded locally (get_icbc off) so
+    the benchmark never touches the network.
+    '''
+    master_dir = dirs['home'].joinpath('templates', 'master')
+
+    nml_path = master_dir.joinpath('namelist.wps.hrrr')
+    with open(nml_path) as f:
+        lines = f.readlines()
+    with open(nml_path, 'w') as f:
+        for line in lines:
+            if line.strip().startswith('opt_output_from_geogrid_path'):
+                line = " opt_output_from_geogrid_path = '" + str(dirs['scratch'].joinpath('geogrid')) + "/',\n"
+            f.write(line)
+
+    overrides = {
+        'sim_hrs': sim_hrs,
+        'template_dir': str(master_dir),
+        'wps_ins_dir': str(dirs['wps']),
+        'wrf_ins_dir': str(dirs['wrf']),
+        'wps_run_dir': str(dirs['scratch'].joinpath('wps')),
+        'wrf_run_dir': str(dirs['scratch'].joinpath('wrf')),
+        'grib_dir': str(dirs['data'].joinpath('hrrr')),
+        'arc_dir': str(dirs['scratch'].joinpath('archive')),
+        'get_icbc': False,
+    }
+    for yaml_name in ['wrfonly.yaml', 'geogridonly.yaml']:
+        yaml_path = master_dir.joinpath(yaml_name)
+        with open(yaml_path) as f:
+            lines = [line for line in f if line.split(':')[0].strip() not in overrides]
+        with open(yaml_path, 'w') as f:
+            f.writelines(lines)
+            for key, value in overrides.items():
+                f.write(f'{key}: {value}\n')
+
+    # Setup mode runs geogrid too, so one direct setup_wps_wrf.py call covers every stage
+    bench_yaml = dirs['home'].joinpath('config', 'bench.yaml')
+    with open(master_dir.joinpath('wrfonly.yaml')) as f:
+        lines = [line for line in f if line.split(':')[0].strip() != 'do_geogrid']
+    with open(bench_yaml, 'w') as f:
+        f.writelines(lines)
+        f.write('do_geogrid: True\n')
+    return bench_yaml
+
+
+def seed_grib(grib_dir, first_dt, hours):
+    '''Fake HRRR analysis files (icbc_analysis = True) for every hour the run will ungrib.'''
+    for hh in range(hours + 1):
+        valid_dt = first_dt + dt.timedelta(hours=hh)
+        this_dir = grib_dir.joinpath('hrrr.' + valid_dt.strftime('%Y%m%d'), 'conus')
+        this_dir.mkdir(parents=True, exist_ok=True)
+        for product in ['wrfnat', 'wrfprs']:
+            this_dir.joinpath(f'hrrr.t{valid_dt:%H}z.{product}f00.grib2').touch()
+
+
+def write_fire_csv(csv_path, first_dt, fires, days):
+    with open(csv_path, 'w') as f:
+        f.write('fire_id,start_date,end_date,lat,lon,state_name\n')
+        for nn in range(fires):
+            beg = first_dt + dt.timedelta(days=nn)
+            end = beg + dt.timedelta(days=days - 1)
+            f.write(f'{9000001 + nn},{beg:%Y-%m-%d},{end:%Y-%m-%d},{39.0 + nn},{-120.0 + nn},Bench\n')
+
+
+## *********
+## Running
+## *********
+
+def bench_env(bench_dir, dirs, scheduler):
+    env = dict(os.environ)
+    env['PATH'] = str(dirs['bin']) + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(dirs['audit']), env.get('PYTHONPATH')]))
+    env['WPS_WRF_BENCH_DIR'] = str(bench_dir)
+    env['WPS_WRF_BENCH_CONFIG'] = str(bench_dir.joinpath('bench_config.json'))
+    env['WPS_WRF_TRACE_FILE'] = str(bench_dir.joinpath('trace.jsonl'))
+    env['WPS_WRF_WORK_DIR'] = str(dirs['home'])
+    env['WPS_WRF_SCRATCH_DIR'] = str(dirs['scratch'])
+    env['WPS_WRF_DATA_DIR'] = str(dirs['data'])
+    env['WPS_WRF_WRFOUT_DIR'] = str(dirs['wrfout'])
+    env['WPS_WRF_ENV_PATH'] = str(bench_dir)
+    for var in ['WPS_WRF_TRACE_ID', 'WPS_WRF_PARENT_SPAN', 'WPS_WRF_TRACE_ATTRS']:
+        env.pop(var, None)
+    # setup_wps_wrf.py checks for sbatch before qsub, so hide a real sbatch when faking pbs
+    if scheduler == 'pbs' and shutil.which('sbatch', path=env['PATH']):
+        log.info('WARNING: a real sbatch is on PATH; setup_wps_wrf.py will prefer it over the fake qsub.')
+    return env
+
+
+def run_step(name, cmd_list, cwd, env, log_path):
+    log.info(f'Running {name}: {" ".join(cmd_list)}')
+    time_beg = time.time()
+    with open(log_path, 'w') as log_file:
+        ret = subprocess.run(cmd_list, cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT).returncode
+    time_end = time.time()
+    if ret != 0:
+        log.error(f'ERROR: {name} returned {ret}. See {log_path}')
+    return {'name': name, 'returncode': ret, 'wall_s': round(time_end - time_beg, 3)}
+
+
+## ***********
+## Reporting
+## ***********
+
+def read_jsonl(path):
+    records = []
+    if path.is_file():
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def union_seconds(intervals):
+    total = 0.0
+    last_end = None
+    for beg, end in sorted(intervals):
+        if last_end is None or beg > last_end:
+            total += end - beg
+            last_end = end
+        elif end > last_end:
+            total += end - last_end
+            last_end = end
+    return total
+
+
+def stage_of(span_id, spans_by_id):
+    '''Walk up the span tree to the nearest workflow stage.'''
+    while span_id in spans_by_id:
+        this_span = spans_by_id[span_id]
+        if this_span['name'] in STAGES:
+            return this_span['name']
+        span_id = this_span['parent_id']
+    return None
+
+
+def build_report(bench_dir, steps):
+    spans = read_jsonl(bench_dir.joinpath('trace.jsonl'))
+    spans_by_id = {s['span_id']: s for s in spans}
+    calls = read_jsonl(bench_dir.joinpath('calls.jsonl'))
+    audits = read_jsonl(bench_dir.joinpath('audit.jsonl'))
+    jobs = []
+    for job_file in sorted(bench_dir.joinpath('jobs').glob('*.json')):
+        with open(job_file) as f:
+            jobs.append(json.load(f))
+
+    ## Per-stage wall time vs. time actually spent in (stub) jobs
+    stages = {}
+    for stage in STAGES:
+        stage_spans = [s for s in spans if s['name'] == stage]
+        if not stage_spans:
+            continue
+        stages[stage] = {'count': len(stage_spans), 'errors': sum(s['status'] != 'ok' for s in stage_spans),
+                         'wall_s': sum(s['duration_s'] for s in stage_spans),
+                         'queue_s': 0.0, 'job_s': 0.0, 'jobs': 0, '_intervals': []}
+    for job in jobs:
+        stage = stage_of(job.get('parent_span'), spans_by_id)
+        if stage not in stages or job.get('end') is None:
+            continue
+        stages[stage]['jobs'] += 1
+        stages[stage]['queue_s'] += job['start'] - job['submit']
+        stages[stage]['_intervals'].append((job['start'], job['end']))
+    # avg_tsfc.exe runs inline rather than through the scheduler; its stub time comes from calls.jsonl
+    for call in calls:
+        stage = stage_of(call.get('parent_span'), spans_by_id)
+        if call['tool'] == 'avg_tsfc.exe' and stage in stages:
+            stages[stage]['_intervals'].append((call['beg'], call['end']))
+    for stage in stages.values():
+        stage['job_s'] = union_seconds(stage.pop('_intervals'))
+        stage['overhead_s'] = max(stage['wall_s'] - stage['job_s'], 0.0)
+        for key in ['wall_s', 'queue_s', 'job_s', 'overhead_s']:
+            stage[key] = round(stage[key], 3)
+
+    ## Counts
+    tool_calls = {}
+    for call in calls:
+        tool_calls[call['tool']] = tool_calls.get(call['tool'], 0) + 1
+    scheduler_calls = {tool: count for tool, count in tool_calls.items() if tool in ['sbatch', 'sacct', 'qsub', 'qstat']}
+    stub_calls = {tool: count for tool, count in tool_calls.items() if tool.endswith('.exe') or tool == 'upp.x'}
+
+    # Only the workflow's own Python processes count towards orchestration, not the stubs
+    fs_ops = {}
+    subprocesses = {}
+    processes = {}
+    for audit in audits:
+        if audit['script'] == 'bench_stubs.py':
+            continue
+        processes[audit['script']] = processes.get(audit['script'], 0) + 1
+        for key, count in audit['fs'].items():
+            fs_ops[key] = fs_ops.get(key, 0) + count
+        for key, count in audit['subprocess'].items():
+            subprocesses[key] = subprocesses.get(key, 0) + count
+
+    return {
+        'steps': steps,
+        'stages': stages,
+        'queue_wait_s': round(sum(s['duration_s'] for s in spans if s['name'] == 'queue_wait'), 3),
+        'scheduler_calls': scheduler_calls,
+        'stub_calls': stub_calls,
+        'python_processes': processes,
+        'fs_ops': dict(sorted(fs_ops.items())),
+        'subprocesses': dict(sorted(subprocesses.items(), key=lambda item: -item[1])),
+    }
+
+
+def print_report(report):
+    log.info('')
+    for step in report['steps']:
+        log.info(f"{step['name']}: {'ok' if step['returncode'] == 0 else 'FAILED'} in {step['wall_s']:.1f} s")
+    log.info('')
+    log.info(f'{"stage":<12}{"count":>6}{"jobs":>6}{"wall_s":>10}{"queue_s":>10}{"job_s":>10}{"overhead_s":>12}{"errors":>8}')
+    for name, stage in report['stages'].items():
+        log.info(f"{name:<12}{stage['count']:>6}{stage['jobs']:>6}{stage['wall_s']:>10.2f}{stage['queue_s']:>10.2f}"
+                 f"{stage['job_s']:>10.2f}{stage['overhead_s']:>12.2f}{stage['errors']:>8}")
+    log.info('')
+    log.info('Scheduler calls:  ' + ', '.join(f'{k}={v}' for k, v in report['scheduler_calls'].items()))
+    log.info('Stub executables: ' + ', '.join(f'{k}={v}' for k, v in report['stub_calls'].items()))
+    log.info('Python processes: ' + ', '.join(f'{k}={v}' for k, v in report['python_processes'].items()))
+    log.info('File-system ops:  ' + ', '.join(f'{k}={v}' for k, v in report['fs_ops'].items()))
+    log.info('Subprocesses:     ' + ', '.join(f'{k}={v}' for k, v in report['subprocesses'].items()))
+
+
+def main(mode, scheduler, cycle_dt_beg, cycles, sim_hrs, fires, days, threads, queue_delay, delays, work_dir, keep, output):
+
+    fmt_yyyymmdd_hh = '%Y%m%d_%H'
+    first_dt = dt.datetime.strptime(cycle_dt_beg, fmt_yyyymmdd_hh)
+
+    if work_dir is None:
+        bench_dir = pathlib.Path(tempfile.mkdtemp(prefix='wps_wrf_bench_'))
+    else:
+        bench_dir = work_dir
+        if bench_dir.exists() and any(bench_dir.iterdir()):
+            log.error('ERROR: work_dir ' + str(bench_dir) + ' is not empty. Exiting!')
+            sys.exit(1)
+        bench_dir.mkdir(parents=True, exist_ok=True)
+    log.info('Building benchmark sandbox in ' + str(bench_dir))
+
+    dirs = build_sandbox(bench_dir, scheduler, queue_delay, delays)
+    bench_yaml = sandbox_templates(dirs, sim_hrs)
+    env = bench_env(bench_dir, dirs, scheduler)
+
+    steps = []
+    if mode in ['setup', 'both']:
+        cycle_dt_end = first_dt + dt.timedelta(days=cycles - 1)
+        seed_grib(dirs['data'].joinpath('hrrr'), first_dt, (cycles - 1) * 24 + sim_hrs)
+        cmd_list = [sys.executable, 'setup_wps_wrf.py', '-b', cycle_dt_beg, '-e', cycle_dt_end.strftime(fmt_yyyymmdd_hh),
+                    '-c', str(bench_yaml)]
+        steps.append(run_step('setup_wps_wrf.py', cmd_list, dirs['home'], env, bench_dir.joinpath('setup_wps_wrf.log')))
+
+    if mode in ['prepare', 'both']:
+        # prepare_data.py gives every fire its own grib_dir (data/<fire_id>)
+        fire_csv = bench_dir.joinpath('fires.csv')
+        write_fire_csv(fire_csv, first_dt, fires, days)
+        for nn in range(fires):
+            seed_grib(dirs['data'].joinpath(str(9000001 + nn)), first_dt + dt.timedelta(days=nn), days * 24 + sim_hrs)
+        cmd_list = [sys.executable, 'wildfireTS_wrapper/prepare_data.py', '--fire-csv', str(fire_csv),
+                    '-m', str(fires), '-n', str(days), '-t', str(threads)]
+        steps.append(run_step('prepare_data.py', cmd_list, dirs['home'], env, bench_dir.joinpath('prepare_data.log')))
+
+    # Let any detached fake jobs finish writing their state before reading it
+    time.sleep(0.5)
+    report = build_report(bench_dir, steps)
+    print_report(report)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        log.info('Wrote report to ' + str(output))
+
+    if keep:
+        log.info('Sandbox kept in ' + str(bench_dir))
+    else:
+        shutil.rmtree(bench_dir)
+
+    if any(step['returncode'] != 0 for step in steps):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    now_time_beg = dt.datetime.now(dt.UTC)
+    main(*parse_args())
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
@@ -1,25 +1,216 @@
+'''
+number_of_procs.py
+
+MPI decomposition planner for real.exe and wrf.exe.
+
+WRF splits every domain into nproc_x x nproc_y patches, one per MPI rank. A patch that is too small spends
+most of its time exchanging halos instead of computing, so a small fire domain run on a full 128-core node is
+badly over-decomposed. For each candidate (ranks, nproc_x, nproc_y) this module estimates the time of one
+model step on the slowest rank, in units of "columns computed":
+  - interior: mass-point columns in the largest patch,
+  - halo:     HALO_WIDTH rows along every edge shared with a neighbouring patch, weighted by HALO_WEIGHT,
+              and by another OFFNODE_WEIGHT if that neighbour sits on a different node,
+  - messages: MSG_COST per neighbour, for message latency,
+summed over domains (nests take parent_time_step_ratio steps per parent step). Layouts with a patch narrower
+than MIN_PATCH points on any domain are rejected. Rank counts are multiples of RANK_STEP within a node and whole
+nodes beyond that. The plan is the fastest layout whose parallel efficiency (speedup over one rank / ranks) is
+at least MIN_EFFICIENCY; among layouts within TOLERANCE of that, the one with the fewest ranks wins.
+
+Run this file directly to print the plan for a namelist, e.g.
+  python utils/number_of_procs.py -n namelist.input -r 128
+'''
+
 import math
 
+# Cost model weights, relative to computing one grid column for one step
+HALO_WIDTH = 3
+HALO_WEIGHT = 0.5
+OFFNODE_WEIGHT = 1.0
+MSG_COST = 20.0
+# Narrowest patch (grid points) WRF is allowed to run with
+MIN_PATCH = 10
+# Fewer ranks are not worth using if they are less efficient than this
+MIN_EFFICIENCY = 0.5
+# Layouts this close to the fastest are considered equal, and the one using fewest ranks is chosen
+TOLERANCE = 0.05
+# Rank counts tried within a node; beyond one node only whole nodes are used
+RANK_STEP = 4
+
+
+def rank_counts(max_ranks, cores_per_node=None):
+    '''Candidate rank counts: multiples of RANK_STEP up to one node, then whole nodes.'''
+    cores_per_node = min(cores_per_node or max_ranks, max_ranks)
+    counts = list(range(1, min(RANK_STEP, cores_per_node) + 1))
+    counts += list(range(2 * RANK_STEP, cores_per_node + 1, RANK_STEP))
+    counts += list(range(2 * cores_per_node, max_ranks + 1, cores_per_node))
+    if cores_per_node not in counts:
+        counts.append(cores_per_node)
+    return sorted(set(counts))
+
+
+def layouts(total_ranks, ny_multiple=1):
+    '''All (nproc_x, nproc_y) pairs with nproc_x * nproc_y = total_ranks and nproc_y a multiple of ny_multiple.'''
+    pairs = []
+    for nx in range(1, total_ranks + 1):
+        if total_ranks % nx == 0 and (total_ranks // nx) % ny_multiple == 0:
+            pairs.append((nx, total_ranks // nx))
+    return pairs
+
+
+def step_cost(e_we, e_sn, nx, ny, cores_per_node=None):
+    '''
+    Estimated cost of one step on the slowest rank for one domain, or None if a patch would be narrower than
+    MIN_PATCH. Ranks are numbered along x first, as WRF does, and fill nodes of cores_per_node in order.
+    '''
+    # e_we/e_sn count staggered points; patches hold mass points
+    px = math.ceil((e_we - 1) / nx)
+    py = math.ceil((e_sn - 1) / ny)
+    if (e_we - 1) // nx < MIN_PATCH or (e_sn - 1) // ny < MIN_PATCH:
+        return None
+
+    ranks = nx * ny
+    cores_per_node = cores_per_node or ranks
+    worst = 0.0
+    for rank in range(ranks):
+        ii = rank % nx
+        jj = rank // nx
+        node = rank // cores_per_node
+        cost = px * py
+        for di, dj, edge in [(-1, 0, py), (1, 0, py), (0, -1, px), (0, 1, px)]:
+            ni, nj = ii + di, jj + dj
+            if ni < 0 or ni >= nx or nj < 0 or nj >= ny:
+                continue
+            weight = HALO_WEIGHT
+            if (nj * nx + ni) // cores_per_node != node:
+                weight *= 1.0 + OFFNODE_WEIGHT
+            cost += weight * HALO_WIDTH * edge + MSG_COST
+        worst = max(worst, cost)
+    return worst
+
+
+def layout_cost(domains, nx, ny, cores_per_node=None):
+    '''
+    Cost of one parent-domain step for all domains with the same nproc_x x nproc_y.
+
+    domains: list of (e_we, e_sn, steps), where steps is the number of steps this domain takes per d01 step.
+    '''
+    total = 0.0
+    for e_we, e_sn, steps in domains:
+        cost = step_cost(e_we, e_sn, nx, ny, cores_per_node)
+        if cost is None:
+            return None
+        total += steps * cost
+    return total
+
+
+def plan_decomposition(domains, max_ranks, cores_per_node=None, ny_multiple=1):
+    '''
+    Choose the rank count and nproc_x x nproc_y for a set of domains. With ny_multiple, only layouts whose nproc_y
+    is a multiple of it are considered (quilting needs nproc_y divisible by nio_tasks_per_group).
+
+    Returns
+    -------
+    tuple
+        (ranks, nproc_x, nproc_y, estimated speedup over one rank)
+    '''
+    serial = layout_cost(domains, 1, 1)
+    candidates = []
+    for ranks in rank_counts(max_ranks, cores_per_node):
+        for nx, ny in layouts(ranks, ny_multiple):
+            cost = layout_cost(domains, nx, ny, cores_per_node)
+            if cost is None:
+                continue
+            speedup = serial / cost
+            if ranks == 1 or speedup / ranks >= MIN_EFFICIENCY:
+                candidates.append((cost, ranks, nx, ny, speedup))
+
+    if not candidates:
+        raise ValueError(f'No decomposition of at most {max_ranks} ranks with nproc_y a multiple of {ny_multiple} '
+                         f'keeps patches at least {MIN_PATCH} points wide')
+    best_cost = min(candidate[0] for candidate in candidates)
+    # Fewest ranks within TOLERANCE of the fastest; layouts within TOLERANCE count as equally fast, so the squarer
+    # nproc_x x nproc_y wins before the (noisy) estimated cost is consulted
+    good = [c for c in candidates if c[0] <= best_cost * (1.0 + TOLERANCE)]
+    cost, ranks, nx, ny, speedup = min(good, key=lambda c: (c[1], abs(c[2] - c[3]), c[0]))
+    return ranks, nx, ny, speedup
+
+
+def layout_for_ranks(domains, ranks, cores_per_node=None, ny_multiple=1):
+    '''
+    Best nproc_x x nproc_y for exactly this many ranks (patches need not divide evenly), e.g. to benchmark a rank
+    count the planner would not choose.
+
+    Returns
+    -------
+    tuple
+        (nproc_x, nproc_y, estimated speedup over one rank)
+    '''
+    scored = [(layout_cost(domains, nx, ny, cores_per_node), nx, ny) for nx, ny in layouts(ranks, ny_multiple)]
+    scored = [s for s in scored if s[0] is not None]
+    if not scored:
+        raise ValueError(f'No decomposition of {ranks} ranks with nproc_y a multiple of {ny_multiple} '
+                         f'keeps patches at least {MIN_PATCH} points wide')
+    cost, nx, ny = min(scored, key=lambda s: (s[0], abs(s[1] - s[2])))
+    return nx, ny, layout_cost(domains, 1, 1) / cost
+
+
 def choose_wrf_ranks(e_we, e_sn, total_ranks):
-    # Find factors of total_ranks
-    factors = []
-    for i in range(1, int(math.sqrt(total_ranks)) + 1):
-        if total_ranks % i == 0:
-            factors.append((i, total_ranks // i))
-            factors.append((total_ranks // i, i))
-
-    # Filter factors that divide the domain
-    valid_pairs = [(nx, ny) for nx, ny in factors if e_we % nx == 0 and e_sn % ny == 0]
-
-    # Pick the pair with nx >= ny and largest nx (more square-ish)
-    if not valid_pairs:
-        raise ValueError("No valid rank decomposition found")
-    
-    nx, ny = max(valid_pairs, key=lambda x: (x[0], x[1]))
+    '''Best nproc_x x nproc_y for exactly total_ranks on a single domain.'''
+    nx, ny, speedup = layout_for_ranks([(e_we, e_sn, 1)], total_ranks)
     return nx, ny
 
-e_we, e_sn = 400, 400
-total_ranks = 128
-nx, ny = choose_wrf_ranks(e_we, e_sn, total_ranks)
-print(f"nproc_x = {nx}, nproc_y = {ny}")
 
+def read_domains(nml_file):
+    '''(e_we, e_sn, steps per d01 step) for every active domain in a WRF namelist.input.'''
+    import f90nml
+
+    domains_nml = f90nml.read(nml_file)['domains']
+    max_dom = int(domains_nml['max_dom'])
+
+    def per_domain(key, default):
+        value = domains_nml.get(key, default)
+        value = value if isinstance(value, list) else [value]
+        return (value + [value[-1]] * max_dom)[:max_dom]
+
+    e_we = per_domain('e_we', None)
+    e_sn = per_domain('e_sn', None)
+    parent_id = per_domain('parent_id', 1)
+    ratio = per_domain('parent_time_step_ratio', 1)
+
+    steps = []
+    for dd in range(max_dom):
+        steps.append(1 if dd == 0 else steps[int(parent_id[dd]) - 1] * int(ratio[dd]))
+    return [(int(e_we[dd]), int(e_sn[dd]), steps[dd]) for dd in range(max_dom)]
+
+
+def write_decomposition(nml_file, nx, ny):
+    '''Set nproc_x/nproc_y in a namelist.input, adding them after max_dom if the template does not have them.'''
+    with open(nml_file) as in_file:
+        lines = in_file.readlines()
+    has_nproc = any(line.strip()[0:7] in ['nproc_x', 'nproc_y'] for line in lines)
+    with open(nml_file, 'w') as out_file:
+        for line in lines:
+            if line.strip()[0:7] == 'nproc_x':
+                out_file.write(' nproc_x                             = ' + str(nx) + ',\n')
+            elif line.strip()[0:7] == 'nproc_y':
+                out_file.write(' nproc_y                             = ' + str(ny) + ',\n')
+            else:
+                out_file.write(line)
+                if not has_nproc and line.strip()[0:7] == 'max_dom':
+                    out_file.write(' nproc_x                             = ' + str(nx) + ',\n')
+                    out_file.write(' nproc_y                             = ' + str(ny) + ',\n')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Plan the MPI decomposition for a WRF domain.')
+    parser.add_argument('-n', '--namelist', default=None, help='namelist.input to read e_we/e_sn/max_dom from')
+    parser.add_argument('-x', '--e_we', type=int, default=400, help='d01 e_we if no namelist is given (default: 400)')
+    parser.add_argument('-y', '--e_sn', type=int, default=400, help='d01 e_sn if no namelist is given (default: 400)')
+    parser.add_argument('-r', '--max_ranks', type=int, default=128, help='most MPI ranks available (default: 128)')
+    parser.add_argument('-c', '--cores_per_node', type=int, default=128, help='cores per node (default: 128)')
+    args = parser.parse_args()
+
+    domains = read_domains(args.namelist) if args.namelist else [(args.e_we, args.e_sn, 1)]
+    ranks, nx, ny, speedup = plan_decomposition(domains, args.max_ranks, args.cores_per_node)
+    print(f'ranks = {ranks}, nproc_x = {nx}, nproc_y = {ny}, estimated speedup = {speedup:.1f}')
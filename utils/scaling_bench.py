@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+'''
+scaling_bench.py
+
+Strong-scaling benchmark for wrf.exe on one or more domain configurations.
+
+For every configuration (a namelist.input template plus a directory holding the wrfinput_d0*/wrfbdy_d01 files that
+run_real.py made for it) and every requested rank count, this script submits a short run of a few model minutes
+through run_wrf.py (--mpi_ranks, --run_minutes, --monitor_wrf), so the namelist handling, MPI layout, submit script
+and job monitoring are exactly those of production runs. Runs are submitted concurrently and each gets its own run
+directory under <output_dir>/<config>/n<ranks>.
+
+From each rsl.out.0000 the per-step "Timing for main" lines are averaged per domain, after discarding the first
+--skip_steps steps of each domain (start-up, first output), and combined into the compute time of one d01 step
+(nests count parent_time_step_ratio steps per d01 step). "Timing for Writing/processing" lines are summed as I/O.
+Against the smallest rank count that finished, each configuration then gets:
+  - speedup and parallel efficiency = speedup * ranks_min / ranks,
+  - simulation speed (simulated seconds per wall-clock second of compute),
+  - the efficiency the cost model in utils/number_of_procs.py predicts for the same layouts, for calibration,
+written to <output_dir>/<config>/scaling.csv and plotted in <output_dir>/<config>/efficiency.png.
+
+With --record, each run's wall time is also appended to the runtime history named by WPS_WRF_RUNTIME_DB
+(walltime_util.py), so walltime requests benefit from the measurements.
+
+Example:
+  python utils/scaling_bench.py -b 20240801_00 -w /path/to/WRF -t templates/WRF_1Dom1km -q pbs -a derecho \
+      -c namelist.input.hrrr.pres=/glade/derecho/scratch/user/WRF_1Dom1km/20240801_00/wrf -r 16,32,64,128,256
+'''
+
+import os
+import sys
+import csv
+import json
+import shutil
+import argparse
+import pathlib
+import subprocess
+import datetime as dt
+import concurrent.futures
+import logging
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+curr_dir = pathlib.Path(__file__).resolve().parent
+repo_dir = curr_dir.parent
+sys.path.insert(0, str(repo_dir))
+
+from rsl_util import MAIN_PATTERN, IO_PATTERN, SUCCESS_PATTERN
+from utils.number_of_procs import layout_for_ranks, read_domains
+from walltime_util import problem_size, record_runtime, template_cores_per_node, is_enabled, RUNTIME_DB_ENV
+
+this_file = os.path.basename(__file__)
+logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                    level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+log = logging.getLogger(__name__)
+
+# Files made by real.exe that wrf.exe reads
+WRF_INPUTS = ['wrfinput_d0*', 'wrfbdy_d01', 'wrflowinp_d0*', 'wrffdda_d0*']
+CSV_FIELDS = ['ranks', 'nproc_x', 'nproc_y', 'steps', 'step_s', 'sim_speed', 'speedup', 'efficiency',
+              'model_efficiency', 'io_s', 'wall_s', 'status']
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Strong-scaling benchmark of wrf.exe over MPI rank counts.')
+    parser.add_argument('-b', '--cycle_dt_beg', default='20240801_00',
+                        help='start date/time of the wrfinput/wrfbdy files [YYYYMMDD_HH] (default: 20240801_00)')
+    parser.add_argument('-w', '--wrf_dir', required=True, help='WRF install directory')
+    parser.add_argument('-t', '--tmp_dir', required=True, help='directory with the namelist and submit_wrf.bash templates')
+    parser.add_argument('-c', '--config', action='append', default=[], metavar='NML_TMP=INPUT_DIR',
+                        help='namelist.input template in tmp_dir and the directory holding its wrfinput/wrfbdy files (repeatable)')
+    parser.add_argument('-r', '--ranks', default='16,32,64,128',
+                        help='comma-separated MPI rank counts to run (default: 16,32,64,128)')
+    parser.add_argument('-M', '--run_minutes', default=10, type=int,
+                        help='model minutes to integrate in each run (default: 10)')
+    parser.add_argument('-k', '--skip_steps', default=2, type=int,
+                        help='steps per domain discarded as start-up before averaging (default: 2)')
+    parser.add_argument('-o', '--output_dir', default='scaling_bench',
+                        help='directory for the benchmark run directories and results (default: scaling_bench)')
+    parser.add_argument('-j', '--concurrent', default=0, type=int,
+                        help='most runs submitted at once (default: 0, all of them)')
+    parser.add_argument('-q', '--scheduler', default='pbs', help='cluster job scheduler (default: pbs)')
+    parser.add_argument('-a', '--hostname', default='derecho', help='hostname (default: derecho)')
+    parser.add_argument('-R', '--record', action='store_true',
+                        help=f'append each run to the runtime history in ${RUNTIME_DB_ENV}')
+    parser.add_argument('--report_only', action='store_true',
+                        help='do not submit anything; rebuild the tables and plots from existing run directories')
+
+    args = parser.parse_args()
+    cycle_dt_beg = args.cycle_dt_beg
+
+    if len(cycle_dt_beg) != 11 or cycle_dt_beg[8] != '_':
+        log.error('ERROR! Incorrect format for argument cycle_dt_beg in call to scaling_bench.py. Exiting!')
+        parser.print_help()
+        sys.exit(1)
+
+    configs = []
+    for item in args.config:
+        try:
+            nml_tmp, input_dir = item.split('=')
+        except ValueError:
+            log.error('ERROR! --config expects NML_TMP=INPUT_DIR, got ' + item + '. Exiting!')
+            sys.exit(1)
+        configs.append((nml_tmp, pathlib.Path(input_dir).resolve()))
+    if not configs:
+        log.error('ERROR! At least one --config is required. Exiting!')
+        parser.print_help()
+        sys.exit(1)
+
+    try:
+        ranks = sorted(set(int(rr) for rr in args.ranks.split(',')))
+    except ValueError:
+        log.error('ERROR! --ranks expects comma-separated integers, got ' + args.ranks + '. Exiting!')
+        sys.exit(1)
+
+    if args.record and not is_enabled():
+        log.error(f'ERROR! --record needs {RUNTIME_DB_ENV} to name the runtime history file. Exiting!')
+        sys.exit(1)
+
+    wrf_dir = pathlib.Path(args.wrf_dir).resolve()
+    tmp_dir = pathlib.Path(args.tmp_dir).resolve()
+    output_dir = pathlib.Path(args.output_dir).resolve()
+
+    return (cycle_dt_beg, wrf_dir, tmp_dir, configs, ranks, args.run_minutes, args.skip_steps, output_dir,
+            args.concurrent, args.scheduler, args.hostname, args.record, args.report_only)
+
+
+## **************
+## Running wrf
+## **************
+
+def stage_run(run_dir, input_dir):
+    '''Fresh run directory with links to the wrf input files of this configuration.'''
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+    run_dir.mkdir(parents=True)
+    n_links = 0
+    for pattern in WRF_INPUTS:
+        for file in sorted(input_dir.glob(pattern)):
+            run_dir.joinpath(file.name).symlink_to(file)
+            n_links += 1
+    return n_links
+
+
+def run_wrf(cmd_list, log_path):
+    log.info('Submitting: ' + ' '.join(cmd_list))
+    with open(log_path, 'w') as log_file:
+        return subprocess.run(cmd_list, cwd=repo_dir, stdout=log_file, stderr=subprocess.STDOUT).returncode
+
+
+## ***********
+## Reporting
+## ***********
+
+def parse_timings(rsl_file, skip_steps):
+    '''Per-domain lists of "Timing for main" step seconds, total I/O seconds, and whether wrf finished.'''
+    steps = {}
+    io_s = 0.0
+    success = False
+    with open(rsl_file, errors='replace') as f:
+        for line in f:
+            match = MAIN_PATTERN.search(line)
+            if match:
+                steps.setdefault(int(match.group(2)), []).append(float(match.group(3)))
+                continue
+            match = IO_PATTERN.search(line)
+            if match:
+                io_s += float(match.group(2))
+                continue
+            if SUCCESS_PATTERN in line:
+                success = True
+    steps = {dom: secs[skip_steps:] for dom, secs in steps.items()}
+    return steps, io_s, success
+
+
+def read_nproc(nml_file):
+    nproc = {}
+    with open(nml_file) as nml:
+        for line in nml:
+            if line.strip()[0:7] in ['nproc_x', 'nproc_y']:
+                nproc[line.strip()[0:7]] = int(line.split('=')[1].strip().split(',')[0])
+    return nproc.get('nproc_x'), nproc.get('nproc_y')
+
+
+def measure_run(run_dir, ranks, skip_steps):
+    '''One row of the scaling table for a finished (or failed) benchmark run.'''
+    row = {'ranks': ranks, 'status': 'missing'}
+    rsl_file = run_dir.joinpath('rsl.out.0000')
+    nml_file = run_dir.joinpath('namelist.input')
+    if not rsl_file.is_file() or not nml_file.is_file():
+        return row
+
+    domains = read_domains(nml_file)
+    steps, io_s, success = parse_timings(rsl_file, skip_steps)
+    row['nproc_x'], row['nproc_y'] = read_nproc(nml_file)
+    row['io_s'] = round(io_s, 2)
+    beg_file = run_dir.joinpath('WRF_BEG')
+    if beg_file.is_file():
+        row['wall_s'] = round(rsl_file.stat().st_mtime - beg_file.stat().st_mtime, 1)
+
+    if any(not steps.get(dd + 1) for dd in range(len(domains))):
+        row['status'] = 'too_few_steps' if success else 'failed'
+        return row
+
+    # Compute time of one d01 step, nests included
+    row['steps'] = len(steps[1])
+    row['step_s'] = sum(sum(steps[dd + 1]) / len(steps[dd + 1]) * domains[dd][2] for dd in range(len(domains)))
+    time_step = problem_size('wrf', nml_file, 0)['time_step']
+    row['sim_speed'] = round(time_step / row['step_s'], 2)
+    row['status'] = 'ok' if success else 'failed'
+    return row
+
+
+def add_efficiency(rows, domains, cores_per_node):
+    '''Speedup and efficiency against the smallest rank count that produced timings, measured and modelled.'''
+    timed = [row for row in rows if row.get('step_s')]
+    if not timed:
+        return
+    base = min(timed, key=lambda row: row['ranks'])
+    base_model = layout_for_ranks(domains, base['ranks'], cores_per_node)[2]
+    for row in timed:
+        row['speedup'] = round(base['step_s'] / row['step_s'], 3)
+        row['efficiency'] = round(row['speedup'] * base['ranks'] / row['ranks'], 3)
+        try:
+            model = layout_for_ranks(domains, row['ranks'], cores_per_node)[2]
+            row['model_efficiency'] = round(model / base_model * base['ranks'] / row['ranks'], 3)
+        except ValueError:
+            row['model_efficiency'] = None
+        row['step_s'] = round(row['step_s'], 4)
+
+
+def write_table(rows, csv_file):
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: row.get(key) for key in CSV_FIELDS})
+
+
+def plot_efficiency(rows, config, png_file):
+    timed = [row for row in rows if row.get('efficiency') is not None]
+    if not timed:
+        return
+    fig, ax = plt.subplots(figsize=(6, 4))
+    ranks = [row['ranks'] for row in timed]
+    ax.plot(ranks, [row['efficiency'] for row in timed], 'o-', label='measured')
+    model = [(row['ranks'], row['model_efficiency']) for row in timed if row.get('model_efficiency') is not None]
+    if model:
+        ax.plot(*zip(*model), 's--', label='number_of_procs.py model')
+    ax.axhline(1.0, color='gray', linewidth=0.5)
+    ax.set_xscale('log', base=2)
+    ax.set_xticks(ranks)
+    ax.set_xticklabels([str(rr) for rr in ranks])
+    ax.set_ylim(bottom=0)
+    ax.set_xlabel('MPI ranks')
+    ax.set_ylabel(f'parallel efficiency (vs. {ranks[0]} ranks)')
+    ax.set_title(config)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(png_file, dpi=120)
+    plt.close(fig)
+
+
+def main(cycle_dt_beg, wrf_dir, tmp_dir, configs, ranks, run_minutes, skip_steps, output_dir, max_jobs,
+         scheduler, hostname, record, report_only):
+
+    ## Stage and submit every (configuration, rank count) run
+    runs = []
+    for nml_tmp, input_dir in configs:
+        for rr in ranks:
+            run_dir = output_dir.joinpath(nml_tmp, f'n{rr:04d}')
+            runs.append((nml_tmp, input_dir, rr, run_dir))
+
+    if not report_only:
+        for nml_tmp, input_dir, rr, run_dir in runs:
+            if stage_run(run_dir, input_dir) == 0:
+                log.error('ERROR! No wrfinput/wrfbdy files found in ' + str(input_dir) + '. Exiting!')
+                sys.exit(1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs or len(runs)) as pool:
+            futures = {}
+            for nml_tmp, input_dir, rr, run_dir in runs:
+                cmd_list = [sys.executable, 'run_wrf.py', '-b', cycle_dt_beg, '-s', '1', '-w', str(wrf_dir),
+                            '-r', str(run_dir), '-t', str(tmp_dir), '-n', nml_tmp, '-q', scheduler, '-a', hostname,
+                            '-m', '-N', str(rr), '-M', str(run_minutes)]
+                futures[pool.submit(run_wrf, cmd_list, run_dir.parent.joinpath(f'run_wrf.n{rr:04d}.log'))] = run_dir
+            for future in concurrent.futures.as_completed(futures):
+                if future.result() != 0:
+                    log.warning('WARNING: run_wrf.py failed for ' + str(futures[future]))
+
+    ## Build the scaling table and efficiency curve for each configuration
+    summary = {}
+    for nml_tmp, input_dir in configs:
+        config_dir = output_dir.joinpath(nml_tmp)
+        config_runs = [run for run in runs if run[0] == nml_tmp]
+        rows = [measure_run(run_dir, rr, skip_steps) for _, _, rr, run_dir in config_runs]
+        nml_files = [run_dir.joinpath('namelist.input') for _, _, _, run_dir in config_runs
+                     if run_dir.joinpath('namelist.input').is_file()]
+        if not nml_files:
+            log.warning('WARNING: no benchmark runs found for ' + nml_tmp)
+            continue
+        domains = read_domains(nml_files[0])
+        cores_per_node = template_cores_per_node(nml_files[0].parent.joinpath('submit_wrf.bash').read_text())
+        add_efficiency(rows, domains, cores_per_node)
+
+        write_table(rows, config_dir.joinpath('scaling.csv'))
+        plot_efficiency(rows, nml_tmp, config_dir.joinpath('efficiency.png'))
+        summary[nml_tmp] = rows
+
+        log.info('')
+        log.info(f'{nml_tmp}: d01 {domains[0][0]} x {domains[0][1]}, {len(domains)} domain(s)')
+        log.info(f'{"ranks":>6}{"layout":>10}{"step_s":>10}{"sim_speed":>11}{"speedup":>9}{"eff":>7}{"model_eff":>11}{"io_s":>8}  status')
+        for row in rows:
+            layout = f'{row.get("nproc_x")}x{row.get("nproc_y")}' if row.get('nproc_x') else '-'
+            log.info(f'{row["ranks"]:>6}{layout:>10}{str(row.get("step_s", "-")):>10}{str(row.get("sim_speed", "-")):>11}'
+                     f'{str(row.get("speedup", "-")):>9}{str(row.get("efficiency", "-")):>7}'
+                     f'{str(row.get("model_efficiency", "-")):>11}{str(row.get("io_s", "-")):>8}  {row["status"]}')
+
+        if record and not report_only:
+            for row, (_, _, rr, run_dir) in zip(rows, config_runs):
+                if row['status'] == 'ok' and row.get('wall_s'):
+                    size = problem_size('wrf', run_dir.joinpath('namelist.input'), run_minutes / 60)
+                    record_runtime(size, rr, row['wall_s'])
+
+    with open(output_dir.joinpath('scaling.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    log.info('Wrote scaling tables and efficiency curves under ' + str(output_dir))
+
+
+if __name__ == '__main__':
+    now_time_beg = dt.datetime.now(dt.UTC)
+    main(*parse_args())
+    now_time_end = dt.datetime.now(dt.UTC)
+    run_time_tot = now_time_end - now_time_beg
+    now_time_beg_str = now_time_beg.strftime('%Y-%m-%d %H:%M:%S')
+    now_time_end_str = now_time_end.strftime('%Y-%m-%d %H:%M:%S')
+    log.info('')
+    log.info(this_file + ' completed successfully.')
+    log.info('Beg time: '+now_time_beg_str)
+    log.info('End time: '+now_time_end_str)
+    log.info('Run time: '+str(run_time_tot)+'\n')
@@ -0,0 +1,324 @@
+'''
+walltime_util.py
+
+Historical runtime model for sizing batch job requests.
+
+The submit_*.bash templates ask for a fixed walltime and core count whatever the domain size or simulation
+length, e.g. walltime=12:00:00 and select=1:ncpus=128 for every wrf.exe job. Over-asking for walltime keeps jobs
+from backfilling into gaps in the schedule and lowers their queue priority.
+
+Every successful geogrid, metgrid, real or wrf job appends its actual run time, together with the size of the
+problem (grid points, vertical levels, domains, simulation hours, time step) and the core count, as one JSON line
+to the file named by the WPS_WRF_RUNTIME_DB environment variable. Before the next job is submitted, a per-stage
+linear model  seconds = a + b * work / cores  is fitted to that history and the submit script is rewritten with
+the predicted walltime plus a safety margin. Until a stage has MIN_SAMPLES runs on record, the template walltime
+is kept. If WPS_WRF_RUNTIME_DB is not set, nothing is recorded and the template walltimes are used.
+
+Core counts for real and wrf come from the MPI decomposition planner in utils/number_of_procs.py
+(size_mpi_job), which runs whether or not a runtime history is kept.
+'''
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import socket
+import pathlib
+
+import f90nml
+
+from utils.number_of_procs import plan_decomposition, layout_for_ranks, read_domains, write_decomposition
+
+RUNTIME_DB_ENV = 'WPS_WRF_RUNTIME_DB'
+
+# Fraction added to the predicted run time, plus a fixed allowance for job start-up and file staging
+WALLTIME_MARGIN = 0.25
+WALLTIME_PAD_S = 300
+# Never ask for less than this, nor more than the longest queue allows
+WALLTIME_MIN_S = 600
+WALLTIME_MAX_S = 12 * 3600
+# Walltimes are rounded up to this many seconds
+WALLTIME_ROUND_S = 300
+# A stage needs this many recorded runs before its walltime is predicted
+MIN_SAMPLES = 3
+
+
+def runtime_db():
+    db_file = os.environ.get(RUNTIME_DB_ENV)
+    return pathlib.Path(db_file) if db_file else None
+
+
+def is_enabled():
+    return runtime_db() is not None
+
+
+def _per_domain(value, max_dom):
+    if not isinstance(value, list):
+        value = [value]
+    value = value + [value[-1]] * (max_dom - len(value))
+    return value[:max_dom]
+
+
+def problem_size(stage, nml_file, sim_hrs):
+    '''
+    Describe the size of one stage's job from its namelist (namelist.wps for geogrid/metgrid, namelist.input
+    for real/wrf). 'work' is the quantity run time is assumed to scale with for that stage:
+      geogrid: horizontal grid points
+      metgrid: horizontal grid points x input times
+      real:    3-D grid points x input times
+      wrf:     3-D grid points x time steps, with nested domains taking parent_time_step_ratio steps each
+    '''
+    nml = f90nml.read(nml_file)
+    if stage in ['geogrid', 'metgrid']:
+        max_dom = int(nml['share']['max_dom'])
+        e_we = _per_domain(nml['geogrid']['e_we'], max_dom)
+        e_sn = _per_domain(nml['geogrid']['e_sn'], max_dom)
+        e_vert = [1] * max_dom
+        interval_s = int(nml['share'].get('interval_seconds', 3600))
+        time_step = None
+    else:
+        domains = nml['domains']
+        max_dom = int(domains['max_dom'])
+        e_we = _per_domain(domains['e_we'], max_dom)
+        e_sn = _per_domain(domains['e_sn'], max_dom)
+        e_vert = _per_domain(domains['e_vert'], max_dom)
+        interval_s = int(nml['time_control'].get('interval_seconds', 3600))
+        time_step = float(domains['time_step'])
+        if domains.get('time_step_fract_den'):
+            time_step += float(domains.get('time_step_fract_num', 0)) / float(domains['time_step_fract_den'])
+
+    points = [int(e_we[dd]) * int(e_sn[dd]) * int(e_vert[dd]) for dd in range(max_dom)]
+    n_times = sim_hrs * 3600 // interval_s + 1
+
+    if stage == 'geogrid':
+        work = sum(points)
+    elif stage in ['metgrid', 'real']:
+        work = sum(points) * n_times
+    else:
+        ratios = _per_domain(nml['domains'].get('parent_time_step_ratio', 1), max_dom)
+        parent_ids = _per_domain(nml['domains'].get('parent_id', 1), max_dom)
+        steps = []
+        for dd in range(max_dom):
+            parent_steps = steps[int(parent_ids[dd]) - 1] if dd > 0 else sim_hrs * 3600 / time_step
+            steps.append(parent_steps * (int(ratios[dd]) if dd > 0 else 1))
+        work = sum(points[dd] * steps[dd] for dd in range(max_dom))
+
+    return {'stage': stage, 'max_dom': max_dom, 'e_we': int(e_we[0]), 'e_sn': int(e_sn[0]), 'e_vert': int(e_vert[0]),
+            'sim_hrs': sim_hrs, 'time_step': time_step, 'work': float(work)}
+
+
+def record_runtime(size, cores, seconds, job_id=None):
+    '''Append one finished job to the runtime history.'''
+    db_file = runtime_db()
+    if db_file is None or seconds <= 0:
+        return
+    record = {**size, 'cores': cores, 'seconds': round(seconds, 1), 'job_id': job_id,
+              'host': socket.gethostname(), 'time': time.time()}
+    try:
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(db_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(record) + '\n').encode())
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f'walltime_util: unable to record runtime to {db_file}: {e}', file=sys.stderr)
+
+
+def load_history(stage):
+    db_file = runtime_db()
+    records = []
+    if db_file is None or not db_file.is_file():
+        return records
+    with open(db_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('stage') == stage and record.get('cores') and record.get('seconds'):
+                records.append(record)
+    return records
+
+
+def fit_model(records):
+    '''
+    Least-squares fit of seconds = a + b * (work / cores). Returns (a, b), or None with too little history.
+    Falls back to a line through the origin when the intercept fit is not physical (negative a or b).
+    '''
+    if len(records) < MIN_SAMPLES:
+        return None
+    xs = [r['work'] / r['cores'] for r in records]
+    ys = [r['seconds'] for r in records]
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x > 0:
+        b = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+        a = mean_y - b * mean_x
+        if a >= 0 and b >= 0:
+            return a, b
+    sum_xx = sum(x * x for x in xs)
+    if sum_xx == 0:
+        return mean_y, 0.0
+    return 0.0, sum(x * y for x, y in zip(xs, ys)) / sum_xx
+
+
+def predict_walltime(size, cores):
+    '''Walltime in seconds to request for a job of this size, or None if the stage has too little history.'''
+    model = fit_model(load_history(size['stage']))
+    if model is None:
+        return None
+    a, b = model
+    seconds = (a + b * size['work'] / cores) * (1.0 + WALLTIME_MARGIN) + WALLTIME_PAD_S
+    seconds = math.ceil(seconds / WALLTIME_ROUND_S) * WALLTIME_ROUND_S
+    return int(min(max(seconds, WALLTIME_MIN_S), WALLTIME_MAX_S))
+
+
+def format_walltime(seconds):
+    return f'{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def template_cores(text):
+    '''MPI task count requested by a submit script (PBS select, Slurm ntasks, or the mpiexec/srun -n argument).'''
+    match = re.search(r'select=(\d+):ncpus=(\d+)(?::mpiprocs=(\d+))?', text)
+    if match:
+        return int(match.group(1)) * int(match.group(3) or match.group(2))
+    match = re.search(r'^#SBATCH\s+(?:--ntasks=|-n\s+)(\d+)', text, re.M)
+    if match:
+        return int(match.group(1))
+    match = re.search(r'^\s*(?:mpiexec|mpirun|srun)\s+-(?:n|np)\s+(\d+)', text, re.M)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def template_cores_per_node(text):
+    '''Cores per node requested by a submit script (PBS ncpus or Slurm ntasks-per-node), or None.'''
+    match = re.search(r'select=\d+:ncpus=(\d+)', text)
+    if match:
+        return int(match.group(1))
+    match = re.search(r'^#SBATCH\s+--ntasks-per-node=(\d+)', text, re.M)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def render_cores(text, cores):
+    def pbs_select(match):
+        # Fill whole nodes first; anything after mpiprocs (e.g. :mem=32GB) is left as it is
+        ncpus = int(match.group(2))
+        nodes = max(math.ceil(cores / ncpus), 1)
+        procs = math.ceil(cores / nodes)
+        return f'select={nodes}:ncpus={ncpus if nodes > 1 else procs}:mpiprocs={procs}'
+    text = re.sub(r'select=(\d+):ncpus=(\d+):mpiprocs=(\d+)', pbs_select, text)
+    text = re.sub(r'^(#SBATCH\s+--ntasks=)\d+', rf'\g<1>{cores}', text, flags=re.M)
+    text = re.sub(r'^(#SBATCH\s+-n\s+)\d+', rf'\g<1>{cores}', text, flags=re.M)
+    text = re.sub(r'^(\s*(?:mpiexec|mpirun|srun)\s+-(?:n|np)\s+)\d+', rf'\g<1>{cores}', text, flags=re.M)
+    return text
+
+
+def render_walltime(text, walltime_s):
+    walltime = format_walltime(walltime_s)
+    text = re.sub(r'walltime=[0-9:]+', f'walltime={walltime}', text)
+    text = re.sub(r'^(#SBATCH\s+(?:--time=|-t\s+))[0-9:-]+', rf'\g<1>{walltime}', text, flags=re.M)
+    return text
+
+
+def size_mpi_job(script_file, nml_file, log, ranks=None, io_tasks=0, ny_multiple=1):
+    '''
+    Choose the MPI decomposition for real.exe/wrf.exe on this domain (utils/number_of_procs.py), using at most the
+    cores the submit script asks for, and write nproc_x/nproc_y into the namelist and the rank count into the
+    submit script. Call from the run directory once namelist.input is final. Passing ranks forces that rank count
+    (e.g. for scaling benchmarks) and only the layout is chosen. io_tasks quilting I/O ranks are added on top of the
+    compute ranks (taken out of what the script asks for when ranks is not given), and nproc_y is kept a multiple of
+    ny_multiple.
+
+    Returns
+    -------
+    int or None
+        Number of compute ranks the job will run with (None, and nothing changed, if the script does not say).
+    '''
+    script_file = pathlib.Path(script_file)
+    text = script_file.read_text()
+    max_ranks = template_cores(text)
+    if max_ranks is None:
+        return None
+
+    cores_per_node = template_cores_per_node(text)
+    if ranks is None:
+        if io_tasks >= max_ranks:
+            raise ValueError(f'{io_tasks} I/O tasks leave no compute ranks out of the {max_ranks} in {script_file}')
+        ranks, nproc_x, nproc_y, speedup = plan_decomposition(read_domains(nml_file), max_ranks - io_tasks,
+                                                              cores_per_node, ny_multiple)
+    else:
+        nproc_x, nproc_y, speedup = layout_for_ranks(read_domains(nml_file), ranks, cores_per_node, ny_multiple)
+    write_decomposition(nml_file, nproc_x, nproc_y)
+    if ranks + io_tasks != max_ranks:
+        script_file.write_text(render_cores(text, ranks + io_tasks))
+    io_note = f' plus {io_tasks} I/O tasks' if io_tasks else ''
+    log.info(f'MPI decomposition: {ranks} ranks{io_note} (of {max_ranks} requested by the template) as '
+             f'nproc_x = {nproc_x}, nproc_y = {nproc_y}, estimated speedup {speedup:.1f}')
+    return ranks
+
+
+def plan_job(stage, script_file, nml_file, sim_hrs, log):
+    '''
+    Set the walltime of a job before it is submitted from the runtime history of its stage. Call from the run
+    directory once the namelist and the job's core count are final.
+
+    Returns
+    -------
+    dict or None
+        The job's problem size and cores, to pass to record_job() when it finishes. None if WPS_WRF_RUNTIME_DB
+        is not set, in which case nothing is changed.
+    '''
+    if not is_enabled():
+        return None
+    script_file = pathlib.Path(script_file)
+    text = script_file.read_text()
+    size = problem_size(stage, nml_file, sim_hrs)
+    cores = template_cores(text)
+    walltime_s = predict_walltime(size, cores or 1)
+    if walltime_s is not None:
+        script_file.write_text(render_walltime(text, walltime_s))
+        log.info(f'Requesting walltime {format_walltime(walltime_s)} for {stage} from its runtime history')
+    return {'size': size, 'cores': cores}
+
+
+def record_job(job_plan, beg_file, fallback_beg, job_id=None):
+    '''
+    Record the run time of a job that just finished successfully. The submit templates touch <STAGE>_BEG right
+    before the executable starts, which is more accurate than when the workflow first noticed the job running;
+    fallback_beg (epoch seconds) is used if that marker is missing.
+    '''
+    if job_plan is None or job_plan['cores'] is None:
+        return
+    beg_file = pathlib.Path(beg_file)
+    beg = beg_file.stat().st_mtime if beg_file.is_file() else fallback_beg
+    record_runtime(job_plan['size'], job_plan['cores'], time.time() - beg, job_id)
+
+
+if __name__ == '__main__':
+    # Summarize the runtime history and the model fitted for each stage
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize recorded WPS/WRF job run times and the fitted walltime models.')
+    parser.add_argument('runtime_db', nargs='?', default=os.environ.get(RUNTIME_DB_ENV),
+                        help=f'JSON-lines runtime history (default: ${RUNTIME_DB_ENV})')
+    args = parser.parse_args()
+    if not args.runtime_db:
+        parser.print_help()
+        sys.exit(1)
+    os.environ[RUNTIME_DB_ENV] = args.runtime_db
+
+    print(f'{"stage":<10}{"runs":>6}{"a_s":>10}{"b_s_per_unit":>16}{"max_s":>10}')
+    for stage in ['geogrid', 'metgrid', 'real', 'wrf']:
+        records = load_history(stage)
+        if not records:
+            continue
+        model = fit_model(records)
+        a, b = model if model is not None else (float('nan'), float('nan'))
+        print(f'{stage:<10}{len(records):>6}{a:>10.1f}{b:>16.3e}{max(r["seconds"] for r in records):>10.1f}')
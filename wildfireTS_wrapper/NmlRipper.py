@@ -4,10 +4,34 @@ This program handles all the fortran namelist stuff for WPS/WRF. It also handles
 Each script and namelist is split into directories by fire id for ease of running in parallel.
 """
 import f90nml
+import io
 import pandas as pd
 import os
 import shutil
 from constants import *
+from config_util import write_if_changed, read_template, render_once, forget
+
+PBS_REPLACEMENTS = {
+    'derecho': {
+        "#PBS -q main@desched1": "#PBS -q main",
+        "#PBS -q casper": "#PBS -q casper-pbs"
+    },
+    'casper': {},
+    # any other host uses the master script as is (setup_wps_wrf.py falls back to submit_*.bash)
+    '': {},
+}
+
+def render_submit_script(text: str, host: str) -> str:
+    """Render a master submit_* script for one host by swapping its PBS queue lines."""
+    replacements = PBS_REPLACEMENTS[host]
+    modified = []
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped in replacements:
+            modified.append(replacements[stripped] + "\n")
+        else:
+            modified.append(line)
+    return "".join(modified)
 
 class NmlRipper:
     def __init__(self, ps : pd.Series):
@@ -66,49 +90,33 @@ class NmlRipper:
         self.namelist['metgrid']['opt_output_from_metgrid_path'] = str(metgrid_output_dir)
 
     def save(self):
+        """
+        Render the WPS namelist, namelist.input copies and per-host job scripts in memory and only write
+        the ones whose content differs from what is already in the fire's template directory.
+        """
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        namelist_file = self.output_dir / 'namelist.wps.hrrr'
 
-        if os.path.exists(namelist_file):
-            os.remove(namelist_file)
-        self.namelist.write(str(self.output_dir / 'namelist.wps.hrrr'))
+        namelist_text = io.StringIO()
+        self.namelist.write(namelist_text)
+        write_if_changed(self.output_dir / 'namelist.wps.hrrr', namelist_text.getvalue())
 
         # copy over namelists.input.*
-        shutil.copy((MASTER_TEMPLATE_DIR / 'namelist.input.hrrr'), (self.output_dir / 'namelist.input.hrrr.hybr'))
-        shutil.copy((MASTER_TEMPLATE_DIR / 'namelist.input.hrrr'), (self.output_dir / 'namelist.input.hrrr.pres'))
+        namelist_input = read_template(MASTER_TEMPLATE_DIR / 'namelist.input.hrrr')
+        write_if_changed(self.output_dir / 'namelist.input.hrrr.hybr', namelist_input)
+        write_if_changed(self.output_dir / 'namelist.input.hrrr.pres', namelist_input)
 
-        pbs_replacements = {
-            "#PBS -q main@desched1": "#PBS -q main",
-            "#PBS -q casper": "#PBS -q casper-pbs"
-        }
-
-        # copy over job submission scripts
+        # copy over job submission scripts, rendered once per master script version
         for master_script in MASTER_TEMPLATE_DIR.glob("submit_*"):
-
-            derecho_path = self.output_dir / f"{master_script.name}.derecho"
-            casper_path = self.output_dir / f"{master_script.name}.casper"
-            shutil.copy(master_script, casper_path)
-
-            with master_script.open("r") as f:
-                lines = f.readlines()
-
-            modified = []
-            for line in lines:
-                stripped = line.strip()
-                if stripped in pbs_replacements:
-                    modified.append(pbs_replacements[stripped] + "\n")
-                else:
-                    modified.append(line)
-
-            with derecho_path.open("w") as f:
-                f.writelines(modified)
-
-
-
+            mode = master_script.stat().st_mode & 0o777
+            for host in PBS_REPLACEMENTS:
+                script = render_once(master_script, host, lambda text, host=host: render_submit_script(text, host))
+                script_name = f"{master_script.name}.{host}" if host else master_script.name
+                write_if_changed(self.output_dir / script_name, script, mode=mode)
 
     def remove(self):
         if os.path.exists(self.output_dir):
             shutil.rmtree(self.output_dir)
+        forget(self.output_dir)
 
 if __name__ == "__main__":
     nr = NrmRipper()
@@ -7,10 +7,13 @@ import yaml
 import os
 from pathlib import Path
 from constants import *
+from config_util import write_if_changed, read_template, forget
 
 class YamlRipper:
-    def __init__(self, fireid: int):
+    def __init__(self, fireid: int, grib_dir: Path = None):
         self.fireid = str(fireid)
+        # shared grib store (e.g. filled by the HRRR prefetcher) instead of one directory per fire
+        self.grib_dir = grib_dir
         self.master_yaml_path = WRF_YAML_DIR
         self.geogrid_yaml_path = GEOGRID_YAML_DIR
         self.output_dir = CONFIG_DIR
@@ -34,18 +37,16 @@ class YamlRipper:
     def _load_master_config(self):
         if not self.master_yaml_path.exists():
             raise FileNotFoundError(f"Master YAML file not found: {self.master_yaml_path}")
-        with open(self.master_yaml_path, 'r') as f:
-            return yaml.safe_load(f)
+        return yaml.safe_load(read_template(self.master_yaml_path))
 
     def _load_geogrid_config(self):
         if not self.geogrid_yaml_path.exists():
             raise FileNotFoundError(f"Master YAML file not found: {self.master_yaml_path}")
-        with open(self.geogrid_yaml_path, 'r') as f:
-            return yaml.safe_load(f)
+        return yaml.safe_load(read_template(self.geogrid_yaml_path))
 
     def _edit_one_yaml(self, config: dict) -> dict:
         # edit download directory
-        grib_dir = HRRR_DIR / self.fireid
+        grib_dir = self.grib_dir if self.grib_dir is not None else HRRR_DIR / self.fireid
         grib_dir.mkdir(parents=True, exist_ok=True)
         config['grib_dir'] = str(grib_dir)
 
@@ -71,8 +72,7 @@ class YamlRipper:
 
     def save_geogrid(self):
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        with open(self.geogrid_output_path, 'w') as f:
-            yaml.safe_dump(self.geogrid_config, f)
+        write_if_changed(self.geogrid_output_path, yaml.safe_dump(self.geogrid_config))
 
 
     def edit(self):
@@ -80,8 +80,7 @@ class YamlRipper:
 
     def save(self):
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        with open(self.wrf_output_path, 'w') as f:
-            yaml.safe_dump(self.wrf_config, f)
+        write_if_changed(self.wrf_output_path, yaml.safe_dump(self.wrf_config))
 
 
     def remove(self):
@@ -91,6 +90,9 @@ class YamlRipper:
         if os.path.exists(self.geogrid_output_path):
             os.remove(self.geogrid_output_path)
 
+        forget(self.wrf_output_path)
+        forget(self.geogrid_output_path)
+
 if __name__ == "__main__":
     fireid = 12345678
     yr = YamlRipper(fireid)
@@ -0,0 +1,122 @@
+"""
+config_util.py
+Author: Kyle Krstulich
+
+Helpers for writing generated configuration files (namelists, yaml configs, job scripts) without
+touching files whose content has not changed.
+
+Each file is rendered in memory, hashed, and compared with what is already on disk. Only changed files
+are written, atomically (temporary file + rename) so a running job never reads a half-written file.
+Digests of files written by this process are remembered, so regenerating the same fire-day again does
+not even need to read the file back. Templates are read once per version (size + mtime) of the source
+file.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+_lock = threading.Lock()
+_written_digests = {}
+_template_cache = {}
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def file_digest(path) -> str:
+    with open(path, "rb") as f:
+        return content_digest(f.read())
+
+def write_if_changed(path, content: str, mode=None) -> bool:
+    """
+    Write content to path only if it differs from what is already there.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Destination file.
+    content : str
+        Full rendered file content.
+    mode : int
+        Optional permission bits for the file (e.g. copied from a master script).
+
+    Returns
+    -------
+    bool
+        True if the file was (re)written, False if it was already up to date.
+    """
+    path = Path(path)
+    data = content.encode()
+    digest = content_digest(data)
+
+    with _lock:
+        if _written_digests.get(path) == digest:
+            return False
+
+        if path.is_file() and file_digest(path) == digest:
+            _written_digests[path] = digest
+            return False
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+        _written_digests[path] = digest
+        return True
+
+def read_template(path) -> str:
+    """
+    Read a template file, re-reading it only when its size or mtime changes.
+    """
+    path = Path(path)
+    stat = path.stat()
+    version = (stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        cached = _template_cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    text = path.read_text()
+    with _lock:
+        _template_cache[path] = (version, text)
+    return text
+
+def render_once(path, key, render):
+    """
+    Cache a rendering of a template per template version.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Template the rendering is derived from.
+    key : hashable
+        Identifies the rendering (e.g. the target host).
+    render : callable
+        Called with the template text to produce the rendering on a cache miss.
+    """
+    path = Path(path)
+    text = read_template(path)
+    stat = path.stat()
+    cache_key = (path, key, stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        if cache_key in _template_cache:
+            return _template_cache[cache_key]
+
+    rendered = render(text)
+    with _lock:
+        _template_cache[cache_key] = rendered
+    return rendered
+
+def forget(path):
+    """Drop remembered digests for a file, or every file under a directory that is being removed."""
+    path = Path(path)
+    with _lock:
+        for written in list(_written_digests):
+            if written == path or path in written.parents:
+                del _written_digests[written]
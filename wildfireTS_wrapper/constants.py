@@ -4,13 +4,17 @@ constants.py
 This file holds all the constants needed for the WRF pipeline.
 """
 from pathlib import Path
+import getpass
 import os
 
-USER = os.getlogin()
+USER = getpass.getuser()
 
-HOME_DIR = Path(f"/glade/u/home/{USER}/wps_wrf_workflow/")
-SCRATCH_DIR = Path(f"/glade/derecho/scratch/{USER}/workflow/")
-HRRR_DIR = Path(f"/glade/derecho/scratch/{USER}/data/")
+# GLADE locations by default; the environment can point the sweep elsewhere (e.g. utils/bench_workflow.py)
+HOME_DIR = Path(os.environ.get('WPS_WRF_WORK_DIR', f"/glade/u/home/{USER}/wps_wrf_workflow/"))
+SCRATCH_DIR = Path(os.environ.get('WPS_WRF_SCRATCH_DIR', f"/glade/derecho/scratch/{USER}/workflow/"))
+HRRR_DIR = Path(os.environ.get('WPS_WRF_DATA_DIR', f"/glade/derecho/scratch/{USER}/data/"))
+WRFOUT_DIR = Path(os.environ.get('WPS_WRF_WRFOUT_DIR', f"/glade/derecho/scratch/{USER}/wrfout/"))
+HRRR_STORE_DIR = HRRR_DIR / 'hrrr_shared'
 WRAPPER_DIR = HOME_DIR / 'wildfireTS_wrapper'
 
 CSV_DIR = WRAPPER_DIR /  'filtered_fires.csv'
@@ -26,11 +30,52 @@ MOVE_SCRIPT = WRAPPER_DIR /  'move_wrf.sh' # TODO: Fix this script
 WATCHDOG_SCRIPT = WRAPPER_DIR /  'monitor.py'
 STOP_SCRIPT = WRAPPER_DIR /  'stop_jobs.sh'
 FIRE_QUERY_SCRIPT = WRAPPER_DIR / 'fire_query' / 'fire_query.py'
+RUN_STATE_DB = HOME_DIR / 'logs' / 'run_state.sqlite'
+DOMAIN_MAP_CSV = WRAPPER_DIR / 'fire_domains.csv'
 
 MAX_WORKERS = 3
 MAX_FIRES = 6
 MAX_DAYS = 31
 
+# Output files a finished stage is expected to leave behind
+WRF_EXPECTED_FILES = 30
+GEOGRID_EXPECTED_FILES = 1
+
+# Shared-domain planning: width of the extraction window kept around each fire and
+# how many grid cells it must stay away from the lateral boundary
+FIRE_WINDOW_KM = 100
+BOUNDARY_MARGIN_CELLS = 10
+
+# Sweep-wide HRRR prefetch: concurrent downloads and bandwidth cap (bytes/s, None for unlimited)
+PREFETCH_WORKERS = 4
+PREFETCH_BYTES_PER_SEC = None
+
+# Pre-flight availability check of the sweep's HRRR files: concurrent HEAD requests and the result cache
+PREFLIGHT_WORKERS = 16
+ICBC_CACHE = HOME_DIR / 'logs' / 'icbc_availability.json'
+
+# wrfout files are copied to WRFOUT_DIR as compressed, rechunked netCDF4 (verified lossless) by this script
+COMPRESS_SCRIPT = HOME_DIR / 'compress_wrfout.py'
+COMPRESS_WRFOUT = True
+COMPRESSION = 'zlib'
+COMPRESS_WORKERS = 4
+
+# Per-fire time-series stores for WildfireTS++ (export_fire.py): files read in parallel, most hours per chunk,
+# uncompressed bytes per chunk (larger grids are split into tiles, 3-D fields per level), memory for the hours
+# buffered before each write (fewer hours per chunk if EXPORT_TIME_CHUNK of them would not fit),
+# compression level, and the variables exported (None for every time-varying field)
+EXPORT_DIR = Path(os.environ.get('WPS_WRF_EXPORT_DIR', f"/glade/derecho/scratch/{USER}/wildfireTS/"))
+EXPORT_WORKERS = 4
+EXPORT_TIME_CHUNK = 24
+EXPORT_CHUNK_BYTES = 4 * 1024 * 1024
+EXPORT_BUFFER_BYTES = 2 * 1024 ** 3
+EXPORT_COMPLEVEL = 4
+EXPORT_VARIABLES = None
+
+# Fire-centred patches and point time series (extract_fire.py); the patch is FIRE_WINDOW_KM wide
+EXTRACT_DIR = EXPORT_DIR / 'patches'
+EXTRACT_VARIABLES = ['T2', 'Q2', 'U10', 'V10', 'PSFC', 'RAINNC', 'PBLH', 'SWDOWN', 'U', 'V', 'W', 'T']
+
 def parse_date(pd_timestamp):
 
     year = pd_timestamp.year
@@ -0,0 +1,178 @@
+"""
+domain_planner.py
+Author: Kyle Krstulich
+
+Plans shared WRF domains for fires that burn close together on overlapping dates.
+
+NmlRipper centres one e_we x e_sn domain on every fire. When several fires fit inside a single domain
+(each with its own extraction window and a margin away from the lateral boundary) and their date ranges
+overlap, they are merged into one shared domain centred on the group. Each fire is then mapped back to its
+grid position and sub-region inside the shared domain so downstream extraction can cut it out again.
+
+Fires that do not share a domain keep their own fire id as the domain id, so their existing output
+directories stay valid.
+"""
+import f90nml
+import numpy as np
+import pandas as pd
+from pyproj import Proj
+from constants import *
+
+# Earth radius used by WPS/WRF map projections
+WRF_EARTH_RADIUS_M = 6370000.0
+
+
+def load_domain_shape(namelist_path=MASTER_TEMPLATE_DIR / 'namelist.wps.hrrr'):
+    """
+    Read the d01 grid size and spacing from the master WPS namelist.
+
+    Returns
+    -------
+    tuple
+        (e_we, e_sn, dx, dy) with dx/dy in metres.
+    """
+    geogrid = f90nml.read(namelist_path)['geogrid']
+
+    def first(value):
+        return value[0] if isinstance(value, list) else value
+
+    return int(first(geogrid['e_we'])), int(first(geogrid['e_sn'])), float(first(geogrid['dx'])), float(first(geogrid['dy']))
+
+def domain_projection(lat, lon):
+    """
+    Lambert conformal projection matching what NmlRipper writes for a domain centred on (lat, lon):
+    ref_lat = truelat1 = truelat2 = lat and ref_lon = stand_lon = lon.
+    """
+    return Proj(proj='lcc', lat_1=lat, lat_2=lat, lat_0=lat, lon_0=lon, R=WRF_EARTH_RADIUS_M)
+
+def _cluster_centre(lats, lons):
+    return (float(np.min(lats) + np.max(lats)) / 2.0, float(np.min(lons) + np.max(lons)) / 2.0)
+
+def _fits(lats, lons, e_we, e_sn, dx, dy, window_km, margin_cells):
+    """Return the domain centre if every fire window fits inside one domain, otherwise None."""
+    centre_lat, centre_lon = _cluster_centre(lats, lons)
+    x, y = domain_projection(centre_lat, centre_lon)(np.asarray(lons), np.asarray(lats))
+
+    half_window = window_km * 1000.0 / 2.0
+    max_x = (e_we - 1) * dx / 2.0 - margin_cells * dx - half_window
+    max_y = (e_sn - 1) * dy / 2.0 - margin_cells * dy - half_window
+    if np.all(np.abs(x) <= max_x) and np.all(np.abs(y) <= max_y):
+        return centre_lat, centre_lon
+    return None
+
+def cluster_fires(fires: pd.DataFrame, e_we, e_sn, dx, dy, window_km=FIRE_WINDOW_KM, margin_cells=BOUNDARY_MARGIN_CELLS):
+    """
+    Greedily group fires whose windows fit in one domain and whose date ranges overlap or touch.
+
+    Fires are visited in start-date order. Each fire joins the first open group it fits into, otherwise
+    it starts a new group. Date ranges must overlap (or be adjacent) so the shared domain still runs one
+    contiguous range of days.
+
+    Parameters
+    ----------
+    fires : pandas.DataFrame
+        Must contain fire_id, start_date, end_date, lat and lon.
+
+    Returns
+    -------
+    list of list of int
+        Row labels of fires in each group.
+    """
+    starts = pd.to_datetime(fires['start_date'])
+    ends = pd.to_datetime(fires['end_date'])
+    one_day = pd.Timedelta(days=1)
+
+    groups = []
+    for idx in starts.sort_values(kind='stable').index:
+        placed = False
+        for group in groups:
+            group_beg = starts[group['members']].min()
+            group_end = ends[group['members']].max()
+            if starts[idx] > group_end + one_day or ends[idx] < group_beg - one_day:
+                continue
+
+            members = group['members'] + [idx]
+            if _fits(fires.loc[members, 'lat'], fires.loc[members, 'lon'], e_we, e_sn, dx, dy, window_km, margin_cells):
+                group['members'] = members
+                placed = True
+                break
+
+        if not placed:
+            groups.append({'members': [idx]})
+
+    return [group['members'] for group in groups]
+
+def plan_domains(fires: pd.DataFrame, namelist_path=MASTER_TEMPLATE_DIR / 'namelist.wps.hrrr',
+                 window_km=FIRE_WINDOW_KM, margin_cells=BOUNDARY_MARGIN_CELLS):
+    """
+    Build the shared-domain plan for a set of fires.
+
+    Parameters
+    ----------
+    fires : pandas.DataFrame
+        Filtered fire CSV (fire_id, start_date, end_date, lat, lon, state_name).
+
+    Returns
+    -------
+    domains : pandas.DataFrame
+        Same columns as the fire CSV, one row per WRF domain to run. fire_id holds the domain id.
+    fire_map : pandas.DataFrame
+        One row per fire: its domain id, 1-based grid indices (i, j) of the fire in that domain and the
+        inclusive sub-region window (i_beg, i_end, j_beg, j_end) for extraction.
+    """
+    e_we, e_sn, dx, dy = load_domain_shape(namelist_path)
+    half_window_i = int(round(window_km * 1000.0 / dx / 2.0))
+    half_window_j = int(round(window_km * 1000.0 / dy / 2.0))
+
+    domain_rows = []
+    map_rows = []
+    for members in cluster_fires(fires, e_we, e_sn, dx, dy, window_km, margin_cells):
+        group = fires.loc[members]
+        if len(members) == 1:
+            domain_id = str(group['fire_id'].iloc[0])
+            centre_lat, centre_lon = float(group['lat'].iloc[0]), float(group['lon'].iloc[0])
+        else:
+            domain_id = 'D' + str(group['fire_id'].iloc[0])
+            centre_lat, centre_lon = _cluster_centre(group['lat'], group['lon'])
+
+        domain = group.iloc[0].copy()
+        domain['fire_id'] = domain_id
+        domain['start_date'] = pd.to_datetime(group['start_date']).min().strftime('%Y-%m-%d')
+        domain['end_date'] = pd.to_datetime(group['end_date']).max().strftime('%Y-%m-%d')
+        domain['lat'] = centre_lat
+        domain['lon'] = centre_lon
+        domain_rows.append(domain)
+
+        # WPS puts the reference point at the centre of the (e_we-1) x (e_sn-1) mass grid by default
+        x, y = domain_projection(centre_lat, centre_lon)(group['lon'].to_numpy(), group['lat'].to_numpy())
+        i = np.rint(e_we / 2.0 + x / dx).astype(int)
+        j = np.rint(e_sn / 2.0 + y / dy).astype(int)
+        for (_, fire), fi, fj in zip(group.iterrows(), i, j):
+            map_rows.append({
+                'fire_id': fire['fire_id'],
+                'domain_id': domain_id,
+                'start_date': fire['start_date'],
+                'end_date': fire['end_date'],
+                'lat': fire['lat'],
+                'lon': fire['lon'],
+                'i': int(fi),
+                'j': int(fj),
+                'i_beg': max(int(fi) - half_window_i, 1),
+                'i_end': min(int(fi) + half_window_i, e_we - 1),
+                'j_beg': max(int(fj) - half_window_j, 1),
+                'j_end': min(int(fj) + half_window_j, e_sn - 1),
+            })
+
+    domains = pd.DataFrame(domain_rows, columns=fires.columns).reset_index(drop=True)
+    fire_map = pd.DataFrame(map_rows)
+    return domains, fire_map
+
+def load_fire_map(map_path=DOMAIN_MAP_CSV):
+    return pd.read_csv(map_path, dtype={'fire_id': str, 'domain_id': str})
+
+
+if __name__ == "__main__":
+    fires = pd.read_csv(CSV_DIR)
+    domains, fire_map = plan_domains(fires)
+    print(f"{len(fires)} fires -> {len(domains)} domains")
+    print(fire_map.to_string(index=False))
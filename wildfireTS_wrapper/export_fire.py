@@ -0,0 +1,314 @@
+"""
+export_fire.py
+Author: Kyle Krstulich
+
+Exports each fire's WRF output as one time series for the WildfireTS++ dataset.
+
+move_wrf.py leaves hourly wrfout files under WRFOUT_DIR/<fireid>/<date>/, so a training loader that wants a
+fire's history has to open hundreds of netCDF files. This module streams every wrfout file of a fire, across
+all of its days, into a single compressed netCDF4 store EXPORT_DIR/<fireid>_d0<domain>.nc with an unlimited
+Time dimension:
+
+  - time-varying fields are chunked as up to EXPORT_TIME_CHUNK hours x one level x a horizontal tile of at most
+    EXPORT_CHUNK_BYTES, so a fire's history is read with few, moderate reads and one field level never
+    decompresses the whole column (xarray.open_dataset(store) gives the whole series lazily),
+  - hours are buffered and written a whole time chunk at once, so each chunk is compressed once rather than read
+    back and rewritten for every appended hour; the hours per chunk shrink so the buffer fits EXPORT_BUFFER_BYTES,
+  - fields that do not change in time (coordinates, terrain, land mask) are stored once without Time,
+  - a CF "time" coordinate is written next to WRF's Times strings,
+  - wrfout files are read ahead in a process pool while the store is appended in time order,
+  - re-running appends only valid times not in the store yet; if an earlier day shows up late the store is
+    rebuilt so it stays sorted.
+
+Where consecutive fire-days overlap in valid time, the hour from the earlier-initialised run is kept so that
+every hour after the first comes from a spun-up model.
+
+Zarr is not part of the workflow environment, so the store is netCDF4/HDF5; its chunk layout is the same one
+a Zarr store would use.
+"""
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+from constants import *
+
+WRF_TIME_FORMAT = '%Y-%m-%d_%H:%M:%S'
+TIME_UNITS = 'hours since 1970-01-01 00:00:00'
+
+# Fields that are constant through a run; stored once without the Time dimension
+STATIC_VARIABLES = ['XLAT', 'XLONG', 'XLAT_U', 'XLONG_U', 'XLAT_V', 'XLONG_V', 'HGT', 'LANDMASK', 'XLAND',
+                    'LU_INDEX', 'IVGTYP', 'ISLTYP', 'MAPFAC_M', 'MAPFAC_U', 'MAPFAC_V', 'SINALPHA', 'COSALPHA',
+                    'ZNU', 'ZNW', 'ZS', 'DZS']
+
+# === Private Functions ===
+
+def __wrfout_time(file_path):
+    match = re.search(r'(\d{4}-\d{2}-\d{2}_\d{2}[:_]\d{2}[:_]\d{2})$', Path(file_path).name)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1).replace('_', ':').replace(':', '_', 1), WRF_TIME_FORMAT)
+
+def __read_times(nc):
+    times = netCDF4.chartostring(nc.variables['Times'][:])
+    return [datetime.strptime(str(t), WRF_TIME_FORMAT) for t in np.atleast_1d(times)]
+
+def __select_variables(nc, variables=None):
+    """
+    Numeric variables of a wrfout file that have Time as their first dimension, or the requested subset.
+    """
+    names = []
+    for name, var in nc.variables.items():
+        if name == 'Times' or not var.dimensions or var.dimensions[0] != 'Time' or var.dtype.kind not in 'fiu':
+            continue
+        if variables is None or name in variables:
+            names.append(name)
+    return names
+
+def __chunk_shape(shape, itemsize, time_chunk):
+    """
+    Chunk of a time-varying field with the given shape (without Time): time_chunk hours, one level of 3-D fields,
+    and the horizontal grid halved along its longer edge until the chunk fits EXPORT_CHUNK_BYTES.
+    """
+    if len(shape) < 2:
+        return [time_chunk] + list(shape)
+    chunks = [1] * (len(shape) - 2) + list(shape[-2:])
+    while time_chunk * itemsize * chunks[-1] * chunks[-2] > EXPORT_CHUNK_BYTES and max(chunks[-2:]) > 1:
+        axis = -1 if chunks[-1] >= chunks[-2] else -2
+        chunks[axis] = (chunks[axis] + 1) // 2
+    return [time_chunk] + chunks
+
+def __time_chunk(nc):
+    """
+    Hours per chunk of a store: those of its time-varying fields, or 1 if it has none.
+    """
+    for name, var in nc.variables.items():
+        if name not in ['Times', 'time'] and var.dimensions and var.dimensions[0] == 'Time':
+            chunking = var.chunking()
+            if chunking != 'contiguous':
+                return chunking[0]
+    return 1
+
+def __create_store(store_path, template_file, names):
+    """
+    Create an empty store with the dimensions, attributes and chunking for the given variables.
+    """
+    with netCDF4.Dataset(template_file) as nc_in:
+        # Hours per chunk: EXPORT_TIME_CHUNK, or fewer if that many frames would not fit the write buffer
+        frame_bytes = sum(int(np.prod(nc_in.variables[name].shape[1:])) * nc_in.variables[name].dtype.itemsize
+                          for name in names if name not in STATIC_VARIABLES)
+        time_chunk = int(max(1, min(EXPORT_TIME_CHUNK, EXPORT_BUFFER_BYTES // max(frame_bytes, 1))))
+        nc_out = netCDF4.Dataset(store_path, 'w', format='NETCDF4')
+        nc_out.setncatts({att: nc_in.getncattr(att) for att in nc_in.ncattrs()})
+        for name, dim in nc_in.dimensions.items():
+            nc_out.createDimension(name, None if name == 'Time' else len(dim))
+
+        nc_out.createVariable('Times', 'S1', ('Time', 'DateStrLen'),
+                              chunksizes=(time_chunk, len(nc_in.dimensions['DateStrLen'])))
+        time = nc_out.createVariable('time', 'f8', ('Time',), chunksizes=(time_chunk,))
+        time.units = TIME_UNITS
+        time.calendar = 'standard'
+        time.standard_name = 'time'
+
+        for name in names:
+            var = nc_in.variables[name]
+            var.set_auto_maskandscale(False)
+            static = name in STATIC_VARIABLES
+            dims = var.dimensions[1:] if static else var.dimensions
+            shape = var.shape[1:]
+            chunks = list(shape) if static else __chunk_shape(shape, var.dtype.itemsize, time_chunk)
+            attrs = {att: var.getncattr(att) for att in var.ncattrs()}
+            fill_value = attrs.pop('_FillValue', None)
+            out = nc_out.createVariable(name, var.dtype, dims, fill_value=fill_value, compression='zlib',
+                                        complevel=EXPORT_COMPLEVEL, shuffle=True,
+                                        chunksizes=chunks if chunks else None)
+            out.set_auto_maskandscale(False)
+            out.setncatts(attrs)
+            if static:
+                out[...] = var[0]
+    return nc_out
+
+def read_frame(file_path, names):
+    """
+    Read the frames of one wrfout file (runs in a worker process).
+
+    Returns
+    -------
+    tuple
+        (list of datetime, dict of name -> array with Time first)
+    """
+    with netCDF4.Dataset(file_path) as nc:
+        times = __read_times(nc)
+        data = {}
+        for name in names:
+            if name in STATIC_VARIABLES:
+                continue
+            var = nc.variables[name]
+            var.set_auto_maskandscale(False)
+            data[name] = var[...]
+    return times, data
+
+def __write_frames(nc_out, n_time, times, data):
+    """
+    Write buffered frames (data holds a list of arrays per variable) at Time index n_time.
+    """
+    n_new = len(times)
+    stamps = [t.strftime(WRF_TIME_FORMAT) for t in times]
+    nc_out.variables['Times'][n_time:n_time + n_new] = netCDF4.stringtochar(np.array(stamps, 'S19'))
+    nc_out.variables['time'][n_time:n_time + n_new] = netCDF4.date2num(times, TIME_UNITS, 'standard')
+    for name, values in data.items():
+        nc_out.variables[name][n_time:n_time + n_new] = np.concatenate(values)
+    return n_new
+
+# === Public Functions ===
+
+def get_fire_wrfout(fireid, domain=1):
+    """
+    All wrfout files of one fire and domain, one per valid time, in time order.
+
+    Parameters
+    ----------
+    fireid : str
+        Fire (or shared domain) id, i.e. the directory name under WRFOUT_DIR.
+    domain : int
+        WRF domain number.
+
+    Returns
+    -------
+    list of tuple
+        (valid time, file path), keeping the earliest-initialised run where fire-days overlap.
+    """
+    fire_dir = WRFOUT_DIR / str(fireid)
+    by_time = {}
+    if not fire_dir.is_dir():
+        return []
+    # Date folders are YYYYMMDD_HH, so sorting them sorts by initialisation time
+    for date_dir in sorted(p for p in fire_dir.iterdir() if p.is_dir()):
+        for file_path in sorted(date_dir.glob(f'wrfout_d{domain:02d}_*')):
+            valid_time = __wrfout_time(file_path)
+            if valid_time is not None and valid_time not in by_time:
+                by_time[valid_time] = file_path
+    return sorted(by_time.items())
+
+def export_fire(fireid, domain=1, variables=None, workers=EXPORT_WORKERS, out_dir=EXPORT_DIR, rebuild=False):
+    """
+    Append a fire's wrfout files to its time-series store, creating or rebuilding the store as needed.
+
+    Parameters
+    ----------
+    fireid : str
+        Fire (or shared domain) id.
+    domain : int
+        WRF domain number.
+    variables : list of str or None
+        Variables to export (default EXPORT_VARIABLES, or every time-varying numeric variable if that is None).
+    workers : int
+        wrfout files read ahead in parallel.
+    out_dir : Path
+        Directory for the stores.
+    rebuild : bool
+        Write the store from scratch even if it could be appended to.
+
+    Returns
+    -------
+    dict
+        store path, number of frames appended and the time range of the store.
+    """
+    variables = variables if variables is not None else EXPORT_VARIABLES
+    files = get_fire_wrfout(fireid, domain)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    store_path = out_dir / f'{fireid}_d{domain:02d}.nc'
+    summary = {'store': str(store_path), 'appended': 0}
+    if not files:
+        return summary
+
+    existing = []
+    if store_path.exists() and not rebuild:
+        with netCDF4.Dataset(store_path) as nc:
+            existing = __read_times(nc) if len(nc.dimensions['Time']) else []
+    new = [(t, f) for t, f in files if t not in set(existing)]
+    if existing and new and new[0][0] < existing[-1]:
+        # An earlier day arrived after later ones were exported; rebuild so Time stays sorted
+        print(f"Rebuilding {store_path}: {new[0][0]} is earlier than the last exported time {existing[-1]}")
+        rebuild = True
+        new = files
+    if not new and not rebuild:
+        return summary
+
+    write_path = store_path
+    if rebuild or not store_path.exists():
+        write_path = store_path.with_name(f'.{store_path.name}.tmp')
+        with netCDF4.Dataset(new[0][1]) as nc:
+            names = __select_variables(nc, variables)
+        nc_out = __create_store(write_path, new[0][1], names)
+    else:
+        nc_out = netCDF4.Dataset(store_path, 'a')
+        names = [name for name in nc_out.variables if name not in ['Times', 'time']]
+
+    try:
+        for var in nc_out.variables.values():
+            var.set_auto_maskandscale(False)
+        n_time = len(nc_out.dimensions['Time'])
+        time_chunk = __time_chunk(nc_out)
+        buffered_times, buffered = [], {}
+        # Read ahead in worker processes, append in time order
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = deque()
+            queue = iter(new)
+            for valid_time, file_path in queue:
+                pending.append(pool.submit(read_frame, file_path, names))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                times, data = pending.popleft().result()
+                next_file = next(queue, None)
+                if next_file is not None:
+                    pending.append(pool.submit(read_frame, next_file[1], names))
+                buffered_times += times
+                for name, values in data.items():
+                    buffered.setdefault(name, []).append(values)
+                # Write up to the end of the current time chunk at once (the first write of an append may
+                # complete a partly filled chunk; after that every write fills whole chunks)
+                if len(buffered_times) >= time_chunk - n_time % time_chunk or not pending:
+                    n_new = __write_frames(nc_out, n_time, buffered_times, buffered)
+                    n_time += n_new
+                    summary['appended'] += n_new
+                    buffered_times, buffered = [], {}
+        first_last = __read_times(nc_out)
+        summary['time_range'] = (str(first_last[0]), str(first_last[-1]))
+    finally:
+        nc_out.close()
+
+    if write_path != store_path:
+        os.replace(write_path, store_path)
+    return summary
+
+def export_all(fireids=None, domain=1, workers=EXPORT_WORKERS, rebuild=False):
+    """
+    Export every fire under WRFOUT_DIR (or the given fire ids).
+    """
+    if fireids is None:
+        fireids = sorted(p.name for p in WRFOUT_DIR.iterdir() if p.is_dir()) if WRFOUT_DIR.is_dir() else []
+    summaries = {}
+    for fireid in fireids:
+        try:
+            summaries[fireid] = export_fire(fireid, domain=domain, workers=workers, rebuild=rebuild)
+            print(f"Exported fire {fireid}: {summaries[fireid]}")
+        except Exception as e:
+            print(f"Export of fire {fireid} failed: {type(e).__name__}: {e}")
+    return summaries
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export each fire's wrfout files into one time-series store.")
+    parser.add_argument("fireids", nargs="*", help="Fire ids to export (default: every fire under WRFOUT_DIR)")
+    parser.add_argument("--domain", "-d", help="WRF domain number", type=int, default=1)
+    parser.add_argument("--workers", "-w", help="wrfout files read in parallel", type=int, default=EXPORT_WORKERS)
+    parser.add_argument("--rebuild", help="Rewrite the stores from scratch", action="store_true")
+    args = parser.parse_args()
+    export_all(args.fireids or None, domain=args.domain, workers=args.workers, rebuild=args.rebuild)
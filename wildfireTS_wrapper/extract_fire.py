@@ -0,0 +1,226 @@
+"""
+extract_fire.py
+Author: Kyle Krstulich
+
+Extracts the region around each fire from its wrfout files.
+
+NmlRipper centres every domain on its fire (or domain_planner centres a shared domain on a group of fires), but
+downstream users only need the fire's neighbourhood, not the whole e_we x e_sn field every hour. For each
+domain this module
+
+  - builds the fire index once: the nearest mass-grid point to every fire in the domain, found from XLAT/XLONG
+    in one vectorized distance computation, plus the FIRE_WINDOW_KM patch around it (shifted to stay inside the
+    grid), cached next to the output so later runs skip it,
+  - reads every wrfout file of the domain in a process pool and cuts all fires' patches and point values out of
+    each field with a single fancy-indexing operation,
+  - writes one compressed .npz per fire and domain to EXTRACT_DIR with the valid times, a patch time series
+    (Time[, level], y, x) and a point time series (Time[, level]) per variable, and the patch's XLAT/XLONG.
+
+Fires are read from fire_domains.csv for shared domains; a domain without an entry there is its own fire, which
+NmlRipper put at the domain centre (CEN_LAT/CEN_LON).
+"""
+import numpy as np
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor
+from constants import *
+from export_fire import get_fire_wrfout
+
+# === Private Functions ===
+
+def __unit_vectors(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def __domain_fires(domain_id, nc):
+    """
+    (fire ids, lats, lons) of the fires inside one domain.
+    """
+    if DOMAIN_MAP_CSV.exists():
+        import pandas as pd
+        fire_map = pd.read_csv(DOMAIN_MAP_CSV, dtype={'fire_id': str, 'domain_id': str})
+        fire_map = fire_map[fire_map['domain_id'] == str(domain_id)]
+        if len(fire_map):
+            return list(fire_map['fire_id']), fire_map['lat'].to_numpy(), fire_map['lon'].to_numpy()
+    return [str(domain_id)], np.array([nc.getncattr('CEN_LAT')]), np.array([nc.getncattr('CEN_LON')])
+
+def __index_path(domain_id, domain):
+    return EXTRACT_DIR / 'index' / f'{domain_id}_d{domain:02d}.npz'
+
+# === Public Functions ===
+
+def nearest_points(xlat, xlong, lats, lons):
+    """
+    Nearest grid point to each location, for all locations at once.
+
+    Parameters
+    ----------
+    xlat, xlong : numpy.ndarray
+        2-D (y, x) latitude and longitude of the grid.
+    lats, lons : array_like
+        Locations to look up.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (j, i) 0-based grid indices, one per location.
+    """
+    grid = __unit_vectors(xlat, xlong).reshape(-1, 3)
+    points = __unit_vectors(lats, lons).reshape(-1, 3)
+    # Largest dot product = smallest great-circle distance
+    flat = np.argmax(points @ grid.T, axis=1)
+    return np.unravel_index(flat, xlat.shape)
+
+def patch_origins(j, i, shape, size):
+    """
+    Lower-left corner of a size x size patch centred on each (j, i), shifted to lie inside a grid of shape (ny, nx).
+    """
+    ny, nx = shape
+    size = min(size, ny, nx)
+    j0 = np.clip(np.asarray(j) - size // 2, 0, ny - size)
+    i0 = np.clip(np.asarray(i) - size // 2, 0, nx - size)
+    return j0, i0, size
+
+def build_index(domain_id, domain=1, files=None, rebuild=False):
+    """
+    Fire index of one domain: fire ids, nearest grid points and patch corners. Cached under EXTRACT_DIR/index.
+
+    Returns
+    -------
+    dict
+        fire_id, j, i, j0, i0 (arrays, one entry per fire), size, and the patch XLAT/XLONG (fire, y, x).
+    """
+    index_path = __index_path(domain_id, domain)
+    if index_path.exists() and not rebuild:
+        with np.load(index_path) as cached:
+            return {key: cached[key] for key in cached.files}
+
+    files = files if files is not None else [f for _, f in get_fire_wrfout(domain_id, domain)]
+    if not files:
+        return None
+    with netCDF4.Dataset(files[0]) as nc:
+        xlat = nc.variables['XLAT'][0]
+        xlong = nc.variables['XLONG'][0]
+        fire_ids, lats, lons = __domain_fires(domain_id, nc)
+        size = int(round(FIRE_WINDOW_KM * 1000.0 / float(nc.getncattr('DX'))))
+    size += 1 - size % 2    # odd, so the fire is the centre cell
+    j, i = nearest_points(xlat, xlong, lats, lons)
+    j0, i0, size = patch_origins(j, i, xlat.shape, size)
+    rows = j0[:, None] + np.arange(size)
+    cols = i0[:, None] + np.arange(size)
+    index = {
+        'fire_id': np.array(fire_ids), 'j': j, 'i': i, 'j0': j0, 'i0': i0, 'size': np.array(size),
+        'xlat': xlat[rows[:, :, None], cols[:, None, :]], 'xlong': xlong[rows[:, :, None], cols[:, None, :]],
+    }
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(index_path, **index)
+    return index
+
+def extract_file(file_path, variables, j, i, j0, i0, size):
+    """
+    Patches and point values of every fire for one wrfout file (runs in a worker process).
+
+    Returns
+    -------
+    tuple
+        (Times strings, {variable: patches (fire, Time[, level], y, x)}, {variable: points (fire, Time[, level])})
+    """
+    rows = j0[:, None] + np.arange(size)
+    cols = i0[:, None] + np.arange(size)
+    patches = {}
+    points = {}
+    with netCDF4.Dataset(file_path) as nc:
+        times = [str(t) for t in np.atleast_1d(netCDF4.chartostring(nc.variables['Times'][:]))]
+        for name in variables:
+            if name not in nc.variables:
+                continue
+            # Staggered fields are averaged onto the mass grid so every variable shares the index
+            data = np.asarray(nc.variables[name][:], dtype=np.float32)
+            dims = nc.variables[name].dimensions
+            if dims[-1].endswith('_stag'):
+                data = 0.5 * (data[..., :-1] + data[..., 1:])
+            if dims[-2].endswith('_stag'):
+                data = 0.5 * (data[..., :-1, :] + data[..., 1:, :])
+            patch = data[..., rows[:, :, None], cols[:, None, :]]    # (Time[, level], fire, y, x)
+            patches[name] = np.moveaxis(patch, -3, 0)
+            points[name] = np.moveaxis(data[..., j, i], -1, 0)        # (fire, Time[, level])
+    return times, patches, points
+
+def extract_domain(domain_id, domain=1, variables=EXTRACT_VARIABLES, workers=EXPORT_WORKERS, rebuild=False):
+    """
+    Extract every fire's patch and point time series from one domain's wrfout files.
+
+    Parameters
+    ----------
+    domain_id : str
+        Domain (fire or shared domain) id, i.e. the directory name under WRFOUT_DIR.
+    domain : int
+        WRF domain number.
+    variables : list of str
+        Variables to extract.
+    workers : int
+        wrfout files read in parallel.
+    rebuild : bool
+        Recompute the cached fire index.
+
+    Returns
+    -------
+    list of Path
+        One .npz per fire.
+    """
+    files = [f for _, f in get_fire_wrfout(domain_id, domain)]
+    index = build_index(domain_id, domain, files=files, rebuild=rebuild)
+    if index is None:
+        return []
+
+    args = (variables, index['j'], index['i'], index['j0'], index['i0'], int(index['size']))
+    times = []
+    patches = {name: [] for name in variables}
+    points = {name: [] for name in variables}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(extract_file, f, *args) for f in files]
+        for future in futures:
+            file_times, file_patches, file_points = future.result()
+            times += file_times
+            for name in file_patches:
+                patches[name].append(file_patches[name])
+                points[name].append(file_points[name])
+
+    EXTRACT_DIR.mkdir(parents=True, exist_ok=True)
+    outputs = []
+    for n, fire_id in enumerate(index['fire_id']):
+        arrays = {'times': np.array(times), 'xlat': index['xlat'][n], 'xlong': index['xlong'][n],
+                  'j': index['j'][n], 'i': index['i'][n]}
+        for name in variables:
+            if patches[name]:
+                arrays[f'{name}_patch'] = np.concatenate([p[n] for p in patches[name]], axis=0)
+                arrays[f'{name}_point'] = np.concatenate([p[n] for p in points[name]], axis=0)
+        out_path = EXTRACT_DIR / f'{fire_id}_d{domain:02d}.npz'
+        np.savez_compressed(out_path, **arrays)
+        outputs.append(out_path)
+    return outputs
+
+def extract_all(domain_ids=None, domain=1, workers=EXPORT_WORKERS, rebuild=False):
+    """
+    Extract every domain under WRFOUT_DIR (or the given domain ids).
+    """
+    if domain_ids is None:
+        domain_ids = sorted(p.name for p in WRFOUT_DIR.iterdir() if p.is_dir()) if WRFOUT_DIR.is_dir() else []
+    outputs = {}
+    for domain_id in domain_ids:
+        try:
+            outputs[domain_id] = extract_domain(domain_id, domain=domain, workers=workers, rebuild=rebuild)
+            print(f"Extracted {len(outputs[domain_id])} fire(s) from {domain_id}")
+        except Exception as e:
+            print(f"Extraction from {domain_id} failed: {type(e).__name__}: {e}")
+    return outputs
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract fire-centred patches and point time series from wrfout files.")
+    parser.add_argument("domain_ids", nargs="*", help="Domain ids to extract (default: every domain under WRFOUT_DIR)")
+    parser.add_argument("--domain", "-d", help="WRF domain number", type=int, default=1)
+    parser.add_argument("--workers", "-w", help="wrfout files read in parallel", type=int, default=EXPORT_WORKERS)
+    parser.add_argument("--rebuild", help="Recompute the cached fire index", action="store_true")
+    args = parser.parse_args()
+    extract_all(args.domain_ids or None, domain=args.domain, workers=args.workers, rebuild=args.rebuild)
@@ -8,18 +8,20 @@ This program will plot all the central points for the fires outlined in the Wild
 
 This csv will be pumped into the WildfireTS_wrapper for wrf weather simuations.
 
+Queries run against a precomputed fire catalog (all_fires.catalog.feather) holding each fire's state,
+domain bounding box and date range. The catalog is rebuilt automatically whenever all_fires.csv changes.
+cartopy and matplotlib are only imported when a plot is requested.
+
 Can also be ran as a standalone module.
 """
 import argparse
+import hashlib
+import json
 import os
 
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 import geopandas as gpd
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-from cartopy.io import shapereader
-from shapely.geometry import Point
 from pathlib import Path
 
 
@@ -77,125 +79,235 @@ US_STATES = {
     "WY": "Wyoming"
 }
 
-def plot_fire_locations(state_filter=None, output_path=None, show_plot=False, fire_filter=None):
+CATALOG_PATH = ALL_FIRES_CSV.with_suffix(".catalog.feather")
+CATALOG_META_PATH = ALL_FIRES_CSV.with_suffix(".catalog.json")
 
+# Half-width of the WRF domain centred on each fire (400 x 400 1-km grid in the master namelist)
+DOMAIN_HALF_WIDTH_KM = 200.0
+KM_PER_DEG_LAT = 111.0
 
-    if state_filter:
-        for index, state in enumerate(state_filter):
 
-            # convert state abbreviation to full name
-            if state in US_STATES.keys():
-                state_filter[index] = US_STATES[state]
+# === Fire Catalog ===
 
-            elif state not in US_STATES.values():
-                raise ValueError(f"{state} is not a valid US state.")
+def _csv_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
 
-    else:
-        state_filter = list(US_STATES.values())
+def _csv_digest(csv_path):
+    with open(csv_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-    # Load fire points
-    csv_path = ALL_FIRES_CSV
-    df = pd.read_csv(csv_path)
-    required_cols = {"fire_id", "lat", "lon"}
-    if not required_cols.issubset(df.columns):
-        raise ValueError(f"CSV must contain columns: {required_cols}")
+def _load_state_polygons():
+    # cartopy is only needed to locate the Natural Earth shapefile, and only when the catalog is rebuilt
+    from cartopy.io import shapereader
 
-    # Convert to GeoDataFrame
-    gdf = gpd.GeoDataFrame(
-        df, geometry=gpd.points_from_xy(df["lon"], df["lat"]), crs="EPSG:4326"
-    )
-
-    # Load US state polygons
     shpfilename = shapereader.natural_earth(
         resolution="110m", category="cultural", name="admin_1_states_provinces"
     )
     states_gdf = gpd.read_file(shpfilename)
     states_gdf = states_gdf[states_gdf["admin"] == "United States of America"]
+    return states_gdf[["name", "geometry"]].rename(columns={"name": "state_name"})
 
-    if state_filter:
-        if isinstance(state_filter, str):
-            state_filter = [state_filter]
-
-        # Lowercase both the dataframe column and the filters
-        state_filter = [s.lower() for s in state_filter]
-        state_geom = states_gdf[states_gdf["name"].str.lower().isin([s.lower() for s in state_filter])]
-
-        if state_geom.empty:
-            raise ValueError(f"State '{state_filters}' not found.")
-
-        # Combine all geometries into one (union of states)
-        combined_geom = state_geom.union_all()
+def _build_catalog(csv_path):
+    """
+    Build the fire catalog from the source CSV.
 
+    All fire points are joined against the state polygons in a single vectorized sjoin, which
+    queries the STRtree spatial index of the state layer instead of looping over every state.
 
-        # Filter points inside state polygon
-        gdf = gdf[gdf.geometry.within(combined_geom)]
-        if gdf.empty:
-            print(f"No fires found in state: {state_filter}")
-            return
-
-        # Create a column for the state each fire belongs to
-        def fire_state(fire_point):
-            for _, row in state_geom.iterrows():
-                if fire_point.within(row.geometry):
-                    return row["name"]  # original state name
-            return None
+    Returns
+    -------
+    pandas.DataFrame
+        One row per fire with its state, domain bounding box and date range.
+    """
+    df = pd.read_csv(csv_path, dtype={"fire_id": str})
+    required_cols = {"fire_id", "lat", "lon"}
+    if not required_cols.issubset(df.columns):
+        raise ValueError(f"CSV must contain columns: {required_cols}")
 
-        gdf["state_name"] = gdf.geometry.apply(fire_state)
+    gdf = gpd.GeoDataFrame(
+        df, geometry=gpd.points_from_xy(df["lon"], df["lat"]), crs="EPSG:4326"
+    )
+    states_gdf = _load_state_polygons().to_crs(gdf.crs)
+
+    joined = gpd.sjoin(gdf, states_gdf, how="left", predicate="within")
+    # A point exactly on a shared border can match two states; keep the first, like the old per-point loop
+    joined = joined[~joined.index.duplicated(keep="first")]
+
+    catalog = pd.DataFrame(joined.drop(columns=["geometry", "index_right"]))
+    catalog["start_date"] = pd.to_datetime(catalog["start_date"])
+    catalog["end_date"] = pd.to_datetime(catalog["end_date"])
+
+    # Footprint of the WRF domain centred on each fire, in degrees
+    half_lat = DOMAIN_HALF_WIDTH_KM / KM_PER_DEG_LAT
+    half_lon = half_lat / np.cos(np.radians(catalog["lat"]))
+    catalog["min_lat"] = catalog["lat"] - half_lat
+    catalog["max_lat"] = catalog["lat"] + half_lat
+    catalog["min_lon"] = catalog["lon"] - half_lon
+    catalog["max_lon"] = catalog["lon"] + half_lon
+
+    return catalog.reset_index(drop=True)
+
+def load_fire_catalog(csv_path=ALL_FIRES_CSV, catalog_path=CATALOG_PATH, meta_path=CATALOG_META_PATH, rebuild=False):
+    """
+    Load the precomputed fire catalog, rebuilding it if the source CSV has changed.
+
+    The catalog is stored as a Feather file next to the CSV. A small JSON sidecar records the size,
+    mtime and SHA-256 digest of the CSV it was built from. When size and mtime still match, the
+    catalog is used as is. Otherwise the digest decides whether the contents actually changed.
+
+    Parameters
+    ----------
+    csv_path : pathlib.Path
+        Source CSV with fire_id, start_date, end_date, lat and lon columns.
+    catalog_path : pathlib.Path
+        Location of the Feather catalog.
+    meta_path : pathlib.Path
+        Location of the JSON sidecar holding the CSV signature.
+    rebuild : bool
+        Force a rebuild even if the catalog looks current.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    signature = _csv_signature(csv_path)
+    meta = None
+    if not rebuild and os.path.exists(catalog_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        if meta.get("size") == signature["size"] and meta.get("mtime_ns") == signature["mtime_ns"]:
+            return pd.read_feather(catalog_path)
+
+        # Touched but possibly unchanged (e.g. a fresh checkout); compare contents before rebuilding
+        digest = _csv_digest(csv_path)
+        if meta.get("sha256") == digest:
+            with open(meta_path, "w") as f:
+                json.dump({**signature, "sha256": digest}, f, indent=2)
+            return pd.read_feather(catalog_path)
+
+    catalog = _build_catalog(csv_path)
+    catalog.to_feather(catalog_path)
+    with open(meta_path, "w") as f:
+        json.dump({**signature, "sha256": _csv_digest(csv_path)}, f, indent=2)
+    return catalog
+
+def _normalize_states(state_filter):
+    if isinstance(state_filter, str):
+        state_filter = [state_filter]
+
+    states = []
+    for state in state_filter:
+        # convert state abbreviation to full name
+        if state.upper() in US_STATES:
+            states.append(US_STATES[state.upper()])
+        elif state.title() in US_STATES.values():
+            states.append(state.title())
+        else:
+            raise ValueError(f"{state} is not a valid US state.")
+    return states
+
+def query_fires(state_filter=None, fire_filter=None, date_window=None, catalog=None):
+    """
+    Filter the fire catalog by state, fire ID and/or date window.
+
+    Parameters
+    ----------
+    state_filter : str or list of str
+        US state names or abbreviations. Defaults to every US state.
+    fire_filter : str or list of str
+        Fire IDs to keep.
+    date_window : tuple
+        (start, end) dates; fires whose date range overlaps the window are kept. Either end may be None.
+    catalog : pandas.DataFrame
+        Catalog to filter. Loaded with load_fire_catalog() if not given.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    if catalog is None:
+        catalog = load_fire_catalog()
+
+    states = _normalize_states(state_filter) if state_filter else list(US_STATES.values())
+    mask = catalog["state_name"].isin(states)
 
-    # Handle fire ID filtering
     if fire_filter:
         if isinstance(fire_filter, str):
             fire_filter = [fire_filter]
+        fire_filter = [str(f).upper() for f in fire_filter]
+        mask &= catalog["fire_id"].str.upper().isin(fire_filter)
+
+    if date_window:
+        window_beg, window_end = date_window
+        if window_beg is not None:
+            mask &= catalog["end_date"] >= pd.to_datetime(window_beg)
+        if window_end is not None:
+            mask &= catalog["start_date"] <= pd.to_datetime(window_end)
+
+    return catalog[mask]
+
+
+# === Plotting ===
+
+def _plot_fires(fires, title):
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(12, 8))
+    ax = plt.axes(projection=ccrs.PlateCarree())
+    ax.set_extent([-125, -65, 24, 50], crs=ccrs.PlateCarree())
+
+    ax.add_feature(cfeature.STATES.with_scale("50m"), edgecolor="gray")
+    ax.add_feature(cfeature.COASTLINE)
+    ax.add_feature(cfeature.BORDERS)
+    ax.add_feature(cfeature.LAND)
+    ax.add_feature(cfeature.OCEAN)
+    ax.add_feature(cfeature.LAKES, alpha=0.5)
+    ax.add_feature(cfeature.RIVERS)
+
+    ax.plot(
+        fires["lon"],
+        fires["lat"],
+        linestyle="none",
+        marker="o",
+        color="red",
+        markersize=5,
+        transform=ccrs.PlateCarree(),
+    )
+    for fire_id, lat, lon in zip(fires["fire_id"], fires["lat"], fires["lon"]):
+        ax.text(lon + 0.2, lat + 0.2, str(fire_id), fontsize=8, transform=ccrs.PlateCarree())
+
+    plt.title(title)
+    plt.tight_layout()
+    plt.show()
 
-        fire_filter = [f.upper() for f in fire_filter]
-        gdf = gdf[gdf["fire_id"].str.upper().isin([fid for fid in fire_filter])]
-        if gdf.empty:
-            print(f"No fires found with fire IDs: {', '.join(fire_filter)}")
-            return
+def plot_fire_locations(state_filter=None, output_path=None, show_plot=False, fire_filter=None, date_window=None):
 
-        if gdf.empty:
-            print(f"No fires found with fire IDs: {', '.join(fire_filter)}")
-            return
+    gdf = query_fires(state_filter=state_filter, fire_filter=fire_filter, date_window=date_window)
+    if gdf.empty:
+        print(f"No fires found for states: {state_filter}, fire IDs: {fire_filter}, dates: {date_window}")
+        return
 
-    # Save filtered CSV
+    # Save filtered CSV (same columns as before the catalog existed; state_name stays the 6th column)
     if not output_path:
         output_path = f"filtered_fires.csv"
-    gdf.drop(columns="geometry").to_csv(output_path, index=False)
+    out_cols = ["fire_id", "start_date", "end_date", "lat", "lon", "state_name"]
+    out = gdf[out_cols].copy()
+    out["start_date"] = out["start_date"].dt.strftime("%Y-%m-%d")
+    out["end_date"] = out["end_date"].dt.strftime("%Y-%m-%d")
+    out.to_csv(output_path, index=False)
 
     # Plot
     if show_plot:
-        fig = plt.figure(figsize=(12, 8))
-        ax = plt.axes(projection=ccrs.PlateCarree())
-        ax.set_extent([-125, -65, 24, 50], crs=ccrs.PlateCarree())
-
-        ax.add_feature(cfeature.STATES.with_scale("50m"), edgecolor="gray")
-        ax.add_feature(cfeature.COASTLINE)
-        ax.add_feature(cfeature.BORDERS)
-        ax.add_feature(cfeature.LAND)
-        ax.add_feature(cfeature.OCEAN)
-        ax.add_feature(cfeature.LAKES, alpha=0.5)
-        ax.add_feature(cfeature.RIVERS)
-
-        for _, row in gdf.iterrows():
-            lat, lon = row["lat"], row["lon"]
-            fire_id = str(row["fire_id"])
-            ax.plot(
-                lon,
-                lat,
-                marker="o",
-                color="red",
-                markersize=5,
-                transform=ccrs.PlateCarree(),
-            )
-            ax.text(lon + 0.2, lat + 0.2, fire_id, fontsize=8, transform=ccrs.PlateCarree())
-
         title = "Fire Locations"
         if state_filter:
-            title += f" in {state_filter.title()}"
+            title += f" in {', '.join(_normalize_states(state_filter))}"
+        _plot_fires(gdf, title)
 
-        plt.title(title)
-        plt.tight_layout()
-        plt.show()
+    return gdf
 
 
 if __name__ == "__main__":
@@ -204,8 +316,19 @@ if __name__ == "__main__":
     )
     parser.add_argument("--states","-s",nargs="+" ,help="Filer by US state name (e.g. Washington)", default=None)
     parser.add_argument("--fire-ids","-f",nargs="+" ,help="Filer by Fire ID", default=None)
-    parser.add_argument("--show-plot", help="Display the map of fire locations")
+    parser.add_argument("--start-date", help="Keep fires burning on or after this date (YYYY-MM-DD)", default=None)
+    parser.add_argument("--end-date", help="Keep fires burning on or before this date (YYYY-MM-DD)", default=None)
+    parser.add_argument("--output", "-o", help="Path of the filtered CSV", default=None)
+    parser.add_argument("--rebuild-catalog", help="Rebuild the fire catalog from the source CSV", action="store_true")
+    parser.add_argument("--show-plot", help="Display the map of fire locations", action="store_true")
     args = parser.parse_args()
 
-    fires = plot_fire_locations(state_filter=args.states, fire_filter=args.fire_ids)
+    if args.rebuild_catalog:
+        load_fire_catalog(rebuild=True)
+
+    date_window = None
+    if args.start_date or args.end_date:
+        date_window = (args.start_date, args.end_date)
 
+    fires = plot_fire_locations(state_filter=args.states, fire_filter=args.fire_ids, output_path=args.output,
+                                show_plot=args.show_plot, date_window=date_window)
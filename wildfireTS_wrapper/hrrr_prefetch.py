@@ -0,0 +1,290 @@
+"""
+hrrr_prefetch.py
+Author: Kyle Krstulich
+
+Sweep-wide HRRR prefetch for the WildfireTS++ WRF sweep.
+
+Without a prefetch every setup_wps_wrf.py run downloads its own HRRR files (download_hrrr_from_aws_or_gc.py)
+right before ungrib, one fire-day at a time, and fires that overlap in time download the same CONUS files
+again into their own grib directories.
+
+The planner here works from the whole fire list up front: it builds the de-duplicated union of
+(cycle, lead, product) files the sweep needs, sorted by date so it matches the order fire-days are
+executed in. The prefetcher downloads them into one shared store with a bounded pool of workers and an
+optional bandwidth cap. Workers wait on a fire-day's files before launching it, so downloads stay ahead
+of the compute front and setup_wps_wrf.py finds everything already on disk.
+"""
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+
+import f90nml
+import pandas as pd
+import yaml
+from constants import *
+
+# icbc_check.py lives at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from icbc_check import AvailabilityCache, check_objects
+
+# Same repositories as download_hrrr_from_aws_or_gc.py
+AWS_BASE_URL = 'https://noaa-hrrr-bdp-pds.s3.amazonaws.com'
+GC_BASE_URL = 'https://storage.googleapis.com/high-resolution-rapid-refresh'
+GC_VARIANTS = ['GoogleCloud', 'googlecloud', 'Google_Cloud', 'google_cloud', 'GC', 'gc', 'GCloud', 'gcloud']
+
+# Pressure-level files are always needed, native-grid files only with hrrr_native
+PRODUCT_PRS = 'wrfprs'
+PRODUCT_NAT = 'wrfnat'
+
+DOWNLOAD_CHUNK = 1 << 20
+
+
+class HrrrFile:
+    """One HRRR grib2 file, identified by its cycle, lead hour and product."""
+
+    def __init__(self, cycle: pd.Timestamp, lead: int, product: str):
+        self.cycle = cycle
+        self.lead = lead
+        self.product = product
+
+    @property
+    def key(self):
+        return (self.cycle, self.lead, self.product)
+
+    @property
+    def valid_time(self):
+        return self.cycle + pd.Timedelta(hours=self.lead)
+
+    @property
+    def relative_path(self):
+        # Same layout as download_hrrr_from_aws_or_gc.py, mirroring the AWS bucket
+        fname = f"hrrr.t{self.cycle:%H}z.{self.product}f{self.lead:02d}.grib2"
+        return Path(f"hrrr.{self.cycle:%Y%m%d}") / 'conus' / fname
+
+    def url(self, icbc_source='AWS'):
+        base = GC_BASE_URL if icbc_source in GC_VARIANTS else AWS_BASE_URL
+        return f"{base}/{self.relative_path.as_posix()}"
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, HrrrFile) and self.key == other.key
+
+    def __repr__(self):
+        return f"HrrrFile({self.relative_path})"
+
+
+# === Planning ===
+
+def load_icbc_settings(yaml_path=WRF_YAML_DIR, namelist_path=MASTER_TEMPLATE_DIR / 'namelist.wps.hrrr'):
+    """
+    Read the IC/LBC settings a fire-day run will use from the master yaml and WPS namelist.
+
+    Returns
+    -------
+    dict
+        sim_hrs, int_hrs, icbc_fc_dt, icbc_analysis, hrrr_native and icbc_source, with the same defaults
+        as setup_wps_wrf.py.
+    """
+    with open(yaml_path, 'r') as f:
+        params = yaml.safe_load(f)
+
+    interval_seconds = f90nml.read(namelist_path)['share']['interval_seconds']
+    if isinstance(interval_seconds, list):
+        interval_seconds = interval_seconds[0]
+
+    return {
+        'sim_hrs': int(params.get('sim_hrs', 24)),
+        'int_hrs': int(interval_seconds) // 3600,
+        'icbc_fc_dt': int(params.get('icbc_fc_dt', 0)),
+        'icbc_analysis': bool(params.get('icbc_analysis', False)),
+        'hrrr_native': bool(params.get('hrrr_native', True)),
+        'icbc_source': params.get('icbc_source', 'AWS'),
+    }
+
+def files_for_fire_day(fdate: str, sim_hrs, int_hrs, icbc_fc_dt=0, icbc_analysis=False, hrrr_native=True):
+    """
+    HRRR files one setup_wps_wrf.py run starting at fdate (YYYYMMDD_HH) downloads.
+
+    Mirrors download_hrrr_from_aws_or_gc.py: forecast leads from a single cycle, or f00 analyses at every
+    valid time when icbc_analysis is set.
+    """
+    cycle_dt = pd.to_datetime(fdate, format='%Y%m%d_%H')
+    products = [PRODUCT_NAT, PRODUCT_PRS] if hrrr_native else [PRODUCT_PRS]
+
+    if icbc_analysis:
+        valid_times = pd.date_range(start=cycle_dt, end=cycle_dt + pd.Timedelta(hours=sim_hrs), freq=f"{int_hrs}h")
+        return [HrrrFile(valid, 0, product) for valid in valid_times for product in products]
+
+    icbc_cycle = cycle_dt - pd.Timedelta(hours=icbc_fc_dt)
+    leads = range(icbc_fc_dt, sim_hrs + icbc_fc_dt + 1, int_hrs)
+    return [HrrrFile(icbc_cycle, lead, product) for lead in leads for product in products]
+
+def plan_prefetch(fire_days, settings):
+    """
+    Build the de-duplicated prefetch plan for a whole sweep.
+
+    Parameters
+    ----------
+    fire_days : list of tuple
+        (fire_id, fdate) for every fire-day the sweep will run.
+    settings : dict
+        Output of load_icbc_settings().
+
+    Returns
+    -------
+    files : list of HrrrFile
+        Union of the files every fire-day needs, in valid-time order.
+    needs : dict
+        {(fire_id, fdate): set of HrrrFile} so a fire-day can wait on just its own files.
+    """
+    needs = {}
+    union = set()
+    for fire_id, fdate in fire_days:
+        files = set(files_for_fire_day(fdate, settings['sim_hrs'], settings['int_hrs'], settings['icbc_fc_dt'],
+                                       settings['icbc_analysis'], settings['hrrr_native']))
+        needs[(str(fire_id), fdate)] = files
+        union |= files
+
+    files = sorted(union, key=lambda f: (f.valid_time, f.cycle, f.product))
+    return files, needs
+
+def unavailable_fire_days(fire_days, settings, workers=PREFLIGHT_WORKERS, cache_file=ICBC_CACHE):
+    """
+    Check every HRRR file the sweep needs with concurrent HEAD requests (icbc_check.py) before anything is queued.
+
+    Returns
+    -------
+    dict
+        {(fire_id, fdate): sorted list of missing URLs} for every fire-day that cannot run.
+    """
+    files, needs = plan_prefetch(fire_days, settings)
+    urls = {f: f.url(settings['icbc_source']) for f in files}
+    available = check_objects(list(urls.values()), workers, AvailabilityCache(cache_file))
+    missing = {}
+    for key, needed in needs.items():
+        # A file that could not be checked (None) is left for the download step to retry
+        lost = sorted(urls[f] for f in needed if available[urls[f]] is False)
+        if lost:
+            missing[key] = lost
+    return missing
+
+
+# === Downloading ===
+
+class BandwidthLimiter:
+    """Token bucket shared by all download workers. A rate of None or 0 means unlimited."""
+
+    def __init__(self, bytes_per_sec=None):
+        self.rate = bytes_per_sec
+        self._lock = threading.Lock()
+        self._allowance = float(bytes_per_sec or 0)
+        self._last = time.monotonic()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HrrrPrefetcher:
+    def __init__(self, files, needs, store_dir: Path = HRRR_STORE_DIR, icbc_source='AWS',
+                 workers=PREFETCH_WORKERS, bytes_per_sec=PREFETCH_BYTES_PER_SEC):
+        self.files = files
+        self.needs = needs
+        self.store_dir = Path(store_dir)
+        self.icbc_source = icbc_source
+        self.workers = workers
+        self.limiter = BandwidthLimiter(bytes_per_sec)
+        self.done = {f: threading.Event() for f in files}
+        self.missing = set()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def local_path(self, hrrr_file: HrrrFile) -> Path:
+        return self.store_dir / hrrr_file.relative_path
+
+    def _download(self, hrrr_file: HrrrFile):
+        out_path = self.local_path(hrrr_file)
+        try:
+            if out_path.is_file():
+                return
+
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = out_path.with_name(f".{out_path.name}.part")
+            url = hrrr_file.url(self.icbc_source)
+            try:
+                with urllib.request.urlopen(url, timeout=120) as response, open(tmp_path, 'wb') as f:
+                    while True:
+                        chunk = response.read(DOWNLOAD_CHUNK)
+                        if not chunk:
+                            break
+                        self.limiter.consume(len(chunk))
+                        f.write(chunk)
+                tmp_path.replace(out_path)
+            except (HTTPError, URLError, OSError) as e:
+                tmp_path.unlink(missing_ok=True)
+                with self._lock:
+                    self.missing.add(hrrr_file)
+                print(f"[WARN] HRRR prefetch failed for {url}: {e}")
+        finally:
+            self.done[hrrr_file].set()
+
+    def start(self):
+        """Queue every planned file in date order on a bounded pool and return immediately."""
+        todo = []
+        for hrrr_file in self.files:
+            if self.local_path(hrrr_file).is_file():
+                self.done[hrrr_file].set()
+            else:
+                todo.append(hrrr_file)
+
+        print(f"Prefetching {len(todo)} of {len(self.files)} HRRR files into {self.store_dir} "
+              f"with {self.workers} workers.")
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hrrr-prefetch')
+        for hrrr_file in todo:
+            self._pool.submit(self._download, hrrr_file)
+
+    def wait_for(self, fire_id, fdate, timeout=None) -> bool:
+        """
+        Block until every file a fire-day needs has been attempted.
+
+        Returns
+        -------
+        bool
+            True if all of them are on disk. False means the fire-day's own download step will retry
+            (and report) whatever is still missing.
+        """
+        for hrrr_file in self.needs.get((str(fire_id), fdate), ()):
+            if not self.done[hrrr_file].wait(timeout):
+                return False
+        return all(self.local_path(f).is_file() for f in self.needs.get((str(fire_id), fdate), ()))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    fires = pd.read_csv(CSV_DIR)
+    settings = load_icbc_settings()
+    fire_days = []
+    for _, fire in fires.iterrows():
+        for day in pd.date_range(start=fire['start_date'], end=fire['end_date'], freq='D'):
+            fire_days.append((fire['fire_id'], parse_date(day)))
+
+    files, needs = plan_prefetch(fire_days, settings)
+    per_fire_day = sum(len(n) for n in needs.values())
+    print(f"{len(fire_days)} fire-days need {per_fire_day} HRRR downloads, {len(files)} after de-duplication.")
@@ -6,7 +6,9 @@ this file will move wrfout files and organize them by fireid
 """
 from constants import *
 import os
+import sys
 import shutil
+import subprocess
 from pathlib import Path
 
 # === Private Functions ===
@@ -63,14 +65,57 @@ def __extract_wrfout_metadata(wrfout_files):
             continue
     return results
 
+def __is_current(file_path, out_file):
+    """
+    True if out_file was already made from this version of file_path (copies keep the source's mtime).
+    """
+    return out_file.exists() and out_file.stat().st_mtime >= Path(file_path).stat().st_mtime
+
+def __compress_wrf_files(metadata):
+    """
+    Copy wrfout files into WRFOUT_DIR as compressed netCDF4 with COMPRESS_SCRIPT, one call per fire-day so
+    each call converts that day's files in parallel. The sources are left in place.
+
+    Parameters
+    ----------
+    metadata : list of tuple
+        (file_path, fire_id, date_str, filename) as returned by __extract_wrfout_metadata.
+
+    Returns
+    -------
+    list of tuple
+        Entries that could not be compressed and still need a plain copy.
+    """
+    groups = {}
+    for entry in metadata:
+        file_path, fireid, fdate, file_name = entry
+        groups.setdefault((fireid, fdate), []).append(entry)
+
+    leftover = []
+    for (fireid, fdate), entries in groups.items():
+        out_dir = WRFOUT_DIR / fireid / fdate
+        cmd = [sys.executable, str(COMPRESS_SCRIPT), *[entry[0] for entry in entries], "-o", str(out_dir),
+               "-c", COMPRESSION, "-j", str(COMPRESS_WORKERS)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Compression incomplete for fire {fireid} at {fdate}, copying the rest unchanged:")
+            print(result.stderr[-2000:])
+        # compress_wrfout.py only writes a file once it has been verified
+        leftover.extend(entry for entry in entries if not (out_dir / entry[3]).exists())
+    return leftover
+
 def __move_wrf_files(metadata):
 
+    metadata = [entry for entry in metadata
+                if not __is_current(entry[0], WRFOUT_DIR / entry[1] / entry[2] / entry[3])]
+    if COMPRESS_WRFOUT and COMPRESS_SCRIPT.exists():
+        metadata = __compress_wrf_files(metadata)
 
     for file_path, fireid, fdate, file_name in metadata:
-        out_dir = Path(f"/glade/derecho/scratch/krstulich/wrfout/{fireid}/{fdate}")
+        out_dir = WRFOUT_DIR / fireid / fdate
         out_dir.mkdir(parents=True, exist_ok=True)
         out_file = out_dir / file_name
-        shutil.copy(file_path,out_file)
+        shutil.copy2(file_path,out_file)
 
 # === Public Functions ===
 
@@ -36,13 +36,19 @@ from constants import *
 from NmlRipper import NmlRipper
 from YamlRipper import YamlRipper
 from typing import List
-from fire_query.fire_query import plot_fire_locations
 from collections import deque
 from move_wrf import get_wrfout_files, move_all_wrfout, get_geogrid_files
+from run_state import RunStateIndex, COMPLETE
+from domain_planner import plan_domains
+from hrrr_prefetch import HrrrPrefetcher, load_icbc_settings, plan_prefetch, unavailable_fire_days
+from export_fire import export_all
+from extract_fire import extract_all
 
 
 
 rippers = []
+run_state = None
+prefetcher = None
 watchdogs = {
         'casper':None,
         'derecho':None,
@@ -62,6 +68,8 @@ def remove_old_files():
         yr.remove()
 
 def load_csv(state,fireid):
+    # geopandas/cartopy are only needed when querying the fire catalog
+    from fire_query.fire_query import plot_fire_locations
     plot_fire_locations(state_filter=state,fire_filter=fireid, output_path=CSV_DIR)
     if not os.path.exists(CSV_DIR):
         print("CSV file not found!")
@@ -75,11 +83,24 @@ def get_wrf_dir(fireid: str, fdate: str):
 def get_geogrid_dir(fireid: str):
     return SCRATCH_DIR / fireid / "wps" / "geogrid"
 
-def is_wrf_complete(fireid:str, fdate: str) -> bool:
-    return len(get_wrfout_files(get_wrf_dir(fireid,fdate))) >= 30
+def record_wrf(fireid: str, fdate: str, failed=False) -> str:
+    files = get_wrfout_files(get_wrf_dir(fireid, fdate))
+    return run_state.record(fireid, fdate, "wrf", files, WRF_EXPECTED_FILES, failed=failed)
 
-def is_geogrid_complete(fireid:str) -> bool:
-    return len(get_geogrid_files(get_geogrid_dir(fireid))) >= 1
+def record_geogrid(fireid: str, failed=False) -> str:
+    files = get_geogrid_files(get_geogrid_dir(fireid))
+    return run_state.record(fireid, "", "geogrid", files, GEOGRID_EXPECTED_FILES, failed=failed)
+
+def is_wrf_complete(fireid:str, fdate: str, states=None) -> bool:
+    # Trust the run-state index when planning; only list the directory for fire-days it has never seen
+    if states is not None and (fireid, fdate, "wrf") in states:
+        return states[(fireid, fdate, "wrf")][0] == COMPLETE
+    return record_wrf(fireid, fdate) == COMPLETE
+
+def is_geogrid_complete(fireid:str, states=None) -> bool:
+    if states is not None and (fireid, "", "geogrid") in states:
+        return states[(fireid, "", "geogrid")][0] == COMPLETE
+    return record_geogrid(fireid) == COMPLETE
 
 
 # === Error Handling ===
@@ -94,7 +115,7 @@ def display_error(e: str, logfile: Path, fireid=None, fdate=None):
     log_result = open_log_file(logfile)
     if any("download_hrrr_from_aws_or_gc.py" in line for line in log_result):
         print(f"[ERROR][{fireid}: {fdate}] HRRR data not found.")
-    elif any("run_wrf.py" in line for line in log_result) and is_wrf_complete(fireid,fdate):
+    elif any("run_wrf.py" in line for line in log_result) and is_wrf_complete(fireid, fdate, run_state.lookup(fireid, fdate, "wrf")):
         print(f"[{fireid}: {fdate}]WRF has finished, but did not exit gracefully.")
     else:
         print(f"[ERROR] {fireid} failed at date {fdate}: {str(e)}")
@@ -117,16 +138,22 @@ def worker(command_list, geogrid_command, semaphore, fireid):
         try:
             if geogrid_command:
                 subprocess.run(geogrid_command, check=True)
+                record_geogrid(fireid)
         except subprocess.CalledProcessError as e1:
+            record_geogrid(fireid, failed=True)
             logfile = HOME_DIR / 'logs' / fireid / f"{geogrid_command[2]}.log"
             display_error(e1, logfile, fireid=fireid, fdate=geogrid_command[2])
             return
 
         for cmd in command_list:
             fdate = cmd[2]
+            if prefetcher is not None and not prefetcher.wait_for(fireid, fdate):
+                print(f"[WARN][{fireid}: {fdate}] Some HRRR files could not be prefetched, setup_wps_wrf.py will retry them.")
             try:
                 subprocess.run(cmd, check=True)
+                record_wrf(fireid, fdate)
             except subprocess.CalledProcessError as e2:
+                record_wrf(fireid, fdate, failed=True)
                 logfile = HOME_DIR / 'logs' / fireid / f"{fdate}.log"
                 display_error(e2, logfile, fireid=fireid, fdate=fdate)
 
@@ -175,25 +202,50 @@ def parse():
     parser.add_argument("--num-days", "-n", help="Number of days to process per fire",type=int, default=MAX_DAYS)
     parser.add_argument("--threads", "-t", help="Number working threads",type=int, default=MAX_WORKERS)
     parser.add_argument("--dry-run", "-d", help="Do a dry run. No WPS/WRF",action="store_true")
+    parser.add_argument("--fire-csv", help="Use an already filtered fire CSV instead of querying the fire catalog", type=Path, default=None)
+    parser.add_argument("--share-domains", help="Run one shared domain for fires that overlap in space and time",action="store_true")
+    parser.add_argument("--rescan", help="Ignore the run-state index and re-list output directories",action="store_true")
+    parser.add_argument("--prefetch", help="Download every HRRR file the sweep needs ahead of the WPS/WRF runs into one shared store",action="store_true")
+    parser.add_argument("--prefetch-workers", help="Number of concurrent HRRR downloads",type=int, default=PREFETCH_WORKERS)
+    parser.add_argument("--preflight", help="Check every fire-day's HRRR files are available before queuing, and drop fire-days missing any",action="store_true")
+    parser.add_argument("--export", help="Export each fire's wrfout files into one time-series store for WildfireTS++",action="store_true")
+    parser.add_argument("--export-workers", help="Number of wrfout files read in parallel by --export and --extract",type=int, default=EXPORT_WORKERS)
+    parser.add_argument("--extract", help="Extract fire-centred patches and point time series from each domain's wrfout files",action="store_true")
     args = parser.parse_args()
     return args
     
 
 def main():
+    global run_state
+    global prefetcher
 
     args = parse()
+    run_state = RunStateIndex()
 
     if args.dry_run:
         running_script = TEST_SCRIPT
     else:
         running_script = WRF_SCRIPT
 
-    state_csv = load_csv(args.states, args.fireids)
+    if args.fire_csv is not None:
+        state_csv = pd.read_csv(args.fire_csv)
+    else:
+        state_csv = load_csv(args.states, args.fireids)
+
+    # Merge fires that fit in one domain on overlapping dates; fire_domains.csv maps each fire back
+    if args.share_domains:
+        domains, fire_map = plan_domains(state_csv)
+        fire_map.to_csv(DOMAIN_MAP_CSV, index=False)
+        print(f"Planned {len(domains)} WRF domains for {len(state_csv)} fires. Fire map: {DOMAIN_MAP_CSV}")
+        state_csv = domains
 
     semaphore = threading.Semaphore(args.threads)
     process_map = {}
     geogrid_map = {}
 
+    # Completion state of every fire-day seen so far, in one query
+    states = None if args.rescan else run_state.load()
+
     # run watchdog scripts
     attach_monitor()
 
@@ -209,7 +261,7 @@ def main():
         # setup run variables
         nr = NmlRipper(fire)
         fireId = nr.fireId
-        yr = YamlRipper(fireId)
+        yr = YamlRipper(fireId, grib_dir=HRRR_STORE_DIR if args.prefetch else None)
         fire_dates = nr.dateRange
         process_map[fireId] = []
         geogrid_map[fireId] = []
@@ -219,7 +271,7 @@ def main():
         yr.edit_geogrid()
         yr.save_geogrid()
         geogrid_path = yr.geogrid_output_path
-        if not is_geogrid_complete(str(fireId)):
+        if not is_geogrid_complete(str(fireId), states):
             geogrid_process = ["bash", str(running_script),fire_dates[0], str(geogrid_path), str(fireId), "Geogrid"]
             geogrid_map[fireId] = geogrid_process
         else:
@@ -240,7 +292,7 @@ def main():
             yr.save()
             yaml_path = yr.wrf_output_path
 
-            if not is_wrf_complete(str(fireId), fdate):
+            if not is_wrf_complete(str(fireId), fdate, states):
                 print(f"Pre-processing {state_name} fire: {fireId} at {fdate}")
                 process = ["bash",str(running_script),fdate,str(yaml_path), str(fireId), "WPS/WRF"]
                 process_map[fireId].append(process)
@@ -248,11 +300,37 @@ def main():
                 print(f"{state_name} fire: {fireId} at {fdate} already completed, skipping.")
 
 
+    # Drop fire-days whose HRRR files are not in the archive, instead of finding out from a 404 mid-sweep
+    if args.preflight and not args.dry_run:
+        fire_days = [(str(fireId), cmd[2]) for fireId, cmds in process_map.items() for cmd in cmds]
+        missing = unavailable_fire_days(fire_days, load_icbc_settings())
+        for fireId in process_map:
+            process_map[fireId] = [cmd for cmd in process_map[fireId] if (str(fireId), cmd[2]) not in missing]
+        for (fireId, fdate), urls in missing.items():
+            print(f"Skipping fire: {fireId} at {fdate}, {len(urls)} HRRR file(s) unavailable, e.g. {urls[0]}")
+        print(f"Pre-flight: {len(fire_days) - len(missing)} of {len(fire_days)} fire-days have their HRRR data")
+
+    # Fetch the union of HRRR files for every pending fire-day, in date order, ahead of the workers
+    if args.prefetch and not args.dry_run:
+        settings = load_icbc_settings()
+        fire_days = [(str(fireId), cmd[2]) for fireId, cmds in process_map.items() for cmd in cmds]
+        files, needs = plan_prefetch(fire_days, settings)
+        prefetcher = HrrrPrefetcher(files, needs, icbc_source=settings['icbc_source'], workers=args.prefetch_workers)
+        prefetcher.start()
+
     run_fires_async(process_map, geogrid_map, semaphore)
 
+    if prefetcher is not None:
+        prefetcher.shutdown()
 
     detach_monitor()
     move_all_wrfout()
+
+    # Append this sweep's wrfout files to each fire's time-series store
+    if args.export and not args.dry_run:
+        export_all([str(fireId) for fireId in process_map], workers=args.export_workers)
+    if args.extract and not args.dry_run:
+        extract_all([str(fireId) for fireId in process_map], workers=args.export_workers)
     print("Done!")
 
 
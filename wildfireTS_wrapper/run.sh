@@ -9,8 +9,8 @@ FIREID="$3"
 JOB_TITLE="$4"
 
 # set all the path variables
-WORK_DIR="/glade/u/home/$USER/wps_wrf_workflow"
-ENV_PATH="/glade/work/$USER/conda-envs/wps_wrf"
+WORK_DIR="${WPS_WRF_WORK_DIR:-/glade/u/home/$USER/wps_wrf_workflow}"
+ENV_PATH="${WPS_WRF_ENV_PATH:-/glade/work/$USER/conda-envs/wps_wrf}"
 PYTHON_SCRIPT="$WORK_DIR/setup_wps_wrf.py"
 SCRIPT_DIR="$WORK_DIR/scripts"
 LOG_DIR="${WORK_DIR}/logs/${FIREID}/"
@@ -24,6 +24,13 @@ cd "$WORK_DIR"
 mkdir -p ${LOG_DIR}
 LOGFILE="$LOG_DIR/${START_DATE}.log"
 
+# timing spans for every stage of this fire-day go to one shared trace file
+export WPS_WRF_TRACE_FILE="${WPS_WRF_TRACE_FILE:-${WORK_DIR}/logs/trace.jsonl}"
+export WPS_WRF_TRACE_ATTRS="{\"fire_id\": \"${FIREID}\", \"job_title\": \"${JOB_TITLE}\"}"
+
+# job run times shared by every fire, used to size walltime and core requests for the next jobs
+export WPS_WRF_RUNTIME_DB="${WPS_WRF_RUNTIME_DB:-${WORK_DIR}/logs/runtimes.jsonl}"
+
 # run the job
 echo "Running $JOB_TITLE for fire $FIREID at $START_DATE"
 python3 setup_wps_wrf.py -b "$START_DATE" -c "$CONFIG_PATH" > "$LOGFILE" 2>&1
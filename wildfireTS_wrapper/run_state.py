@@ -0,0 +1,259 @@
+"""
+run_state.py
+Author: Kyle Krstulich
+
+Durable run-state index for the WildfireTS++ WRF sweep.
+
+Every time a stage finishes for a fire (geogrid) or a fire-day (WPS/WRF), its outputs are listed once
+and a row is written to a small sqlite database: fire id, date, stage, status, how many output files
+were expected and how many are present, plus the size and mtime of each output file. Quick checksums
+are only computed when asked for, and only recomputed once a file's size or mtime has changed.
+
+Planning a sweep then becomes a single query against the index instead of one directory listing per
+fire-day on the shared filesystem.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from constants import *
+
+# Status values stored in the index
+COMPLETE = "complete"
+PARTIAL = "partial"
+FAILED = "failed"
+MISSING = "missing"
+
+# Bytes hashed from each end of an output file for its quick checksum
+CHECKSUM_CHUNK = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_state (
+    fire_id   TEXT NOT NULL,
+    fdate     TEXT NOT NULL,
+    stage     TEXT NOT NULL,
+    status    TEXT NOT NULL,
+    expected  INTEGER NOT NULL,
+    present   INTEGER NOT NULL,
+    checksums TEXT NOT NULL,
+    updated   TEXT NOT NULL,
+    PRIMARY KEY (fire_id, fdate, stage)
+);
+CREATE INDEX IF NOT EXISTS run_state_status ON run_state (stage, status);
+"""
+
+
+def quick_checksum(file_path):
+    """
+    Cheap fingerprint of a (potentially multi-GB) output file.
+
+    Hashes the file size together with its first and last CHECKSUM_CHUNK bytes. This catches truncated
+    or rewritten files without reading whole wrfout files back from disk.
+
+    Parameters
+    ----------
+    file_path : str or pathlib.Path
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(CHECKSUM_CHUNK))
+        if size > CHECKSUM_CHUNK:
+            f.seek(max(size - CHECKSUM_CHUNK, CHECKSUM_CHUNK))
+            digest.update(f.read(CHECKSUM_CHUNK))
+    return digest.hexdigest()
+
+
+def _file_entries(files, previous):
+    """
+    Size/mtime entries for a stage's output files, carrying over any checksum from the previous record
+    of a file whose size and mtime are unchanged.
+    """
+    entries = {}
+    for f in sorted(files):
+        st = os.stat(f)
+        entry = {"path": str(f), "size": st.st_size, "mtime": st.st_mtime_ns}
+        old = previous.get(os.path.basename(f))
+        # Rows written before size/mtime were tracked hold a bare checksum string; those are recomputed
+        if isinstance(old, dict) and "checksum" in old and \
+                (old["size"], old["mtime"]) == (entry["size"], entry["mtime"]):
+            entry["checksum"] = old["checksum"]
+        entries[os.path.basename(f)] = entry
+    return entries
+
+
+class RunStateIndex:
+    def __init__(self, db_path: Path = RUN_STATE_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # prepare_data records from several worker threads
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3's own context manager only commits or rolls back; closing() also releases the connection
+        with closing(sqlite3.connect(self.db_path, timeout=60)) as conn, conn:
+            yield conn
+
+    def record(self, fire_id, fdate, stage, files, expected, failed=False):
+        """
+        Record the outputs of a stage that just finished.
+
+        Parameters
+        ----------
+        fire_id : str
+        fdate : str
+            Date of the fire-day (YYYYMMDD_HH), or '' for per-fire stages such as geogrid.
+        stage : str
+            Stage name (e.g. 'geogrid', 'wrf').
+        files : list of str
+            Output files found for the stage.
+        expected : int
+            Number of output files a complete run produces.
+        failed : bool
+            The stage exited with an error. Still recorded as complete if every output is present.
+
+        Returns
+        -------
+        str
+            Status written to the index.
+        """
+        present = len(files)
+        if present >= expected:
+            status = COMPLETE
+        elif present > 0:
+            status = PARTIAL
+        elif failed:
+            status = FAILED
+        else:
+            status = MISSING
+
+        with self._lock, self._connect() as conn:
+            previous = self._entries(conn, fire_id, fdate, stage)
+            row = (str(fire_id), fdate, stage, status, expected, present, json.dumps(_file_entries(files, previous)),
+                   datetime.now(timezone.utc).isoformat())
+            conn.execute(
+                "INSERT OR REPLACE INTO run_state "
+                "(fire_id, fdate, stage, status, expected, present, checksums, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+        return status
+
+    def load(self, stage=None):
+        """
+        Read the whole index (optionally for one stage) in a single query.
+
+        Returns
+        -------
+        dict
+            {(fire_id, fdate, stage): (status, expected, present)}
+        """
+        query = "SELECT fire_id, fdate, stage, status, expected, present FROM run_state"
+        params = ()
+        if stage is not None:
+            query += " WHERE stage = ?"
+            params = (stage,)
+
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return {(fire_id, fdate, stg): (status, expected, present)
+                for fire_id, fdate, stg, status, expected, present in rows}
+
+    def lookup(self, fire_id, fdate, stage):
+        """
+        Read a single fire-day/stage from the index.
+
+        Returns
+        -------
+        dict
+            Same shape as load(): {(fire_id, fdate, stage): (status, expected, present)}, or {} if it was
+            never recorded.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, expected, present FROM run_state WHERE fire_id = ? AND fdate = ? AND stage = ?",
+                (str(fire_id), fdate, stage),
+            ).fetchone()
+        return {(fire_id, fdate, stage): row} if row else {}
+
+    def incomplete(self, stage=None):
+        """
+        List fire-days whose recorded outputs fall short of what was expected.
+
+        Returns
+        -------
+        list of tuple
+            (fire_id, fdate, stage, status, expected, present)
+        """
+        query = ("SELECT fire_id, fdate, stage, status, expected, present FROM run_state "
+                 "WHERE status != ?")
+        params = [COMPLETE]
+        if stage is not None:
+            query += " AND stage = ?"
+            params.append(stage)
+
+        with self._connect() as conn:
+            return conn.execute(query + " ORDER BY fire_id, fdate", params).fetchall()
+
+    @staticmethod
+    def _entries(conn, fire_id, fdate, stage):
+        row = conn.execute(
+            "SELECT checksums FROM run_state WHERE fire_id = ? AND fdate = ? AND stage = ?",
+            (str(fire_id), fdate, stage),
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def checksums(self, fire_id, fdate, stage):
+        """
+        Quick checksums of a stage's recorded output files, computed on first request and cached in the index.
+
+        Returns
+        -------
+        dict
+            {file name: hex digest}, or None for a file that is gone or whose size or mtime no longer match
+            what was recorded (record the stage again to pick up the new file).
+        """
+        with self._lock, self._connect() as conn:
+            entries = self._entries(conn, fire_id, fdate, stage)
+            result = {}
+            changed = False
+            for name, entry in entries.items():
+                if not isinstance(entry, dict):
+                    result[name] = entry
+                    continue
+                try:
+                    st = os.stat(entry["path"])
+                except OSError:
+                    st = None
+                if st is None or (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime"]):
+                    result[name] = None
+                    continue
+                if "checksum" not in entry:
+                    entry["checksum"] = quick_checksum(entry["path"])
+                    changed = True
+                result[name] = entry["checksum"]
+            if changed:
+                conn.execute(
+                    "UPDATE run_state SET checksums = ? WHERE fire_id = ? AND fdate = ? AND stage = ?",
+                    (json.dumps(entries), str(fire_id), fdate, stage),
+                )
+        return result
+
+
+if __name__ == "__main__":
+    index = RunStateIndex()
+    for fire_id, fdate, stage, status, expected, present in index.incomplete():
+        print(f"[{fire_id}: {fdate or '-'}] {stage} {status}: {present}/{expected} files")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+'''
+wps_cache.py
+
+Shares ungrib/metgrid output between experiments whose WPS inputs are identical.
+
+Physics-only experiments (different namelist.input.<model>.<exp>, same IC/LBC model, cycle and domain) produce
+identical met_em files. With share_wps in the yaml, setup_wps_wrf.py runs ungrib, avg_tsfc and metgrid once per
+distinct set of WPS inputs, in wps_run_dir/<cycle>/wps_<key>, where key is a hash of everything that affects the
+output: the IC/LBC model, source, cycle and lead times, the namelist.wps templates, the Vtables, METGRID.TBL, the WPS
+install and the contents of the geo_em files. Each experiment's run directory then links to that directory.
+
+A producer claims a key by creating its lock file (O_EXCL, so only one process can) and runs the stages it needs
+that are not done yet, plus any missing stage those read (ungrib for avg_tsfc and metgrid; avg_tsfc for metgrid
+when it uses TAVGSFC). After each stage succeeds it is recorded in COMPLETE, so a run that needs a stage an earlier
+producer did not run (e.g. that producer had do_metgrid: False) produces it instead of linking to nothing. Any
+other run needing the same key waits for the producer instead of repeating the work, then runs whatever is still
+missing. The producer touches its lock every HEARTBEAT_S seconds; a lock left untouched for STALE_S (its producer
+died) is taken over by the next waiter. A producer that fails releases the lock, so a waiter takes over at once.
+
+    python wps_cache.py /glade/derecho/scratch/$USER/workflow/wps/20240801_00/wps_*    # state of shared dirs
+'''
+
+import os
+import json
+import time
+import socket
+import hashlib
+import pathlib
+import argparse
+import threading
+import logging
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+LOCK_NAME = '.producer.lock'
+COMPLETE_NAME = 'COMPLETE'
+# Outputs in a shared directory that experiments link to
+SHARED_OUTPUTS = ['ungrib', 'metgrid', 'TAVGSFC', 'namelist.wps']
+# Shared stages in run order, and the stages whose output each one reads
+STAGES = ['ungrib', 'avg_tsfc', 'metgrid']
+STAGE_INPUTS = {'ungrib': [], 'avg_tsfc': ['ungrib'], 'metgrid': ['ungrib']}
+# Digests of the geo_em files, kept beside them and reused while a file's size and mtime are unchanged
+GEO_DIGESTS_NAME = '.geo_em_digests.json'
+HEARTBEAT_S = 60
+STALE_S = 15 * 60
+POLL_S = 30
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def geo_em_digests(geo_dir):
+    '''
+    {name: content digest} of the geo_em files in geo_dir. geogrid output differs with GEOGRID.TBL, geog_data_res
+    or the static data set without changing its size, so the contents are hashed. Digests are cached in geo_dir and
+    recomputed only for files whose size or mtime changed; an unchanged geogrid re-run therefore costs one read of
+    each file but keeps the same digests.
+    '''
+    geo_dir = pathlib.Path(geo_dir)
+    cache_file = geo_dir.joinpath(GEO_DIGESTS_NAME)
+    try:
+        cache = json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    digests = {}
+    updated = {}
+    for f in sorted(geo_dir.glob('geo_em.d[0-9][0-9].nc')):
+        st = f.stat()
+        entry = cache.get(f.name)
+        if entry is None or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': file_digest(f)}
+        updated[f.name] = entry
+        digests[f.name] = entry['sha256']
+    if updated != cache:
+        try:
+            tmp = cache_file.with_name(GEO_DIGESTS_NAME + f'.{os.getpid()}.tmp')
+            tmp.write_text(json.dumps(updated, indent=1) + '\n')
+            os.replace(tmp, cache_file)
+        except OSError as e:
+            # A read-only geogrid directory only costs re-hashing next time
+            log.info(f'Not caching geo_em digests in {geo_dir}: {e}')
+    return digests
+
+
+def wps_key(settings, files=(), geo_dir=None):
+    '''
+    Hash of the WPS inputs: settings (a JSON-able dict), the contents of files (missing files count as missing),
+    and the contents of the geo_em files in geo_dir.
+    '''
+    h = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode())
+    for path in sorted(str(f) for f in files):
+        h.update(path.encode())
+        h.update((file_digest(path) if os.path.isfile(path) else 'missing').encode())
+    if geo_dir is not None:
+        h.update(json.dumps(sorted(geo_em_digests(geo_dir).items())).encode())
+    return h.hexdigest()[:16]
+
+
+class SharedWps:
+    '''One keyed WPS output directory and its producer lock.'''
+
+    def __init__(self, root, key):
+        self.key = key
+        self.dir = pathlib.Path(root).joinpath('wps_' + key)
+        self.lock_file = self.dir.joinpath(LOCK_NAME)
+        self.complete_file = self.dir.joinpath(COMPLETE_NAME)
+        self._stop = None
+
+    def completed(self):
+        '''{stage: record} of the stages whose output is complete.'''
+        try:
+            return json.loads(self.complete_file.read_text()).get('stages', {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning(f'WARNING: ignoring unreadable {self.complete_file}: {e}')
+            return {}
+
+    def missing(self, stages, tavgsfc=False):
+        '''
+        Stages, in run order, that must run to provide all of stages: those not complete, and the incomplete
+        stages they read from (with tavgsfc, metgrid reads the TAVGSFC that avg_tsfc writes).
+        '''
+        inputs = dict(STAGE_INPUTS, metgrid=['ungrib', 'avg_tsfc'] if tavgsfc else ['ungrib'])
+        done = self.completed()
+        todo = set()
+        pending = [stage for stage in stages if stage not in done]
+        while pending:
+            stage = pending.pop()
+            if stage not in todo:
+                todo.add(stage)
+                pending += [s for s in inputs[stage] if s not in done]
+        return [stage for stage in STAGES if stage in todo]
+
+    def lock_age(self):
+        '''Seconds since the producer last touched its lock, or None without a lock.'''
+        try:
+            return time.time() - self.lock_file.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def state(self):
+        age = self.lock_age()
+        if age is not None:
+            return 'stale' if age > STALE_S else 'producing'
+        return 'complete' if self.completed() else 'empty'
+
+    def acquire(self, owner, stages, tavgsfc=False, poll_s=POLL_S):
+        '''
+        Return the stages this process must run (see missing) once it holds the lock, or an empty list as soon as
+        every one of stages is complete (possibly after waiting for another producer). A caller given stages holds
+        the lock until release().
+        '''
+        self.dir.mkdir(parents=True, exist_ok=True)
+        waiting = False
+        while True:
+            if not self.missing(stages, tavgsfc):
+                return []
+            try:
+                fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                age = self.lock_age()
+                if age is not None and age > STALE_S:
+                    log.warning(f'WARNING: taking over {self.dir}: its producer has not been seen for {age:.0f} s')
+                    try:
+                        # Renaming is atomic, so of several waiters only one removes this lock
+                        os.rename(self.lock_file, self.lock_file.with_name(LOCK_NAME + '.stale'))
+                    except FileNotFoundError:
+                        pass
+                    continue
+                if not waiting:
+                    log.info(f'Waiting for the producer of {self.dir} ({self.holder()})')
+                    waiting = True
+                time.sleep(poll_s)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'owner': owner, 'host': socket.gethostname(), 'pid': os.getpid(), 'since': time.time()}, f)
+            # The previous producer may have finished between the check above and taking the lock
+            todo = self.missing(stages, tavgsfc)
+            if not todo:
+                self.release()
+                return []
+            self._start_heartbeat()
+            return todo
+
+    def holder(self):
+        try:
+            info = json.loads(self.lock_file.read_text())
+        except (OSError, ValueError):
+            return 'unknown producer'
+        return f'{info.get("owner")} on {info.get("host")}, pid {info.get("pid")}'
+
+    def _start_heartbeat(self):
+        self._stop = threading.Event()
+
+        def beat():
+            while not self._stop.wait(HEARTBEAT_S):
+                try:
+                    os.utime(self.lock_file)
+                except FileNotFoundError:
+                    return
+
+        threading.Thread(target=beat, daemon=True).start()
+
+    def mark(self, stages, info=None):
+        '''Record stages as complete. Only the lock holder calls this, so the read-modify-write cannot race.'''
+        try:
+            record = json.loads(self.complete_file.read_text())
+        except (OSError, ValueError):
+            record = {}
+        record.update(info or {})
+        done = record.setdefault('stages', {})
+        for stage in stages:
+            done[stage] = {'completed': time.time(), 'producer': (info or {}).get('producer')}
+        tmp = self.complete_file.with_name(COMPLETE_NAME + '.tmp')
+        tmp.write_text(json.dumps(record, indent=1, default=str) + '\n')
+        os.replace(tmp, self.complete_file)
+
+    def release(self):
+        '''Give up the lock; the stages recorded by mark stay complete.'''
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        try:
+            self.lock_file.unlink()
+        except FileNotFoundError:
+            pass
+
+    def link(self, run_dir):
+        '''Point run_dir/{ungrib,metgrid,TAVGSFC,namelist.wps} at the shared outputs that exist.'''
+        run_dir = pathlib.Path(run_dir)
+        run_dir.mkdir(parents=True, exist_ok=True)
+        for name in SHARED_OUTPUTS:
+            target = self.dir.joinpath(name)
+            path = run_dir.joinpath(name)
+            if not target.exists():
+                continue
+            if path.is_symlink() or path.is_file():
+                path.unlink()
+            elif path.is_dir():
+                # Output of an earlier unshared run of this experiment; keep it rather than delete it
+                path.rename(path.with_name(name + '.unshared'))
+                log.info(f'Moved the earlier {path} aside to {path.name}.unshared')
+            path.symlink_to(target)
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser(description='Report the state of shared WPS output directories.')
+    parser.add_argument('dirs', nargs='+', help='wps_<key> directories')
+    args = parser.parse_args()
+    return args.dirs
+
+
+def main(dirs):
+    for path in dirs:
+        path = pathlib.Path(path)
+        shared = SharedWps(path.parent, path.name[len('wps_'):])
+        state = shared.state()
+        done = ', '.join(stage for stage in STAGES if stage in shared.completed()) or 'no stages'
+        if state in ('producing', 'stale'):
+            log.info(f'{path}: {state}, {shared.holder()}, lock touched {shared.lock_age():.0f} s ago; complete: {done}')
+        else:
+            log.info(f'{path}: ' + ('complete: ' + done if state == 'complete' else state))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    main(parse_args())
@@ -0,0 +1,275 @@
+'''
+wps_intermediate.py
+
+Reads and writes WPS intermediate files (the PREFIX:YYYY-MM-DD_HH files ungrib.exe writes and metgrid.exe reads).
+
+Each field in an intermediate file is five Fortran unformatted sequential records, big-endian, each framed by a
+4-byte record length before and after the payload:
+    1. IFV (int32), the format version, 5 for WPS
+    2. HDATE (char*24), XFCST (real), MAP_SOURCE (char*32), FIELD (char*9), UNITS (char*25), DESC (char*46),
+       XLVL (real), NX, NY, IPROJ (int32)
+    3. the projection record for IPROJ; all of its reals follow STARTLOC (char*8):
+           0 lat-lon            STARTLAT, STARTLON, DELTALAT, DELTALON, EARTH_RADIUS
+           1 Mercator           STARTLAT, STARTLON, DX, DY, TRUELAT1, EARTH_RADIUS
+           3 Lambert conformal  STARTLAT, STARTLON, DX, DY, XLONC, TRUELAT1, TRUELAT2, EARTH_RADIUS
+           4 Gaussian           STARTLAT, STARTLON, NLATS, DELTALON, EARTH_RADIUS
+           5 polar stereo       STARTLAT, STARTLON, DX, DY, XLONC, TRUELAT1, EARTH_RADIUS
+       with DX/DY and EARTH_RADIUS in km
+    4. IS_WIND_EARTH_REL (4-byte logical)
+    5. SLAB (NX*NY reals, x varying fastest)
+Strings are blank-padded. Missing values are -1.E30, as ungrib.exe writes them.
+
+IntermediateFile memory-maps a file and indexes its records by reading only the small header records and skipping
+over each slab, so an inventory of a multi-GB file takes milliseconds; a field's data is a read-only view of the
+mapping that is paged in only when used. check_fields builds on it to QA ungrib output before metgrid is queued:
+every Vtable field present at every valid time, with the same levels and grid throughout.
+
+    python wps_intermediate.py FILE:2024-08-01_00 ...            # inventory
+    python wps_intermediate.py -t Vtable FILE:2024-08-01_* ...   # QA against a Vtable
+'''
+
+import os
+import sys
+import struct
+import argparse
+import logging
+
+import numpy as np
+
+this_file = os.path.basename(__file__)
+# Configured under __main__ only, so importing this module does not take over the caller's log format
+log = logging.getLogger(__name__)
+
+WPS_VERSION = 5
+MISSING_VALUE = -1.e30
+
+# Names of the reals in the projection record that follow STARTLOC, by IPROJ
+PROJ_FIELDS = {
+    0: ('startlat', 'startlon', 'deltalat', 'deltalon', 'earth_radius'),
+    1: ('startlat', 'startlon', 'dx', 'dy', 'truelat1', 'earth_radius'),
+    3: ('startlat', 'startlon', 'dx', 'dy', 'xlonc', 'truelat1', 'truelat2', 'earth_radius'),
+    4: ('startlat', 'startlon', 'nlats', 'deltalon', 'earth_radius'),
+    5: ('startlat', 'startlon', 'dx', 'dy', 'xlonc', 'truelat1', 'earth_radius'),
+}
+
+# XLVL codes ungrib.exe uses for non-pressure levels
+LEVEL_SURFACE = 200100.
+LEVEL_SEA = 201300.
+LEVEL_TROPOPAUSE = 207300.
+LEVEL_MAX_WIND = 206200.
+
+_HEADER = struct.Struct('>24sf32s9s25s46sf3i')
+
+
+def _pad(text, length):
+    return str(text).ljust(length)[:length].encode('ascii')
+
+
+def _record(payload):
+    marker = struct.pack('>i', len(payload))
+    return marker + payload + marker
+
+
+def pack_field(field):
+    '''
+    Bytes of one field in intermediate format. field is a dict with hdate, xfcst, map_source, field, units, desc,
+    xlvl, iproj, the projection entries PROJ_FIELDS[iproj] (startloc defaults to SWCORNER), is_wind_earth_rel,
+    and slab, a (ny, nx) array.
+    '''
+    slab = np.ascontiguousarray(field['slab'], dtype='>f4')
+    ny, nx = slab.shape
+    iproj = int(field['iproj'])
+    header = _HEADER.pack(_pad(field['hdate'], 24), float(field.get('xfcst', 0.0)), _pad(field.get('map_source', ''), 32),
+                          _pad(field['field'], 9), _pad(field.get('units', ''), 25), _pad(field.get('desc', ''), 46),
+                          float(field['xlvl']), nx, ny, iproj)
+    proj = _pad(field.get('startloc', 'SWCORNER'), 8) + struct.pack('>' + 'f' * len(PROJ_FIELDS[iproj]),
+                                                                     *[float(field[k]) for k in PROJ_FIELDS[iproj]])
+    return b''.join([_record(struct.pack('>i', WPS_VERSION)), _record(header), _record(proj),
+                     _record(struct.pack('>i', 1 if field.get('is_wind_earth_rel', True) else 0)),
+                     _record(slab.tobytes())])
+
+
+def write_fields(path, fields):
+    '''Write the fields, in order, to an intermediate file.'''
+    with open(path, 'wb') as f:
+        for field in fields:
+            f.write(pack_field(field))
+
+
+class IntermediateFile:
+    '''
+    Memory-mapped intermediate file. Iterating gives one header dict per field (the pack_field keys without slab,
+    plus nx, ny and the byte offset of the slab); data(record) returns the (ny, nx) slab as a read-only view.
+    '''
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._buf = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+        self.records = self._index()
+
+    def _record(self, pos):
+        if pos + 4 > len(self._buf):
+            raise ValueError(f'{self.path}: truncated record at byte {pos}')
+        (length,) = struct.unpack('>i', self._buf[pos:pos + 4].tobytes())
+        if pos + length + 8 > len(self._buf):
+            raise ValueError(f'{self.path}: truncated record at byte {pos}')
+        return pos + 4, length, pos + length + 8
+
+    def _index(self):
+        try:
+            return self._read_headers()
+        except struct.error as e:
+            # A record of the wrong length for its contents: not an intermediate file, or a corrupt one
+            raise ValueError(f'{self.path}: malformed intermediate file: {e}') from None
+
+    def _read_headers(self):
+        records = []
+        pos = 0
+        while pos < len(self._buf):
+            start, length, pos = self._record(pos)
+            (version,) = struct.unpack('>i', self._buf[start:start + length].tobytes())
+            if version != WPS_VERSION:
+                raise ValueError(f'{self.path}: intermediate format version {version} is not WPS (5)')
+            start, length, pos = self._record(pos)
+            hdate, xfcst, source, name, units, desc, xlvl, nx, ny, iproj = _HEADER.unpack(
+                self._buf[start:start + length].tobytes())
+            if iproj not in PROJ_FIELDS:
+                raise ValueError(f'{self.path}: unknown projection {iproj}')
+            record = {'hdate': hdate.decode().strip(), 'xfcst': xfcst, 'map_source': source.decode().strip(),
+                      'field': name.decode().strip(), 'units': units.decode().strip(), 'desc': desc.decode().strip(),
+                      'xlvl': xlvl, 'nx': nx, 'ny': ny, 'iproj': iproj}
+            start, length, pos = self._record(pos)
+            proj = self._buf[start:start + length].tobytes()
+            record['startloc'] = proj[:8].decode().strip()
+            record.update(zip(PROJ_FIELDS[iproj], struct.unpack('>' + 'f' * len(PROJ_FIELDS[iproj]), proj[8:])))
+            start, length, pos = self._record(pos)
+            record['is_wind_earth_rel'] = struct.unpack('>i', self._buf[start:start + length].tobytes())[0] != 0
+            start, length, pos = self._record(pos)
+            if length != 4 * nx * ny:
+                raise ValueError(f'{self.path}: {record["field"]} slab holds {length} bytes, expected {4 * nx * ny}')
+            record['offset'] = start
+            records.append(record)
+        return records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def keys(self):
+        '''(field, xlvl) of every record, in file order.'''
+        return [(r['field'], r['xlvl']) for r in self.records]
+
+    def find(self, field, xlvl=None):
+        '''Records of a field, at one level or at all levels.'''
+        return [r for r in self.records if r['field'] == field and (xlvl is None or r['xlvl'] == xlvl)]
+
+    def data(self, record):
+        return self._buf[record['offset']:record['offset'] + 4 * record['nx'] * record['ny']].view('>f4').reshape(
+            record['ny'], record['nx'])
+
+    def read(self, field, xlvl):
+        '''Slab of one field and level (a view of the mapping).'''
+        found = self.find(field, xlvl)
+        if not found:
+            raise KeyError(f'{field} at {xlvl} not in {self.path}')
+        return self.data(found[0])
+
+
+def read_fields(path):
+    '''Read every field of an intermediate file; returns a list of dicts laid out as pack_field expects.'''
+    f = IntermediateFile(path)
+    return [dict(r, slab=np.array(f.data(r))) for r in f]
+
+
+def vtable_expectations(vtable):
+    '''
+    What a Vtable asks ungrib for: {field: xlvl} with xlvl None for rows that take every level ('*').
+    '''
+    import grib2_to_wps
+
+    expected = {}
+    for entry in grib2_to_wps.read_vtable(vtable):
+        if entry.level1 in ('', '*'):
+            expected[entry.name] = None
+        elif expected.get(entry.name, 0) is not None:
+            level = float(entry.level1) * (100.0 if entry.level_type == 100 else 1.0)
+            expected.setdefault(entry.name, set()).add(grib2_to_wps.level_xlvl(entry.level_type, level))
+    return expected
+
+
+def check_fields(paths, vtable=None):
+    '''
+    QA a set of intermediate files of one prefix (one per valid time). Returns (errors, warnings):
+    errors for unreadable files and for fields, levels or grids that differ between times; warnings for
+    Vtable fields that are absent at every time (ungrib.exe also skips fields a model does not provide).
+    '''
+    errors = []
+    warnings = []
+    inventories = {}
+    grids = {}
+    for path in paths:
+        try:
+            f = IntermediateFile(path)
+        except (OSError, ValueError) as e:
+            errors.append(str(e))
+            continue
+        if not len(f):
+            errors.append(f'{path}: no fields')
+            continue
+        inventories[str(path)] = set(f.keys())
+        grids[str(path)] = {(r['nx'], r['ny'], r['iproj'], round(r['startlat'], 4), round(r['startlon'], 4)) for r in f}
+
+    if inventories:
+        union = set().union(*inventories.values())
+        for path, keys in inventories.items():
+            for name, xlvl in sorted(union - keys):
+                errors.append(f'{path}: {name} at {xlvl:g} missing (present at other times)')
+        grid_sets = {frozenset(g) for g in grids.values()}
+        if len(grid_sets) > 1:
+            errors.append('grids differ between times: ' + '; '.join(sorted(map(str, set().union(*grid_sets)))))
+        if vtable is not None:
+            names = {name for name, _ in union}
+            for name, levels in vtable_expectations(vtable).items():
+                if levels is None:
+                    if name not in names:
+                        warnings.append(f'{name}: in the Vtable but at no level of any file')
+                else:
+                    for xlvl in sorted(levels - {x for n, x in union if n == name}):
+                        warnings.append(f'{name} at {xlvl:g}: in the Vtable but in no file')
+    return errors, warnings
+
+
+def parse_args():
+    ## Parse the command-line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='intermediate files (one prefix, one file per valid time)')
+    parser.add_argument('-t', '--vtable', default=None, help='Vtable to check the files against')
+    args = parser.parse_args()
+    return args.files, args.vtable
+
+
+def main(files, vtable):
+    if vtable is None:
+        for path in files:
+            log.info(path)
+            for r in IntermediateFile(path):
+                log.info(f'   {r["field"]:9s} {r["xlvl"]:10g} {r["hdate"]} {r["nx"]}x{r["ny"]} iproj={r["iproj"]} '
+                         f'{r["units"]}')
+        return
+    errors, warnings = check_fields(files, vtable)
+    for warning in warnings:
+        log.info('WARNING: ' + warning)
+    for error in errors:
+        log.error('ERROR: ' + error)
+    if errors:
+        log.error('Exiting!')
+        sys.exit(1)
+    log.info(str(len(files)) + ' file(s) passed the checks against ' + vtable)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=f'{this_file}: %(asctime)s - %(message)s',
+                        level=logging.DEBUG, datefmt='%Y-%m-%dT%H:%M:%S')
+    main(*parse_args())
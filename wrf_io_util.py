@@ -0,0 +1,128 @@
+'''
+wrf_io_util.py
+
+I/O profiles for WRF history output.
+
+With io_form_history = 2 every history write gathers each field onto rank 0, which writes it with serial netCDF
+while all the other ranks wait. On 1-km fire domains with hourly history this is a large part of the run time.
+run_wrf.py can instead apply one of these profiles to namelist.input and submit_wrf.bash:
+  serial:  io_form_history = 2, no quilting (the default WRF behaviour)
+  pnetcdf: io_form_history = 11, every rank writes its own patch through Parallel-netCDF
+           (needs a WRF built with PNETCDF set)
+  quilt:   io_form_history = 2, with nio_groups groups of nio_tasks_per_group dedicated I/O ranks that receive the
+           history fields and write them while the compute ranks carry on
+For quilting the I/O ranks come on top of the compute ranks, so the rank count in submit_wrf.bash is
+nproc_x * nproc_y + nio_groups * nio_tasks_per_group, and nproc_y must be a multiple of nio_tasks_per_group.
+Without a profile the namelist's own settings are kept, but any quilting it asks for is still reserved in the
+rank count.
+'''
+
+import re
+import pathlib
+
+from walltime_util import size_mpi_job, template_cores
+
+IO_FORMS = {'serial': 2, 'pnetcdf': 11, 'quilt': 2}
+# Default quilting: one I/O task for roughly every this many compute ranks, rounded down to a power of two
+QUILT_RANKS_PER_IO_TASK = 32
+# Fewer compute ranks than this per I/O task is almost certainly a waste of cores
+MIN_RANKS_PER_IO_TASK = 8
+
+
+def read_io_settings(nml_file):
+    '''(io_form_history, nio_tasks_per_group, nio_groups) as set in a namelist.input (missing entries are 2, 0, 0).'''
+    settings = {'io_form_history': 2, 'nio_tasks_per_group': 0, 'nio_groups': 0}
+    with open(nml_file) as nml:
+        for line in nml:
+            key = line.split('=')[0].strip()
+            if key in settings:
+                settings[key] = int(line.split('=')[1].strip().split(',')[0])
+    return settings['io_form_history'], settings['nio_tasks_per_group'], settings['nio_groups']
+
+
+def write_io_settings(nml_file, io_form, nio_tasks_per_group, nio_groups):
+    '''Set io_form_history and the quilting entries, adding a &namelist_quilt group if the namelist has none.'''
+    with open(nml_file) as in_file:
+        lines = in_file.readlines()
+    has_quilt = any(line.strip().lower() == '&namelist_quilt' for line in lines)
+    with open(nml_file, 'w') as out_file:
+        for line in lines:
+            key = line.split('=')[0].strip()
+            if key == 'io_form_history':
+                out_file.write(' io_form_history                     = ' + str(io_form) + '\n')
+            elif key == 'nio_tasks_per_group':
+                out_file.write(' nio_tasks_per_group = ' + str(nio_tasks_per_group) + ',\n')
+            elif key == 'nio_groups':
+                out_file.write(' nio_groups = ' + str(nio_groups) + ',\n')
+            else:
+                out_file.write(line)
+        if not has_quilt:
+            out_file.write('\n&namelist_quilt\n')
+            out_file.write(' nio_tasks_per_group = ' + str(nio_tasks_per_group) + ',\n')
+            out_file.write(' nio_groups = ' + str(nio_groups) + ',\n')
+            out_file.write('/\n')
+
+
+def default_io_tasks(ranks):
+    tasks = 1
+    while tasks * 2 * QUILT_RANKS_PER_IO_TASK <= ranks:
+        tasks *= 2
+    return tasks
+
+
+def wrf_has_pnetcdf(wrf_dir):
+    '''True/False if configure.wrf in the WRF install shows whether it was built with PNETCDF; None if unknown.'''
+    configure_file = pathlib.Path(wrf_dir).joinpath('configure.wrf')
+    if not configure_file.is_file():
+        return None
+    return re.search(r'-DPNETCDF\b', configure_file.read_text(errors='replace')) is not None
+
+
+def apply_io_profile(io_profile, script_file, nml_file, wrf_dir, log, ranks=None, nio_tasks_per_group=None,
+                     nio_groups=None):
+    '''
+    Apply an I/O profile (serial, pnetcdf, quilt, or None to keep the namelist's settings) to namelist.input, then
+    size the MPI job for it (walltime_util.size_mpi_job) with room for any quilting I/O tasks. Call from the run
+    directory once namelist.input is otherwise final. Raises ValueError if the profile cannot work with this WRF
+    build, domain, or rank count.
+
+    Returns
+    -------
+    int or None
+        Number of compute ranks (None if the submit script does not give a rank count).
+    '''
+    if io_profile is None:
+        io_form, tasks, groups = read_io_settings(nml_file)
+    elif io_profile not in IO_FORMS:
+        raise ValueError(f'Unknown I/O profile {io_profile}; choose from {", ".join(IO_FORMS)}')
+    elif io_profile == 'quilt':
+        io_form = IO_FORMS[io_profile]
+        groups = nio_groups or 1
+        if nio_tasks_per_group:
+            tasks = nio_tasks_per_group
+        else:
+            total_ranks = ranks or template_cores(pathlib.Path(script_file).read_text()) or 1
+            tasks = default_io_tasks(total_ranks // groups)
+    else:
+        io_form, tasks, groups = IO_FORMS[io_profile], 0, 0
+
+    if io_form == 11:
+        if wrf_has_pnetcdf(wrf_dir) is False:
+            raise ValueError(f'io_form_history = 11 needs Parallel-netCDF, but {wrf_dir} was not built with PNETCDF')
+        if tasks * groups > 0:
+            raise ValueError('Quilting is not supported together with io_form_history = 11')
+
+    io_tasks = tasks * groups
+    compute_ranks = size_mpi_job(script_file, nml_file, log, ranks=ranks, io_tasks=io_tasks,
+                                 ny_multiple=tasks if io_tasks else 1)
+    write_io_settings(nml_file, io_form, tasks, groups)
+
+    if compute_ranks is None:
+        log.warning(f'WARNING: {script_file} gives no rank count, so the I/O profile could not be checked against it')
+    elif io_tasks and compute_ranks < MIN_RANKS_PER_IO_TASK * io_tasks:
+        log.warning(f'WARNING: {io_tasks} quilting I/O tasks for only {compute_ranks} compute ranks; '
+                    'consider fewer I/O tasks or the serial profile')
+    if io_profile is not None:
+        quilt_note = f', {groups} I/O group(s) of {tasks} task(s)' if io_tasks else ''
+        log.info(f'I/O profile {io_profile}: io_form_history = {io_form}{quilt_note}')
+    return compute_ranks